@@ -0,0 +1,186 @@
+"""
+ユーザー・チャンネル・ワークスペース単位の受付制御（トークンバケット）
+
+CSV取り込みとR解析のジョブを受け付ける前に、ユーザー・チャンネル・ワークスペースごとのトークンバケットで
+投入ペースを制限します。1人が短時間に大量のファイルを投入しても、上限を超えた分は受け付けずに再試行までの
+目安の秒数を返すため、他の利用者のジョブがその後ろに積み上がりません。
+
+受け付けたジョブはユーザーごとの重み（ADMISSION_QUOTAS で指定）とともにジョブスケジューラーに渡され、
+レーン内で重み付きラウンドロビンにより順番に実行されます。
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_CONTROL_ENABLED = os.environ.get('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'true'
+
+# 受付制御の対象レーン（対話・レポート生成は軽いため制限しない）
+ADMISSION_LANES = tuple(
+    lane.strip() for lane in os.environ.get('ADMISSION_LANES', 'csv,analysis').split(',') if lane.strip()
+)
+
+# スコープごとの既定の上限（1分あたりの補充数とバースト量）
+ADMISSION_DEFAULT_QUOTAS = {
+    "user": {
+        "rate_per_minute": float(os.environ.get('ADMISSION_USER_RATE_PER_MINUTE', '4')),
+        "burst": float(os.environ.get('ADMISSION_USER_BURST', '6')),
+    },
+    "channel": {
+        "rate_per_minute": float(os.environ.get('ADMISSION_CHANNEL_RATE_PER_MINUTE', '10')),
+        "burst": float(os.environ.get('ADMISSION_CHANNEL_BURST', '15')),
+    },
+    "workspace": {
+        "rate_per_minute": float(os.environ.get('ADMISSION_WORKSPACE_RATE_PER_MINUTE', '30')),
+        "burst": float(os.environ.get('ADMISSION_WORKSPACE_BURST', '45')),
+    },
+}
+
+# 個別の上限と重み（例: {"user:U123": {"rate_per_minute": 20, "burst": 30, "weight": 2}}）
+ADMISSION_QUOTAS = os.environ.get('ADMISSION_QUOTAS', '')
+
+# 保持するバケット数の上限（超えた分は最も長く使われていないものから削除）
+ADMISSION_MAX_BUCKETS = int(os.environ.get('ADMISSION_MAX_BUCKETS', '10000'))
+
+ADMISSION_SCOPES = ("user", "channel", "workspace")
+
+
+class TokenBucket:
+    """一定のペースで補充されるトークンバケット"""
+
+    def __init__(self, rate_per_minute: float, burst: float, now: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def available(self, cost: float, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= cost
+
+    def retry_after(self, cost: float, now: float) -> float:
+        """cost 分のトークンがたまるまでの秒数（バースト量を超える cost は受け付けられないため inf）"""
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        if cost > self.burst or self.rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float):
+        self.tokens -= cost
+
+    def refund(self, cost: float):
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+def _load_quota_overrides(raw: str) -> Dict[str, Dict[str, float]]:
+    if not raw:
+        return {}
+    try:
+        overrides = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid ADMISSION_QUOTAS (ignored): {e}")
+        return {}
+    return {key: value for key, value in overrides.items() if isinstance(value, dict)}
+
+
+class AdmissionController:
+    """ユーザー・チャンネル・ワークスペースのトークンバケットでジョブの受付を判定"""
+
+    def __init__(self, default_quotas: Optional[Dict[str, Dict[str, float]]] = None,
+                 quota_overrides: Optional[Dict[str, Dict[str, float]]] = None,
+                 max_buckets: int = ADMISSION_MAX_BUCKETS):
+        self.default_quotas = default_quotas or ADMISSION_DEFAULT_QUOTAS
+        self.quota_overrides = (quota_overrides if quota_overrides is not None
+                                else _load_quota_overrides(ADMISSION_QUOTAS))
+        self.max_buckets = max_buckets
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Dict[str, int]] = {}
+
+    def _quota(self, scope: str, key: str) -> Dict[str, float]:
+        return {**self.default_quotas[scope], **self.quota_overrides.get(key, {})}
+
+    def weight_for(self, user_id: Optional[str]) -> int:
+        """重み付きラウンドロビンでのユーザーの重み（既定は1）"""
+        if not user_id:
+            return 1
+        return max(1, int(self.quota_overrides.get(f"user:{user_id}", {}).get("weight", 1)))
+
+    def _bucket(self, scope: str, key: str, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            quota = self._quota(scope, key)
+            bucket = TokenBucket(quota["rate_per_minute"], quota["burst"], now=now)
+            self.buckets[key] = bucket
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, lane: str, user_id: Optional[str] = None, channel_id: Optional[str] = None,
+              team_id: Optional[str] = None, cost: float = 1) -> Dict[str, Any]:
+        """
+        すべてのスコープに cost 分の余裕がある場合のみトークンを消費して受け付けます。
+
+        Returns:
+            Dict: admitted, scope（拒否したスコープ）, retry_after（再試行までの目安の秒数）, keys（消費したバケット）, cost
+        """
+        now = time.monotonic()
+        ids = {"user": user_id, "channel": channel_id, "workspace": team_id}
+        with self.lock:
+            keys = [(scope, f"{scope}:{ids[scope]}") for scope in ADMISSION_SCOPES if ids[scope]]
+            buckets = [(scope, key, self._bucket(scope, key, now)) for scope, key in keys]
+            for scope, key, bucket in buckets:
+                if not bucket.available(cost, now):
+                    retry_after = bucket.retry_after(cost, now)
+                    self._count(lane, f"rejected_{scope}")
+                    logger.warning(f"Admission rejected for {key} in lane {lane} (retry after {retry_after:.0f}s)")
+                    return {"admitted": False, "scope": scope, "retry_after": retry_after, "keys": [], "cost": cost}
+            for _, _, bucket in buckets:
+                bucket.consume(cost)
+            self._count(lane, "admitted")
+        return {"admitted": True, "scope": None, "retry_after": 0.0, "keys": [key for _, key, _ in buckets], "cost": cost}
+
+    def refund(self, decision: Dict[str, Any]):
+        """受け付けたジョブが実行されなかった場合に消費したトークンを戻す"""
+        with self.lock:
+            for key in decision.get("keys", []):
+                bucket = self.buckets.get(key)
+                if bucket is not None:
+                    bucket.refund(decision["cost"])
+
+    def _count(self, lane: str, name: str):
+        counters = self.metrics.setdefault(lane, {})
+        counters[name] = counters.get(name, 0) + 1
+
+    def get_metrics(self) -> Dict[str, Dict[str, int]]:
+        """レーン別の受付数・スコープ別の拒否数"""
+        with self.lock:
+            return {lane: dict(counters) for lane, counters in self.metrics.items()}
+
+
+# グローバルコントローラー
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """受付制御のシングルトンを取得"""
+    global _admission_controller
+    with _admission_controller_lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController()
+        return _admission_controller
@@ -0,0 +1,174 @@
+"""
+共有asyncioイベントループサービス
+
+プロセス内で1つのイベントループをバックグラウンドスレッドで常駐させ、すべての非同期処理を実行します。
+Slackハンドラー（同期関数）はコルーチンを submit() で投入し、concurrent.futures.Future を受け取ります。
+
+イベントごとに new_event_loop() を作成していた従来の方式と異なり、aiohttpセッションやGeminiクライアント、
+コネクションプールをイベント間で再利用でき、プロセス全体で同時実行数を管理する基盤になります。
+"""
+import os
+import asyncio
+import logging
+import threading
+import itertools
+import concurrent.futures
+from typing import Any, Coroutine, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 同時に実行するジョブ数の上限（従来の MAX_CSV_WORKERS を引き継ぐ。超えた分はループ内で待機）
+ASYNC_LOOP_MAX_JOBS = int(os.environ.get('ASYNC_LOOP_MAX_JOBS', os.environ.get('MAX_CSV_WORKERS', '5')))
+
+# asyncio.to_thread 用のスレッド数（R実行・ファイルI/Oなどのブロッキング処理を担当）
+ASYNC_LOOP_THREAD_WORKERS = int(os.environ.get('ASYNC_LOOP_THREAD_WORKERS', '16'))
+
+# シャットダウン時に実行中ジョブの完了を待つ秒数
+ASYNC_LOOP_SHUTDOWN_TIMEOUT = float(os.environ.get('ASYNC_LOOP_SHUTDOWN_TIMEOUT', '30'))
+
+
+class AsyncLoopService:
+    """バックグラウンドスレッドで常駐するイベントループ"""
+
+    def __init__(self, max_jobs: int = ASYNC_LOOP_MAX_JOBS, thread_workers: int = ASYNC_LOOP_THREAD_WORKERS):
+        self.max_jobs = max_jobs
+        self.thread_workers = thread_workers
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.thread: Optional[threading.Thread] = None
+        self.jobs: Dict[str, concurrent.futures.Future] = {}
+        self.lock = threading.Lock()
+        self._ready = threading.Event()
+        self._job_counter = itertools.count(1)
+        self.pid = os.getpid()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive() and self.loop is not None and self.loop.is_running()
+
+    def start(self):
+        """イベントループスレッドを起動"""
+        with self.lock:
+            if self.running:
+                return
+            self._ready.clear()
+            self.thread = threading.Thread(target=self._run_loop, name="async-loop-service", daemon=True)
+            self.thread.start()
+        self._ready.wait(timeout=10)
+        logger.info(f"Async loop service started (max jobs: {self.max_jobs}, thread workers: {self.thread_workers})")
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.thread_workers, thread_name_prefix="async-loop-worker"
+        ))
+        asyncio.set_event_loop(loop)
+        self._semaphore = asyncio.Semaphore(self.max_jobs) if self.max_jobs > 0 else None
+        self.loop = loop
+        loop.call_soon(self._ready.set)
+        try:
+            loop.run_forever()
+        finally:
+            try:
+                # ループに紐づく共有HTTPセッションをループ停止前に閉じる
+                from utils.file_utils import close_http_session
+                loop.run_until_complete(close_http_session())
+                loop.run_until_complete(loop.shutdown_asyncgens())
+                loop.run_until_complete(loop.shutdown_default_executor())
+            finally:
+                loop.close()
+                logger.info("Async loop service stopped")
+
+    def submit(self, coro: Coroutine, job_id: Optional[str] = None, limit: bool = True) -> concurrent.futures.Future:
+        """
+        コルーチンをイベントループに投入します（任意のスレッドから呼び出し可能）。
+
+        Args:
+            coro: 実行するコルーチン
+            job_id: ログ・状態確認用のジョブID（Noneの場合は自動生成）
+            limit: Falseの場合は max_jobs の同時実行数制限を通さない（レーンごとに制限するジョブスケジューラー用）
+
+        Returns:
+            concurrent.futures.Future: コルーチンの結果
+        """
+        if not self.running:
+            self.start()
+        if job_id is None:
+            job_id = f"job_{next(self._job_counter)}"
+
+        future = asyncio.run_coroutine_threadsafe(self._run_job(coro, limit), self.loop)
+        with self.lock:
+            self.jobs[job_id] = future
+        future.add_done_callback(lambda f: self._handle_job_completion(job_id, f))
+        logger.info(f"Submitted async job {job_id} (active: {self.get_active_count()})")
+        return future
+
+    async def _run_job(self, coro: Coroutine, limit: bool = True) -> Any:
+        if self._semaphore is None or not limit:
+            return await coro
+        async with self._semaphore:
+            return await coro
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """コルーチンを投入して完了まで待つ（ループスレッド外の同期コードから使用）"""
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("AsyncLoopService.run() cannot be called from the loop thread")
+        return self.submit(coro).result(timeout=timeout)
+
+    def _handle_job_completion(self, job_id: str, future: concurrent.futures.Future):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+        if future.cancelled():
+            logger.warning(f"Async job {job_id} was cancelled")
+        elif future.exception() is not None:
+            error = future.exception()
+            logger.error(f"Async job {job_id} failed: {error}", exc_info=(type(error), error, error.__traceback__))
+
+    def get_active_count(self) -> int:
+        """実行中のジョブ数"""
+        with self.lock:
+            return len(self.jobs)
+
+    def shutdown(self, timeout: float = ASYNC_LOOP_SHUTDOWN_TIMEOUT):
+        """実行中のジョブを待ってからループを停止（タイムアウト後は残りをキャンセル）"""
+        if not self.running:
+            return
+        with self.lock:
+            pending = list(self.jobs.values())
+        if pending:
+            logger.info(f"Waiting for {len(pending)} async jobs to finish...")
+            _, not_done = concurrent.futures.wait(pending, timeout=timeout)
+            for future in not_done:
+                future.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=10)
+
+
+# グローバルサービス
+_loop_service = None
+_loop_service_lock = threading.Lock()
+
+
+def get_loop_service() -> AsyncLoopService:
+    """共有イベントループサービスのシングルトンを取得（未起動なら起動）"""
+    global _loop_service
+    with _loop_service_lock:
+        # fork後の子プロセスではスレッドが引き継がれないため作り直す
+        if _loop_service is None or _loop_service.pid != os.getpid():
+            _loop_service = AsyncLoopService()
+    _loop_service.start()
+    return _loop_service
+
+
+def submit_async(coro: Coroutine, job_id: Optional[str] = None) -> concurrent.futures.Future:
+    """共有イベントループにコルーチンを投入"""
+    return get_loop_service().submit(coro, job_id=job_id)
+
+
+def shutdown_loop_service():
+    """共有イベントループサービスをシャットダウン"""
+    global _loop_service
+    with _loop_service_lock:
+        if _loop_service is not None:
+            _loop_service.shutdown()
+            _loop_service = None
@@ -0,0 +1,331 @@
+"""
+ルールベースの列役割検出
+
+examples/ にあるような標準的なレイアウト（二値: イベント数/総数、連続: 平均/SD/n、単一群比率、
+事前計算済み yi/vi・log_hr/se_log_hr、OR/RR/HRと95%信頼区間）を、列名の同義語（日本語・英語）と
+値の検査（数値型、整数・非負、イベント数≤総数、SD>0、信頼区間の順序）で判定します。
+
+結果は GeminiClient.analyze_csv と同じスキーマ（detected_columns, suggested_analysis など）に
+信頼度 confidence（0〜1）を加えたものです。信頼度が LOCAL_COLUMN_DETECTOR_MIN_CONFIDENCE 以上の場合、
+CSV受付時にGeminiを呼ばずにこの結果を使います。
+"""
+import io
+import os
+import re
+import json
+import logging
+from typing import Dict, Any, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# ルールベース検出の有効化（false で常にGeminiを使用）
+LOCAL_COLUMN_DETECTOR_ENABLED = os.environ.get('LOCAL_COLUMN_DETECTOR_ENABLED', 'true').lower() == 'true'
+
+# この信頼度以上ならGeminiを呼ばない
+LOCAL_COLUMN_DETECTOR_MIN_CONFIDENCE = float(os.environ.get('LOCAL_COLUMN_DETECTOR_MIN_CONFIDENCE', '0.8'))
+
+# 群を表す語（英語はトークン一致、日本語は部分一致）
+TREATMENT_WORDS = {"treatment", "treat", "treated", "intervention", "int", "tx", "trt", "exp", "experimental",
+                   "active", "drug", "介入", "治療", "実験"}
+CONTROL_WORDS = {"control", "ctrl", "ctl", "placebo", "comparator", "usual", "standard", "対照", "コントロール", "プラセボ"}
+
+# 値の種類を表す語
+EVENTS_WORDS = {"events", "event", "cases", "case", "deaths", "death", "responders", "success", "successes",
+                "イベント", "発生", "死亡", "イベント数"}
+TOTAL_WORDS = {"total", "n", "size", "patients", "participants", "subjects", "sample", "総数", "人数", "例数", "症例数", "対象者数"}
+MEAN_WORDS = {"mean", "avg", "average", "平均", "平均値"}
+SD_WORDS = {"sd", "std", "stdev", "標準偏差"}
+
+# metafor の引数名
+CANONICAL_ROLES = {
+    "ai": ("treatment", "events"), "n1i": ("treatment", "total"), "m1i": ("treatment", "mean"), "sd1i": ("treatment", "sd"),
+    "ci": ("control", "events"), "n2i": ("control", "total"), "m2i": ("control", "mean"), "sd2i": ("control", "sd"),
+}
+
+# 事前計算済み効果量・分散・標準誤差（記号を除いた小文字の列名で一致）
+EFFECT_SIZE_NAMES = {"yi", "effectsize", "es", "estimate", "smd", "md", "hedgesg", "cohensd",
+                     "loghr", "lnhr", "logor", "lnor", "logrr", "lnrr", "効果量"}
+VARIANCE_NAMES = {"vi", "variance", "var", "分散"}
+SE_NAMES = {"sei", "se", "stderr", "standarderror", "標準誤差"}
+
+# 比率系の点推定値と信頼区間
+RATIO_NAMES = {"or": "OR", "oddsratio": "OR", "オッズ比": "OR", "rr": "RR", "riskratio": "RR", "relativerisk": "RR",
+               "リスク比": "RR", "相対リスク": "RR", "hr": "HR", "hazardratio": "HR", "ハザード比": "HR"}
+CI_LOWER_WORDS = {"lower", "low", "lb", "ll", "lcl", "下限"}
+CI_UPPER_WORDS = {"upper", "up", "high", "ub", "ul", "ucl", "上限"}
+
+STUDY_ID_NAMES = {"study", "studyid", "studyname", "author", "authors", "trial", "trialid", "id",
+                  "研究", "研究名", "研究id", "著者", "試験"}
+
+MEASURE_LABELS = {"binary": "二値アウトカム", "continuous": "連続アウトカム", "proportion": "単一群比率",
+                  "precomputed": "事前計算済み効果量", "ratio_ci": "比率と95%信頼区間"}
+
+
+def _tokens(name: str) -> set:
+    lower = name.lower()
+    return set(re.split(r'[^0-9a-z\u3040-\u30ff\u4e00-\u9fff]+', lower)) - {""}
+
+
+def _compact(name: str) -> str:
+    return re.sub(r'[^0-9a-z\u3040-\u30ff\u4e00-\u9fff]', '', name.lower())
+
+
+def _has_word(name: str, words: set) -> bool:
+    """英語はトークン一致、日本語（非ASCII）は部分一致で判定"""
+    tokens = _tokens(name)
+    return any((word in tokens) if word.isascii() else (word in name) for word in words)
+
+
+def _group_of(name: str) -> Optional[str]:
+    is_treatment = _has_word(name, TREATMENT_WORDS)
+    is_control = _has_word(name, CONTROL_WORDS)
+    if is_treatment == is_control:
+        return None
+    return "treatment" if is_treatment else "control"
+
+
+def _kind_of(name: str) -> Optional[str]:
+    for kind, words in (("events", EVENTS_WORDS), ("mean", MEAN_WORDS), ("sd", SD_WORDS), ("total", TOTAL_WORDS)):
+        if _has_word(name, words):
+            return kind
+    return None
+
+
+def _numeric(dat: pd.DataFrame, column: str) -> Optional[pd.Series]:
+    """すべての値が数値なら数値列を返す（"14,210" のようなカンマ区切りも数値化）"""
+    series = dat[column]
+    if series.dtype == object:
+        series = pd.to_numeric(series.astype(str).str.replace(",", "", regex=False).str.strip(), errors='coerce')
+    if not pd.api.types.is_numeric_dtype(series) or series.isna().any():
+        return None
+    return series.astype(float)
+
+
+def _is_count(series: Optional[pd.Series]) -> bool:
+    return series is not None and bool(((series >= 0) & (series == series.round())).all())
+
+
+def detect_columns(csv_content: str, dat: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+    """
+    CSV内容から列の役割をルールベースで検出します。
+
+    Args:
+        csv_content: CSVテキスト
+        dat: csv_ingest でパース済みのDataFrame（指定された場合はCSVを読み直さない）
+
+    Returns:
+        GeminiClient.analyze_csv と同じスキーマの辞書に confidence（0〜1）と detector を加えたもの
+    """
+    try:
+        if dat is None:
+            dat = pd.read_csv(io.StringIO(csv_content.lstrip('\ufeff')), skipinitialspace=True)
+        dat = dat.dropna(how='all')
+    except Exception as e:
+        logger.info(f"ルールベース検出をスキップしました（CSVを読み込めません）: {e}")
+        return {"is_suitable": False, "confidence": 0.0, "detector": "rule_based"}
+
+    columns = [str(col) for col in dat.columns]
+    dat.columns = columns
+    numeric = {col: _numeric(dat, col) for col in columns}
+    layouts = [layout for layout in (
+        _binary_layout(dat, columns, numeric),
+        _continuous_layout(columns, numeric),
+        _proportion_layout(columns, numeric),
+        _precomputed_layout(columns, numeric),
+        _ratio_ci_layout(columns, numeric),
+    ) if layout is not None]
+
+    k = len(dat)
+    best = max(layouts, key=lambda layout: layout["score"], default=None)
+    confidence = best["score"] if best else 0.0
+    # 複数のレイアウトが列名で成立する場合はどちらを使うべきか曖昧
+    ambiguous = best is not None and sum(1 for layout in layouts if layout["score"] >= 0.6) > 1
+    if ambiguous:
+        confidence -= 0.3
+    if k < 2:
+        confidence = 0.0
+
+    used_columns = set(best["used_columns"]) if best else set()
+    study_ids = [col for col in columns if _compact(col) in STUDY_ID_NAMES or "study" in _tokens(col) or "研究" in col]
+    if not study_ids:
+        study_ids = [col for col in columns if numeric[col] is None and dat[col].nunique() == k][:1]
+    subgroups = [col for col in columns
+                 if numeric[col] is None and col not in study_ids and col not in used_columns
+                 and 2 <= dat[col].nunique() < k]
+    sample_sizes = [col for col in columns if col not in used_columns and _group_of(col) is None
+                    and _kind_of(col) == "total" and _is_count(numeric[col])]
+    moderators = [col for col in columns if numeric[col] is not None and col not in used_columns
+                  and col not in study_ids and col not in sample_sizes and numeric[col].nunique() > 1]
+
+    detected_columns = {
+        "effect_size_candidates": [], "variance_candidates": [],
+        "transformation_status": {"is_log_transformed": False, "detected_log_columns": [],
+                                  "transformation_indicators": [], "needs_transformation": False},
+        "binary_intervention_events": [], "binary_intervention_total": [],
+        "binary_control_events": [], "binary_control_total": [],
+        "continuous_intervention_mean": [], "continuous_intervention_sd": [], "continuous_intervention_n": [],
+        "continuous_control_mean": [], "continuous_control_sd": [], "continuous_control_n": [],
+        "proportion_events": [], "proportion_total": [], "proportion_time": [],
+        "sample_size_candidates": sample_sizes, "study_id_candidates": study_ids,
+        "subgroup_candidates": subgroups, "moderator_candidates": moderators,
+    }
+    suggested_analysis = {"effect_type_suggestion": None, "model_type_suggestion": "random",
+                          "transformation_recommendation": "", "ambiguity_detected": ambiguous,
+                          "ambiguity_reason": "複数のデータ形式に該当する列があります" if ambiguous else ""}
+    if best:
+        for key, value in best["detected_columns"].items():
+            if key == "transformation_status":
+                detected_columns[key].update(value)
+            else:
+                detected_columns[key] = value
+        suggested_analysis["effect_type_suggestion"] = best["effect_type"]
+        suggested_analysis["transformation_recommendation"] = best.get("transformation_recommendation", "")
+
+    if best and best["score"] >= 0.6:
+        reason = f"{k}件の研究について{MEASURE_LABELS[best['name']]}の列を検出しました。"
+    else:
+        reason = f"{k}件の研究のデータですが、メタ解析に必要な列を特定できませんでした。"
+
+    return {
+        "is_suitable": bool(best and best["score"] >= 0.6 and k >= 2),
+        "reason": reason,
+        "num_studies": k,
+        "detected_columns": detected_columns,
+        "suggested_analysis": suggested_analysis,
+        "column_descriptions": {col: "数値" if numeric[col] is not None else "文字列" for col in columns},
+        "data_preview": json.loads(dat.head(3).to_json(orient='records', force_ascii=False)),
+        "confidence": round(max(confidence, 0.0), 2),
+        "detector": "rule_based",
+    }
+
+
+def _layout(name: str, roles: Dict[str, List[str]], checks_passed: bool, **extra) -> Dict[str, Any]:
+    """列名で成立したレイアウトの信頼度: 列名一致 0.6 + 値の検査 0.3 + 候補が一意 0.1"""
+    score = 0.6
+    score += 0.3 if checks_passed else -0.3
+    if all(len(candidates) == 1 for candidates in roles.values()):
+        score += 0.1
+    used = [candidates[0] for candidates in roles.values() if candidates]
+    return {"name": name, "score": round(score, 2), "used_columns": used, **extra}
+
+
+def _grouped_roles(columns: List[str]) -> Dict[tuple, List[str]]:
+    roles: Dict[tuple, List[str]] = {}
+    for col in columns:
+        role = CANONICAL_ROLES.get(col.lower())
+        if role is None:
+            group, kind = _group_of(col), _kind_of(col)
+            if group is None or kind is None:
+                continue
+            role = (group, kind)
+        roles.setdefault(role, []).append(col)
+    return roles
+
+
+def _binary_layout(dat, columns, numeric) -> Optional[Dict[str, Any]]:
+    roles = _grouped_roles(columns)
+    needed = [("treatment", "events"), ("treatment", "total"), ("control", "events"), ("control", "total")]
+    if not all(roles.get(role) for role in needed):
+        return None
+    events_t, total_t, events_c, total_c = (numeric[roles[role][0]] for role in needed)
+    checks_passed = all(_is_count(series) for series in (events_t, total_t, events_c, total_c)) \
+        and bool((events_t <= total_t).all() and (events_c <= total_c).all())
+    has_zero = checks_passed and bool(((events_t == 0) | (events_c == 0)).any())
+    return _layout("binary", {role: roles[role] for role in needed}, checks_passed,
+                   effect_type="OR",
+                   transformation_recommendation="ゼロセルを含む研究があります（Mantel-Haenszel法で解析します）" if has_zero else "",
+                   detected_columns={
+                       "binary_intervention_events": roles[needed[0]], "binary_intervention_total": roles[needed[1]],
+                       "binary_control_events": roles[needed[2]], "binary_control_total": roles[needed[3]],
+                   })
+
+
+def _continuous_layout(columns, numeric) -> Optional[Dict[str, Any]]:
+    roles = _grouped_roles(columns)
+    needed = [("treatment", "mean"), ("treatment", "sd"), ("treatment", "total"),
+              ("control", "mean"), ("control", "sd"), ("control", "total")]
+    if not all(roles.get(role) for role in needed):
+        return None
+    mean_t, sd_t, n_t, mean_c, sd_c, n_c = (numeric[roles[role][0]] for role in needed)
+    checks_passed = mean_t is not None and mean_c is not None \
+        and all(series is not None and bool((series > 0).all()) for series in (sd_t, sd_c)) \
+        and _is_count(n_t) and _is_count(n_c) and bool((n_t > 1).all() and (n_c > 1).all())
+    return _layout("continuous", {role: roles[role] for role in needed}, checks_passed,
+                   effect_type="SMD",
+                   detected_columns={
+                       "continuous_intervention_mean": roles[needed[0]], "continuous_intervention_sd": roles[needed[1]],
+                       "continuous_intervention_n": roles[needed[2]], "continuous_control_mean": roles[needed[3]],
+                       "continuous_control_sd": roles[needed[4]], "continuous_control_n": roles[needed[5]],
+                   })
+
+
+def _proportion_layout(columns, numeric) -> Optional[Dict[str, Any]]:
+    if any(CANONICAL_ROLES.get(col.lower()) or _group_of(col) for col in columns if _kind_of(col) == "events"):
+        return None
+    events = [col for col in columns if _group_of(col) is None and _kind_of(col) == "events"]
+    totals = [col for col in columns if _group_of(col) is None and _kind_of(col) == "total"]
+    if not events or not totals:
+        return None
+    checks_passed = _is_count(numeric[events[0]]) and _is_count(numeric[totals[0]]) \
+        and bool((numeric[events[0]] <= numeric[totals[0]]).all())
+    return _layout("proportion", {"events": events, "total": totals}, checks_passed,
+                   effect_type="PLO",
+                   detected_columns={"proportion_events": events, "proportion_total": totals})
+
+
+def _precomputed_layout(columns, numeric) -> Optional[Dict[str, Any]]:
+    effects = [col for col in columns if _compact(col) in EFFECT_SIZE_NAMES]
+    variances = [col for col in columns if _compact(col) in VARIANCE_NAMES]
+    standard_errors = [col for col in columns if _compact(col) in SE_NAMES
+                       or (_compact(col).startswith("se") and _compact(col)[2:] in EFFECT_SIZE_NAMES)]
+    spreads = variances + standard_errors
+    if not effects or not spreads:
+        return None
+    effect_col = effects[0]
+    checks_passed = numeric[effect_col] is not None and numeric[spreads[0]] is not None \
+        and bool((numeric[spreads[0]] > 0).all())
+
+    compact = _compact(effect_col)
+    is_log = compact.startswith(("log", "ln"))
+    effect_type = "PRE"
+    if is_log:
+        effect_type = {"hr": "HR", "or": "OR", "rr": "RR"}.get(re.sub(r'^(log|ln)', '', compact), "PRE")
+    recommendation = ""
+    if effect_type != "PRE":
+        recommendation = f"{effect_type}データは既にログ変換済みです"
+    if standard_errors and not variances:
+        recommendation = (recommendation + "。" if recommendation else "") + f"{spreads[0]} は標準誤差のため2乗して分散に変換します"
+    return _layout("precomputed", {"effect": effects, "spread": spreads}, checks_passed,
+                   effect_type=effect_type, transformation_recommendation=recommendation,
+                   detected_columns={
+                       "effect_size_candidates": effects, "variance_candidates": spreads,
+                       "transformation_status": {
+                           "is_log_transformed": is_log, "detected_log_columns": [effect_col] if is_log else [],
+                           "transformation_indicators": ["列名パターン"] if is_log else [],
+                           "needs_transformation": False,
+                       },
+                   })
+
+
+def _ratio_ci_layout(columns, numeric) -> Optional[Dict[str, Any]]:
+    ratios = [col for col in columns if _compact(col) in RATIO_NAMES]
+    lowers = [col for col in columns if _has_word(col, CI_LOWER_WORDS) and col not in ratios]
+    uppers = [col for col in columns if _has_word(col, CI_UPPER_WORDS) and col not in ratios]
+    if not ratios or not lowers or not uppers:
+        return None
+    estimate, lower, upper = numeric[ratios[0]], numeric[lowers[0]], numeric[uppers[0]]
+    checks_passed = all(series is not None and bool((series > 0).all()) for series in (estimate, lower, upper)) \
+        and bool(((lower <= estimate) & (estimate <= upper)).all())
+    effect_type = RATIO_NAMES[_compact(ratios[0])]
+    return _layout("ratio_ci", {"ratio": ratios, "lower": lowers, "upper": uppers}, checks_passed,
+                   effect_type=effect_type,
+                   transformation_recommendation=f"{effect_type}と95%信頼区間から対数変換した効果量と標準誤差を計算します",
+                   detected_columns={
+                       "effect_size_candidates": ratios, "ci_lower_candidates": lowers, "ci_upper_candidates": uppers,
+                       "transformation_status": {
+                           "is_log_transformed": False, "detected_log_columns": [],
+                           "transformation_indicators": ["信頼区間の列"], "needs_transformation": True,
+                       },
+                   })
@@ -0,0 +1,336 @@
+"""
+NumPyによるメタ解析の高速パス
+
+モデレーター・サブグループの無い基本的な解析（事前計算済みyi/vi、または二値・連続アウトカムのescalc）について、
+Rを起動せずに統合効果量を計算します。Rの実行（プロット・RData生成）はこれまで通り行い、
+こちらはSlackに速報値を先に返すためだけに使います。
+
+計算は metafor の escalc() / rma() の既定動作に合わせています。
+- escalc: OR, RR, RD, SMD（Hedgesのg, vtype="LS"）, MD（vtype="LS"）
+- tau²推定: FE, DL, REML, PM
+- 異質性: Q, I², H²（ランダム効果モデルでは metafor と同じ「典型的な研究内分散」を使用）
+- 信頼区間: 正規近似（rma() の既定 test="z"）
+"""
+import os
+import math
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 高速パスの有効化（false で無効）
+FAST_META_ANALYSIS_ENABLED = os.environ.get('FAST_META_ANALYSIS_ENABLED', 'true').lower() == 'true'
+
+SUPPORTED_METHODS = ("FE", "EE", "DL", "REML", "PM")
+BINARY_MEASURES = ("OR", "RR", "RD")
+CONTINUOUS_MEASURES = ("SMD", "MD")
+PRECALCULATED_MEASURES = ("PRE", "HR")
+
+_Z_CRIT = 1.959963984540054  # qnorm(0.975)
+_REML_MAX_ITER = 100
+_TOL = 1e-10
+
+
+def escalc(measure: str, **columns: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    効果量 yi と標本分散 vi を計算します（metafor::escalc と同じ定義）。
+
+    Args:
+        measure: "OR", "RR", "RD", "SMD", "MD"
+        columns: 二値は ai, bi, ci, di、連続は m1i, sd1i, n1i, m2i, sd2i, n2i
+
+    Returns:
+        (yi, vi)
+    """
+    if measure in BINARY_MEASURES:
+        ai, bi, ci, di = (np.asarray(columns[name], dtype=float) for name in ("ai", "bi", "ci", "di"))
+        n1i = ai + bi
+        n2i = ci + di
+        if measure == "OR":
+            yi = np.log(ai * di / (bi * ci))
+            vi = 1 / ai + 1 / bi + 1 / ci + 1 / di
+        elif measure == "RR":
+            yi = np.log((ai / n1i) / (ci / n2i))
+            vi = 1 / ai - 1 / n1i + 1 / ci - 1 / n2i
+        else:
+            p1i = ai / n1i
+            p2i = ci / n2i
+            yi = p1i - p2i
+            vi = p1i * (1 - p1i) / n1i + p2i * (1 - p2i) / n2i
+        return yi, vi
+
+    if measure in CONTINUOUS_MEASURES:
+        m1i, sd1i, n1i, m2i, sd2i, n2i = (
+            np.asarray(columns[name], dtype=float) for name in ("m1i", "sd1i", "n1i", "m2i", "sd2i", "n2i")
+        )
+        if measure == "MD":
+            yi = m1i - m2i
+            vi = sd1i ** 2 / n1i + sd2i ** 2 / n2i
+            return yi, vi
+        # Hedgesのg（正確な小標本補正係数）
+        mi = n1i + n2i - 2
+        sdpi = np.sqrt(((n1i - 1) * sd1i ** 2 + (n2i - 1) * sd2i ** 2) / mi)
+        cmi = np.exp(_lgamma(mi / 2) - 0.5 * np.log(mi / 2) - _lgamma((mi - 1) / 2))
+        yi = cmi * (m1i - m2i) / sdpi
+        vi = 1 / n1i + 1 / n2i + yi ** 2 / (2 * (n1i + n2i))
+        return yi, vi
+
+    raise ValueError(f"Unsupported measure for escalc: {measure}")
+
+
+def rma(yi: np.ndarray, vi: np.ndarray, method: str = "REML") -> Dict[str, Any]:
+    """
+    モデレーター無しのメタ解析（metafor::rma の切片のみモデル）。
+
+    Returns:
+        R側の summary_list$overall_analysis と同じキーを持つ辞書
+    """
+    yi = np.asarray(yi, dtype=float)
+    vi = np.asarray(vi, dtype=float)
+    keep = np.isfinite(yi) & np.isfinite(vi)
+    yi, vi = yi[keep], vi[keep]
+    k = len(yi)
+    if k < 2:
+        raise ValueError("At least two studies are required")
+
+    # 固定効果モデルの重みでQ統計量
+    w_fe = 1 / vi
+    mu_fe = np.sum(w_fe * yi) / np.sum(w_fe)
+    qe = float(np.sum(w_fe * (yi - mu_fe) ** 2))
+    df = k - 1
+
+    if method in ("FE", "EE"):
+        tau2 = 0.0
+    elif method == "DL":
+        tau2 = _tau2_dl(yi, vi, qe)
+    elif method == "REML":
+        tau2 = _tau2_reml(yi, vi, start=_tau2_dl(yi, vi, qe))
+    elif method == "PM":
+        tau2 = _tau2_pm(yi, vi)
+    else:
+        raise ValueError(f"Unsupported method: {method}")
+
+    w = 1 / (vi + tau2)
+    estimate = float(np.sum(w * yi) / np.sum(w))
+    se = float(math.sqrt(1 / np.sum(w)))
+    zval = estimate / se
+
+    if method in ("FE", "EE"):
+        i2 = max(0.0, 100 * (qe - df) / qe) if qe > 0 else 0.0
+        h2 = qe / df
+    else:
+        # metafor の「典型的な研究内分散」
+        s2 = df * np.sum(w_fe) / (np.sum(w_fe) ** 2 - np.sum(w_fe ** 2))
+        i2 = float(100 * tau2 / (tau2 + s2))
+        h2 = float((tau2 + s2) / s2)
+
+    return {
+        "k": k,
+        "estimate": estimate,
+        "se": se,
+        "zval": zval,
+        "pval": math.erfc(abs(zval) / math.sqrt(2)),
+        "ci_lb": estimate - _Z_CRIT * se,
+        "ci_ub": estimate + _Z_CRIT * se,
+        "I2": i2,
+        "H2": h2,
+        "tau2": float(tau2),
+        "QE": qe,
+        "QEp": _chi2_sf(qe, df),
+        "method": method,
+    }
+
+
+def run_fast_meta_analysis(csv_path: Path, analysis_params: Dict[str, Any],
+                           column_mapping: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    クリーンアップ済みCSVに対して高速パスを実行します。
+
+    Rと同じ結果が保証できない解析（モデレーター、サブグループ、ゼロセル、未対応の効果量・推定法など）の
+    場合は None を返し、呼び出し側はRの結果を待ちます。
+
+    Returns:
+        {"engine": "numpy", "measure": ..., "overall_analysis": {...}} または None
+    """
+    if not FAST_META_ANALYSIS_ENABLED:
+        return None
+    reason = _unsupported_reason(analysis_params)
+    if reason:
+        logger.info(f"高速パスを使用しません: {reason}")
+        return None
+
+    measure = analysis_params.get("measure")
+    data_cols = _map_columns(analysis_params.get("data_columns", {}), column_mapping or {})
+    try:
+        dat = pd.read_csv(csv_path, na_values=['NA', 'na', 'N/A', 'n/a', ''])
+        if measure in BINARY_MEASURES:
+            columns = _binary_columns(dat, data_cols)
+            if columns is None:
+                return None
+            yi, vi = escalc(measure, **columns)
+        elif measure in CONTINUOUS_MEASURES:
+            yi, vi = escalc(measure, **{
+                name: _numeric(dat, data_cols[name]) for name in ("m1i", "sd1i", "n1i", "m2i", "sd2i", "n2i")
+            })
+        else:
+            yi = _numeric(dat, data_cols["yi"])
+            if data_cols.get("se_col_needs_squaring"):
+                vi = _numeric(dat, data_cols["se_col_needs_squaring"]) ** 2
+            else:
+                vi = _numeric(dat, data_cols["vi"])
+        overall = rma(yi, vi, method=analysis_params.get("model", "REML"))
+    except (KeyError, ValueError, OSError, pd.errors.ParserError) as e:
+        logger.info(f"高速パスでの計算をスキップしました: {e}")
+        return None
+
+    logger.info(f"高速パスで統合効果量を計算しました: estimate={overall['estimate']:.4f}, k={overall['k']}")
+    return {"engine": "numpy", "measure": measure, "overall_analysis": overall}
+
+
+def _unsupported_reason(analysis_params: Dict[str, Any]) -> Optional[str]:
+    measure = analysis_params.get("measure")
+    data_cols = analysis_params.get("data_columns") or {}
+    if analysis_params.get("model", "REML") not in SUPPORTED_METHODS:
+        return f"method={analysis_params.get('model')}"
+    if analysis_params.get("moderator_columns") or analysis_params.get("moderators"):
+        return "moderators"
+    if analysis_params.get("subgroup_columns") or analysis_params.get("subgroups"):
+        return "subgroups"
+    if analysis_params.get("data_format") in ("or_ci", "rr_ci"):
+        return f"data_format={analysis_params.get('data_format')}"
+    if measure in BINARY_MEASURES:
+        if not (data_cols.get("ai") and data_cols.get("ci")
+                and (data_cols.get("bi") or data_cols.get("n1i"))
+                and (data_cols.get("di") or data_cols.get("n2i"))):
+            return "missing binary columns"
+    elif measure in CONTINUOUS_MEASURES:
+        if not all(data_cols.get(name) for name in ("m1i", "sd1i", "n1i", "m2i", "sd2i", "n2i")):
+            return "missing continuous columns"
+    elif measure in PRECALCULATED_MEASURES:
+        if not (data_cols.get("yi") and data_cols.get("vi")):
+            return "missing yi/vi columns"
+    else:
+        return f"measure={measure}"
+    return None
+
+
+def _map_columns(data_cols: Dict[str, Any], column_mapping: Dict[str, str]) -> Dict[str, Any]:
+    """元の列名をクリーンアップ済み列名に変換（RTemplateGeneratorと同じ規則）"""
+    return {key: column_mapping.get(value, value) if isinstance(value, str) else value
+            for key, value in data_cols.items()}
+
+
+def _numeric(dat: pd.DataFrame, column: str) -> np.ndarray:
+    """数値列として取得（Rテンプレートと同様に "14,210" のようなカンマ区切りも数値化）"""
+    series = dat[column]
+    if series.dtype == object:
+        series = series.astype(str).str.replace(",", "", regex=False)
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+
+
+def _binary_columns(dat: pd.DataFrame, data_cols: Dict[str, Any]) -> Optional[Dict[str, np.ndarray]]:
+    ai = _numeric(dat, data_cols["ai"])
+    ci = _numeric(dat, data_cols["ci"])
+    bi = _numeric(dat, data_cols["bi"]) if data_cols.get("bi") else _numeric(dat, data_cols["n1i"]) - ai
+    di = _numeric(dat, data_cols["di"]) if data_cols.get("di") else _numeric(dat, data_cols["n2i"]) - ci
+    cells = np.vstack([ai, bi, ci, di])
+    # ゼロセルがある場合、Rの主解析はMantel-Haenszel法になるため高速パスは使わない
+    if np.any(cells[:, np.all(np.isfinite(cells), axis=0)] == 0):
+        logger.info("高速パスを使用しません: zero cells")
+        return None
+    return {"ai": ai, "bi": bi, "ci": ci, "di": di}
+
+
+def _tau2_dl(yi: np.ndarray, vi: np.ndarray, qe: float) -> float:
+    w = 1 / vi
+    c = np.sum(w) - np.sum(w ** 2) / np.sum(w)
+    return max(0.0, float((qe - (len(yi) - 1)) / c))
+
+
+def _tau2_reml(yi: np.ndarray, vi: np.ndarray, start: float) -> float:
+    """Fisherスコアリング（metafor と同じ更新式、負になる場合はステップを半分に）"""
+    tau2 = start
+    for _ in range(_REML_MAX_ITER):
+        w = 1 / (vi + tau2)
+        sw = np.sum(w)
+        resid = yi - np.sum(w * yi) / sw
+        tr_p = sw - np.sum(w ** 2) / sw
+        tr_pp = np.sum(w ** 2) - 2 * np.sum(w ** 3) / sw + (np.sum(w ** 2) / sw) ** 2
+        adj = (np.sum((w * resid) ** 2) - tr_p) / tr_pp
+        while tau2 + adj < 0 and abs(adj) > _TOL:
+            adj /= 2
+        tau2 = max(0.0, tau2 + adj)
+        if abs(adj) < _TOL:
+            break
+    # ステップ半減で境界に張り付いた場合は0とみなす
+    return float(tau2) if tau2 > _TOL else 0.0
+
+
+def _tau2_pm(yi: np.ndarray, vi: np.ndarray) -> float:
+    """Paule-Mandel: 一般化Q統計量が k-1 となる tau² を二分法で求める"""
+    df = len(yi) - 1
+
+    def generalized_q(tau2):
+        w = 1 / (vi + tau2)
+        return np.sum(w * (yi - np.sum(w * yi) / np.sum(w)) ** 2) - df
+
+    if generalized_q(0.0) <= 0:
+        return 0.0
+    upper = max(float(np.var(yi)), 1e-4)
+    while generalized_q(upper) > 0:
+        upper *= 2
+    lower = 0.0
+    while upper - lower > _TOL * max(1.0, upper):
+        mid = (lower + upper) / 2
+        if generalized_q(mid) > 0:
+            lower = mid
+        else:
+            upper = mid
+    return (lower + upper) / 2
+
+
+def _lgamma(x: np.ndarray) -> np.ndarray:
+    return np.vectorize(math.lgamma, otypes=[float])(x)
+
+
+def _chi2_sf(x: float, df: int) -> float:
+    """カイ二乗分布の上側確率（正則化不完全ガンマ関数）"""
+    a = df / 2
+    x = x / 2
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # 級数展開で下側確率を計算
+        term = total = 1 / a
+        n = a
+        for _ in range(1000):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1 - total * math.exp(log_prefix))
+    # 連分数（Lentz法）で上側確率を計算
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(log_prefix) * h
@@ -1,40 +1,189 @@
 import os
 import json
+import time
 import asyncio
 import logging
+import threading
+import weakref
 import google.generativeai as genai
+from google.generativeai import client as genai_client
 from typing import Dict, Any, Optional
 
+from utils.csv_analysis_cache import compute_csv_fingerprint, get_cached_csv_analysis, store_csv_analysis
+from utils.csv_ingest import describe_schema
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_GEMINI_MODEL_NAME = "gemini-2.5-flash"
+
+# analyze_csv のプロンプトのバージョン（プロンプトを変更したら上げる。CSV分析キャッシュのキーに含まれる）
+ANALYZE_CSV_PROMPT_VERSION = "2"
+
+# イベントループごとの非同期クライアントの作成は google-generativeai の非公開API（_client_manager）に依存するため、
+# 動作を確認したバージョンでのみ使う。それ以外のバージョンではSDKが作る既定の非同期クライアントを使う
+PER_LOOP_ASYNC_CLIENT_SDK_VERSIONS = ("0.8.",)
+
+
+def _make_loop_async_client():
+    """現在のイベントループ専用の非同期クライアントを作成（対応していないSDKの場合はNone）"""
+    version = getattr(genai, "__version__", "")
+    manager = getattr(genai_client, "_client_manager", None)
+    if not version.startswith(PER_LOOP_ASYNC_CLIENT_SDK_VERSIONS) or not hasattr(manager, "make_client"):
+        return None
+    try:
+        return manager.make_client("generative_async")
+    except Exception as e:
+        logger.warning(f"Failed to create a per-loop Gemini async client (using the SDK default): {e}")
+        return None
+
+
+class GeminiModelRegistry:
+    """
+    プロセス全体で共有するGeminiモデルのレジストリ
+
+    genai.configure() はクライアント（gRPCチャネル）のキャッシュを破棄するため、設定はプロセスで一度だけ行います。
+    GenerativeModel はモデル名ごとに一度だけ作成して再利用します。非同期クライアントのgRPCチャネルは
+    作成したイベントループに紐づくため、イベントループごとに専用のクライアントを持ちます
+    （対応するSDKのバージョンのみ。それ以外ではモデルだけをループごとに持ち、クライアントはSDKに任せる）。
+    呼び出しごとのレイテンシとトークン数を操作別に集計します。
+    """
+
+    def __init__(self, api_key: str):
+        genai.configure(api_key=api_key)
+        self.lock = threading.Lock()
+        self.sync_models: Dict[str, genai.GenerativeModel] = {}
+        self.async_models = weakref.WeakKeyDictionary()  # {event_loop: {model_name: GenerativeModel}}
+        self.metrics: Dict[str, Dict[str, float]] = {}
+
+    def get_model(self, model_name: str) -> genai.GenerativeModel:
+        """現在のイベントループ（無ければ同期用）のモデルを取得"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        with self.lock:
+            if loop is None:
+                models = self.sync_models
+            else:
+                models = self.async_models.setdefault(loop, {})
+            model = models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                async_client = _make_loop_async_client() if loop is not None else None
+                if async_client is not None:
+                    # ループごとに専用の非同期クライアントを割り当てる（既定ではプロセス共有のクライアントが使われる）
+                    model._async_client = async_client
+                models[model_name] = model
+                logger.info(f"Created Gemini model {model_name} ({'async' if loop else 'sync'})")
+        return model
+
+    async def generate_content_async(self, prompt: str, model_name: str, operation: str = "generate"):
+        """generate_content_async を実行し、レイテンシとトークン数を記録"""
+        model = self.get_model(model_name)
+        start_time = time.monotonic()
+        try:
+            response = await model.generate_content_async(prompt)
+        except Exception:
+            self._record(operation, time.monotonic() - start_time, None, success=False)
+            raise
+        latency = time.monotonic() - start_time
+        self._record(operation, latency, getattr(response, "usage_metadata", None), success=True)
+        return response
+
+    def _record(self, operation: str, latency: float, usage, success: bool):
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        with self.lock:
+            stats = self.metrics.setdefault(operation, {
+                "calls": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0,
+                "prompt_tokens": 0, "output_tokens": 0,
+            })
+            stats["calls"] += 1
+            stats["errors"] += 0 if success else 1
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            stats["prompt_tokens"] += prompt_tokens
+            stats["output_tokens"] += output_tokens
+        logger.info(f"Gemini {operation}: {latency:.2f}s, tokens in/out={prompt_tokens}/{output_tokens}, success={success}")
+
+    def get_metrics(self) -> Dict[str, Dict[str, float]]:
+        """操作別の呼び出し数・平均/最大レイテンシ・トークン数を取得"""
+        with self.lock:
+            return {
+                operation: {**stats, "avg_latency": stats["total_latency"] / stats["calls"] if stats["calls"] else 0.0}
+                for operation, stats in self.metrics.items()
+            }
+
+
+# グローバルレジストリ
+_gemini_registry = None
+_gemini_registry_lock = threading.Lock()
+
+
+def get_gemini_registry() -> GeminiModelRegistry:
+    """Geminiモデルレジストリのシングルトンを取得"""
+    global _gemini_registry
+    with _gemini_registry_lock:
+        if _gemini_registry is None:
+            # APIキーが設定されていない場合のエラーハンドリングを追加
+            api_key = os.environ.get("GEMINI_API_KEY")
+            if not api_key:
+                logger.error("GEMINI_API_KEY not found in environment variables")
+                raise ValueError("環境変数 GEMINI_API_KEY が設定されていません。")
+            _gemini_registry = GeminiModelRegistry(api_key)
+            logger.info("Gemini model registry initialized")
+    return _gemini_registry
+
+
 class GeminiClient:
     """Gemini APIクライアント（統合版）"""
     
-    def __init__(self):
-        logger.info("Initializing GeminiClient...")
-        # APIキーが設定されていない場合のエラーハンドリングを追加
-        api_key = os.environ.get("GEMINI_API_KEY")
-        if not api_key:
-            logger.error("GEMINI_API_KEY not found in environment variables")
-            raise ValueError("環境変数 GEMINI_API_KEY が設定されていません。")
-        logger.info("GEMINI_API_KEY found, configuring...")
-        genai.configure(api_key=api_key)
-        
-        self.model_name = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.5-flash") # モデル名を修正
-        logger.info(f"Using model: {self.model_name}")
-        self.model = genai.GenerativeModel(self.model_name)
-        logger.info("GeminiClient initialized successfully")
+    def __init__(self, model_name: Optional[str] = None):
+        # 設定とモデルの生成はレジストリで一度だけ行うため、インスタンス生成は軽量
+        self.registry = get_gemini_registry()
+        self.model_name = model_name or os.environ.get("GEMINI_MODEL_NAME", DEFAULT_GEMINI_MODEL_NAME)
+    
+    @property
+    def model(self) -> genai.GenerativeModel:
+        """現在のイベントループ用に共有されたモデル"""
+        return self.registry.get_model(self.model_name)
     
-    async def analyze_csv(self, csv_content: str) -> Dict[str, Any]:
-        """CSV内容を分析してメタ解析への適合性を評価"""
+    async def _generate(self, prompt: str, operation: str):
+        return await self.registry.generate_content_async(prompt, model_name=self.model_name, operation=operation)
+    
+    async def analyze_csv(self, csv_content: str, schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """CSV内容を分析してメタ解析への適合性を評価（schema は csv_ingest のスキーママニフェスト）"""
         logger.info(f"analyze_csv called with content length: {len(csv_content)}")
         # プロンプトを改善し、より堅牢なJSON出力を目指す
         # CSVの行数をカウント（空行を除外し、より堅牢に）
-        csv_lines = [line.strip() for line in csv_content.strip().split('\n') if line.strip()]
-        data_rows = len(csv_lines) - 1 if csv_lines else 0  # ヘッダーを除く
-        logger.info(f"CSV analysis: {len(csv_lines)} total lines, {data_rows} data rows")
+        if schema:
+            data_rows = schema["n_rows"]
+        else:
+            csv_lines = [line.strip() for line in csv_content.strip().split('\n') if line.strip()]
+            data_rows = len(csv_lines) - 1 if csv_lines else 0  # ヘッダーを除く
+        logger.info(f"CSV analysis: {data_rows} data rows")
         logger.info(f"CSV content preview: {csv_content[:500]}...")
         
+        # 同じデータセットの分析結果があればGeminiを呼ばずに返す
+        # プロンプトに含めるスキーマ（全行から判定した列の型）もキャッシュのキーに含める
+        schema_description = describe_schema(schema)
+        fingerprint = compute_csv_fingerprint(csv_content, ANALYZE_CSV_PROMPT_VERSION, self.model_name,
+                                              schema_description)
+        # ファイル・Redisの読み書きで共有イベントループを止めないようスレッドで実行する
+        cached_result = await asyncio.to_thread(get_cached_csv_analysis, fingerprint)
+        if cached_result is not None:
+            logger.info(f"CSV analysis cache hit ({fingerprint[:12]})")
+            return cached_result
+        
+        # 取り込み時に推定した列の型（全行から判定済み）を伝え、先頭3000文字だけでの推測を補う
+        schema_section = ""
+        if schema:
+            schema_section = f"""
+        列の型（全{data_rows}行から判定、桁区切りカンマは数値として扱う）:
+{schema_description}
+"""
+        
         prompt = f"""
         以下のCSVデータを分析し、メタ解析に適しているかを評価してください。
         メタ解析で使用可能な列の種類を特定してください：
@@ -51,7 +200,7 @@ class GeminiClient:
 
         CSV内容 (全{data_rows}行のデータ):
         {csv_content[:3000]}
-
+{schema_section}
         データ変換の自動検出:
         - 列名に「log」「ln」が含まれる場合、ログ変換済みデータとして識別
         - HR、OR、RRなどの比率系効果量は通常ログ変換が必要
@@ -118,7 +267,7 @@ class GeminiClient:
         
         try:
             logger.info("Sending request to Gemini API...")
-            response = await self.model.generate_content_async(prompt)
+            response = await self._generate(prompt, operation="analyze_csv")
             logger.info("Received response from Gemini API")
             # Geminiからの応答がマークダウン形式のJSONブロック(` ```json ... ``` `)で返ってくる場合があるため、それをパースする
             raw_response_text = response.text
@@ -135,6 +284,7 @@ class GeminiClient:
             cleaned_json_str = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', json_str)
             result = json.loads(cleaned_json_str)
             logger.info(f"Successfully parsed JSON response: is_suitable={result.get('is_suitable')}")
+            await asyncio.to_thread(store_csv_analysis, fingerprint, result)
             return result
         except Exception as e:
             logger.error(f"Error in analyze_csv: {e}", exc_info=True)
@@ -218,7 +368,7 @@ class GeminiClient:
         """
         
         try:
-            response = await self.model.generate_content_async(prompt)
+            response = await self._generate(prompt, operation="generate_interpretation")
             raw_response_text = response.text
             if raw_response_text.strip().startswith("```json"):
                 json_str = raw_response_text.strip()[7:-3].strip()
@@ -262,7 +412,7 @@ class GeminiClient:
 - 適切な値がない場合はフィールドを省略してください"""
             
             logger.info(f"Sending structured data extraction request to Gemini")
-            response = await self.model.generate_content_async(enhanced_prompt)
+            response = await self._generate(enhanced_prompt, operation="extract_structured_data")
             raw_response_text = response.text.strip()
             
             # JSONマーカーを削除
@@ -0,0 +1,545 @@
+"""
+永続ジョブキュー
+
+CSV取り込み・R解析・レポート生成のジョブを、実行前にRedis Streams（STORAGE_BACKEND=redis の場合）またはSQLite（単一ノード向け）に
+記録します。ディスパッチャーがキューからジョブを取り出してジョブスケジューラー（core.job_scheduler）のレーンに流すため、
+dynoの再起動やSIGTERMで実行中のジョブが失われません。
+キューを Redis Streams で共有すれば、取り出しと実行を別プロセスのワーカー（python -m worker）に任せ、
+Webプロセスはイベントのackと投入だけを行う構成にできます（JOB_QUEUE_CONSUMER_ENABLED=false）。
+
+- 少なくとも1回の実行: 取り出したジョブには可視性タイムアウトのリースを付け、実行中は定期的に延長し、完了したらackする。
+  リースが切れたジョブ（実行中にプロセスが停止したもの）は次に取り出したコンシューマーが再実行する
+- 冪等な投入: 実行待ち・実行中のジョブと同じジョブIDの投入は1件にまとめる（Slackのイベント再送やボタンの二度押し）。
+  完了または dead となったジョブは、同じジョブIDで改めて投入すると再び実行する
+- 起動時の再開: ディスパッチャーは起動直後からリースの切れたジョブを取り出す。シャットダウン時は未完了のジョブのリースを
+  手放すため、次のプロセスがタイムアウトを待たずに再開できる
+
+ジョブはコルーチンではなく「種類とJSONのパラメータ」で記録し、実行時に register_job_kind で登録した関数で
+コルーチンを組み立てます（SlackクライアントやロガーはJSONにできないため、実行するプロセスのものを渡す）。
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Callable, Coroutine, Dict, List, Optional
+
+from core.job_scheduler import (
+    JOB_LANE_LABELS, JobQueueFullError, check_admission, get_job_scheduler, queued_message, submit_job
+)
+from core.admission_control import get_admission_controller
+
+logger = logging.getLogger(__name__)
+
+# 永続化のバックエンド（auto: STORAGE_BACKEND=redis ならRedis Streams、それ以外はSQLite / memory: 永続化しない）
+JOB_QUEUE_BACKEND = os.environ.get('JOB_QUEUE_BACKEND', 'auto').lower()
+
+JOB_QUEUE_SQLITE_PATH = os.environ.get(
+    'JOB_QUEUE_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'meta_analysis_bot_jobs.sqlite3')
+)
+
+# 取り出したジョブのリースの長さ（実行中は1/3ごとに延長する）
+JOB_QUEUE_VISIBILITY_TIMEOUT = float(os.environ.get('JOB_QUEUE_VISIBILITY_TIMEOUT', '300'))
+
+# リース切れによる再実行を含めた実行回数の上限（超えたジョブは dead として記録して取り出さない）
+JOB_QUEUE_MAX_ATTEMPTS = int(os.environ.get('JOB_QUEUE_MAX_ATTEMPTS', '3'))
+
+# 完了・dead となったジョブの記録（get で参照できる状態）を残す秒数
+JOB_QUEUE_DONE_TTL_SECONDS = float(os.environ.get('JOB_QUEUE_DONE_TTL_SECONDS', '600'))
+
+# キューを確認する間隔（投入時は即座に確認する）
+JOB_QUEUE_POLL_INTERVAL = float(os.environ.get('JOB_QUEUE_POLL_INTERVAL', '1'))
+
+# このプロセスでキューからジョブを取り出して実行するか
+JOB_QUEUE_CONSUMER_ENABLED = os.environ.get('JOB_QUEUE_CONSUMER_ENABLED', 'true').lower() == 'true'
+
+# 永続化するレーン（対話は短く、Webプロセスで応答するため対象外）
+DURABLE_JOB_LANES = ("csv", "analysis", "report")
+
+REDIS_JOB_QUEUE_PREFIX = "job_queue"
+REDIS_JOB_QUEUE_GROUP = "job_workers"
+
+
+# ジョブの種類 -> (レーン, パラメータ・Slackクライアント・ロガーからコルーチンを作る関数)
+_job_kinds: Dict[str, Dict[str, Any]] = {}
+
+
+def register_job_kind(kind: str, lane: str, factory: Callable[[Dict[str, Any], Any, logging.Logger], Coroutine]):
+    """永続ジョブの種類を登録"""
+    _job_kinds[kind] = {"lane": lane, "factory": factory}
+
+
+class SQLiteJobQueue:
+    """SQLiteによる永続ジョブキュー（単一ノード向け。同じファイルを使う複数プロセスで共有できる）"""
+
+    def __init__(self, path: str = JOB_QUEUE_SQLITE_PATH, visibility_timeout: float = JOB_QUEUE_VISIBILITY_TIMEOUT,
+                 max_attempts: int = JOB_QUEUE_MAX_ATTEMPTS, done_ttl: float = JOB_QUEUE_DONE_TTL_SECONDS):
+        self.path = str(path)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.done_ttl = done_ttl
+        self.lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY, lane TEXT NOT NULL, data TEXT NOT NULL, status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, lease_owner TEXT, lease_expires REAL NOT NULL DEFAULT 0,"
+            " enqueued_at REAL NOT NULL, finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_lane_status ON jobs (lane, status, enqueued_at)")
+
+    def enqueue(self, job: Dict[str, Any]) -> bool:
+        """ジョブを記録（同じジョブIDが実行待ち・実行中ならFalse）"""
+        now = time.time()
+        with self.lock:
+            self._conn.execute("DELETE FROM jobs WHERE status IN ('done', 'dead') AND (finished_at < ? OR job_id = ?)",
+                               (now - self.done_ttl, job["job_id"]))
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, lane, data, status, enqueued_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job["job_id"], job["lane"], json.dumps(job, ensure_ascii=False, default=str), now)
+            )
+            return cursor.rowcount == 1
+
+    def claim(self, lane: str, consumer: str, limit: int) -> List[Dict[str, Any]]:
+        """待機中またはリースの切れたジョブを最大 limit 件取り出してリースを付ける"""
+        now = time.time()
+        jobs = []
+        with self.lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT job_id, data, attempts FROM jobs WHERE lane = ? AND"
+                    " (status = 'queued' OR (status = 'leased' AND lease_expires < ?))"
+                    " ORDER BY enqueued_at LIMIT ?", (lane, now, limit)
+                ).fetchall()
+                for job_id, data, attempts in rows:
+                    if attempts >= self.max_attempts:
+                        self._conn.execute("UPDATE jobs SET status = 'dead', finished_at = ? WHERE job_id = ?",
+                                           (now, job_id))
+                        logger.error(f"Job {job_id} exceeded {self.max_attempts} attempts and was marked dead")
+                        continue
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'leased', attempts = ?, lease_owner = ?, lease_expires = ?"
+                        " WHERE job_id = ?", (attempts + 1, consumer, now + self.visibility_timeout, job_id)
+                    )
+                    jobs.append({**json.loads(data), "attempts": attempts + 1})
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return jobs
+
+    def extend(self, job: Dict[str, Any], consumer: str) -> bool:
+        """リースを延長（他のコンシューマーに取り出し直されていた場合はFalse）"""
+        with self.lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND status = 'leased' AND lease_owner = ?",
+                (time.time() + self.visibility_timeout, job["job_id"], consumer)
+            )
+            return cursor.rowcount == 1
+
+    def ack(self, job: Dict[str, Any]):
+        """ジョブを完了として記録"""
+        with self.lock:
+            self._conn.execute("UPDATE jobs SET status = 'done', lease_owner = NULL, finished_at = ? WHERE job_id = ?",
+                               (time.time(), job["job_id"]))
+
+    def release(self, job: Dict[str, Any]):
+        """リースを手放してすぐに取り出せる状態に戻す（実行回数には数えない）"""
+        with self.lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), lease_owner = NULL,"
+                " lease_expires = 0 WHERE job_id = ? AND status = 'leased'", (job["job_id"],)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ジョブの記録（status, attempts を含む）"""
+        with self.lock:
+            row = self._conn.execute("SELECT data, status, attempts FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[0]), "status": row[1], "attempts": row[2]}
+
+    def count(self, lane: str) -> int:
+        """未完了（待機中・実行中）のジョブ数"""
+        with self.lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE lane = ? AND status IN ('queued', 'leased')",
+                                      (lane,)).fetchone()[0]
+
+
+class RedisStreamJobQueue:
+    """Redis Streamsのコンシューマーグループによる永続ジョブキュー（複数dynoで共有）"""
+
+    def __init__(self, client, prefix: str = REDIS_JOB_QUEUE_PREFIX,
+                 visibility_timeout: float = JOB_QUEUE_VISIBILITY_TIMEOUT,
+                 max_attempts: int = JOB_QUEUE_MAX_ATTEMPTS, done_ttl: float = JOB_QUEUE_DONE_TTL_SECONDS):
+        self.client = client
+        self.prefix = prefix
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.done_ttl = done_ttl
+        self._groups = set()
+
+    def _stream(self, lane: str) -> str:
+        return f"{self.prefix}:stream:{lane}"
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def _ensure_group(self, lane: str):
+        if lane in self._groups:
+            return
+        try:
+            self.client.xgroup_create(self._stream(lane), REDIS_JOB_QUEUE_GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._groups.add(lane)
+
+    def enqueue(self, job: Dict[str, Any]) -> bool:
+        """ジョブを記録してストリームに追加（同じジョブIDが実行待ち・実行中ならFalse）"""
+        import redis
+        record = {**job, "status": "queued", "attempts": 0}
+        key = self._key(job["job_id"])
+        self._ensure_group(job["lane"])
+        # 記録だけが残ってストリームに載らない（二度と実行されず、再投入も重複扱いになる）状態を防ぐため、
+        # WATCHで実行待ち・実行中の記録が無いことを確認したうえで記録とXADDを MULTI/EXEC でまとめて実行する
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    if raw and json.loads(raw)["status"] not in ("done", "dead"):
+                        return False
+                    pipe.multi()
+                    pipe.set(key, json.dumps(record, ensure_ascii=False, default=str))
+                    pipe.xadd(self._stream(job["lane"]), {"job_id": job["job_id"]})
+                    pipe.execute()
+                    return True
+                except redis.exceptions.WatchError:
+                    # 同じジョブIDが同時に投入された場合は記録を確認し直す
+                    continue
+
+    def claim(self, lane: str, consumer: str, limit: int) -> List[Dict[str, Any]]:
+        """リースの切れたメッセージを引き取り、残りの枠で新しいメッセージを読む"""
+        self._ensure_group(lane)
+        stream = self._stream(lane)
+        claimed = self.client.xautoclaim(stream, REDIS_JOB_QUEUE_GROUP, consumer,
+                                         min_idle_time=int(self.visibility_timeout * 1000), start_id="0-0",
+                                         count=limit)
+        messages = list(claimed[1])
+        if len(messages) < limit:
+            for _, entries in self.client.xreadgroup(REDIS_JOB_QUEUE_GROUP, consumer, {stream: ">"},
+                                                     count=limit - len(messages)) or []:
+                messages.extend(entries)
+
+        jobs = []
+        for message_id, fields in messages:
+            raw = self.client.get(self._key(fields["job_id"])) if fields else None
+            record = json.loads(raw) if raw else None
+            if record is None or record["status"] in ("done", "dead"):
+                self._drop(stream, message_id)
+                continue
+            if record["attempts"] >= self.max_attempts:
+                record["status"] = "dead"
+                self.client.set(self._key(record["job_id"]), json.dumps(record, ensure_ascii=False), ex=int(self.done_ttl))
+                self._drop(stream, message_id)
+                logger.error(f"Job {record['job_id']} exceeded {self.max_attempts} attempts and was marked dead")
+                continue
+            record["attempts"] += 1
+            record["status"] = "leased"
+            self.client.set(self._key(record["job_id"]), json.dumps(record, ensure_ascii=False))
+            jobs.append({**record, "message_id": message_id})
+        return jobs
+
+    def _drop(self, stream: str, message_id: str):
+        pipe = self.client.pipeline()
+        pipe.xack(stream, REDIS_JOB_QUEUE_GROUP, message_id)
+        pipe.xdel(stream, message_id)
+        pipe.execute()
+
+    def extend(self, job: Dict[str, Any], consumer: str) -> bool:
+        """保留中のメッセージのアイドル時間をリセットしてリースを延長（他のコンシューマーに移っていた場合はFalse）"""
+        stream = self._stream(job["lane"])
+        pending = self.client.xpending_range(stream, REDIS_JOB_QUEUE_GROUP, min=job["message_id"],
+                                             max=job["message_id"], count=1, consumername=consumer)
+        if not pending:
+            return False
+        return bool(self.client.xclaim(stream, REDIS_JOB_QUEUE_GROUP, consumer, min_idle_time=0,
+                                       message_ids=[job["message_id"]], justid=True))
+
+    def ack(self, job: Dict[str, Any]):
+        """メッセージをackし、重複投入の判定用に完了の記録を残す"""
+        record = {key: value for key, value in job.items() if key != "message_id"}
+        record["status"] = "done"
+        pipe = self.client.pipeline()
+        pipe.xack(self._stream(job["lane"]), REDIS_JOB_QUEUE_GROUP, job["message_id"])
+        pipe.xdel(self._stream(job["lane"]), job["message_id"])
+        pipe.set(self._key(job["job_id"]), json.dumps(record, ensure_ascii=False, default=str), ex=int(self.done_ttl))
+        pipe.execute()
+
+    def release(self, job: Dict[str, Any]):
+        """メッセージをストリームに入れ直してすぐに取り出せる状態に戻す（実行回数には数えない）"""
+        record = {key: value for key, value in job.items() if key != "message_id"}
+        record["status"] = "queued"
+        record["attempts"] = max(record["attempts"] - 1, 0)
+        stream = self._stream(job["lane"])
+        pipe = self.client.pipeline()
+        pipe.set(self._key(job["job_id"]), json.dumps(record, ensure_ascii=False, default=str))
+        pipe.xack(stream, REDIS_JOB_QUEUE_GROUP, job["message_id"])
+        pipe.xdel(stream, job["message_id"])
+        pipe.xadd(stream, {"job_id": job["job_id"]})
+        pipe.execute()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ジョブの記録（status, attempts を含む）"""
+        raw = self.client.get(self._key(job_id))
+        return json.loads(raw) if raw else None
+
+    def count(self, lane: str) -> int:
+        """未完了（待機中・実行中）のジョブ数"""
+        return self.client.xlen(self._stream(lane))
+
+
+class JobQueueDispatcher:
+    """永続ジョブキューからジョブを取り出し、ジョブスケジューラーのレーンに空きがある分だけ流すディスパッチャー"""
+
+    def __init__(self, queue, client: Any = None, scheduler=None, lanes=DURABLE_JOB_LANES,
+                 poll_interval: float = JOB_QUEUE_POLL_INTERVAL, consumer_id: Optional[str] = None):
+        self.queue = queue
+        self.client = client
+        self._scheduler = scheduler
+        self.lanes = lanes
+        self.poll_interval = poll_interval
+        self.consumer_id = consumer_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lock = threading.Lock()
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, name="job-queue-dispatcher", daemon=True)
+        self.thread.start()
+        logger.info(f"Job queue dispatcher started (consumer: {self.consumer_id})")
+
+    def wake(self):
+        """新しいジョブが投入されたことを知らせる"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error(f"Job queue dispatch failed: {e}", exc_info=True)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def poll_once(self) -> int:
+        """各レーンの空き（同時実行数と待ち行列の残り）の分だけジョブを取り出して投入"""
+        scheduler = self._scheduler or get_job_scheduler()
+        lane_stats = scheduler.get_stats()["lanes"]
+        dispatched = 0
+        for lane in self.lanes:
+            stats = lane_stats.get(lane)
+            if stats is None:
+                continue
+            room = stats["concurrency"] + stats["queue_size"] - stats["running"] - stats["queued"]
+            if room <= 0:
+                continue
+            for job in self.queue.claim(lane, self.consumer_id, room):
+                self._dispatch(scheduler, job)
+                dispatched += 1
+        return dispatched
+
+    def _notifier(self, job: Dict[str, Any]) -> Callable[[str], Any]:
+        def notify(text: str):
+            if self.client is None or not job.get("channel_id"):
+                return
+            try:
+                self.client.chat_postMessage(channel=job["channel_id"], thread_ts=job.get("thread_ts"), text=text)
+            except Exception as e:
+                logger.error(f"Failed to notify job {job['job_id']}: {e}")
+        return notify
+
+    def _dispatch(self, scheduler, job: Dict[str, Any]):
+        kind = _job_kinds.get(job["kind"])
+        if kind is None:
+            logger.error(f"Unknown job kind {job['kind']} for job {job['job_id']} (dropped)")
+            self.queue.ack(job)
+            return
+        if job["attempts"] > 1:
+            logger.warning(f"Resuming job {job['job_id']} (attempt {job['attempts']})")
+        notify = self._notifier(job)
+        with self.lock:
+            self._inflight[job["job_id"]] = job
+        coro = self._run_job(job, kind["factory"](job["params"], self.client, logger), notify)
+        user_id = job.get("user_id")
+        try:
+            ticket = scheduler.submit(coro, job["lane"], job_id=job["job_id"],
+                                      tenant=f"user:{user_id}" if user_id else None,
+                                      weight=get_admission_controller().weight_for(user_id))
+        except JobQueueFullError:
+            # 取り出した後に枠が埋まった場合はキューに戻して次の確認で取り出す
+            with self.lock:
+                self._inflight.pop(job["job_id"], None)
+            self.queue.release(job)
+            return
+        if ticket["status"] == "queued":
+            notify(queued_message(job["lane"], ticket["position"]))
+
+    async def _run_job(self, job: Dict[str, Any], coro: Coroutine, notify: Callable[[str], Any]):
+        heartbeat = asyncio.ensure_future(self._heartbeat(job))
+        try:
+            await coro
+        except Exception as e:
+            # 処理自体のエラーは再実行しても同じ結果になるため、通知して完了扱いにする
+            logger.error(f"Durable job {job['job_id']} failed: {e}", exc_info=True)
+            label = JOB_LANE_LABELS.get(job["lane"], job["lane"])
+            notify(f"❌ {label}の処理中にエラーが発生しました: {str(e)}")
+        finally:
+            heartbeat.cancel()
+        # キャンセル（シャットダウン）された場合はここに来ないため、ackせずにリースを手放す
+        await asyncio.to_thread(self.queue.ack, job)
+        with self.lock:
+            self._inflight.pop(job["job_id"], None)
+
+    async def _heartbeat(self, job: Dict[str, Any]):
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            if not await asyncio.to_thread(self.queue.extend, job, self.consumer_id):
+                logger.warning(f"Lost the lease on job {job['job_id']}; it may be run again by another consumer")
+                return
+
+    def stop(self):
+        """新しいジョブの取り出しを停止"""
+        self._stop.set()
+        self._wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+
+    def release_inflight(self):
+        """未完了のジョブのリースを手放し、次に起動したプロセスがすぐに再開できるようにする"""
+        with self.lock:
+            inflight = list(self._inflight.values())
+            self._inflight.clear()
+        for job in inflight:
+            try:
+                self.queue.release(job)
+            except Exception as e:
+                logger.error(f"Failed to release job {job['job_id']}: {e}")
+        if inflight:
+            logger.info(f"Released {len(inflight)} unfinished durable jobs")
+
+
+# グローバルキューとディスパッチャー
+_job_queue = None
+_job_queue_lock = threading.Lock()
+_dispatcher: Optional[JobQueueDispatcher] = None
+
+
+def get_job_queue():
+    """永続ジョブキューを取得（JOB_QUEUE_BACKEND=memory の場合はNone）"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None and JOB_QUEUE_BACKEND != 'memory':
+            _job_queue = _create_job_queue()
+        return _job_queue
+
+
+def _create_job_queue():
+    from utils import conversation_state
+    if JOB_QUEUE_BACKEND == 'redis' or (JOB_QUEUE_BACKEND == 'auto' and conversation_state.STORAGE_BACKEND == 'redis'):
+        backend = conversation_state.get_storage_backend()
+        if hasattr(backend, 'xadd'):
+            logger.info("Durable job queue initialized (Redis Streams)")
+            return RedisStreamJobQueue(backend)
+        logger.warning("Redis is not available for the job queue, falling back to SQLite")
+    logger.info(f"Durable job queue initialized (SQLite: {JOB_QUEUE_SQLITE_PATH})")
+    return SQLiteJobQueue(JOB_QUEUE_SQLITE_PATH)
+
+
+def start_job_queue_dispatcher(client: Any, force: bool = False) -> Optional[JobQueueDispatcher]:
+    """
+    このプロセスで永続ジョブの取り出しを開始（キューが無効、またはコンシューマーでない場合はNone）
+
+    Args:
+        force: JOB_QUEUE_CONSUMER_ENABLED に関わらず取り出す（ワーカープロセス用）
+    """
+    global _dispatcher
+    queue = get_job_queue()
+    if queue is None:
+        return None
+    if not (force or JOB_QUEUE_CONSUMER_ENABLED):
+        logger.info("Job queue consumer is disabled in this process (jobs are run by python -m worker)")
+        if isinstance(queue, SQLiteJobQueue):
+            logger.warning("The SQLite job queue is only shared with workers on the same host; use STORAGE_BACKEND=redis")
+        return None
+    with _job_queue_lock:
+        if _dispatcher is None:
+            _dispatcher = JobQueueDispatcher(queue, client=client)
+        _dispatcher.start()
+        return _dispatcher
+
+
+def enqueue_job(kind: str, params: Dict[str, Any], job_id: str, client: Any, channel_id: Optional[str],
+                thread_ts: Optional[str] = None, user_id: Optional[str] = None,
+                team_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    ジョブを受付制御のうえ永続ジョブキューに記録します（永続化しない構成ではスケジューラーに直接投入）。
+
+    Args:
+        kind: register_job_kind で登録したジョブの種類
+        params: ジョブのパラメータ（JSONにできる値）
+        job_id: 冪等なジョブID（実行待ち・実行中のジョブと同じIDの投入は1件にまとめる）
+        client: Slackクライアント（受付結果の通知と、永続化しない場合の実行に使用）
+
+    Returns:
+        Dict: job_id, lane, status（"enqueued" / "duplicate"、直接投入した場合は submit_job の結果）。受け付けなかった場合はNone
+    """
+    kind_info = _job_kinds[kind]
+    lane = kind_info["lane"]
+
+    def notify(text: str):
+        client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, text=text)
+
+    queue = get_job_queue()
+    if queue is None:
+        return submit_job(kind_info["factory"](params, client, logger), lane, job_id=job_id, notify=notify,
+                          user_id=user_id, channel_id=channel_id, team_id=team_id)
+
+    decision = check_admission(lane, notify=notify, user_id=user_id, channel_id=channel_id, team_id=team_id)
+    if not decision["admitted"]:
+        logger.warning(f"Rejected job {job_id} by admission control ({decision['scope']})")
+        return None
+    job = {"job_id": job_id, "kind": kind, "lane": lane, "params": params, "channel_id": channel_id,
+           "thread_ts": thread_ts, "user_id": user_id, "team_id": team_id, "enqueued_at": time.time()}
+    if not queue.enqueue(job):
+        get_admission_controller().refund(decision)
+        logger.info(f"Job {job_id} is already queued or running (duplicate ignored)")
+        return {"job_id": job_id, "lane": lane, "status": "duplicate"}
+    logger.info(f"Enqueued durable {kind} job {job_id}")
+    if _dispatcher is not None:
+        _dispatcher.wake()
+    return {"job_id": job_id, "lane": lane, "status": "enqueued"}
+
+
+def stop_job_queue_dispatcher():
+    """永続ジョブの取り出しを停止（実行中のジョブはそのまま）"""
+    if _dispatcher is not None:
+        _dispatcher.stop()
+
+
+def release_inflight_jobs():
+    """未完了の永続ジョブのリースを手放す（共有イベントループの停止後に呼ぶ）"""
+    if _dispatcher is not None:
+        _dispatcher.release_inflight()
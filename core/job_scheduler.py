@@ -0,0 +1,464 @@
+"""
+レーン別ジョブスケジューラー
+
+Slackハンドラーから投入するジョブを種類ごとのレーン（対話・CSV取り込み・R解析・レポート生成）に振り分け、
+レーンごとの同時実行数と待ち行列の上限を守りながら共有イベントループ（core.async_loop）で実行します。
+数分かかるR解析が同時実行枠を埋めていても、対話のターンは対話レーンの枠ですぐに実行されます。
+
+- 待ち行列が上限に達したレーンへの投入は JobQueueFullError で拒否する（バックプレッシャー）
+- 待ち行列内は優先度順で、待ち時間に応じて優先度を引き上げる（エージング）ため低優先度のジョブも取り残されない
+- 投入したユーザー（テナント）ごとに重み付きラウンドロビンで順番を回し、1人あたりの待ち件数にも上限を設けるため、
+  大量に投入したユーザーがいても他のユーザーのジョブはその後ろに並ばない
+  （CSV取り込みとR解析は投入前に core.admission_control のトークンバケットで受付を判定する）
+- 完了したジョブの記録は保持期間と件数の上限を超えたものから自動的に削除する
+"""
+import os
+import math
+import time
+import logging
+import threading
+import itertools
+import concurrent.futures
+from collections import OrderedDict
+from typing import Any, Callable, Coroutine, Dict, List, Optional
+
+from core.async_loop import AsyncLoopService, get_loop_service
+from core.admission_control import ADMISSION_CONTROL_ENABLED, ADMISSION_LANES, get_admission_controller
+
+logger = logging.getLogger(__name__)
+
+JOB_LANES = ("dialogue", "csv", "analysis", "report")
+
+# レーンごとの同時実行数と待ち行列の上限
+# （R解析の同時実行数は常駐Rワーカー数に合わせる。超えた分はワーカーの空き待ちになるだけのため）
+JOB_LANE_LIMITS = {
+    "dialogue": {
+        "concurrency": int(os.environ.get('JOB_LANE_DIALOGUE_CONCURRENCY', '8')),
+        "queue_size": int(os.environ.get('JOB_LANE_DIALOGUE_QUEUE_SIZE', '50')),
+    },
+    "csv": {
+        "concurrency": int(os.environ.get('JOB_LANE_CSV_CONCURRENCY', '3')),
+        "queue_size": int(os.environ.get('JOB_LANE_CSV_QUEUE_SIZE', '20')),
+    },
+    "analysis": {
+        "concurrency": int(os.environ.get('JOB_LANE_ANALYSIS_CONCURRENCY', os.environ.get('R_WORKER_POOL_SIZE', '2'))),
+        "queue_size": int(os.environ.get('JOB_LANE_ANALYSIS_QUEUE_SIZE', '10')),
+    },
+    "report": {
+        "concurrency": int(os.environ.get('JOB_LANE_REPORT_CONCURRENCY', '2')),
+        "queue_size": int(os.environ.get('JOB_LANE_REPORT_QUEUE_SIZE', '20')),
+    },
+}
+
+# 利用者向けメッセージでのレーン名
+JOB_LANE_LABELS = {"dialogue": "対話", "csv": "データ取り込み", "analysis": "解析", "report": "レポート生成"}
+
+# この秒数だけ待つごとに優先度を1つ引き上げる（0でエージングなし）
+JOB_PRIORITY_AGING_SECONDS = float(os.environ.get('JOB_PRIORITY_AGING_SECONDS', '30'))
+
+# 1テナント（ユーザー）がレーンの待ち行列に置けるジョブ数の上限（0で無制限）
+JOB_TENANT_QUEUE_SIZE = int(os.environ.get('JOB_TENANT_QUEUE_SIZE', '3'))
+
+# 完了したジョブの記録を保持する秒数と件数の上限
+JOB_RECORD_TTL_SECONDS = float(os.environ.get('JOB_RECORD_TTL_SECONDS', '3600'))
+JOB_RECORD_MAX = int(os.environ.get('JOB_RECORD_MAX', '500'))
+
+
+class JobQueueFullError(RuntimeError):
+    """レーンの待ち行列が上限に達しているためジョブを受け付けられない"""
+
+    def __init__(self, lane: str, queue_size: int, tenant: Optional[str] = None):
+        if tenant is None:
+            super().__init__(f"Job lane '{lane}' is full ({queue_size} jobs queued)")
+        else:
+            super().__init__(f"Job lane '{lane}' is full for {tenant} ({queue_size} jobs queued)")
+        self.lane = lane
+        self.queue_size = queue_size
+        self.tenant = tenant
+
+
+class JobScheduler:
+    """レーンごとに同時実行数と待ち行列を管理するジョブスケジューラー"""
+
+    def __init__(self, lanes: Optional[Dict[str, Dict[str, int]]] = None,
+                 aging_seconds: float = JOB_PRIORITY_AGING_SECONDS,
+                 record_ttl: float = JOB_RECORD_TTL_SECONDS, max_records: int = JOB_RECORD_MAX,
+                 tenant_queue_size: int = JOB_TENANT_QUEUE_SIZE,
+                 loop_service: Optional[AsyncLoopService] = None):
+        self.lanes = {lane: dict(limits) for lane, limits in (lanes or JOB_LANE_LIMITS).items()}
+        self.aging_seconds = aging_seconds
+        self.tenant_queue_size = tenant_queue_size
+        self.record_ttl = record_ttl
+        self.max_records = max_records
+        self._loop_service = loop_service
+        self.lock = threading.Lock()
+        self._queues: Dict[str, List[Dict[str, Any]]] = {lane: [] for lane in self.lanes}
+        self._running: Dict[str, int] = {lane: 0 for lane in self.lanes}
+        # 重み付きラウンドロビンの巡回順と、先頭のテナントが今回の順番で実行した件数
+        self._rotation: Dict[str, List[Optional[str]]] = {lane: [] for lane in self.lanes}
+        self._served: Dict[str, int] = {lane: 0 for lane in self.lanes}
+        self.metrics: Dict[str, Dict[str, float]] = {lane: {
+            "submitted": 0, "started_immediately": 0, "queued": 0, "rejected_lane_full": 0,
+            "rejected_tenant_full": 0, "dispatched_from_queue": 0, "total_queue_wait": 0.0, "max_queue_wait": 0.0,
+        } for lane in self.lanes}
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self.records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._seq = itertools.count(1)
+        self.pid = os.getpid()
+
+    def submit(self, coro: Coroutine, lane: str, job_id: Optional[str] = None, priority: int = 0,
+               tenant: Optional[str] = None, weight: int = 1) -> Dict[str, Any]:
+        """
+        ジョブをレーンに投入します（任意のスレッドから呼び出し可能）。
+
+        Args:
+            coro: 実行するコルーチン
+            lane: JOB_LANES のいずれか
+            job_id: ログ・状態確認用のジョブID（Noneの場合は自動生成）
+            priority: 同じテナント内での優先度（大きいほど先に実行）
+            tenant: 公平に順番を回す単位（通常は "user:<ユーザーID>"。Noneのジョブは1つのテナントとして扱う）
+            weight: 重み付きラウンドロビンで1回の順番に実行するテナントのジョブ数
+
+        Returns:
+            Dict: job_id, lane, status（"running" または "queued"）, position（待ち順、実行中は0）, future
+
+        Raises:
+            JobQueueFullError: レーンの待ち行列、またはテナントの待ち件数が上限に達している場合
+        """
+        if lane not in self.lanes:
+            coro.close()
+            raise ValueError(f"Unknown job lane: {lane}")
+        seq = next(self._seq)
+        if job_id is None:
+            job_id = f"{lane}_{seq}"
+        now = time.time()
+        record = {"job_id": job_id, "lane": lane, "tenant": tenant, "priority": priority, "status": "queued",
+                  "submitted_at": now, "started_at": None, "finished_at": None, "error": None}
+        entry = {"seq": seq, "coro": coro, "future": concurrent.futures.Future(), "record": record, "inner": None,
+                 "weight": max(1, weight)}
+
+        with self.lock:
+            queue = self._queues[lane]
+            limits = self.lanes[lane]
+            metrics = self.metrics[lane]
+            metrics["submitted"] += 1
+            start = self._running[lane] < limits["concurrency"] and not queue
+            if not start and len(queue) >= limits["queue_size"]:
+                metrics["rejected_lane_full"] += 1
+                coro.close()
+                raise JobQueueFullError(lane, len(queue))
+            if not start and tenant is not None and self.tenant_queue_size > 0:
+                tenant_queued = sum(1 for queued in queue if queued["record"]["tenant"] == tenant)
+                if tenant_queued >= self.tenant_queue_size:
+                    metrics["rejected_tenant_full"] += 1
+                    coro.close()
+                    raise JobQueueFullError(lane, tenant_queued, tenant=tenant)
+            self.records[job_id] = record
+            self.records.move_to_end(job_id)
+            self._evict_finished_records(now)
+            self._active[job_id] = entry
+            if start:
+                self._running[lane] += 1
+                metrics["started_immediately"] += 1
+                position = 0
+            else:
+                queue.append(entry)
+                metrics["queued"] += 1
+                position = self._position(lane, entry, now)
+
+        if start:
+            self._start(entry)
+            logger.info(f"Started {lane} job {job_id}")
+        else:
+            logger.info(f"Queued {lane} job {job_id} (position: {position})")
+        return {"job_id": job_id, "lane": lane, "status": "running" if start else "queued",
+                "position": position, "future": entry["future"]}
+
+    def _effective_priority(self, entry: Dict[str, Any], now: float) -> float:
+        priority = entry["record"]["priority"]
+        if self.aging_seconds > 0:
+            priority += (now - entry["record"]["submitted_at"]) / self.aging_seconds
+        return priority
+
+    def _pending_by_tenant(self, lane: str, now: float) -> Dict[Optional[str], List[Dict[str, Any]]]:
+        # テナント内は実効優先度が高い順、同じなら投入順
+        pending: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        for entry in sorted(self._queues[lane], key=lambda entry: (-self._effective_priority(entry, now), entry["seq"])):
+            pending.setdefault(entry["record"]["tenant"], []).append(entry)
+        return pending
+
+    def _rotation_state(self, lane: str, pending: Dict[Optional[str], List[Dict[str, Any]]]):
+        """待ちのあるテナントの巡回順（新しく並んだテナントは最初の投入順に末尾へ）と先頭のテナントの実行済み件数"""
+        rotation = [tenant for tenant in self._rotation[lane] if tenant in pending]
+        served = self._served[lane] if rotation and self._rotation[lane][0] == rotation[0] else 0
+        newcomers = [tenant for tenant in pending if tenant not in rotation]
+        rotation += sorted(newcomers, key=lambda tenant: min(entry["seq"] for entry in pending[tenant]))
+        return rotation, served
+
+    @staticmethod
+    def _take_turn(rotation: List[Optional[str]], served: int,
+                   pending: Dict[Optional[str], List[Dict[str, Any]]]):
+        """巡回順の先頭のテナントから1件取り出し、重みの件数だけ実行したら次のテナントに順番を回す"""
+        tenant = rotation[0]
+        entry = pending[tenant].pop(0)
+        served += 1
+        if not pending[tenant]:
+            rotation.pop(0)
+            served = 0
+        elif served >= entry["weight"]:
+            rotation.append(rotation.pop(0))
+            served = 0
+        return entry, served
+
+    def _ordered_queue(self, lane: str, now: float) -> List[Dict[str, Any]]:
+        """待ち行列のジョブを実行される順に並べる（テナント間は重み付きラウンドロビン）"""
+        pending = self._pending_by_tenant(lane, now)
+        rotation, served = self._rotation_state(lane, pending)
+        order = []
+        while rotation:
+            entry, served = self._take_turn(rotation, served, pending)
+            order.append(entry)
+        return order
+
+    def _position(self, lane: str, entry: Dict[str, Any], now: float) -> int:
+        return self._ordered_queue(lane, now).index(entry) + 1
+
+    def _start(self, entry: Dict[str, Any]):
+        """ジョブを共有イベントループで実行（呼び出し前にレーンの実行数を加算済みであること）"""
+        record = entry["record"]
+        if not entry["future"].set_running_or_notify_cancel():
+            entry["coro"].close()
+            self._finish(entry, "cancelled")
+            return
+        record["status"] = "running"
+        record["started_at"] = time.time()
+        try:
+            service = self._loop_service or get_loop_service()
+            # 同時実行数はレーンで制限済みのため、ループ全体の上限は通さない
+            entry["inner"] = service.submit(entry["coro"], job_id=record["job_id"], limit=False)
+        except Exception as e:
+            entry["coro"].close()
+            self._finish(entry, "failed", e)
+            entry["future"].set_exception(e)
+            return
+        entry["inner"].add_done_callback(lambda inner: self._handle_completion(entry, inner))
+
+    def _handle_completion(self, entry: Dict[str, Any], inner: concurrent.futures.Future):
+        future = entry["future"]
+        if inner.cancelled():
+            self._finish(entry, "cancelled")
+            future.set_exception(concurrent.futures.CancelledError())
+        elif inner.exception() is not None:
+            self._finish(entry, "failed", inner.exception())
+            future.set_exception(inner.exception())
+        else:
+            self._finish(entry, "completed")
+            future.set_result(inner.result())
+
+    def _finish(self, entry: Dict[str, Any], status: str, error: Optional[BaseException] = None):
+        """実行済みのジョブを完了として記録し、空いた枠で待ち行列の次のジョブを開始"""
+        record = entry["record"]
+        lane = record["lane"]
+        to_start = []
+        with self.lock:
+            record["status"] = status
+            record["finished_at"] = time.time()
+            record["error"] = str(error) if error is not None else None
+            self._active.pop(record["job_id"], None)
+            self._running[lane] -= 1
+            to_start = self._pop_startable(lane)
+        for next_entry in to_start:
+            self._start(next_entry)
+
+    def _pop_startable(self, lane: str) -> List[Dict[str, Any]]:
+        """空いている枠の数だけ待ち行列から取り出す（ロックを保持して呼び出すこと）"""
+        now = time.time()
+        to_start = []
+        metrics = self.metrics[lane]
+        while self._queues[lane] and self._running[lane] < self.lanes[lane]["concurrency"]:
+            pending = self._pending_by_tenant(lane, now)
+            rotation, served = self._rotation_state(lane, pending)
+            entry, self._served[lane] = self._take_turn(rotation, served, pending)
+            self._rotation[lane] = rotation
+            self._queues[lane].remove(entry)
+            self._running[lane] += 1
+            wait = now - entry["record"]["submitted_at"]
+            metrics["dispatched_from_queue"] += 1
+            metrics["total_queue_wait"] += wait
+            metrics["max_queue_wait"] = max(metrics["max_queue_wait"], wait)
+            to_start.append(entry)
+        return to_start
+
+    def _evict_finished_records(self, now: float):
+        """保持期間を過ぎた完了済みの記録と、件数の上限を超えた古い完了済みの記録を削除（ロックを保持して呼び出すこと）"""
+        finished = [job_id for job_id, record in self.records.items() if record["finished_at"] is not None]
+        expired = {job_id for job_id in finished if now - self.records[job_id]["finished_at"] > self.record_ttl}
+        overflow = max(0, len(self.records) - len(expired) - self.max_records)
+        for job_id in list(expired) + [job_id for job_id in finished if job_id not in expired][:overflow]:
+            del self.records[job_id]
+
+    def cancel_job(self, job_id: str) -> bool:
+        """待機中のジョブを取り消すか、実行中のジョブにキャンセルを要求"""
+        with self.lock:
+            entry = self._active.get(job_id)
+            if entry is None:
+                return False
+            queue = self._queues[entry["record"]["lane"]]
+            queued = entry in queue
+            if queued:
+                queue.remove(entry)
+                self._active.pop(job_id, None)
+                entry["record"]["status"] = "cancelled"
+                entry["record"]["finished_at"] = time.time()
+        if queued:
+            entry["coro"].close()
+            entry["future"].cancel()
+            logger.info(f"Cancelled queued job {job_id}")
+            return True
+        return entry["inner"] is not None and entry["inner"].cancel()
+
+    def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ジョブの状態（待機中の場合は現在の待ち順を含む）"""
+        with self.lock:
+            record = self.records.get(job_id)
+            if record is None:
+                return None
+            status = dict(record)
+            entry = self._active.get(job_id)
+            if status["status"] == "queued" and entry is not None:
+                status["position"] = self._position(record["lane"], entry, time.time())
+        return status
+
+    def get_stats(self) -> Dict[str, Any]:
+        """レーンごとの実行数・待ち数と保持している記録の件数"""
+        with self.lock:
+            lanes = {lane: {"running": self._running[lane], "queued": len(self._queues[lane]), **limits}
+                     for lane, limits in self.lanes.items()}
+            return {"lanes": lanes, "records": len(self.records)}
+
+    def get_metrics(self) -> Dict[str, Dict[str, float]]:
+        """レーン別の投入数・待ち数・拒否数と待ち時間（平均・最大）"""
+        with self.lock:
+            return {
+                lane: {**metrics, "avg_queue_wait": (metrics["total_queue_wait"] / metrics["dispatched_from_queue"]
+                                                     if metrics["dispatched_from_queue"] else 0.0)}
+                for lane, metrics in self.metrics.items()
+            }
+
+    def shutdown(self):
+        """待機中のジョブをすべて取り消す（実行中のジョブは共有イベントループのシャットダウンで待つ）"""
+        with self.lock:
+            pending = [entry for queue in self._queues.values() for entry in queue]
+            for queue in self._queues.values():
+                queue.clear()
+            for entry in pending:
+                self._active.pop(entry["record"]["job_id"], None)
+                entry["record"]["status"] = "cancelled"
+                entry["record"]["finished_at"] = time.time()
+        for entry in pending:
+            entry["coro"].close()
+            entry["future"].cancel()
+        if pending:
+            logger.info(f"Cancelled {len(pending)} queued jobs")
+
+
+# グローバルスケジューラー
+_job_scheduler = None
+_job_scheduler_lock = threading.Lock()
+
+
+def get_job_scheduler() -> JobScheduler:
+    """ジョブスケジューラーのシングルトンを取得"""
+    global _job_scheduler
+    with _job_scheduler_lock:
+        # fork後の子プロセスでは待ち行列を引き継がない
+        if _job_scheduler is None or _job_scheduler.pid != os.getpid():
+            _job_scheduler = JobScheduler()
+        return _job_scheduler
+
+
+def submit_job(coro: Coroutine, lane: str, job_id: Optional[str] = None, priority: int = 0,
+               notify: Optional[Callable[[str], Any]] = None, user_id: Optional[str] = None,
+               channel_id: Optional[str] = None, team_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    ジョブをレーンに投入し、待ちが発生した場合や受け付けられなかった場合は notify で利用者に知らせます。
+
+    受付制御の対象レーン（ADMISSION_LANES）では、ユーザー・チャンネル・ワークスペースのトークンバケットで
+    受付を判定してから、ユーザーをテナントとしてスケジューラーに投入します。
+
+    Returns:
+        Dict: JobScheduler.submit の結果（受付制御や待ち行列の上限で受け付けられなかった場合はNone）
+    """
+    decision = check_admission(lane, notify=notify, user_id=user_id, channel_id=channel_id, team_id=team_id)
+    if not decision["admitted"]:
+        coro.close()
+        logger.warning(f"Rejected job {job_id} by admission control ({decision['scope']})")
+        return None
+
+    try:
+        ticket = get_job_scheduler().submit(coro, lane, job_id=job_id, priority=priority,
+                                            tenant=f"user:{user_id}" if user_id else None,
+                                            weight=get_admission_controller().weight_for(user_id))
+    except JobQueueFullError as e:
+        get_admission_controller().refund(decision)
+        logger.warning(f"Rejected job {job_id}: {e}")
+        _notify(notify, queue_full_message(e))
+        return None
+    if ticket["status"] == "queued":
+        _notify(notify, queued_message(lane, ticket["position"]))
+    return ticket
+
+
+def check_admission(lane: str, notify: Optional[Callable[[str], Any]] = None, user_id: Optional[str] = None,
+                    channel_id: Optional[str] = None, team_id: Optional[str] = None) -> Dict[str, Any]:
+    """受付制御の対象レーンならトークンバケットで判定し、拒否した場合は notify で再試行の目安を知らせる"""
+    if not (ADMISSION_CONTROL_ENABLED and lane in ADMISSION_LANES):
+        return {"admitted": True, "scope": None, "retry_after": 0.0, "keys": [], "cost": 0}
+    decision = get_admission_controller().admit(lane, user_id=user_id, channel_id=channel_id, team_id=team_id)
+    if not decision["admitted"]:
+        _notify(notify, _admission_rejected_message(JOB_LANE_LABELS.get(lane, lane), decision))
+    return decision
+
+
+def queued_message(lane: str, position: int) -> str:
+    """順番待ちになったことを知らせるメッセージ"""
+    return f"⏳ {JOB_LANE_LABELS.get(lane, lane)}の順番待ちです（{position}番目）。順番が来たら自動的に開始します。"
+
+
+def queue_full_message(error: JobQueueFullError) -> str:
+    """待ち行列の上限で受け付けられなかったことを知らせるメッセージ"""
+    label = JOB_LANE_LABELS.get(error.lane, error.lane)
+    if error.tenant is not None:
+        return (f"⚠️ すでに{label}の順番待ちが{error.queue_size}件あるため受け付けできませんでした。"
+                "先に依頼したものが始まってからもう一度お試しください。")
+    return (f"⚠️ ただいま{label}の待ちが{error.queue_size}件あり、受け付けできませんでした。"
+            "しばらくしてからもう一度お試しください。")
+
+
+_ADMISSION_SCOPE_LABELS = {"user": "ユーザー", "channel": "チャンネル", "workspace": "ワークスペース"}
+
+
+def _admission_rejected_message(label: str, decision: Dict[str, Any]) -> str:
+    scope_label = _ADMISSION_SCOPE_LABELS.get(decision["scope"], decision["scope"])
+    if math.isinf(decision["retry_after"]):
+        return f"⚠️ {scope_label}ごとの{label}の上限を超えるため受け付けできませんでした。"
+    return (f"⚠️ 短時間に{label}の依頼が集中したため受け付けできませんでした（{scope_label}ごとの上限）。"
+            f"約{math.ceil(decision['retry_after'])}秒後にもう一度お試しください。")
+
+
+def _notify(notify: Optional[Callable[[str], Any]], text: str):
+    if notify is None:
+        return
+    try:
+        notify(text)
+    except Exception as e:
+        logger.error(f"Failed to notify job queue status: {e}")
+
+
+def shutdown_job_scheduler():
+    """待機中のジョブを取り消してスケジューラーを破棄"""
+    global _job_scheduler
+    with _job_scheduler_lock:
+        if _job_scheduler is not None:
+            _job_scheduler.shutdown()
+            _job_scheduler = None
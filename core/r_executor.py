@@ -7,6 +7,8 @@ from pathlib import Path
 from typing import Dict, Any, Optional
 
 from templates.r_templates import RTemplateGenerator # templatesからRTemplateGeneratorをインポート
+from core.r_worker_pool import get_r_worker_pool, RWorkerUnavailableError
+from core.result_cache import get_result_cache, compute_cache_key
 
 logger = logging.getLogger(__name__)
 
@@ -39,14 +41,17 @@ class RAnalysisExecutor:
             "forest_plot_subgroup_prefix": str(self.r_output_dir / f"forest_plot_subgroup_{self.job_id}") # プレフィックス
         }
 
-    async def execute_meta_analysis(self, analysis_params: Dict[str, Any], data_summary: Dict[str, Any]) -> Dict[str, Any]:
+    async def execute_meta_analysis(self, analysis_params: Dict[str, Any], data_summary: Dict[str, Any],
+                                    use_cache: bool = True) -> Dict[str, Any]:
         """
         指定されたパラメータに基づいてメタ解析Rスクリプトを生成し、実行します。
+        同じCSV・同じパラメータの結果が解析結果キャッシュにあれば、Rを実行せずにそれを返します。
 
         Args:
             analysis_params: ユーザーが指定した解析パラメータ。
                              例: {"measure": "OR", "model": "REML", "data_columns": {...}, ...}
             data_summary: CSVファイルの基本的な情報（列名など）。RTemplateGeneratorが参照します。
+            use_cache: Falseの場合は解析結果キャッシュを参照せずに必ずRを実行します（結果は保存されます）。
 
         Returns:
             解析結果を含む辞書。
@@ -59,11 +64,29 @@ class RAnalysisExecutor:
                 "structured_summary_json_path": "/path/to/summary.json",
                 "structured_summary_content": "{...}" (JSON文字列),
                 "rdata_path": "/path/to/result.RData",
+                "cache_hit": True (キャッシュから返した場合のみ),
                 "error": "エラーメッセージ (失敗時)"
             }
         """
         logger.info(f"Rメタ解析実行開始 (Job ID: {self.job_id})。パラメータ: {analysis_params}")
         
+        result_cache = get_result_cache()
+        cache_key = None
+        if result_cache is not None:
+            try:
+                # ファイルの読み込み・コピーはイベントループを止めないようスレッドで行う
+                csv_bytes = await asyncio.to_thread(self.csv_file_path.read_bytes)
+                cache_key = await asyncio.to_thread(compute_cache_key, csv_bytes, analysis_params, data_summary)
+                if use_cache:
+                    cached_result = await asyncio.to_thread(result_cache.get, cache_key, self.r_output_dir, self.job_id)
+                    if cached_result is not None:
+                        return cached_result
+                else:
+                    logger.info(f"解析結果キャッシュをバイパスします (Job ID: {self.job_id})")
+            except Exception as e_cache:
+                logger.warning(f"解析結果キャッシュの参照に失敗しました (Job ID: {self.job_id}): {e_cache}")
+                cache_key = None
+        
         try:
             r_code = self.template_generator.generate_full_r_script(
                 analysis_params=analysis_params,
@@ -89,16 +112,8 @@ class RAnalysisExecutor:
         logger.info(f"使用するR実行可能ファイル: {r_executable} (Job ID: {self.job_id})")
 
         try:
-            # asyncio.to_thread を使って同期的な subprocess.run を非同期的に実行
-            process_result = await asyncio.to_thread(
-                subprocess.run,
-                [r_executable, str(self.r_script_path)],
-                capture_output=True,
-                text=True,
-                timeout=300, # 5分タイムアウト
-                encoding='utf-8', # 明示的にエンコーディング指定
-                check=False # check=False にして、エラー時も結果を処理できるようにする
-            )
+            # asyncio.to_thread を使って同期的なR実行を非同期的に実行
+            process_result = await asyncio.to_thread(self._run_r_script, r_executable)
 
             stdout = process_result.stdout
             stderr = process_result.stderr
@@ -142,7 +157,7 @@ class RAnalysisExecutor:
                     logger.error(f"JSONサマリーのパースに失敗。プロットパスを取得できません。 (Job ID: {self.job_id})")
 
 
-            return {
+            result = {
                 "success": True,
                 "stdout": stdout,
                 "stderr": stderr,
@@ -152,6 +167,9 @@ class RAnalysisExecutor:
                 "structured_summary_content": structured_summary_content,
                 "rdata_path": self.output_paths_in_r["rdata_path"] if Path(self.output_paths_in_r["rdata_path"]).exists() else None,
             }
+            if result_cache is not None and cache_key is not None and structured_summary_content:
+                await asyncio.to_thread(result_cache.put, cache_key, result, self.job_id)
+            return result
 
         except subprocess.TimeoutExpired:
             logger.error(f"Rスクリプト実行タイムアウト (Job ID: {self.job_id})")
@@ -175,6 +193,28 @@ class RAnalysisExecutor:
                 "r_script_path": str(self.r_script_path)
             }
 
+    def _run_r_script(self, r_executable: str, timeout: int = 300) -> subprocess.CompletedProcess:
+        """
+        Rスクリプトを実行します。常駐Rワーカープールが利用可能であればそちらで実行し、
+        利用できない場合は単発のRscriptプロセスで実行します。
+        """
+        pool = get_r_worker_pool()
+        if pool is not None:
+            try:
+                logger.info(f"常駐Rワーカーでスクリプトを実行します (Job ID: {self.job_id})")
+                return pool.run_script(self.r_script_path, timeout=timeout)
+            except RWorkerUnavailableError as e:
+                logger.warning(f"Rワーカープールが利用できないため単発Rscriptで実行します (Job ID: {self.job_id}): {e}")
+
+        return subprocess.run(
+            [r_executable, str(self.r_script_path)],
+            capture_output=True,
+            text=True,
+            timeout=timeout, # 5分タイムアウト
+            encoding='utf-8', # 明示的にエンコーディング指定
+            check=False # check=False にして、エラー時も結果を処理できるようにする
+        )
+
 if __name__ == '__main__':
     # このテストを実行するには、適切なCSVファイルと環境設定が必要
     async def run_test():
@@ -0,0 +1,454 @@
+"""
+常駐Rワーカープール
+
+metafor/jsonlite をロード済みの長寿命Rプロセスを保持し、標準入出力の行プロトコルで
+Rスクリプトを実行します。ジョブごとにRの起動とパッケージロードを行うコストを削減します。
+
+プロトコル（1行1コマンド、タブ区切り）:
+    __PING__                              -> __PONG__
+    __RUN__<TAB>script<TAB>stdout<TAB>stderr -> __R_WORKER_DONE__<TAB>status
+    __QUIT__                              -> プロセス終了
+"""
+import os
+import queue
+import logging
+import tempfile
+import threading
+import subprocess
+import time
+from pathlib import Path
+from typing import Optional
+
+from templates.r_templates import r_function_library_loader
+
+logger = logging.getLogger(__name__)
+
+# プールサイズ（0で無効化）
+R_WORKER_POOL_SIZE = int(os.environ.get('R_WORKER_POOL_SIZE', '2'))
+
+# 1ワーカーあたりの最大ジョブ数（超えたらプロセスを作り直す）
+R_WORKER_MAX_JOBS = int(os.environ.get('R_WORKER_MAX_JOBS', '50'))
+
+# ワーカー起動（ライブラリロード含む）のタイムアウト（秒）
+R_WORKER_STARTUP_TIMEOUT = float(os.environ.get('R_WORKER_STARTUP_TIMEOUT', '60'))
+
+# アイドル状態のワーカーを再利用する前にヘルスチェックする間隔（秒）
+R_WORKER_HEALTH_CHECK_INTERVAL = float(os.environ.get('R_WORKER_HEALTH_CHECK_INTERVAL', '60'))
+
+# 空きワーカーを待つ最大時間（秒）。超えた場合は呼び出し側で単発Rscriptにフォールバックする
+R_WORKER_ACQUIRE_TIMEOUT = float(os.environ.get('R_WORKER_ACQUIRE_TIMEOUT', '30'))
+
+# 起動・再起動に失敗して欠けたワーカーを補充し直すまでの間隔（秒）
+R_WORKER_RESPAWN_INTERVAL = float(os.environ.get('R_WORKER_RESPAWN_INTERVAL', '60'))
+
+_READY_MARKER = "__R_WORKER_READY__"
+_DONE_MARKER = "__R_WORKER_DONE__"
+_PONG_MARKER = "__PONG__"
+
+# ワーカー側のRコード。ジョブは毎回新しい環境で評価し、終了後にグローバル環境・
+# グラフィックデバイス・sink・作業ディレクトリ・optionsを起動直後の状態に戻す。
+# 共通R関数ライブラリは起動時にグローバル環境へ読み込み、ジョブ間で再利用する（__FUNCTION_LIBRARY__ を置換）。
+WORKER_BOOTSTRAP_R = r"""
+suppressPackageStartupMessages({
+    library(metafor)
+    library(jsonlite)
+})
+
+.worker_reset <- function() {
+    while (sink.number() > 0) sink()
+    if (sink.number(type = "message") != 2) sink(type = "message")
+    graphics.off()
+    setwd(.worker_wd)
+    options(.worker_options)
+    leftovers <- setdiff(ls(globalenv(), all.names = TRUE), .worker_baseline)
+    rm(list = leftovers, envir = globalenv())
+    invisible(gc(verbose = FALSE))
+}
+
+.worker_run <- function(script_path, out_path, err_path) {
+    out_con <- file(out_path, open = "wt", encoding = "UTF-8")
+    err_con <- file(err_path, open = "wt", encoding = "UTF-8")
+    sink(out_con)
+    sink(err_con, type = "message")
+    job_env <- new.env(parent = globalenv())
+    status <- tryCatch({
+        withCallingHandlers(
+            source(script_path, local = job_env, encoding = "UTF-8"),
+            warning = function(w) {
+                message("Warning message:\n", conditionMessage(w))
+                invokeRestart("muffleWarning")
+            }
+        )
+        0L
+    }, error = function(e) {
+        message("Error: ", conditionMessage(e))
+        1L
+    })
+    .worker_reset()
+    close(out_con)
+    close(err_con)
+    status
+}
+
+.worker_loop <- function() {
+    input <- file("stdin", open = "r")
+    cat("__R_WORKER_READY__\n")
+    flush(stdout())
+    repeat {
+        line <- readLines(input, n = 1, warn = FALSE)
+        if (length(line) == 0 || line == "__QUIT__") break
+        if (line == "__PING__") {
+            cat("__PONG__\n")
+            flush(stdout())
+            next
+        }
+        parts <- strsplit(line, "\t", fixed = TRUE)[[1]]
+        if (length(parts) != 4 || parts[1] != "__RUN__") next
+        status <- .worker_run(parts[2], parts[3], parts[4])
+        cat("__R_WORKER_DONE__\t", status, "\n", sep = "")
+        flush(stdout())
+    }
+}
+
+__FUNCTION_LIBRARY__
+
+.worker_wd <- getwd()
+.worker_options <- options()
+.worker_baseline <- c(ls(globalenv(), all.names = TRUE), ".worker_baseline")
+.worker_loop()
+"""
+
+
+class RWorkerError(RuntimeError):
+    """Rワーカーの起動・通信に失敗した場合の例外"""
+
+
+class RWorkerUnavailableError(RWorkerError):
+    """プールが利用できない（無効・起動失敗・空きなし）場合の例外"""
+
+
+def _bootstrap_script_path() -> Path:
+    """ワーカー起動用Rスクリプトを一時ディレクトリに書き出し、そのパスを返す"""
+    worker_dir = Path(tempfile.gettempdir()) / "meta_analysis_bot_r_worker"
+    worker_dir.mkdir(parents=True, exist_ok=True)
+    script_path = worker_dir / "r_worker_bootstrap.R"
+    bootstrap = WORKER_BOOTSTRAP_R.replace("__FUNCTION_LIBRARY__", r_function_library_loader())
+    if not script_path.exists() or script_path.read_text(encoding='utf-8') != bootstrap:
+        # 別プロセスのワーカーが書きかけのスクリプトを読まないよう、一時ファイルから os.replace で置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=worker_dir, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(bootstrap)
+            os.replace(tmp_path, script_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    return script_path
+
+
+class RWorker:
+    """metaforロード済みの常駐Rプロセス1つ分"""
+
+    def __init__(self, r_executable: str, worker_id: int):
+        self.r_executable = r_executable
+        self.worker_id = worker_id
+        self.process: Optional[subprocess.Popen] = None
+        self.jobs_completed = 0
+        self.last_used_at = time.time()
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._reader: Optional[threading.Thread] = None
+
+    def start(self, timeout: float = R_WORKER_STARTUP_TIMEOUT):
+        """Rプロセスを起動し、ライブラリロード完了を待つ"""
+        self.process = subprocess.Popen(
+            [self.r_executable, str(_bootstrap_script_path())],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding='utf-8',
+            bufsize=1
+        )
+        self._reader = threading.Thread(
+            target=self._read_stdout, name=f"r-worker-{self.worker_id}-reader", daemon=True
+        )
+        self._reader.start()
+        if self._wait_for(_READY_MARKER, timeout) is None:
+            self.stop()
+            raise RWorkerError(f"Rワーカー {self.worker_id} の起動に失敗しました")
+        self.last_used_at = time.time()
+        logger.info(f"Rワーカー {self.worker_id} を起動しました (pid={self.process.pid})")
+
+    def _read_stdout(self):
+        """プロトコル行を読み取りキューへ渡す（EOFでNoneを送る）"""
+        for line in self.process.stdout:
+            self._lines.put(line.rstrip("\n"))
+        self._lines.put(None)
+
+    def _wait_for(self, marker: str, timeout: float) -> Optional[str]:
+        """指定マーカーで始まる行を待つ。タイムアウトまたはEOFでNone"""
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if line is None:
+                return None
+            if line.startswith(marker):
+                return line
+            logger.debug(f"Rワーカー {self.worker_id} の出力を無視: {line[:200]}")
+
+    def _send(self, command: str):
+        self.process.stdin.write(command + "\n")
+        self.process.stdin.flush()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def ping(self, timeout: float = 5.0) -> bool:
+        """ヘルスチェック"""
+        if not self.is_alive():
+            return False
+        try:
+            self._send("__PING__")
+        except (BrokenPipeError, OSError):
+            return False
+        return self._wait_for(_PONG_MARKER, timeout) is not None
+
+    def run_script(self, script_path: Path, timeout: float) -> subprocess.CompletedProcess:
+        """
+        Rスクリプトをワーカー内で実行します。
+
+        Raises:
+            subprocess.TimeoutExpired: タイムアウトした場合（ワーカーは停止される）
+            RWorkerError: ワーカーとの通信に失敗した場合
+        """
+        script_path = Path(script_path)
+        stdout_path = script_path.with_suffix(".stdout.log")
+        stderr_path = script_path.with_suffix(".stderr.log")
+        command = "\t".join(["__RUN__", str(script_path.resolve()), str(stdout_path.resolve()), str(stderr_path.resolve())])
+
+        try:
+            self._send(command)
+        except (BrokenPipeError, OSError) as e:
+            raise RWorkerError(f"Rワーカー {self.worker_id} への送信に失敗: {e}")
+
+        done_line = self._wait_for(_DONE_MARKER, timeout)
+        if done_line is None:
+            timed_out = self.is_alive()
+            self.stop()
+            if timed_out:
+                raise subprocess.TimeoutExpired([self.r_executable, str(script_path)], timeout)
+            raise RWorkerError(f"Rワーカー {self.worker_id} がジョブ実行中に終了しました")
+
+        self.jobs_completed += 1
+        self.last_used_at = time.time()
+        returncode = int(done_line.split("\t")[1])
+        stdout = stdout_path.read_text(encoding='utf-8', errors='replace') if stdout_path.exists() else ""
+        stderr = stderr_path.read_text(encoding='utf-8', errors='replace') if stderr_path.exists() else ""
+        for log_path in (stdout_path, stderr_path):
+            try:
+                log_path.unlink()
+            except OSError:
+                pass
+        return subprocess.CompletedProcess(
+            args=[self.r_executable, str(script_path)], returncode=returncode, stdout=stdout, stderr=stderr
+        )
+
+    def stop(self):
+        """Rプロセスを停止"""
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self._send("__QUIT__")
+                self.process.wait(timeout=5)
+            except Exception:
+                self.process.kill()
+                self.process.wait()
+        logger.info(f"Rワーカー {self.worker_id} を停止しました (jobs={self.jobs_completed})")
+
+
+class RWorkerPool:
+    """常駐Rワーカーのプール"""
+
+    def __init__(self, size: int = R_WORKER_POOL_SIZE,
+                 r_executable: Optional[str] = None,
+                 max_jobs_per_worker: int = R_WORKER_MAX_JOBS):
+        """
+        Args:
+            size: ワーカー数
+            r_executable: Rscriptのパス（省略時は環境変数 R_EXECUTABLE_PATH または "Rscript"）
+            max_jobs_per_worker: この回数ジョブを実行したワーカーは作り直す
+        """
+        self.size = size
+        self.r_executable = r_executable or os.environ.get("R_EXECUTABLE_PATH", "Rscript")
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._idle: "queue.Queue[RWorker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_worker_id = 0
+        self._closed = False
+        # 稼働中のワーカー数（待機中と実行中の合計）。0になった場合のみプールを利用不可にする
+        self._live = 0
+        self._last_spawn_failure = 0.0
+        self.available = False
+
+    def _spawn_worker(self) -> RWorker:
+        with self._lock:
+            self._next_worker_id += 1
+            worker_id = self._next_worker_id
+        worker = RWorker(self.r_executable, worker_id)
+        worker.start()
+        return worker
+
+    def start(self) -> bool:
+        """
+        ワーカーを起動します。1つも起動できなかった場合はFalseを返し、プールは利用不可となります。
+        """
+        for _ in range(self.size):
+            try:
+                self._idle.put(self._spawn_worker())
+            except (RWorkerError, OSError) as e:
+                logger.warning(f"Rワーカーの起動に失敗しました: {e}")
+                self._last_spawn_failure = time.monotonic()
+                break
+            with self._lock:
+                self._live += 1
+        self.available = self._idle.qsize() > 0
+        if self.available:
+            logger.info(f"Rワーカープールを起動しました (workers={self._idle.qsize()}/{self.size})")
+        return self.available
+
+    def _replace(self, worker: RWorker) -> Optional[RWorker]:
+        """ワーカーを停止し、新しいワーカーに置き換える。失敗時はNone"""
+        worker.stop()
+        if self._closed:
+            return None
+        try:
+            return self._spawn_worker()
+        except (RWorkerError, OSError) as e:
+            logger.error(f"Rワーカーの再起動に失敗しました: {e}")
+            self._last_spawn_failure = time.monotonic()
+            return None
+
+    def _respawn_missing(self):
+        """起動・再起動に失敗して欠けたワーカーを、R_WORKER_RESPAWN_INTERVAL ごとに1つずつ補充する"""
+        with self._lock:
+            if (self._closed or self._live >= self.size
+                    or time.monotonic() - self._last_spawn_failure < R_WORKER_RESPAWN_INTERVAL):
+                return
+            self._live += 1  # 他のスレッドと同時に補充しないよう先に枠を確保する
+        try:
+            worker = self._spawn_worker()
+        except (RWorkerError, OSError) as e:
+            logger.warning(f"Rワーカーの補充に失敗しました: {e}")
+            with self._lock:
+                self._live -= 1
+                self._last_spawn_failure = time.monotonic()
+            return
+        self._idle.put(worker)
+        self.available = True
+        logger.info(f"Rワーカー {worker.worker_id} を補充しました (workers={self._live}/{self.size})")
+
+    def _release(self, worker: Optional[RWorker]):
+        if worker is None:
+            # 再起動に失敗したワーカーの分だけ減らし、実行中のワーカーが残っていればプールは使い続ける
+            with self._lock:
+                self._live -= 1
+                live = self._live
+            if live <= 0 and not self._closed:
+                logger.warning("利用可能なRワーカーがありません。補充できるまで単発Rscriptで実行します。")
+                self.available = False
+            elif not self._closed:
+                logger.warning(f"Rワーカーが減りました (workers={live}/{self.size})")
+            return
+        if self._closed:
+            worker.stop()
+            return
+        if worker.jobs_completed >= self.max_jobs_per_worker:
+            logger.info(f"Rワーカー {worker.worker_id} が {worker.jobs_completed} ジョブに達したため再起動します")
+            worker = self._replace(worker)
+            if worker is None:
+                return self._release(None)
+        self._idle.put(worker)
+
+    def run_script(self, script_path: Path, timeout: float = 300) -> subprocess.CompletedProcess:
+        """
+        空いているワーカーでRスクリプトを実行します。
+
+        Raises:
+            RWorkerUnavailableError: プールが利用不可、または空きワーカーがない場合
+            subprocess.TimeoutExpired: スクリプトがタイムアウトした場合
+        """
+        self._respawn_missing()
+        if not self.available or self._closed:
+            raise RWorkerUnavailableError("Rワーカープールは利用できません")
+        try:
+            worker = self._idle.get(timeout=R_WORKER_ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            raise RWorkerUnavailableError("空いているRワーカーがありません")
+
+        if time.time() - worker.last_used_at > R_WORKER_HEALTH_CHECK_INTERVAL and not worker.ping():
+            logger.warning(f"Rワーカー {worker.worker_id} がヘルスチェックに失敗したため再起動します")
+            worker = self._replace(worker)
+            if worker is None:
+                self._release(None)
+                raise RWorkerUnavailableError("Rワーカーの再起動に失敗しました")
+
+        try:
+            result = worker.run_script(script_path, timeout)
+        except subprocess.TimeoutExpired:
+            self._release(self._replace(worker))
+            raise
+        except RWorkerError as e:
+            self._release(self._replace(worker))
+            raise RWorkerUnavailableError(str(e))
+        self._release(worker)
+        return result
+
+    def shutdown(self):
+        """全ワーカーを停止"""
+        self._closed = True
+        self.available = False
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+        logger.info("Rワーカープールをシャットダウンしました")
+
+
+# グローバルプール
+_r_worker_pool = None
+_r_worker_pool_lock = threading.Lock()
+
+
+def get_r_worker_pool() -> Optional[RWorkerPool]:
+    """Rワーカープールのシングルトンを取得（無効または起動失敗時はNone）"""
+    global _r_worker_pool
+    if R_WORKER_POOL_SIZE <= 0:
+        return None
+    with _r_worker_pool_lock:
+        if _r_worker_pool is None:
+            pool = RWorkerPool()
+            pool.start()
+            _r_worker_pool = pool
+    # 全ワーカーが落ちた場合や初回の起動に失敗した場合も、R_WORKER_RESPAWN_INTERVAL ごとに補充を試みる
+    _r_worker_pool._respawn_missing()
+    return _r_worker_pool if _r_worker_pool.available else None
+
+
+def shutdown_r_worker_pool():
+    """Rワーカープールをシャットダウン"""
+    global _r_worker_pool
+    with _r_worker_pool_lock:
+        if _r_worker_pool is not None:
+            _r_worker_pool.shutdown()
+            _r_worker_pool = None
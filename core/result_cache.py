@@ -0,0 +1,296 @@
+"""
+メタ解析結果のコンテンツアドレス型キャッシュ
+
+同じCSV・同じパラメータでの再解析に対して、Rを再実行せずに以前の成果物
+（サマリーJSON、プロット、RData、Rスクリプト）を返します。
+
+キャッシュキー = sha256(クリーンアップ済みCSVのバイト列 + 正規化した解析パラメータ
+                     + テンプレートのバージョン + R/metaforのバージョン)
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの有効化（false で無効）
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+
+# キャッシュディレクトリ
+RESULT_CACHE_DIR = os.environ.get(
+    'RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'meta_analysis_bot_result_cache')
+)
+
+# キャッシュ全体の最大サイズ（MB）と最大エントリ数
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', '500'))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', '200'))
+
+# 他のプロセスが追加・削除したエントリを反映するため、ディレクトリを走査し直す間隔（秒）
+RESULT_CACHE_RESCAN_INTERVAL = float(os.environ.get('RESULT_CACHE_RESCAN_INTERVAL', '300'))
+
+_META_FILE = "meta.json"
+
+_r_version_fingerprint = None
+_r_version_lock = threading.Lock()
+
+
+def get_template_version() -> str:
+    """Rテンプレートモジュールと共通R関数ライブラリの内容ハッシュ（変更で自動的にキャッシュが無効になる）"""
+    import templates.r_templates as r_templates
+    hasher = hashlib.sha256(Path(r_templates.__file__).read_bytes())
+    hasher.update(r_templates.R_FUNCTION_LIBRARY_VERSION.encode('utf-8'))
+    return hasher.hexdigest()[:16]
+
+
+def get_r_version_fingerprint() -> str:
+    """RとmetaforのバージョンをRscriptで一度だけ取得する（取得失敗時は "unknown"）"""
+    global _r_version_fingerprint
+    with _r_version_lock:
+        if _r_version_fingerprint is None:
+            r_executable = os.environ.get("R_EXECUTABLE_PATH", "Rscript")
+            try:
+                result = subprocess.run(
+                    [r_executable, "-e", 'cat(R.version.string, as.character(packageVersion("metafor")), sep="|")'],
+                    capture_output=True, text=True, timeout=30, encoding='utf-8', check=False
+                )
+                _r_version_fingerprint = result.stdout.strip() if result.returncode == 0 and result.stdout.strip() else "unknown"
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.warning(f"R/metaforのバージョン取得に失敗しました: {e}")
+                _r_version_fingerprint = "unknown"
+            logger.info(f"R/metafor version fingerprint: {_r_version_fingerprint}")
+    return _r_version_fingerprint
+
+
+def compute_cache_key(csv_bytes: bytes, analysis_params: Dict[str, Any], data_summary: Dict[str, Any]) -> str:
+    """
+    キャッシュキーを計算します。
+
+    Args:
+        csv_bytes: クリーンアップ済みCSVの内容
+        analysis_params: 解析パラメータ
+        data_summary: RTemplateGeneratorに渡すデータサマリー（列名と列名マッピングのみ使用）
+    """
+    normalized = json.dumps({
+        "analysis_params": analysis_params,
+        "columns": data_summary.get("columns", []),
+        "column_mapping": data_summary.get("column_mapping") or {},
+    }, sort_keys=True, ensure_ascii=False, default=str)
+
+    hasher = hashlib.sha256()
+    hasher.update(hashlib.sha256(csv_bytes).digest())
+    hasher.update(normalized.encode('utf-8'))
+    hasher.update(get_template_version().encode('utf-8'))
+    hasher.update(get_r_version_fingerprint().encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """ディスク上のLRU解析結果キャッシュ"""
+
+    def __init__(self, cache_dir: str = RESULT_CACHE_DIR,
+                 max_bytes: int = RESULT_CACHE_MAX_MB * 1024 * 1024,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        # キー -> 成果物の合計サイズ（最終アクセスが古い順）。保存のたびにディレクトリを走査しないよう差分で更新する
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._scanned_at: Optional[float] = None
+
+    def _rescan_if_stale(self):
+        """インデックスが未作成か RESULT_CACHE_RESCAN_INTERVAL を過ぎていればディレクトリから作り直す（self.lock を取得済み）"""
+        if self._scanned_at is not None and time.monotonic() - self._scanned_at < RESULT_CACHE_RESCAN_INTERVAL:
+            return
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            meta_path = entry_dir / _META_FILE
+            if entry_dir.name.startswith('.') or not meta_path.exists():
+                continue
+            size = sum(p.stat().st_size for p in entry_dir.iterdir() if p.is_file())
+            entries.append((meta_path.stat().st_mtime, entry_dir.name, size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._total_bytes = sum(self._index.values())
+        self._scanned_at = time.monotonic()
+
+    def _forget(self, key: str):
+        """インデックスからエントリを外す（self.lock を取得済み）"""
+        self._total_bytes -= self._index.pop(key, 0)
+
+    def _count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """ヒット/ミス等のカウンタを取得"""
+        with self.lock:
+            return dict(self.counters)
+
+    def get(self, key: str, r_output_dir: Path, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        キャッシュ済みの結果を r_output_dir にコピーし、execute_meta_analysis と同じ形式の辞書を返します。
+        ミスの場合は None。
+        """
+        entry_dir = self.cache_dir / key
+        meta_path = entry_dir / _META_FILE
+        # エントリの特定とLRUの更新だけをロック内で行い、成果物のコピーは他の保存・参照を止めないようロック外で行う
+        with self.lock:
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                os.utime(meta_path)  # LRU用に最終アクセス時刻を更新
+            except (OSError, json.JSONDecodeError):
+                meta = None
+
+            if meta is None:
+                self._forget(key)
+                self.counters["misses"] += 1
+                return None
+            if key in self._index:
+                self._index.move_to_end(key)
+
+        old_job_id = meta["job_id"]
+        restored = {}
+        try:
+            for kind, file_name in meta["files"].items():
+                target = Path(r_output_dir) / file_name.replace(old_job_id, job_id)
+                shutil.copy2(entry_dir / file_name, target)
+                restored[kind] = str(target)
+            plots = []
+            for plot in meta["plots"]:
+                target = Path(r_output_dir) / plot["file"].replace(old_job_id, job_id)
+                shutil.copy2(entry_dir / plot["file"], target)
+                plots.append({"label": plot["label"], "path": str(target)})
+        except OSError as e:
+            # コピー中に削除・置き換えられた場合も含め、ミスとして扱う（置き換え後の新しいエントリは消さない）
+            logger.warning(f"キャッシュエントリの復元に失敗しました ({key}): {e}")
+            with self.lock:
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        unchanged = json.load(f)["created_at"] == meta["created_at"]
+                except (OSError, json.JSONDecodeError, KeyError):
+                    unchanged = False
+                if unchanged:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    self._forget(key)
+                self.counters["misses"] += 1
+            return None
+        self._count("hits")
+
+        structured_summary_content = None
+        if "summary_json" in restored:
+            summary = json.loads(Path(restored["summary_json"]).read_text(encoding='utf-8'))
+            summary["generated_plots_paths"] = plots
+            structured_summary_content = json.dumps(summary, ensure_ascii=False)
+            Path(restored["summary_json"]).write_text(structured_summary_content, encoding='utf-8')
+
+        logger.info(f"解析結果キャッシュにヒットしました (key: {key[:12]}, Job ID: {job_id})")
+        return {
+            "success": True,
+            "cache_hit": True,
+            "stdout": meta.get("stdout", ""),
+            "stderr": meta.get("stderr", ""),
+            "r_script_path": restored.get("r_script"),
+            "generated_plots_paths": plots,
+            "structured_summary_json_path": restored.get("summary_json"),
+            "structured_summary_content": structured_summary_content,
+            "rdata_path": restored.get("rdata"),
+        }
+
+    def put(self, key: str, result: Dict[str, Any], job_id: str):
+        """成功した解析結果の成果物をキャッシュに保存"""
+        if not result.get("success"):
+            return
+        entry_dir = self.cache_dir / key
+        staging_dir = self.cache_dir / f".{key}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            staging_dir.mkdir(parents=True, exist_ok=True)
+            files = {}
+            size = 0
+            for kind, result_key in (("summary_json", "structured_summary_json_path"),
+                                     ("rdata", "rdata_path"),
+                                     ("r_script", "r_script_path")):
+                path = result.get(result_key)
+                if path and Path(path).exists():
+                    shutil.copy2(path, staging_dir / Path(path).name)
+                    files[kind] = Path(path).name
+                    size += Path(path).stat().st_size
+            plots = []
+            for plot in result.get("generated_plots_paths", []):
+                path = Path(plot["path"])
+                if path.exists():
+                    shutil.copy2(path, staging_dir / path.name)
+                    plots.append({"label": plot["label"], "file": path.name})
+                    size += path.stat().st_size
+
+            meta = {
+                "job_id": job_id,
+                "created_at": time.time(),
+                "stdout": result.get("stdout", ""),
+                "stderr": result.get("stderr", ""),
+                "files": files,
+                "plots": plots,
+            }
+            with open(staging_dir / _META_FILE, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            size += (staging_dir / _META_FILE).stat().st_size
+
+            with self.lock:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(staging_dir, entry_dir)
+                self._forget(key)
+                self._index[key] = size
+                self._total_bytes += size
+                self.counters["stores"] += 1
+            logger.info(f"解析結果をキャッシュに保存しました (key: {key[:12]}, Job ID: {job_id})")
+        except OSError as e:
+            logger.warning(f"解析結果のキャッシュ保存に失敗しました (Job ID: {job_id}): {e}")
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        サイズ・件数の上限を超えた分を最終アクセスが古い順に削除
+
+        合計サイズと順序はメモリ上のインデックスで管理し、ディレクトリの走査は RESULT_CACHE_RESCAN_INTERVAL ごとに限る。
+        """
+        evicted = 0
+        with self.lock:
+            self._rescan_if_stale()
+            while self._index and (self._total_bytes > self.max_bytes or len(self._index) > self.max_entries):
+                key, size = self._index.popitem(last=False)
+                shutil.rmtree(self.cache_dir / key, ignore_errors=True)
+                self._total_bytes -= size
+                evicted += 1
+            self.counters["evictions"] += evicted
+        if evicted:
+            logger.info(f"解析結果キャッシュから {evicted} 件を削除しました")
+        return evicted
+
+
+# グローバルキャッシュ
+_result_cache = None
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """解析結果キャッシュのシングルトンを取得（無効時はNone）"""
+    global _result_cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
@@ -1,10 +1,16 @@
 import asyncio
 import json # 追加
+import hashlib
+from pathlib import Path
 from slack_bolt import App
 from core.metadata_manager import MetadataManager
 from core.r_executor import RAnalysisExecutor # コメント解除
-from utils.slack_utils import create_analysis_result_message, upload_files_to_slack
+from core.fast_meta_analysis import run_fast_meta_analysis
+from utils.rds_writer import R_DATA_HANDOFF_FORMAT, write_dataset_rds
+from core.job_queue import enqueue_job, register_job_kind
+from utils.slack_utils import create_analysis_result_message, create_fast_result_message, upload_files_to_slack
 from utils.file_utils import get_r_output_dir, cleanup_temp_dir_async, save_content_to_temp_file # file_utils から関数をインポート
+from utils.dataset_store import load_dataset
 
 # upload_files_to_slack は utils.slack_utils に作成するが、ここでは一旦ダミーを定義しておく
 # async def upload_files_to_slack(files_to_upload: list, channel_id: str, thread_ts: str, client, job_id: str):
@@ -38,10 +44,6 @@ def register_analysis_handlers(app: App):
             "model": payload.get("csv_analysis", {}).get("suggested_analysis", {}).get("model_type", "random")
         })
         
-        # 一時ディレクトリの準備
-        job_id = payload.get('job_id', 'unknown_job')
-        r_output_dir = get_r_output_dir(job_id)
-
         # CSVファイルもRがアクセスできるように一時保存する (file_urlからダウンロードして保存)
         # csv_handlerでダウンロードしたコンテンツをmetadata経由で渡すか、ここで再度ダウンロードするか検討
         # ここでは、payloadに file_url がある前提で再度ダウンロードして保存する
@@ -52,41 +54,107 @@ def register_analysis_handlers(app: App):
         original_file_url = payload.get("file_url") # csv_handlerで保存したURL
         original_file_name = payload.get("csv_analysis", {}).get("original_filename", "data.csv") # Gemini分析結果からファイル名取得
 
-        asyncio.create_task(run_analysis_async(
+        ticket = enqueue_analysis(
             payload=payload,
             user_parameters=user_parameters,
             channel_id=body["channel"]["id"],
             thread_ts=body["message"]["ts"],
             user_id=body["user"]["id"],
             client=client,
-            logger=logger,
-            r_output_dir=r_output_dir, # Rの出力先ディレクトリ
             original_file_url=original_file_url, # CSVファイルのURL
-            original_file_name=original_file_name # CSVファイル名
-        ))
+            original_file_name=original_file_name, # CSVファイル名
+            team_id=(body.get("team") or {}).get("id")
+        )
         
+        # 受付不可・重複（同じ解析が実行待ち・実行中）の場合は enqueue_analysis で通知済み
+        if ticket is not None and ticket["status"] != "duplicate":
+            client.chat_postMessage(
+                channel=body["channel"]["id"],
+                thread_ts=body["message"]["ts"],
+                text="🔄 解析を開始しました。完了まで少々お待ちください..."
+            )
+
+def analysis_queue_job_id(payload, user_parameters) -> str:
+    """解析ジョブの冪等なジョブID（同じデータ・同じパラメータの依頼は、実行待ち・実行中の間は1件にまとめる）"""
+    digest = hashlib.sha256(json.dumps(user_parameters, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+    return f"analysis_{payload.get('job_id', 'unknown_job')}_{digest}"
+
+
+def enqueue_analysis(payload, user_parameters, channel_id, thread_ts, user_id, client, original_file_url,
+                     original_file_name, team_id=None):
+    """解析ジョブを永続ジョブキューに投入（受け付けなかった場合はNone、同じ解析が実行中なら利用者に知らせる）"""
+    params = {
+        "payload": payload,
+        "user_parameters": user_parameters,
+        "channel_id": channel_id,
+        "thread_ts": thread_ts,
+        "user_id": user_id,
+        "original_file_url": original_file_url,
+        "original_file_name": original_file_name,
+    }
+    ticket = enqueue_job("analysis", params, analysis_queue_job_id(payload, user_parameters), client,
+                         channel_id, thread_ts=thread_ts, user_id=user_id, team_id=team_id)
+    if ticket is not None and ticket["status"] == "duplicate":
         client.chat_postMessage(
-            channel=body["channel"]["id"],
-            thread_ts=body["message"]["ts"],
-            text="🔄 解析を開始しました。完了まで少々お待ちください..."
+            channel=channel_id,
+            thread_ts=thread_ts,
+            text="⏳ 同じ条件の解析がすでに実行待ち・実行中です。完了までお待ちください。"
         )
+    return ticket
+
+
+def _analysis_job(params, client, job_logger):
+    # Rの出力先は実行するプロセスで用意する（再起動後に別のdynoで再開する場合があるため）
+    return run_analysis_async(
+        client=client,
+        logger=job_logger,
+        r_output_dir=get_r_output_dir(params["payload"].get("job_id", "unknown_job")),
+        **params
+    )
+
 
 async def run_analysis_async(payload, user_parameters, channel_id, thread_ts, user_id, client, logger, r_output_dir, original_file_url, original_file_name):
     """メタ解析の非同期実行"""
     temp_csv_path = None
     try:
-        # CSVファイルをダウンロードして一時保存
-        if original_file_url:
+        # CSV受付時に保存したデータセットがあれば再ダウンロードせずに使用
+        stored = None
+        # CSV受付時に作成したスキーママニフェスト（古い会話状態には無い）
+        schema = payload.get("schema")
+        if payload.get("file_id"):
+            stored = await asyncio.to_thread(load_dataset, payload["file_id"], payload.get("content_hash"))
+        if stored:
+            cleaned_csv, stored_column_mapping = stored
+            logger.info(f"Using stored dataset for file {payload['file_id']} (Job ID: {payload['job_id']})")
+            temp_csv_path_str, temp_csv_path_obj, column_mapping = await save_content_to_temp_file(
+                cleaned_csv, payload["job_id"], original_filename=f"{Path(original_file_name).stem}.csv",
+                precleaned_column_mapping=stored_column_mapping or {}
+            )
+            temp_csv_path = temp_csv_path_obj
+        # 保存済みデータセットが無い場合（期限切れ等）はダウンロードして一時保存
+        elif original_file_url:
             from utils.file_utils import download_slack_file_content_async # ここでインポート
+            from utils.csv_ingest import ingest_csv
             csv_bytes = await download_slack_file_content_async(original_file_url, client.token)
+            ingested = await asyncio.to_thread(ingest_csv, csv_bytes)
+            schema = ingested["schema"]
             temp_csv_path_str, temp_csv_path_obj, column_mapping = await save_content_to_temp_file(
-                csv_bytes, payload["job_id"], original_filename=original_file_name
+                ingested["csv_bytes"], payload["job_id"], original_filename=f"{Path(original_file_name).stem}.csv",
+                precleaned_column_mapping=ingested["column_mapping"]
             )
             temp_csv_path = temp_csv_path_obj # Pathオブジェクトを後で使う
         else:
             logger.error("run_analysis_async: CSVファイルのURLがpayloadにありません。")
             raise ValueError("CSV file URL is missing.")
 
+        # 型付きデータセットをRDSで渡す設定なら、RでのCSVパースと列ごとの型変換を省略する
+        rds_path = None
+        if schema and R_DATA_HANDOFF_FORMAT == 'rds':
+            try:
+                rds_path = await asyncio.to_thread(write_dataset_rds, temp_csv_path, schema)
+            except Exception as e:
+                logger.warning(f"RDSの書き出しに失敗したためCSVでRに渡します: {e}")
+        
         r_executor = RAnalysisExecutor(r_output_dir=r_output_dir, csv_file_path=temp_csv_path, job_id=payload["job_id"])
         
         # data_summary を準備（CSVの基本情報）
@@ -123,7 +191,11 @@ async def run_analysis_async(payload, user_parameters, channel_id, thread_ts, us
             return name
         
         # クリーンアップされた列名を使用（Rスクリプトが実際に読み込むCSVと一致させる）
-        csv_columns = [clean_column_name(col) for col in csv_columns_original]
+        if schema:
+            # スキーママニフェストがあれば正規化済みCSVの実際の列名を使う
+            csv_columns = [column["name"] for column in schema["columns"]]
+        else:
+            csv_columns = [clean_column_name(col) for col in csv_columns_original]
         
         # デバッグログ追加
         logger.info(f"Debug - CSV column extraction: original column names: {csv_columns_original}")
@@ -136,12 +208,24 @@ async def run_analysis_async(payload, user_parameters, channel_id, thread_ts, us
             "detected_columns": csv_analysis.get("detected_columns", {}),
             "columns": csv_columns,  # 列情報を追加
             "column_mapping": column_mapping,  # 列名マッピングを追加
+            "schema": schema,  # 列の型情報（Rの colClasses に使用）
+            "rds_path": str(rds_path) if rds_path else None,  # 型付きデータセット（readRDSで読み込む）
             "file_info": {
                 "filename": original_file_name,
                 "job_id": payload["job_id"]
             }
         }
         
+        # Rの完了を待たずに速報値を投稿（高速パスで扱えない解析の場合はNone）
+        fast_result = await asyncio.to_thread(run_fast_meta_analysis, temp_csv_path, user_parameters, column_mapping)
+        if fast_result:
+            await asyncio.to_thread(
+                client.chat_postMessage,
+                channel=channel_id,
+                thread_ts=thread_ts,
+                text=create_fast_result_message(fast_result)
+            )
+        
         analysis_result_from_r = await r_executor.execute_meta_analysis(
             analysis_params=user_parameters,
             data_summary=data_summary
@@ -247,7 +331,8 @@ async def run_analysis_async(payload, user_parameters, channel_id, thread_ts, us
         }
 
         result_message = create_analysis_result_message(display_result_for_blocks)
-        client.chat_postMessage(
+        await asyncio.to_thread(
+            client.chat_postMessage,
             channel=channel_id,
             thread_ts=thread_ts,
             text=result_message,
@@ -270,7 +355,8 @@ async def run_analysis_async(payload, user_parameters, channel_id, thread_ts, us
         }
         
         # レポート生成中メッセージを送信
-        client.chat_postMessage(
+        await asyncio.to_thread(
+            client.chat_postMessage,
             channel=channel_id,
             thread_ts=thread_ts,
             text="📝 解釈レポートを生成中です..."
@@ -287,7 +373,8 @@ async def run_analysis_async(payload, user_parameters, channel_id, thread_ts, us
         
     except Exception as e:
         logger.error(f"解析実行エラー: {e}")
-        client.chat_postMessage(
+        await asyncio.to_thread(
+            client.chat_postMessage,
             channel=channel_id,
             thread_ts=thread_ts,
             text=f"❌ 解析中にエラーが発生しました: {str(e)}"
@@ -299,3 +386,6 @@ async def run_analysis_async(payload, user_parameters, channel_id, thread_ts, us
         if r_output_dir.exists(): # Rの出力ディレクトリ
             await cleanup_temp_dir_async(r_output_dir)
         logger.info(f"解析完了後の一時ディレクトリクリーンアップ試行完了。")
+
+
+register_job_kind("analysis", "analysis", _analysis_job)
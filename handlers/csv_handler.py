@@ -4,26 +4,54 @@ import time
 import logging
 import pandas as pd
 import io
+import shutil
+import tempfile
+from pathlib import Path
 from slack_bolt import App
 from core.metadata_manager import MetadataManager
 from core.gemini_client import GeminiClient
+from core import column_detector
 from utils.slack_utils import create_unsuitable_csv_message, create_analysis_start_message
-from utils.file_utils import download_slack_file_content_async, clean_column_names # clean_column_namesもインポート
+from utils.file_utils import (
+    download_slack_file_to_path_async, clean_column_names, FileTooLargeError, SLACK_DOWNLOAD_MAX_BYTES
+)
 from utils.conversation_state import get_or_create_state, save_state
+from utils.dataset_store import store_dataset
+from utils.csv_ingest import ingest_csv
+from core.job_queue import enqueue_job, register_job_kind
 
 logger = logging.getLogger(__name__)
 
-async def _convert_excel_to_csv(file_bytes, logger):
-    """Excel ファイルを CSV 形式の文字列に変換する"""
+async def analyze_csv_content(csv_content, logger, ingested=None):
+    """CSVの列を分析（標準的なレイアウトはルールベースで判定し、信頼度が低い場合のみGeminiを使用）
+
+    ingested（csv_ingest.ingest_csv の結果）が指定された場合は、パース済みのデータとスキーマを使う。
+    """
+    dat = ingested["dataframe"] if ingested else None
+    schema = ingested["schema"] if ingested else None
+    if column_detector.LOCAL_COLUMN_DETECTOR_ENABLED:
+        local_result = await asyncio.to_thread(column_detector.detect_columns, csv_content, dat)
+        if local_result["confidence"] >= column_detector.LOCAL_COLUMN_DETECTOR_MIN_CONFIDENCE:
+            logger.info(f"Columns detected locally (confidence: {local_result['confidence']}), skipping Gemini")
+            return local_result
+        logger.info(f"Local column detection confidence {local_result['confidence']} is low, using Gemini")
+    
+    logger.info("Calling Gemini API to analyze CSV...")
+    gemini_client = GeminiClient()
+    return await gemini_client.analyze_csv(csv_content, schema=schema)
+
+async def _convert_excel_to_csv(file_source, logger):
+    """Excel ファイル（パスまたはバイト列）を CSV 形式の文字列に変換する"""
     try:
-        # BytesIO を使ってメモリ上でファイルを処理
-        file_buffer = io.BytesIO(file_bytes)
+        # バイト列の場合は BytesIO を使ってメモリ上でファイルを処理
+        if isinstance(file_source, (bytes, bytearray)):
+            file_source = io.BytesIO(file_source)
         
         # pandas で Excel ファイルを読み込み
-        df = pd.read_excel(file_buffer, engine='openpyxl')
+        df = pd.read_excel(file_source, engine='openpyxl')
         
         # 列名をクリーンアップ
-        df = clean_column_names(df)
+        df, _ = clean_column_names(df)
         logger.info(f"Cleaned column names: {list(df.columns)}")
         
         # CSV 形式の文字列に変換
@@ -59,24 +87,15 @@ def register_csv_handlers(app: App):
         
         logger.info(f"CSV/XLSX file detected: {file_info.get('name')}")
         
-        # 非同期でCSV分析を実行
-        import threading
-        
-        def run_async_csv_processing():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(process_csv_async(
-                file_info=file_info,
-                channel_id=event["channel_id"],
-                user_id=event["user_id"],
-                client=client,
-                logger=logger
-            ))
-            loop.close()
-        
-        thread = threading.Thread(target=run_async_csv_processing)
-        thread.start()
-        logger.info(f"Started thread for CSV processing: {thread.name}")
+        # 永続ジョブキュー経由でCSV取り込みレーンに投入（同じファイルの再送は1件にまとめる）
+        job_id = f"file_shared_{file_info.get('id')}"
+        enqueue_job("csv_file", {
+            "file_info": file_info,
+            "channel_id": event["channel_id"],
+            "user_id": event["user_id"],
+        }, job_id=job_id, client=client, channel_id=event["channel_id"],
+            user_id=event["user_id"], team_id=body.get("team_id"))
+        logger.info(f"CSV processing job submitted with ID: {job_id}")
 
 async def process_csv_text_async(csv_text, channel_id, user_id, thread_ts, client, logger):
     """テキスト形式のCSVデータを処理する"""
@@ -85,16 +104,17 @@ async def process_csv_text_async(csv_text, channel_id, user_id, thread_ts, clien
         logger.info(f"Starting CSV text processing. Text size: {len(csv_text)} chars")
         logger.info(f"First 200 chars of CSV text: {csv_text[:200]}...")
         
-        # Gemini APIでCSV分析
-        logger.info("Creating GeminiClient instance...")
-        gemini_client = GeminiClient()
-        logger.info("Calling Gemini API to analyze CSV...")
-        analysis_result = await gemini_client.analyze_csv(csv_text)
-        logger.info(f"Gemini analysis result: is_suitable={analysis_result.get('is_suitable')}, reason={analysis_result.get('reason', 'N/A')[:100]}...")
+        # デコード・パース・型の推定を一度だけ行い、以降の分析と保存で共有する
+        ingested = await asyncio.to_thread(ingest_csv, csv_text)
+        
+        # CSV分析（ルールベース検出またはGemini）
+        analysis_result = await analyze_csv_content(csv_text, logger, ingested)
+        logger.info(f"CSV analysis result: is_suitable={analysis_result.get('is_suitable')}, reason={analysis_result.get('reason', 'N/A')[:100]}...")
         
         if not analysis_result.get("is_suitable", False):
             # メタ解析に適さない場合
-            client.chat_postMessage(
+            await asyncio.to_thread(
+                client.chat_postMessage,
                 channel=channel_id,
                 thread_ts=thread_ts,
                 text=create_unsuitable_csv_message(analysis_result.get('reason', '詳細不明'))
@@ -107,7 +127,8 @@ async def process_csv_text_async(csv_text, channel_id, user_id, thread_ts, clien
         # 直接自然言語パラメータ収集を開始
         analysis_summary = create_analysis_start_message(analysis_result)
         
-        response_message = client.chat_postMessage(
+        response_message = await asyncio.to_thread(
+            client.chat_postMessage,
             channel=channel_id,
             thread_ts=thread_ts,
             text=analysis_summary
@@ -118,11 +139,19 @@ async def process_csv_text_async(csv_text, channel_id, user_id, thread_ts, clien
             msg_channel = response_message.get("channel")
 
             # 会話状態を初期化
-            state = get_or_create_state(thread_ts, channel_id)
+            state = await asyncio.to_thread(get_or_create_state, thread_ts, channel_id)
             state.csv_analysis = analysis_result
+            # 貼り付けテキストはSlackファイルが無いため、ジョブIDをキーに保存する
+            dataset_ref = await asyncio.to_thread(
+                store_dataset, f"text_{job_id}", ingested["csv_bytes"], "data.csv",
+                ingested["column_mapping"], ingested["schema"]
+            )
             state.file_info = {
                 "job_id": job_id,
                 "csv_text": csv_text,
+                "file_id": dataset_ref["file_id"],
+                "content_hash": dataset_ref["content_hash"],
+                "schema": ingested["schema"],
                 "user_id": user_id,
                 "original_filename": "data.csv"
             }
@@ -133,11 +162,12 @@ async def process_csv_text_async(csv_text, channel_id, user_id, thread_ts, clien
             # ボットの初期メッセージを会話履歴に追加
             state.add_conversation("assistant", analysis_summary)
             
-            save_state(state)
+            await asyncio.to_thread(save_state, state)
             logger.info(f"CSV text analysis result message (Job ID: {job_id}) にメタデータを付加しました。ts: {msg_ts}")
         else:
             logger.error(f"CSV text analysis result message投稿に失敗しました。Job ID: {job_id}")
-            client.chat_postMessage(
+            await asyncio.to_thread(
+                client.chat_postMessage,
                 channel=channel_id,
                 thread_ts=thread_ts,
                 text="❌ CSV分析結果の表示中にエラーが発生しました。"
@@ -160,7 +190,8 @@ async def process_csv_text_async(csv_text, channel_id, user_id, thread_ts, clien
         else:
             error_message += f"\n⚠️ エラー詳細: {error_details}"
         
-        client.chat_postMessage(
+        await asyncio.to_thread(
+            client.chat_postMessage,
             channel=channel_id,
             thread_ts=thread_ts,
             text=error_message
@@ -176,38 +207,57 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
         logger.info(f"Channel ID: {channel_id}, User ID: {user_id}, Thread TS: {thread_ts}")
         logger.info(f"Processing in thread: {threading.current_thread().name}")
         
-        # ファイルダウンロード
-        file_content_bytes = await download_slack_file_content_async(
-            file_url=file_info["url_private_download"], # プライベートダウンロードURLを使用
-            bot_token=client.token
-        )
+        # ファイルダウンロード（チャンク単位で一時ファイルに書き込み、サイズ上限を超えたら中断）
+        download_dir = Path(tempfile.mkdtemp(prefix="slack_upload_"))
+        try:
+            if file_info.get("size", 0) > SLACK_DOWNLOAD_MAX_BYTES:
+                raise FileTooLargeError(SLACK_DOWNLOAD_MAX_BYTES)
+            download = await download_slack_file_to_path_async(
+                file_url=file_info["url_private_download"], # プライベートダウンロードURLを使用
+                bot_token=client.token,
+                dest_path=download_dir / "upload"
+            )
+        except FileTooLargeError as e:
+            shutil.rmtree(download_dir, ignore_errors=True)
+            logger.warning(f"File {file_info.get('name', 'unknown')} rejected: {e}")
+            message_kwargs = {
+                "channel": channel_id,
+                "text": f"❌ {e}。ファイルを分割するか、不要な列を削除してから再度アップロードしてください。"
+            }
+            if thread_ts:
+                message_kwargs["thread_ts"] = thread_ts
+            await asyncio.to_thread(client.chat_postMessage, **message_kwargs)
+            return
+        except Exception:
+            shutil.rmtree(download_dir, ignore_errors=True)
+            raise
+        logger.info(f"Downloaded {download['size']} bytes (sha256: {download['sha256'][:12]})")
         
         # ファイル形式に応じて処理
         file_name = file_info.get("name", "").lower()
         try:
             if file_name.endswith(".xlsx") or file_name.endswith(".xls"):
-                # XLSX/XLSファイルの処理
+                # XLSX/XLSファイルの処理（ダウンロードしたファイルから直接読み込む）
                 logger.info("Processing XLSX/XLS file")
-                csv_content = await _convert_excel_to_csv(file_content_bytes, logger)
+                file_content = await _convert_excel_to_csv(download["path"], logger)
             else:
-                # CSVファイルの処理（従来通り）
+                # CSVファイルの処理
                 logger.info("Processing CSV file")
-                try:
-                    csv_content = file_content_bytes.decode('utf-8')
-                except UnicodeDecodeError:
-                    logger.warning("UTF-8でのデコードに失敗。Shift-JISで試行します。")
-                    try:
-                        csv_content = file_content_bytes.decode('shift_jis')
-                    except UnicodeDecodeError:
-                        logger.error("CSVファイルのデコードに失敗しました。")
-                        message_kwargs = {
-                            "channel": channel_id,
-                            "text": "❌ CSVファイルのエンコーディングが不明で処理できませんでした。"
-                        }
-                        if thread_ts:
-                            message_kwargs["thread_ts"] = thread_ts
-                        client.chat_postMessage(**message_kwargs)
-                        return
+                file_content = await asyncio.to_thread(download["path"].read_bytes)
+            # エンコーディング・区切り文字の判定とパース・型の推定を一度だけ行う
+            try:
+                ingested = await asyncio.to_thread(ingest_csv, file_content)
+            except UnicodeDecodeError:
+                logger.error("CSVファイルのデコードに失敗しました。")
+                message_kwargs = {
+                    "channel": channel_id,
+                    "text": "❌ CSVファイルのエンコーディングが不明で処理できませんでした。"
+                }
+                if thread_ts:
+                    message_kwargs["thread_ts"] = thread_ts
+                await asyncio.to_thread(client.chat_postMessage, **message_kwargs)
+                return
+            csv_content = ingested["text"]
         except Exception as e:
             logger.error(f"ファイル処理エラー: {e}")
             message_kwargs = {
@@ -216,16 +266,15 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
             }
             if thread_ts:
                 message_kwargs["thread_ts"] = thread_ts
-            client.chat_postMessage(**message_kwargs)
+            await asyncio.to_thread(client.chat_postMessage, **message_kwargs)
             return
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
 
-        # Gemini APIでデータ分析
-        logger.info(f"Analyzing file content with Gemini. Content size: {len(csv_content)} chars")
-        logger.info("Creating GeminiClient instance...")
-        gemini_client = GeminiClient()
-        logger.info("Calling Gemini API to analyze CSV...")
-        analysis_result = await gemini_client.analyze_csv(csv_content)
-        logger.info(f"Gemini analysis result: is_suitable={analysis_result.get('is_suitable')}, reason={analysis_result.get('reason', 'N/A')[:100]}...")
+        # データ分析（ルールベース検出またはGemini）
+        logger.info(f"Analyzing file content. Content size: {len(csv_content)} chars")
+        analysis_result = await analyze_csv_content(csv_content, logger, ingested)
+        logger.info(f"CSV analysis result: is_suitable={analysis_result.get('is_suitable')}, reason={analysis_result.get('reason', 'N/A')[:100]}...")
         
         if not analysis_result.get("is_suitable", False):
             # メタ解析に適さない場合
@@ -235,7 +284,7 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
             }
             if thread_ts:
                 message_kwargs["thread_ts"] = thread_ts
-            client.chat_postMessage(**message_kwargs)
+            await asyncio.to_thread(client.chat_postMessage, **message_kwargs)
             return
         
         # メタデータ作成
@@ -332,7 +381,7 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
         }
         if thread_ts:
             message_kwargs["thread_ts"] = thread_ts
-        response_message = client.chat_postMessage(**message_kwargs)
+        response_message = await asyncio.to_thread(client.chat_postMessage, **message_kwargs)
         
         if response_message and response_message.get("ok"):
             msg_ts = response_message.get("ts")
@@ -340,12 +389,19 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
 
             # 会話状態を初期化
             effective_thread_ts = thread_ts if thread_ts else msg_ts
-            state = get_or_create_state(effective_thread_ts, channel_id)
+            state = await asyncio.to_thread(get_or_create_state, effective_thread_ts, channel_id)
             state.csv_analysis = analysis_result
+            # 解析時にSlackから再ダウンロード・再パースしないよう、正規化済みCSVを保存しておく
+            dataset_ref = await asyncio.to_thread(
+                store_dataset, file_info["id"], ingested["csv_bytes"], file_info.get("name", "data.csv"),
+                ingested["column_mapping"], ingested["schema"]
+            )
             state.file_info = {
                 "job_id": job_id,
                 "file_id": file_info["id"],
                 "file_url": file_info["url_private_download"],
+                "content_hash": dataset_ref["content_hash"],
+                "schema": ingested["schema"],
                 "original_filename": file_info.get("name", "data.csv"),
                 "user_id": user_id
             }
@@ -360,7 +416,7 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
             # ボットの初期メッセージを会話履歴に追加
             state.add_conversation("assistant", analysis_summary)
             
-            save_state(state)
+            await asyncio.to_thread(save_state, state)
             logger.info(f"CSV分析完了、自然言語パラメータ収集を開始しました (Job ID: {job_id}) ts: {msg_ts}")
             logger.info(f"CSV processing completed successfully in {time.time() - start_time:.2f} seconds")
         else:
@@ -372,7 +428,7 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
             }
             if thread_ts:
                 message_kwargs["thread_ts"] = thread_ts
-            client.chat_postMessage(**message_kwargs)
+            await asyncio.to_thread(client.chat_postMessage, **message_kwargs)
             return
         
     except Exception as e:
@@ -400,7 +456,7 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
         }
         if thread_ts:
             message_kwargs["thread_ts"] = thread_ts
-        client.chat_postMessage(**message_kwargs)
+        await asyncio.to_thread(client.chat_postMessage, **message_kwargs)
 
 # download_slack_file のような関数は utils/file_utils.py に実装することを推奨
 # async def download_slack_file(url: str, token: str) -> str:
@@ -410,3 +466,29 @@ async def process_csv_async(file_info, channel_id, user_id, client, logger, thre
 #         async with session.get(url, headers=headers) as response:
 #             response.raise_for_status()
 #             return await response.text() # または .read() でバイト列
+
+
+def _csv_file_job(params, client, job_logger):
+    return process_csv_async(
+        file_info=params["file_info"],
+        channel_id=params["channel_id"],
+        user_id=params["user_id"],
+        client=client,
+        logger=job_logger,
+        thread_ts=params.get("thread_ts")
+    )
+
+
+def _csv_text_job(params, client, job_logger):
+    return process_csv_text_async(
+        csv_text=params["csv_text"],
+        channel_id=params["channel_id"],
+        user_id=params["user_id"],
+        thread_ts=params.get("thread_ts"),
+        client=client,
+        logger=job_logger
+    )
+
+
+register_job_kind("csv_file", "csv", _csv_file_job)
+register_job_kind("csv_text", "csv", _csv_text_job)
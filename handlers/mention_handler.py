@@ -3,39 +3,17 @@ Mentionハンドラー
 
 ボットへのメンションやダイレクトメッセージを処理します。
 """
+import asyncio
 import logging
 import re
-import threading
 import json
-import os
-import signal
-import atexit
 import time
 from slack_bolt import App
-from mcp_legacy.async_processing import AsyncJobManager
+from core.job_scheduler import submit_job
+from core.job_queue import enqueue_job
 
 logger = logging.getLogger(__name__)
 
-# グローバルジョブマネージャー
-_job_manager = None
-
-def get_job_manager():
-    """ジョブマネージャーのシングルトンを取得"""
-    global _job_manager
-    if _job_manager is None:
-        _job_manager = AsyncJobManager(max_workers=int(os.environ.get('MAX_CSV_WORKERS', '5')))
-        # グレースフルシャットダウンの設定
-        atexit.register(shutdown_job_manager)
-    return _job_manager
-
-def shutdown_job_manager():
-    """ジョブマネージャーをシャットダウン"""
-    global _job_manager
-    if _job_manager:
-        logger.info("Shutting down job manager...")
-        _job_manager.executor.shutdown(wait=True, cancel_futures=False)
-        logger.info("Job manager shutdown complete")
-
 def _contains_csv_data(text: str) -> bool:
     """テキスト内にCSVデータが含まれているかチェック"""
     logger.info(f"CSV detection check for text: {text[:200]}...")  # 最初の200文字をログ
@@ -88,6 +66,38 @@ def _contains_csv_data(text: str) -> bool:
     
     return is_csv
 
+
+def _enqueue_data_files(data_files, client, channel_id, thread_ts, user_id, team_id):
+    """添付ファイルごとにCSV取り込みジョブを投入（同じファイルの再送は1件にまとめる）"""
+    for data_file in data_files:
+        job_id = f"csv_{channel_id}_{thread_ts}_{data_file.get('id')}"
+        ticket = enqueue_job("csv_file", {
+            "file_info": data_file,
+            "channel_id": channel_id,
+            "user_id": user_id,
+            "thread_ts": thread_ts,
+        }, job_id=job_id, client=client, channel_id=channel_id, thread_ts=thread_ts,
+            user_id=user_id, team_id=team_id)
+        if ticket is None:
+            # 受け付けられなかった場合、残りのファイルも同じ理由で拒否されるため投入しない
+            break
+        logger.info(f"CSV processing job {ticket['status']} with ID: {job_id}")
+
+
+def _enqueue_csv_text(csv_text, message_ts, client, channel_id, thread_ts, user_id, team_id):
+    """メッセージ本文のCSVデータの取り込みジョブを投入"""
+    job_id = f"csv_text_{channel_id}_{message_ts}"
+    ticket = enqueue_job("csv_text", {
+        "csv_text": csv_text,
+        "channel_id": channel_id,
+        "user_id": user_id,
+        "thread_ts": thread_ts,
+    }, job_id=job_id, client=client, channel_id=channel_id, thread_ts=thread_ts,
+        user_id=user_id, team_id=team_id)
+    if ticket is not None:
+        logger.info(f"CSV text processing job {ticket['status']} with ID: {job_id}")
+
+
 def register_mention_handlers(app: App):
     """メンション関連のハンドラーを登録"""
     
@@ -203,64 +213,8 @@ def register_mention_handlers(app: App):
                     text="📊 データファイルを検出しました。分析を開始します..."
                 )
                 
-                # CSV処理を実行
-                from handlers.csv_handler import process_csv_async
-                import asyncio
-                
-                job_manager = get_job_manager()
-                
-                def run_csv_processing_in_event_loop():
-                    """イベントループ内でCSV処理を実行"""
-                    try:
-                        # 新しいイベントループを作成
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        
-                        # 各データファイルを処理
-                        for data_file in data_files:
-                            logger.info(f"Processing data file: {data_file.get('name', 'unknown')} via job manager")
-                            try:
-                                loop.run_until_complete(process_csv_async(
-                                    file_info=data_file,
-                                    channel_id=channel_id,
-                                    user_id=user_id,
-                                    client=client,
-                                    logger=logger,
-                                    thread_ts=thread_ts
-                                ))
-                            except Exception as file_error:
-                                logger.error(f"Error processing {data_file.get('name')}: {file_error}", exc_info=True)
-                                # ファイル単位のエラーを通知
-                                try:
-                                    client.chat_postMessage(
-                                        channel=channel_id,
-                                        thread_ts=thread_ts,
-                                        text=f"❌ {data_file.get('name', 'データファイル')}の処理中にエラーが発生しました: {str(file_error)}"
-                                    )
-                                except Exception as notify_error:
-                                    logger.error(f"Failed to notify file error: {notify_error}")
-                        
-                        loop.close()
-                        logger.info("CSV processing completed successfully")
-                        
-                    except Exception as e:
-                        logger.error(f"Error in CSV processing job: {e}", exc_info=True)
-                        # 全体的なエラーを通知
-                        try:
-                            client.chat_postMessage(
-                                channel=channel_id,
-                                thread_ts=thread_ts,
-                                text=f"❌ CSV処理中にエラーが発生しました: {str(e)}"
-                            )
-                        except Exception as notify_error:
-                            logger.error(f"Failed to notify error: {notify_error}")
-                
-                # ジョブをサブミット
-                job_id = job_manager.submit_job(
-                    job_id=f"csv_processing_{channel_id}_{thread_ts}_{int(time.time())}",
-                    func=run_csv_processing_in_event_loop
-                )
-                logger.info(f"CSV processing job submitted with ID: {job_id}")
+                # 永続ジョブキュー経由でファイルごとにCSV取り込みレーンに投入
+                _enqueue_data_files(data_files, client, channel_id, thread_ts, user_id, body.get("team_id"))
                 return
             
             # スレッド内メッセージの場合、既存の会話状態をチェック
@@ -278,40 +232,31 @@ def register_mention_handlers(app: App):
                         logger.info(f"Processing parameter collection in thread {event['thread_ts']}: {clean_text}")
                         
                         # パラメータ収集を非同期で実行
-                        import asyncio
                         from handlers.parameter_handler import handle_natural_language_parameters
                         
-                        def run_parameter_processing():
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
+                        async def process_params():
+                            # messageオブジェクトを構築
+                            message = {
+                                "channel": channel_id,
+                                "thread_ts": event["thread_ts"],
+                                "text": clean_text,
+                                "user": user_id,
+                                "ts": event["ts"]
+                            }
                             
-                            async def process_params():
-                                # messageオブジェクトを構築
-                                message = {
-                                    "channel": channel_id,
-                                    "thread_ts": event["thread_ts"],
-                                    "text": clean_text,
-                                    "user": user_id,
-                                    "ts": event["ts"]
-                                }
-                                
-                                # say 関数を定義
-                                async def say(text, thread_ts=None):
-                                    # thread_tsが指定されていない場合は、イベントのthread_tsを使用
-                                    ts = thread_ts or event["thread_ts"]
-                                    client.chat_postMessage(channel=channel_id, thread_ts=ts, text=text)
-                                
-                                await handle_natural_language_parameters(message, say, client, logger)
+                            # say 関数を定義
+                            async def say(text, thread_ts=None):
+                                # thread_tsが指定されていない場合は、イベントのthread_tsを使用
+                                ts = thread_ts or event["thread_ts"]
+                                await asyncio.to_thread(client.chat_postMessage, channel=channel_id, thread_ts=ts, text=text)
                             
-                            loop.run_until_complete(process_params())
-                            loop.close()
+                            await handle_natural_language_parameters(message, say, client, logger)
                         
                         # ジョブとして実行
-                        job_manager = get_job_manager()
-                        job_id = job_manager.submit_job(
-                            job_id=f"parameter_collection_{channel_id}_{event['thread_ts']}_{int(time.time())}",
-                            func=run_parameter_processing
-                        )
+                        job_id = f"parameter_collection_{channel_id}_{event['thread_ts']}_{int(time.time())}"
+                        submit_job(process_params(), lane="dialogue", job_id=job_id,
+                                   notify=lambda text: client.chat_postMessage(channel=channel_id, thread_ts=event["thread_ts"], text=text),
+                                   user_id=user_id, channel_id=channel_id, team_id=body.get("team_id"))
                         logger.info(f"Parameter collection job submitted with ID: {job_id}")
                         return
                         
@@ -350,49 +295,9 @@ def register_mention_handlers(app: App):
                         text="📊 CSVデータを検出しました。分析を開始します..."
                     )
                     
-                    # CSV処理を実行
-                    from handlers.csv_handler import process_csv_text_async
-                    import asyncio
-                    
-                    job_manager = get_job_manager()
-                    
-                    def run_csv_text_processing_in_event_loop():
-                        """イベントループ内でCSVテキスト処理を実行"""
-                        try:
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-                            
-                            logger.info(f"Processing CSV text data via job manager")
-                            loop.run_until_complete(process_csv_text_async(
-                                csv_text=clean_text,
-                                channel_id=channel_id,
-                                user_id=user_id,
-                                thread_ts=thread_ts,
-                                client=client,
-                                logger=logger
-                            ))
-                            
-                            loop.close()
-                            logger.info("CSV text processing completed successfully")
-                            
-                        except Exception as e:
-                            logger.error(f"Error in CSV text processing job: {e}", exc_info=True)
-                            # エラーをSlackに通知
-                            try:
-                                client.chat_postMessage(
-                                    channel=channel_id,
-                                    thread_ts=thread_ts,
-                                    text=f"❌ CSVデータ処理中にエラーが発生しました: {str(e)}"
-                                )
-                            except Exception as notify_error:
-                                logger.error(f"Failed to notify error: {notify_error}")
-                    
-                    # ジョブをサブミット
-                    job_id = job_manager.submit_job(
-                        job_id=f"csv_text_processing_{channel_id}_{thread_ts}_{int(time.time())}",
-                        func=run_csv_text_processing_in_event_loop
-                    )
-                    logger.info(f"CSV text processing job submitted with ID: {job_id}")
+                    # 永続ジョブキュー経由でCSV取り込みレーンに投入
+                    _enqueue_csv_text(clean_text, event["ts"], client, channel_id, thread_ts, user_id,
+                                      body.get("team_id"))
                 else:
                     # スレッド内でパラメータ収集中かチェック
                     if thread_ts and thread_ts != event["ts"]:
@@ -407,44 +312,34 @@ def register_mention_handlers(app: App):
                             logger.info(f"Processing parameter collection in app_mention thread {thread_ts}: {clean_text}")
                             
                             # パラメータ収集を非同期で実行
-                            import asyncio
                             from handlers.parameter_handler import handle_natural_language_parameters
                             
-                            def run_parameter_processing():
-                                loop = asyncio.new_event_loop()
-                                asyncio.set_event_loop(loop)
+                            async def process_params():
+                                # message オブジェクトを構築
+                                message = {
+                                    'channel': channel_id,
+                                    'thread_ts': thread_ts,
+                                    'text': clean_text,
+                                    'user': user_id,
+                                    'ts': event.get('ts')
+                                }
                                 
-                                async def process_params():
-                                    # message オブジェクトを構築
-                                    message = {
-                                        'channel': channel_id,
-                                        'thread_ts': thread_ts,
-                                        'text': clean_text,
-                                        'user': user_id,
-                                        'ts': event.get('ts')
-                                    }
-                                    
-                                    # say 関数を定義
-                                    async def say(msg_text, thread_ts=None):
-                                        outer_thread_ts = message.get("thread_ts") or event.get("thread_ts", event["ts"])
-                                        current_thread_ts = thread_ts or outer_thread_ts
-                                        client.chat_postMessage(channel=channel_id, thread_ts=current_thread_ts, text=msg_text)
-                                    
-                                    await handle_natural_language_parameters(message, say, client, logger)
+                                # say 関数を定義
+                                async def say(msg_text, thread_ts=None):
+                                    outer_thread_ts = message.get("thread_ts") or event.get("thread_ts", event["ts"])
+                                    current_thread_ts = thread_ts or outer_thread_ts
+                                    await asyncio.to_thread(client.chat_postMessage, channel=channel_id, thread_ts=current_thread_ts, text=msg_text)
                                 
                                 try:
-                                    loop.run_until_complete(process_params())
+                                    await handle_natural_language_parameters(message, say, client, logger)
                                     logger.info("Parameter processing completed in app_mention")
                                 except Exception as e:
                                     logger.error(f"Error in parameter processing: {e}", exc_info=True)
-                                finally:
-                                    loop.close()
                             
-                            job_manager = get_job_manager()
-                            job_id = job_manager.submit_job(
-                                job_id=f"app_mention_param_processing_{channel_id}_{thread_ts}_{int(time.time())}",
-                                func=run_parameter_processing
-                            )
+                            job_id = f"app_mention_param_processing_{channel_id}_{thread_ts}_{int(time.time())}"
+                            submit_job(process_params(), lane="dialogue", job_id=job_id,
+                                       notify=lambda text: client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, text=text),
+                                       user_id=user_id, channel_id=channel_id, team_id=body.get("team_id"))
                             logger.info(f"App mention parameter processing job submitted with ID: {job_id}")
                             return
                     
@@ -525,60 +420,8 @@ def register_mention_handlers(app: App):
                         text="📊 データファイルを検出しました。分析を開始します..."
                     )
                     
-                    # CSV処理を実行
-                    from handlers.csv_handler import process_csv_async
-                    import asyncio
-                    
-                    job_manager = get_job_manager()
-                    
-                    def run_dm_csv_processing_in_event_loop():
-                        """ダイレクトメッセージ内のCSV処理を実行"""
-                        try:
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-                            
-                            for data_file in data_files:
-                                logger.info(f"Processing data file in DM: {data_file.get('name', 'unknown')}")
-                                try:
-                                    loop.run_until_complete(process_csv_async(
-                                        file_info=data_file,
-                                        channel_id=channel_id,
-                                        user_id=user_id,
-                                        client=client,
-                                        logger=logger,
-                                        thread_ts=thread_ts
-                                    ))
-                                except Exception as file_error:
-                                    logger.error(f"Error processing {data_file.get('name')} in DM: {file_error}", exc_info=True)
-                                    try:
-                                        client.chat_postMessage(
-                                            channel=channel_id,
-                                            thread_ts=thread_ts,
-                                            text=f"❌ {data_file.get('name', 'データファイル')}の処理中にエラーが発生しました: {str(file_error)}"
-                                        )
-                                    except Exception as notify_error:
-                                        logger.error(f"Failed to notify file error in DM: {notify_error}")
-                            
-                            loop.close()
-                            logger.info("DM CSV processing completed successfully")
-                            
-                        except Exception as e:
-                            logger.error(f"Error in DM CSV processing job: {e}", exc_info=True)
-                            try:
-                                client.chat_postMessage(
-                                    channel=channel_id,
-                                    thread_ts=thread_ts,
-                                    text=f"❌ CSV処理中にエラーが発生しました: {str(e)}"
-                                )
-                            except Exception as notify_error:
-                                logger.error(f"Failed to notify error: {notify_error}")
-                    
-                    # ジョブをサブミット
-                    job_id = job_manager.submit_job(
-                        job_id=f"dm_csv_processing_{channel_id}_{thread_ts}_{int(time.time())}",
-                        func=run_dm_csv_processing_in_event_loop
-                    )
-                    logger.info(f"DM CSV processing job submitted with ID: {job_id}")
+                    # 永続ジョブキュー経由でファイルごとにCSV取り込みレーンに投入
+                    _enqueue_data_files(data_files, client, channel_id, thread_ts, user_id, body.get("team_id"))
                 # CSVデータが含まれているかチェック
                 elif _contains_csv_data(text):
                     # CSVデータが含まれている場合は処理する
@@ -589,48 +432,9 @@ def register_mention_handlers(app: App):
                         text="📊 CSVデータを検出しました。分析を開始します..."
                     )
                     
-                    # CSV処理を実行
-                    from handlers.csv_handler import process_csv_text_async
-                    import asyncio
-                    
-                    job_manager = get_job_manager()
-                    
-                    def run_dm_csv_text_processing_in_event_loop():
-                        """ダイレクトメッセージ内のCSVテキスト処理を実行"""
-                        try:
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-                            
-                            logger.info("Processing CSV text data in DM via job manager")
-                            loop.run_until_complete(process_csv_text_async(
-                                csv_text=text,
-                                channel_id=channel_id,
-                                user_id=user_id,
-                                thread_ts=thread_ts,
-                                client=client,
-                                logger=logger
-                            ))
-                            
-                            loop.close()
-                            logger.info("DM CSV text processing completed successfully")
-                            
-                        except Exception as e:
-                            logger.error(f"Error in DM CSV text processing job: {e}", exc_info=True)
-                            try:
-                                client.chat_postMessage(
-                                    channel=channel_id,
-                                    thread_ts=thread_ts,
-                                    text=f"❌ CSVデータ処理中にエラーが発生しました: {str(e)}"
-                                )
-                            except Exception as notify_error:
-                                logger.error(f"Failed to notify error: {notify_error}")
-                    
-                    # ジョブをサブミット
-                    job_id = job_manager.submit_job(
-                        job_id=f"dm_csv_text_processing_{channel_id}_{thread_ts}_{int(time.time())}",
-                        func=run_dm_csv_text_processing_in_event_loop
-                    )
-                    logger.info(f"DM CSV text processing job submitted with ID: {job_id}")
+                    # 永続ジョブキュー経由でCSV取り込みレーンに投入
+                    _enqueue_csv_text(text, event["ts"], client, channel_id, thread_ts, user_id,
+                                      body.get("team_id"))
                 else:
                     # CSVファイルがない場合、パラメータ収集の対話を処理する可能性がある
                     # 会話状態をチェック
@@ -645,41 +449,32 @@ def register_mention_handlers(app: App):
                         logger.info(f"Processing parameter collection in thread {thread_ts}: {text}")
                         
                         # パラメータ収集を非同期で実行
-                        import asyncio
                         from handlers.parameter_handler import handle_natural_language_parameters
                         
-                        def run_parameter_processing():
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
+                        async def process_params():
+                            # message オブジェクトを構築
+                            message = {
+                                'channel': channel_id,
+                                'thread_ts': thread_ts,
+                                'text': text,
+                                'user': user_id,
+                                'ts': event.get('ts')
+                            }
                             
-                            async def process_params():
-                                # message オブジェクトを構築
-                                message = {
-                                    'channel': channel_id,
-                                    'thread_ts': thread_ts,
-                                    'text': text,
-                                    'user': user_id,
-                                    'ts': event.get('ts')
-                                }
-                                
-                                # say 関数を定義
-                                async def say(msg_text, thread_ts=None):
-                                    # thread_tsが指定されていない場合は、外側のthread_tsを使用
-                                    outer_thread_ts = message.get("thread_ts") or event.get("thread_ts", event["ts"])
-                                    current_thread_ts = thread_ts or outer_thread_ts
-                                    client.chat_postMessage(channel=channel_id, thread_ts=current_thread_ts, text=msg_text)
-                                
-                                await handle_natural_language_parameters(message, say, client, logger)
+                            # say 関数を定義
+                            async def say(msg_text, thread_ts=None):
+                                # thread_tsが指定されていない場合は、外側のthread_tsを使用
+                                outer_thread_ts = message.get("thread_ts") or event.get("thread_ts", event["ts"])
+                                current_thread_ts = thread_ts or outer_thread_ts
+                                await asyncio.to_thread(client.chat_postMessage, channel=channel_id, thread_ts=current_thread_ts, text=msg_text)
                             
-                            loop.run_until_complete(process_params())
-                            loop.close()
+                            await handle_natural_language_parameters(message, say, client, logger)
                         
                         # ジョブとして実行
-                        job_manager = get_job_manager()
-                        job_id = job_manager.submit_job(
-                            job_id=f"param_collection_{channel_id}_{thread_ts}_{int(time.time())}",
-                            func=run_parameter_processing
-                        )
+                        job_id = f"param_collection_{channel_id}_{thread_ts}_{int(time.time())}"
+                        submit_job(process_params(), lane="dialogue", job_id=job_id,
+                                   notify=lambda text: client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, text=text),
+                                   user_id=user_id, channel_id=channel_id, team_id=body.get("team_id"))
                         logger.info(f"Parameter collection job submitted with ID: {job_id}")
                     elif channel_type == "im":
                         # DMでCSVデータがない場合のみヘルプメッセージ
@@ -1,15 +1,14 @@
-import asyncio
 import json
 import time
+import asyncio
 from slack_bolt import App
 from slack_sdk.errors import SlackApiError
 from core.metadata_manager import MetadataManager
 # Removed unused imports: create_parameter_modal_blocks, create_simple_parameter_selection_blocks
 # These are no longer needed due to migration to natural language interaction
-from handlers.analysis_handler import run_analysis_async 
-from utils.file_utils import get_r_output_dir
+from handlers.analysis_handler import enqueue_analysis
 from utils.parameter_extraction import extract_parameters_from_text, get_next_question
-from utils.conversation_state import get_or_create_state, save_state
+from utils.conversation_state import get_or_create_state, update_state
 
 # Simplified parameter collection approach
 
@@ -51,7 +50,7 @@ async def handle_natural_language_parameters(message, say, client, logger):
             return
         
         # 会話状態を取得
-        state = get_or_create_state(thread_ts, channel_id)
+        state = await asyncio.to_thread(get_or_create_state, thread_ts, channel_id)
         
         # パラメータ収集中でない場合はスキップ
         from utils.conversation_state import DialogState
@@ -75,12 +74,13 @@ async def handle_natural_language_parameters(message, say, client, logger):
         if state.conversation_history:
             logger.info(f"Last message in history: role={state.conversation_history[-1].get('role')}, content={state.conversation_history[-1].get('content')[:100]}...")
         
-        # ユーザーの入力を履歴に追加
-        state.conversation_history.append({
+        # ユーザーの入力を履歴に追加（保存は応答後に update_state で最新の状態に対して行う）
+        user_entry = {
             "role": "user",
             "content": user_text
-        })
-        logger.info(f"Added user input to conversation history. New length: {len(state.conversation_history)}")
+        }
+        conversation_history = state.conversation_history + [user_entry]
+        logger.info(f"Added user input to conversation history. New length: {len(conversation_history)}")
         
         # Geminiでパラメータを抽出して応答を生成
         from utils.gemini_dialogue import process_user_input_with_gemini
@@ -89,25 +89,34 @@ async def handle_natural_language_parameters(message, say, client, logger):
             user_input=user_text,
             csv_columns=csv_columns,
             current_params=state.collected_params,
-            conversation_history=state.conversation_history,
-            csv_analysis=state.csv_analysis
+            conversation_history=conversation_history,
+            csv_analysis=state.csv_analysis,
+            history_summary=state.history_summary
         )
         
         if response:
-            # パラメータを更新
-            if response.get("extracted_params"):
-                state.update_params(response["extracted_params"])
-                logger.info(f"Updated parameters: {response['extracted_params']}")
+            extracted_params = response.get("extracted_params")
+            bot_message = response.get("bot_message")
+            
+            def apply_turn(latest_state):
+                # 他のワーカーの更新を上書きしないよう、この発言での差分だけを最新の状態に適用する
+                if extracted_params:
+                    latest_state.update_params(extracted_params)
+                latest_state.conversation_history.append(user_entry)
+                if bot_message:
+                    latest_state.conversation_history.append({
+                        "role": "assistant",
+                        "content": bot_message
+                    })
+            
+            # パラメータと会話履歴を更新
+            state = await asyncio.to_thread(update_state, thread_ts, channel_id, apply_turn)
+            if extracted_params:
+                logger.info(f"Updated parameters: {extracted_params}")
             
             # Geminiの応答を送信（スレッド内に）
-            bot_message = response.get("bot_message")
             if bot_message:
                 await say(bot_message, thread_ts=thread_ts)
-                # ボットの応答を履歴に追加
-                state.conversation_history.append({
-                    "role": "assistant",
-                    "content": bot_message
-                })
             
             # 解析準備完了チェック
             if response.get("is_ready_to_analyze"):
@@ -204,32 +213,31 @@ async def handle_natural_language_parameters(message, say, client, logger):
                 logger.info(f"Final analysis_params: {analysis_params}")
                 
                 # 解析を実行
-                from utils.file_utils import get_r_output_dir
-                job_id = state.file_info.get("job_id", "unknown_job")
-                r_output_dir = get_r_output_dir(job_id)
-                
                 # csv_analysis情報をpayloadに含める
                 payload = state.file_info.copy()
                 payload["csv_analysis"] = state.csv_analysis
                 logger.info(f"Debug - Added csv_analysis to payload: has {len(state.csv_analysis)} keys")
                 
-                await run_analysis_async(
+                # R解析は永続ジョブキュー経由で解析レーンに投入し、対話のジョブは解析の完了を待たずに終える
+                ticket = await asyncio.to_thread(
+                    enqueue_analysis,
                     payload=payload,
                     user_parameters=analysis_params,
                     channel_id=channel_id,
                     thread_ts=thread_ts,
-                    user_id=state.file_info.get("user_id", "unknown_user"),
+                    user_id=message.get("user") or state.file_info.get("user_id", "unknown_user"),
                     client=client,
-                    logger=logger,
-                    r_output_dir=r_output_dir,
                     original_file_url=state.file_info.get("file_url"),
-                    original_file_name=state.file_info.get("original_filename", "data.csv")
+                    original_file_name=state.file_info.get("original_filename", "data.csv"),
+                    team_id=message.get("team")
                 )
                 
-                # 状態をリセット
-                state.state = "COMPLETED"
-            
-            save_state(state)
+                # 状態をリセット（受け付けられなかった場合は再度依頼できるようにパラメータ収集を続ける）
+                if ticket is not None:
+                    await asyncio.to_thread(
+                        update_state, thread_ts, channel_id,
+                        lambda latest_state: setattr(latest_state, "state", "COMPLETED")
+                    )
         else:
             logger.error("Failed to get response from Gemini")
             await say("申し訳ございません。応答の生成に失敗しました。もう一度お試しください。", thread_ts=thread_ts)
@@ -263,10 +271,10 @@ def register_parameter_handlers(app: App):
             thread_ts = body["message"]["ts"]
             
             # 会話状態を初期化
-            state = get_or_create_state(thread_ts, channel_id)
-            state.csv_analysis = csv_analysis
-            state.file_info = original_message_payload
-            save_state(state)
+            def init_state(latest_state):
+                latest_state.csv_analysis = csv_analysis
+                latest_state.file_info = original_message_payload
+            update_state(thread_ts, channel_id, init_state)
             
             # 自然言語でのパラメータ収集を開始
             await client.chat_postMessage(
@@ -361,14 +369,17 @@ def register_parameter_handlers(app: App):
                 "model_type": "random" if model_type != "FE" else "fixed"
             }
             
-            # 非同期で解析を実行
-            await run_analysis_async(
-                original_payload,
-                analysis_params,
-                body["channel"]["id"],
-                body["message"]["ts"],
-                client,
-                logger
+            # 永続ジョブキュー経由で解析レーンに投入（再起動しても中断されない）
+            enqueue_analysis(
+                payload=original_payload,
+                user_parameters=analysis_params,
+                channel_id=body["channel"]["id"],
+                thread_ts=body["message"]["ts"],
+                user_id=body["user"]["id"],
+                client=client,
+                original_file_url=original_payload.get("file_url"),
+                original_file_name=original_payload.get("csv_analysis", {}).get("original_filename", "data.csv"),
+                team_id=(body.get("team") or {}).get("id")
             )
             
         except Exception as e:
@@ -512,20 +523,18 @@ def register_parameter_handlers(app: App):
             text=f"⚙️ パラメータを設定しました。解析を開始します。(Job ID: {job_id})"
         )
 
-        r_output_dir = get_r_output_dir(job_id)
-        
-        asyncio.create_task(run_analysis_async(
+        # 永続ジョブキュー経由で解析レーンに投入（再起動しても中断されない）
+        enqueue_analysis(
             payload=original_message_payload, # 更新されたpayload
             user_parameters=user_parameters,
             channel_id=response_channel_id,
             thread_ts=response_thread_ts,
             user_id=body["user"]["id"], # モーダルを操作したユーザー
             client=client,
-            logger=logger,
-            r_output_dir=r_output_dir,
             original_file_url=original_message_payload.get("file_url"),
-            original_file_name=original_message_payload.get("csv_analysis", {}).get("original_filename", "data.csv")
-        ))
+            original_file_name=original_message_payload.get("csv_analysis", {}).get("original_filename", "data.csv"),
+            team_id=(body.get("team") or {}).get("id")
+        )
 
 
     @app.action("start_analysis_with_defaults")
@@ -569,20 +578,18 @@ def register_parameter_handlers(app: App):
             text=f"🚀 推奨設定で解析を開始します。(Job ID: {job_id})"
         )
         
-        r_output_dir = get_r_output_dir(job_id)
-
-        asyncio.create_task(run_analysis_async(
+        # 永続ジョブキュー経由で解析レーンに投入（再起動しても中断されない）
+        enqueue_analysis(
             payload=payload,
             user_parameters=default_parameters,
             channel_id=body["channel"]["id"],
             thread_ts=body["message"]["ts"],
             user_id=body["user"]["id"],
             client=client,
-            logger=logger,
-            r_output_dir=r_output_dir,
             original_file_url=payload.get("file_url"),
-            original_file_name=payload.get("csv_analysis", {}).get("original_filename", "data.csv")
-        ))
+            original_file_name=payload.get("csv_analysis", {}).get("original_filename", "data.csv"),
+            team_id=(body.get("team") or {}).get("id")
+        )
 
     @app.action("cancel_analysis_request")
     async def handle_cancel_analysis_action(ack, body, client, logger):
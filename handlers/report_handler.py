@@ -1,8 +1,9 @@
-import asyncio # generate_report_async のために追加
+import asyncio
 from slack_bolt import App
 from core.metadata_manager import MetadataManager
 from core.gemini_client import GeminiClient
 from utils.slack_utils import create_report_message
+from core.job_queue import enqueue_job, register_job_kind
 
 def register_report_handlers(app: App):
     """レポート生成関連のハンドラーを登録"""
@@ -29,26 +30,14 @@ def register_report_handlers(app: App):
             text="📝 解釈レポートを生成中..."
         )
         
-        # 非同期でレポート生成を実行（エラーハンドリング付き）
-        async def run_report_generation():
-            try:
-                await generate_report_async(
-                    payload=payload,
-                    channel_id=body["channel"]["id"],
-                    thread_ts=body["message"]["ts"],
-                    client=client,
-                    logger=logger
-                )
-            except Exception as e:
-                logger.error(f"レポート生成エラー: {e}")
-                client.chat_postMessage(
-                    channel=body["channel"]["id"],
-                    thread_ts=body["message"]["ts"],
-                    text=f"❌ レポート生成中にエラーが発生しました: {str(e)}"
-                )
-        
-        # タスクを作成して実行
-        task = asyncio.create_task(run_report_generation())
+        # 永続ジョブキュー経由でレポート生成レーンに投入（ボタンの二度押しは1件にまとめる）
+        enqueue_job("report", {
+            "payload": payload,
+            "channel_id": body["channel"]["id"],
+            "thread_ts": body["message"]["ts"],
+        }, job_id=f"report_{payload.get('job_id')}", client=client, channel_id=body["channel"]["id"],
+            thread_ts=body["message"]["ts"], user_id=body["user"]["id"],
+            team_id=(body.get("team") or {}).get("id"))
         # タスクが完了するまで待機しない（非同期実行）
 
 async def generate_report_async(payload, channel_id, thread_ts, client, logger):
@@ -78,7 +67,8 @@ async def generate_report_async(payload, channel_id, thread_ts, client, logger):
         })
         
         report_text = create_report_message(interpretation)
-        client.chat_postMessage(
+        await asyncio.to_thread(
+            client.chat_postMessage,
             channel=channel_id,
             thread_ts=thread_ts,
             text=report_text,
@@ -87,8 +77,22 @@ async def generate_report_async(payload, channel_id, thread_ts, client, logger):
         
     except Exception as e:
         logger.error(f"レポート生成エラー: {e}")
-        client.chat_postMessage(
+        await asyncio.to_thread(
+            client.chat_postMessage,
             channel=channel_id,
             thread_ts=thread_ts,
             text=f"❌ レポート生成中にエラーが発生しました: {str(e)}"
         )
+
+
+def _report_job(params, client, job_logger):
+    return generate_report_async(
+        payload=params["payload"],
+        channel_id=params["channel_id"],
+        thread_ts=params["thread_ts"],
+        client=client,
+        logger=job_logger
+    )
+
+
+register_job_kind("report", "report", _report_job)
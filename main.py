@@ -3,7 +3,7 @@ import asyncio
 import logging
 import signal
 import sys
-from slack_bolt import App
+from slack_bolt import App, BoltResponse
 from slack_bolt.adapter.wsgi import SlackRequestHandler
 
 # Configure logging
@@ -24,6 +24,7 @@ from handlers.analysis_handler import register_analysis_handlers
 from handlers.report_handler import register_report_handlers
 from handlers.parameter_handler import register_parameter_handlers # 追加
 from handlers.mention_handler import register_mention_handlers
+from utils.event_dedup import is_duplicate_event
 
 # Slack App初期化
 logger = logging.getLogger(__name__)
@@ -48,6 +49,14 @@ def log_request(logger, body, next):
     logger.debug(f"Body keys: {list(body.keys())}")
     return next()
 
+# Slackが再送したイベント（処理済みのevent_id）はハンドラーに渡す前に捨てる
+@app.middleware
+def deduplicate_events(body, request, next):
+    """Drop retried or duplicated Slack events before any work is scheduled"""
+    if is_duplicate_event(body, request.headers):
+        return BoltResponse(status=200, body="")
+    return next()
+
 # 各ハンドラーを登録
 register_csv_handlers(app)
 register_analysis_handlers(app)
@@ -66,16 +75,59 @@ def signal_handler(sig, frame):
     """シグナルハンドラー"""
     logger.info(f"Received signal {sig}. Starting graceful shutdown...")
     
-    # mention_handlerのジョブマネージャーをシャットダウン
+    # 永続ジョブキューからの取り出しを停止
+    try:
+        from core.job_queue import stop_job_queue_dispatcher
+        stop_job_queue_dispatcher()
+    except Exception as e:
+        logger.error(f"Error during job queue dispatcher shutdown: {e}")
+    
+    # 待機中のジョブを取り消す
+    try:
+        from core.job_scheduler import shutdown_job_scheduler
+        shutdown_job_scheduler()
+    except Exception as e:
+        logger.error(f"Error during job scheduler shutdown: {e}")
+    
+    # 共有イベントループを停止（実行中のジョブは完了を待つ）
+    try:
+        from core.async_loop import shutdown_loop_service
+        shutdown_loop_service()
+    except Exception as e:
+        logger.error(f"Error during async loop service shutdown: {e}")
+    
+    # 終わらなかった永続ジョブのリースを手放し、次に起動したプロセスで再開できるようにする
+    try:
+        from core.job_queue import release_inflight_jobs
+        release_inflight_jobs()
+    except Exception as e:
+        logger.error(f"Error during durable job release: {e}")
+    
+    # 常駐Rワーカーを停止
     try:
-        from handlers.mention_handler import shutdown_job_manager
-        shutdown_job_manager()
+        from core.r_worker_pool import shutdown_r_worker_pool
+        shutdown_r_worker_pool()
     except Exception as e:
-        logger.error(f"Error during job manager shutdown: {e}")
+        logger.error(f"Error during R worker pool shutdown: {e}")
+    
+    # 会話状態の期限切れ掃除スレッドを停止
+    try:
+        from utils.conversation_state import stop_state_expiry_sweeper
+        stop_state_expiry_sweeper()
+    except Exception as e:
+        logger.error(f"Error during state expiry sweeper shutdown: {e}")
     
     logger.info("Graceful shutdown complete")
     sys.exit(0)
 
+# 非同期処理用の共有イベントループを起動
+from core.async_loop import get_loop_service
+get_loop_service()
+
+# 永続ジョブキューからCSV取り込み・R解析のジョブを取り出して実行（再起動前に残ったジョブも再開）
+from core.job_queue import start_job_queue_dispatcher
+start_job_queue_dispatcher(app.client)
+
 # シグナルハンドラーを登録
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
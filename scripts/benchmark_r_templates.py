@@ -0,0 +1,99 @@
+"""
+RTemplateGenerator のスクリプト生成時間のマイクロベンチマーク
+
+以前の実装（インスタンスごとにテンプレートを再構築し、プレースホルダーごとに str.replace を繰り返す
+_safe_format）、コンパイル済みテンプレート（スクリプト本体キャッシュなし）、スクリプト本体キャッシュあり
+（ジョブIDだけが異なる再解析）の3つで、1スクリプトあたりの生成時間を比較します。
+
+使用方法:
+    python scripts/benchmark_r_templates.py [--iterations 200]
+"""
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from templates.r_templates import RTemplateGenerator, get_script_body_cache  # noqa: E402
+
+OUTPUT_PATHS = {
+    "forest_plot_path": "/tmp/forest.png",
+    "funnel_plot_path": "/tmp/funnel.png",
+    "rdata_path": "/tmp/result.RData",
+    "json_summary_path": "/tmp/summary.json",
+    "bubble_plot_path_prefix": "/tmp/bubble",
+}
+DATA_SUMMARY = {"columns": ["study", "events_treatment", "total_treatment", "events_control", "total_control",
+                            "region", "year"]}
+SCENARIOS = {
+    "binary_subgroup": {
+        "measure": "OR", "model": "REML",
+        "data_columns": {"ai": "events_treatment", "n1i": "total_treatment", "ci": "events_control",
+                         "n2i": "total_control", "study_label": "study"},
+        "subgroup_columns": ["region"], "moderator_columns": ["year"],
+    },
+    "precalculated": {
+        "measure": "PRE", "model": "REML",
+        "data_columns": {"yi": "events_treatment", "vi": "total_treatment", "study_label": "study"},
+    },
+}
+
+
+class LegacyRTemplateGenerator(RTemplateGenerator):
+    """以前の実装を再現した比較用のジェネレーター"""
+
+    def __init__(self):
+        self.templates = self._load_templates()
+
+    def generate_full_r_script(self, analysis_params, data_summary, output_paths, csv_file_path_in_script):
+        # スクリプト本体キャッシュを通さずに毎回生成する
+        return self._generate_script_body(analysis_params, data_summary, output_paths, csv_file_path_in_script)
+
+    def _safe_format(self, template: str, **kwargs) -> str:
+        token_map = {}
+        for key in kwargs:
+            token = f"__PLACEHOLDER_{key.upper()}__"
+            token_map[token] = f"{{{key}}}"
+            template = template.replace(f"{{{key}}}", token)
+        template = template.replace('{', '{{').replace('}', '}}')
+        for token, marker in token_map.items():
+            template = template.replace(token, marker)
+        return template.format(**kwargs)
+
+
+def _time_per_script(generator_class, analysis_params, iterations: int, use_cache: bool = True) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        if not use_cache:
+            get_script_body_cache().clear()
+        output_paths = {key: value.replace("/tmp/", f"/tmp/job_{i}/") for key, value in OUTPUT_PATHS.items()}
+        generator_class().generate_full_r_script(analysis_params, DATA_SUMMARY, output_paths, "/tmp/data.csv")
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rスクリプト生成時間のベンチマーク")
+    parser.add_argument("--iterations", type=int, default=200, help="シナリオごとの生成回数")
+    args = parser.parse_args()
+    # 生成中のinfoログは計測の邪魔になるため抑制する
+    logging.disable(logging.INFO)
+
+    for name, analysis_params in SCENARIOS.items():
+        legacy_script = LegacyRTemplateGenerator().generate_full_r_script(
+            analysis_params, DATA_SUMMARY, OUTPUT_PATHS, "/tmp/data.csv")
+        compiled_script = RTemplateGenerator().generate_full_r_script(
+            analysis_params, DATA_SUMMARY, OUTPUT_PATHS, "/tmp/data.csv")
+        if legacy_script != compiled_script:
+            print(f"{name}: 生成されたスクリプトが一致しません", file=sys.stderr)
+
+        legacy_ms = _time_per_script(LegacyRTemplateGenerator, analysis_params, args.iterations)
+        compiled_ms = _time_per_script(RTemplateGenerator, analysis_params, args.iterations, use_cache=False)
+        memoized_ms = _time_per_script(RTemplateGenerator, analysis_params, args.iterations)
+        print(f"{name:16s} before: {legacy_ms:7.3f} ms/script  compiled: {compiled_ms:7.3f} ms/script  "
+              f"memoized: {memoized_ms:7.3f} ms/script")
+
+
+if __name__ == "__main__":
+    main()
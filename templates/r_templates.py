@@ -1,11 +1,151 @@
 """
 Rスクリプトテンプレートに基づいてRコードを生成するモジュール
 """
+import os
+import re
+import json
+import hashlib
 import logging
-from typing import Dict, List, Optional, Any
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, List, Optional, Any, Mapping
 
 logger = logging.getLogger(__name__)
 
+# {name} 形式のプレースホルダー（それ以外の波括弧はRコードの一部としてそのまま残す）
+_PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+_MISSING = object()
+
+
+class CompiledTemplate:
+    """
+    プレースホルダーの位置を事前に解析したテンプレート
+
+    リテラル部分とプレースホルダー名に分割しておき、render() で1回の走査で置換します。
+    値が渡されなかったプレースホルダーは {name} のまま残します（_safe_format と同じ動作）。
+    """
+    __slots__ = ('literals', 'names')
+
+    def __init__(self, template: str):
+        parts = _PLACEHOLDER_PATTERN.split(template)
+        self.literals = parts[0::2]
+        self.names = parts[1::2]
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        literals = self.literals
+        out = [literals[0]]
+        for name, literal in zip(self.names, literals[1:]):
+            value = values.get(name, _MISSING)
+            out.append(f"{{{name}}}" if value is _MISSING else format(value))
+            out.append(literal)
+        return ''.join(out)
+
+
+@lru_cache(maxsize=256)
+def compile_template(template: str) -> CompiledTemplate:
+    """テンプレート文字列をコンパイル（同じ文字列は一度だけ解析）"""
+    return CompiledTemplate(template)
+
+
+# 生成スクリプトから呼び出す共通R関数ライブラリ（バージョンは内容ハッシュ）
+R_FUNCTION_LIBRARY_PATH = Path(__file__).resolve().with_name("r_function_library.R")
+R_FUNCTION_LIBRARY_VERSION = hashlib.sha256(R_FUNCTION_LIBRARY_PATH.read_bytes()).hexdigest()[:12]
+
+
+def r_function_library_loader() -> str:
+    """
+    共通R関数ライブラリを読み込むRコード
+
+    同じバージョンが読み込み済み（常駐Rワーカー）なら何もせず、単発のRscriptでは評価中の環境に読み込みます。
+    """
+    library_path = str(R_FUNCTION_LIBRARY_PATH).replace('\\', '/')
+    return (
+        "# 共通R関数ライブラリ（常駐Rワーカーでは起動時に読み込み済み）\n"
+        f'if (!exists(".metabot_lib_version") || !identical(.metabot_lib_version, "{R_FUNCTION_LIBRARY_VERSION}")) {{\n'
+        f"    source('{library_path}', local = environment(), encoding = \"UTF-8\")\n"
+        f'    .metabot_lib_version <- "{R_FUNCTION_LIBRARY_VERSION}"\n'
+        "}"
+    )
+
+
+# プロットを並列に描画するRのプロセス数（0: コア数とプロット数の小さい方、1: 順に描画）
+R_PLOT_WORKERS = int(os.environ.get('R_PLOT_WORKERS', '0'))
+
+# パスに依存しないスクリプト本体のキャッシュ件数（0で無効）
+R_SCRIPT_CACHE_SIZE = int(os.environ.get('R_SCRIPT_CACHE_SIZE', '128'))
+
+# スクリプト本体に埋め込むジョブごとのパスのプレースホルダー名の接頭辞
+_JOB_PATH_PREFIX = "__job_path_"
+
+
+class ScriptBodyCache:
+    """正規化したパラメータのハッシュをキーに、コンパイル済みのスクリプト本体を保持するLRUキャッシュ"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, CompiledTemplate]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[CompiledTemplate]:
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: str, body: CompiledTemplate):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+_script_body_cache = ScriptBodyCache(R_SCRIPT_CACHE_SIZE)
+
+
+def get_script_body_cache() -> ScriptBodyCache:
+    """スクリプト本体キャッシュのシングルトンを取得"""
+    return _script_body_cache
+
+
+def compute_script_cache_key(analysis_params: Dict[str, Any], data_summary: Dict[str, Any],
+                             job_path_keys: List[str]) -> str:
+    """
+    スクリプト本体のキャッシュキーを計算します。
+
+    本体はパラメータ・列名・列名マッピング・スキーマの列の型と、どの出力パスが指定されているかだけで決まり、
+    パスの値（ジョブID）には依存しません。
+    """
+    schema = data_summary.get("schema") or {}
+    normalized = json.dumps({
+        "analysis_params": analysis_params,
+        "columns": data_summary.get("columns", []),
+        "column_mapping": data_summary.get("column_mapping") or {},
+        "schema_columns": [[column["name"], column["dtype"]] for column in schema.get("columns", [])],
+        "job_path_keys": sorted(job_path_keys),
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
 class RTemplateGenerator:
     """
     Rスクリプトテンプレートを管理し、パラメータに基づいてRコードを生成するクラス
@@ -23,7 +163,7 @@ class RTemplateGenerator:
         """
         RTemplateGeneratorを初期化し、テンプレートをロードします。
         """
-        self.templates = self._load_templates()
+        self.templates = _SHARED_TEMPLATES
 
     def _calculate_dynamic_plot_width(self, data_summary: Dict[str, Any]) -> float:
         """
@@ -103,24 +243,12 @@ class RTemplateGenerator:
             The formatted string with placeholders replaced and all other
             braces preserved.
         """
-        # Temporarily replace placeholders with unique tokens so we can
-        # escape the remaining curly braces without interfering with them.
-        token_map = {}
-        for key in kwargs:
-            token = f"__PLACEHOLDER_{key.upper()}__"
-            token_map[token] = f"{{{key}}}"
-            template = template.replace(f"{{{key}}}", token)
-
-        # Escape any remaining braces which belong to the R code itself.
-        template = template.replace('{', '{{').replace('}', '}}')
-
-        # Restore the placeholder tokens to standard format markers.
-        for token, marker in token_map.items():
-            template = template.replace(token, marker)
+        # The template is tokenized once (and cached), so each call is a
+        # single pass over the pre-split literal parts.
+        return compile_template(template).render(kwargs)
 
-        return template.format(**kwargs)
-
-    def _load_templates(self) -> Dict[str, str]:
+    @staticmethod
+    def _load_templates() -> Dict[str, str]:
         """
         Rスクリプトのテンプレートをロードします。
         将来的にはファイルや設定からロードするように拡張します。
@@ -183,53 +311,11 @@ if (exists("zero_cells_summary") && !is.null(zero_cells_summary$studies_with_zer
 }}
 """,
             "zero_cell_analysis": """
-# ゼロセル分析（NA値を適切に処理）
-zero_cells_summary <- list()
-zero_cells_summary$total_studies <- nrow(dat)
-
-# NA値を除いてゼロセルを計算
-valid_rows <- !is.na(dat${ai}) & !is.na(dat${bi}) & !is.na(dat${ci}) & !is.na(dat${di})
-zero_cells_summary$valid_studies <- sum(valid_rows, na.rm=TRUE)
-
-if (zero_cells_summary$valid_studies > 0) {{
-    valid_dat <- dat[valid_rows, ]
-    zero_cells_summary$studies_with_zero_cells <- sum((valid_dat${ai} == 0) | (valid_dat${bi} == 0) | (valid_dat${ci} == 0) | (valid_dat${di} == 0), na.rm=TRUE)
-    zero_cells_summary$double_zero_studies <- sum((valid_dat${ai} == 0 & valid_dat${ci} == 0), na.rm=TRUE)
-    zero_cells_summary$zero_in_treatment <- sum(valid_dat${ai} == 0, na.rm=TRUE)
-    zero_cells_summary$zero_in_control <- sum(valid_dat${ci} == 0, na.rm=TRUE)
-}} else {{
-    zero_cells_summary$studies_with_zero_cells <- 0
-    zero_cells_summary$double_zero_studies <- 0
-    zero_cells_summary$zero_in_treatment <- 0
-    zero_cells_summary$zero_in_control <- 0
-}}
-
-print("📊 ゼロセル分析:")
-if (exists("zero_cells_summary")) {{
-  print(paste("総研究数:", zero_cells_summary$total_studies))
-  print(paste("有効研究数（NA値除外後）:", zero_cells_summary$valid_studies))
-  
-  # NA値により除外された研究があれば警告
-  excluded_count <- zero_cells_summary$total_studies - zero_cells_summary$valid_studies
-  if (excluded_count > 0) {{
-    print(paste("⚠️ ", excluded_count, "件の研究がNA値のため解析から除外されました"))
-  }}
-  
-  print(paste("ゼロセルを含む研究数:", zero_cells_summary$studies_with_zero_cells))
-  print(paste("両群ゼロ研究数:", zero_cells_summary$double_zero_studies))
-  print(paste("介入群ゼロ研究数:", zero_cells_summary$zero_in_treatment))
-  print(paste("対照群ゼロ研究数:", zero_cells_summary$zero_in_control))
-}}
+# ゼロセル分析（NA値を除いて計算）
+zero_cells_summary <- metabot_zero_cell_summary(dat, "{ai}", "{bi}", "{ci}", "{di}")
 
 # ゼロセルがある場合の推奨手法の判定
-if (exists("zero_cells_summary") && !is.null(zero_cells_summary$studies_with_zero_cells) && 
-    !is.na(zero_cells_summary$studies_with_zero_cells) && zero_cells_summary$studies_with_zero_cells > 0) {{
-    print("ゼロセルが検出されました。Mantel-Haenszel法を推奨します。")
-    recommended_method <- "MH"
-}} else {{
-    print("ゼロセルは検出されませんでした。逆分散法で問題ありません。")
-    recommended_method <- "IV"
-}}
+recommended_method <- metabot_recommended_method(zero_cells_summary)
 """,
             "or_ci_conversion": """
 # OR/RRと信頼区間からlnOR/lnRRとSEへの変換
@@ -529,80 +615,13 @@ if (exists("res_by_subgroup_{safe_var_name}") && length(res_by_subgroup_{safe_va
         print(paste("DEBUG: summary_list$subgroup_exclusions exists:", !is.null(summary_list$subgroup_exclusions)))
     }}
     
-    # 行位置を計算 (下から上へ) - 除外後のデータに基づいて計算
-    # 各サブグループ間に2行のギャップ（1行はサブグループサマリー、1行は空白）
-    total_studies_filtered <- nrow(dat_ordered_filtered)
-    current_row <- total_studies_filtered + (n_sg_levels * 2) + 2  # 開始位置
-    
-    rows_list <- list()
-    subtotal_rows <- c()
-    
-    # 除外後のデータでのサブグループ別研究数を再計算
-    studies_per_sg_filtered <- table(dat_ordered_filtered[[sanitized_sg_col_name]])[sg_level_names]
-    
-    # 修正: 安全なforループ（subscript out of bounds エラー防止）
-    if (length(sg_level_names) > 0 && n_sg_levels > 0) {{
-        for (i in seq_along(sg_level_names)) {{
-            sg_name <- sg_level_names[i]
-            
-            # 修正: サブグループが存在するかチェック
-            if (!(sg_name %in% names(studies_per_sg_filtered))) {{
-                print(paste("WARNING: Subgroup", sg_name, "not found in filtered data, skipping"))
-                next
-            }}
-            
-            n_studies_sg <- studies_per_sg_filtered[sg_name]
-            
-            # 修正: 研究数が0以下の場合のチェック
-            if (is.na(n_studies_sg) || n_studies_sg <= 0) {{
-                print(paste("WARNING: Subgroup", sg_name, "has no studies, skipping"))
-                next
-            }}
-            
-            print(paste("DEBUG: Subgroup", sg_name, "filtered studies:", n_studies_sg))
-            
-            # この サブグループの研究の行位置
-            study_rows <- seq(current_row - n_studies_sg + 1, current_row)
-            rows_list[[sg_name]] <- study_rows
-            
-            # サブグループサマリーの行位置
-            subtotal_row <- current_row - n_studies_sg - 1
-            subtotal_rows <- c(subtotal_rows, subtotal_row)
-            names(subtotal_rows)[length(subtotal_rows)] <- sg_name
-            
-            # 次のサブグループのための位置更新 (2行のギャップ)
-            current_row <- current_row - n_studies_sg - 2
-        }}
-    }} else {{
-        print("WARNING: No valid subgroups found for row position calculation")
-    }}
-    
-    # 修正: 全ての研究の行位置を統合（安全な処理）
-    if (length(rows_list) > 0 && length(sg_level_names) > 0) {{
-        all_study_rows <- unlist(rows_list[sg_level_names])
-        
-        # 修正: 空の場合のフォールバック
-        if (length(all_study_rows) == 0) {{
-            print("WARNING: No study rows calculated, using default positions")
-            all_study_rows <- seq_len(nrow(dat_ordered_filtered))
-        }}
-    }} else {{
-        print("WARNING: No valid rows_list, using sequential positions")
-        all_study_rows <- seq_len(nrow(dat_ordered_filtered))
-    }}
-    
-    # 行位置は後でres_for_plot_filteredに合わせて調整される
-    
-    # ylimを設定 (十分な空間を確保)
-    # 修正: subtotal_rowsが空の場合の対処
-    if (length(subtotal_rows) > 0 && length(all_study_rows) > 0) {{
-        ylim_bottom <- min(subtotal_rows) - 3
-        ylim_top <- max(all_study_rows) + 3
-    }} else {{
-        print("WARNING: Cannot calculate ylim properly, using defaults")
-        ylim_bottom <- 1
-        ylim_top <- nrow(dat_ordered_filtered) + 5
-    }}
+    # 行位置とY軸範囲を計算 (下から上へ) - 除外後のデータに基づいて計算
+    sg_layout <- metabot_subgroup_row_layout(dat_ordered_filtered, sanitized_sg_col_name, sg_level_names)
+    rows_list <- sg_layout$rows_list
+    subtotal_rows <- sg_layout$subtotal_rows
+    all_study_rows <- sg_layout$all_study_rows
+    ylim_bottom <- sg_layout$ylim_bottom
+    ylim_top <- sg_layout$ylim_top
     
     # --- 高さ計算 ---
     total_plot_rows <- ylim_top - ylim_bottom + extra_rows_sg_val
@@ -656,75 +675,9 @@ if (exists("res_by_subgroup_{safe_var_name}") && length(res_by_subgroup_{safe_va
         }}
         
         # res_for_plotをフィルタリング（除外されたサブグループのデータを削除）
-        print("DEBUG: Filtering res_for_plot for subgroup forest plot")
-        print(paste("DEBUG: Original res_for_plot data rows:", nrow({res_for_plot_model_name}$data)))
-        print(paste("DEBUG: Filtered data rows:", nrow(dat_ordered_filtered)))
-        
-        # 修正: n=1のサブグループを持つ研究を特定して除外
-        # まず、元データでどの研究が除外されたかを確認
-        excluded_studies <- setdiff(dat$Study, dat_ordered_filtered$Study)
-        if (length(excluded_studies) > 0) {{
-            print(paste("DEBUG: Studies excluded due to n=1 subgroups:", paste(excluded_studies, collapse=", ")))
-        }}
-        
-        # フィルタ済みデータのインデックスを取得（Study列で照合）
-        if ("Study" %in% names({res_for_plot_model_name}$data)) {{
-            # 修正: dat_ordered_filteredに存在する研究のみを選択
-            filtered_indices <- which({res_for_plot_model_name}$data$Study %in% dat_ordered_filtered$Study)
-            print(paste("DEBUG: Matching studies found:", length(filtered_indices)))
-        }} else {{
-            # Study列がない場合は、サブグループ列で直接フィルタリング
-            # n=1のサブグループを除外
-            valid_subgroups <- names(table(dat[['{subgroup_col_name}']])[table(dat[['{subgroup_col_name}']]) > 1])
-            filtered_indices <- which({res_for_plot_model_name}$data[['{subgroup_col_name}']] %in% valid_subgroups)
-            print(paste("DEBUG: Valid subgroups:", paste(valid_subgroups, collapse=", ")))
-        }}
-        
-        print(paste("DEBUG: Filtered indices length:", length(filtered_indices)))
-        print(paste("DEBUG: dat_ordered_filtered rows:", nrow(dat_ordered_filtered)))
-        
-        # 修正: インデックス範囲の安全性チェック（subscript out of bounds エラー防止）
-        max_index <- length({res_for_plot_model_name}$yi)
-        invalid_indices <- filtered_indices[filtered_indices <= 0 | filtered_indices > max_index]
-        if (length(invalid_indices) > 0) {{
-            print(paste("WARNING: Invalid indices detected:", paste(invalid_indices, collapse=", ")))
-            print(paste("WARNING: Valid index range: 1 to", max_index))
-            filtered_indices <- filtered_indices[filtered_indices > 0 & filtered_indices <= max_index]
-        }}
-        
-        # インデックスの長さがdat_ordered_filteredと一致することを確認
-        if (length(filtered_indices) != nrow(dat_ordered_filtered)) {{
-            print("ERROR: Index length mismatch after validation, using sequential indices")
-            print(paste("DEBUG: Expected:", nrow(dat_ordered_filtered), "Got:", length(filtered_indices)))
-            filtered_indices <- seq_len(min(nrow(dat_ordered_filtered), max_index))
-        }}
-        
-        # res_for_plotのコピーを作成し、フィルタ済みデータのみを含むようにする
-        res_for_plot_filtered <- {res_for_plot_model_name}
-        
-        # 効果量と分散をフィルタリング
-        res_for_plot_filtered$yi <- {res_for_plot_model_name}$yi[filtered_indices]
-        res_for_plot_filtered$vi <- {res_for_plot_model_name}$vi[filtered_indices]
-        res_for_plot_filtered$se <- {res_for_plot_model_name}$se[filtered_indices]
-        
-        # その他の要素もフィルタリング（存在する場合）
-        if (!is.null({res_for_plot_model_name}$ni)) {{
-            res_for_plot_filtered$ni <- {res_for_plot_model_name}$ni[filtered_indices]
-        }}
-        if (!is.null({res_for_plot_model_name}$weights)) {{
-            res_for_plot_filtered$weights <- {res_for_plot_model_name}$weights[filtered_indices]
-        }}
-        
-        # slabもフィルタリング（重要：整合性を保つ）
-        if (!is.null({res_for_plot_model_name}$slab)) {{
-            res_for_plot_filtered$slab <- {res_for_plot_model_name}$slab[filtered_indices]
-        }}
-        
-        # データ行数を更新
-        res_for_plot_filtered$k <- length(filtered_indices)
-        
-        # データフレームもフィルタリング
-        res_for_plot_filtered$data <- {res_for_plot_model_name}$data[filtered_indices, ]
+        filtered_model <- metabot_filter_model_rows({res_for_plot_model_name}, dat, dat_ordered_filtered, '{subgroup_col_name}')
+        res_for_plot_filtered <- filtered_model$model
+        filtered_indices <- filtered_model$indices
         
         # 修正: ilab_data_main を res_for_plot_filtered の順序に完全に合わせて再構築
         if (!is.null(ilab_data_main)) {{
@@ -1846,50 +1799,17 @@ if (sanitized_subgroup_col %in% names(dat)) {{
             
             exclusion_code = f'''
 # Detect exclusions for subgroup '{subgroup_col}'
-# 元の列名に対応するサニタイズ後の列名を取得
-sanitized_subgroup_col_{safe_var_name} <- names(column_mapping)[column_mapping == "{subgroup_col}"]
-if (length(sanitized_subgroup_col_{safe_var_name}) == 0) {{
-    sanitized_subgroup_col_{safe_var_name} <- make.names("{subgroup_col}")
-}}
-
-if (exists("res_by_subgroup_{safe_var_name}") && !is.null(res_by_subgroup_{safe_var_name})) {{
-    # Get all subgroups in original data
-    all_subgroups_in_data <- unique(dat[[sanitized_subgroup_col_{safe_var_name}]])
-    
-    # Get subgroups that have valid analysis results 
-    subgroups_in_res <- names(res_by_subgroup_{safe_var_name})
-    
-    # Find excluded subgroups using setdiff
-    excluded_subgroups <- setdiff(all_subgroups_in_data, subgroups_in_res)
-    
-    print(paste("DEBUG: Early exclusion detection for {subgroup_col}"))
-    print(paste("DEBUG: All subgroups in data:", paste(all_subgroups_in_data, collapse=", ")))
-    print(paste("DEBUG: Valid subgroups in results:", paste(subgroups_in_res, collapse=", ")))
-    print(paste("DEBUG: Excluded subgroups:", paste(excluded_subgroups, collapse=", ")))
-    
-    # Save exclusion information if any subgroups were excluded
-    if (length(excluded_subgroups) > 0) {{
-        excluded_info <- list(
-            excluded_subgroups = excluded_subgroups,
-            reason = "insufficient_data_n_le_1",
-            included_subgroups = subgroups_in_res
-        )
-        
-        # Save to summary_list (this runs before forest plots, so no scoping issues)
-        summary_list$subgroup_exclusions[['{subgroup_col}']] <- excluded_info
-        
-        print(paste("DEBUG: Saved exclusion info for {subgroup_col} to summary_list"))
-        print(paste("DEBUG: Excluded subgroups saved:", paste(excluded_subgroups, collapse=", ")))
-    }} else {{
-        print(paste("DEBUG: No exclusions detected for {subgroup_col}"))
-    }}
-}}'''
+summary_list <- metabot_detect_subgroup_exclusions(
+    summary_list, dat, column_mapping, "{subgroup_col}",
+    if (exists("res_by_subgroup_{safe_var_name}")) res_by_subgroup_{safe_var_name} else NULL
+)'''
             exclusion_codes.append(exclusion_code)
         
         return "\n".join(exclusion_codes)
         
     def _generate_plot_code(self, analysis_params: Dict[str, Any], output_paths: Dict[str, str], data_summary: Dict[str, Any]) -> str:
-        plot_parts = []
+        # (ラベル, 描画コード) のリスト。各プロットは独立したタスクとして描画する
+        plot_tasks = []
         # analysis_params から data_columns を取得、なければ空の辞書
         data_cols = analysis_params.get("data_columns", {})
         ai_col = data_cols.get("ai", "") # data_columns がなくてもエラーにならないように
@@ -1905,7 +1825,8 @@ if (exists("res_by_subgroup_{safe_var_name}") && !is.null(res_by_subgroup_{safe_
 
         # 1. メインフォレストプロット
         main_forest_plot_path = output_paths.get("forest_plot_path", "forest_plot_overall.png")
-        plot_parts.append(
+        plot_tasks.append((
+            "forest_plot_overall",
             self._safe_format(
                 self.templates["forest_plot"],
                 forest_plot_path=main_forest_plot_path.replace('\\', '/'),
@@ -1919,7 +1840,7 @@ if (exists("res_by_subgroup_{safe_var_name}") && !is.null(res_by_subgroup_{safe_
                 extra_rows_main_placeholder=self.PLOT_EXTRA_ROWS_MAIN,
                 dynamic_xlim_placeholder=dynamic_xlim
             )
-        )
+        ))
         
         # 2. サブグループごとのフォレストプロット
         subgroup_columns = analysis_params.get("subgroups", analysis_params.get("subgroup_columns", []))
@@ -1933,7 +1854,8 @@ if (exists("res_by_subgroup_{safe_var_name}") && !is.null(res_by_subgroup_{safe_
                     continue
                 safe_var_name = self._make_safe_var_name(sg_col)
                 sg_forest_plot_path = f"{subgroup_plot_prefix}_{safe_var_name}.png".replace('\\', '/')
-                plot_parts.append(
+                plot_tasks.append((
+                    f"forest_plot_subgroup_{safe_var_name}",
                     self._safe_format(
                         self.templates["subgroup_forest_plot_template"],
                         subgroup_col_name=sg_col,
@@ -1950,16 +1872,17 @@ if (exists("res_by_subgroup_{safe_var_name}") && !is.null(res_by_subgroup_{safe_
                         extra_rows_subgroup_placeholder=self.PLOT_EXTRA_ROWS_SUBGROUP,
                         dynamic_xlim_placeholder=dynamic_xlim
                     )
-                )
+                ))
 
         # 3. ファンネルプロット
         if output_paths.get("funnel_plot_path"):
-            plot_parts.append(
+            plot_tasks.append((
+                "funnel_plot",
                 self._safe_format(
                     self.templates["funnel_plot"],
                     funnel_plot_path=output_paths["funnel_plot_path"].replace('\\', '/')
                 )
-            )
+            ))
             
         # 4. バブルプロット (メタ回帰用)
         moderators = analysis_params.get("moderator_columns", [])
@@ -1972,14 +1895,23 @@ if (exists("res_by_subgroup_{safe_var_name}") && !is.null(res_by_subgroup_{safe_
                     continue
                 safe_mod_col_name = self._make_safe_var_name(mod_col)
                 bubble_plot_path_specific = f"{bubble_plot_prefix}_{safe_mod_col_name}.png".replace('\\', '/')
-                plot_parts.append(
+                plot_tasks.append((
+                    f"bubble_plot_{safe_mod_col_name}",
                     self._safe_format(
                         self.templates["bubble_plot"],
                         moderator_column_for_bubble=mod_col,
                         bubble_plot_path=bubble_plot_path_specific
                     )
-                )
-        return "\n\n".join(plot_parts)
+                ))
+
+        # モデル推定後に実行されるため、各タスクは推定済みのオブジェクトを読み取るだけで互いに依存しない
+        # （並列時はフォークした子プロセスがメモリ上のオブジェクトをそのまま共有する）
+        task_code = ["# プロット作成（各プロットを独立したタスクとして並列に描画）", "plot_tasks <- list()"]
+        for label, code in plot_tasks:
+            # Rの複数行文字列を含むため、描画コードはインデントせずにそのまま関数本体にする
+            task_code.append(f'plot_tasks[["{label}"]] <- function() {{\n{code}\n}}')
+        task_code.append(f"metabot_run_plot_tasks(plot_tasks, workers = {R_PLOT_WORKERS})")
+        return "\n\n".join(task_code)
 
     def _generate_save_code(self, analysis_params: Dict[str, Any], output_paths: Dict[str, str], data_summary: Dict[str, Any]) -> str:
         additional_objects_to_save = ["res_for_plot"] # res_for_plot は常に保存
@@ -2110,10 +2042,48 @@ if (exists("res_by_subgroup_{safe_var_name}") && !is.null(res_by_subgroup_{safe_
                                data_summary: Dict[str, Any], # CSVの列情報などを含むサマリー
                                output_paths: Dict[str, str],
                                csv_file_path_in_script: str) -> str:
-        logger.info(f"Rスクリプト生成開始。解析パラメータ: {analysis_params}")
-        logger.info(f"データサマリー (列名など): {data_summary.get('columns', 'N/A')}") # data_summary全体は大きい可能性があるので一部のみログ
+        """
+        Rスクリプトを生成します。
+
+        パスに依存しない本体は正規化したパラメータのハッシュをキーにキャッシュし、
+        ジョブごとのパス（CSV・RDS・出力ファイル）はキャッシュ済みの本体に差し込むだけにします。
+        パスはバックスラッシュをスラッシュに置換して埋め込みます。
+        """
+        job_paths = {"csv_path": csv_file_path_in_script, "rds_path": data_summary.get("rds_path")}
+        job_paths.update(output_paths)
+        job_paths = {key: str(value) for key, value in job_paths.items() if value}
+        cache_key = compute_script_cache_key(analysis_params, data_summary, list(job_paths))
+
+        body = _script_body_cache.get(cache_key)
+        if body is None:
+            placeholders = {key: f"{{{_JOB_PATH_PREFIX}{key}}}" for key in job_paths}
+            summary_for_body = dict(data_summary)
+            if "rds_path" in placeholders:
+                summary_for_body["rds_path"] = placeholders["rds_path"]
+            body = CompiledTemplate(self._generate_script_body(
+                analysis_params,
+                summary_for_body,
+                {key: placeholders.get(key, value) for key, value in output_paths.items()},
+                placeholders.get("csv_path", csv_file_path_in_script)
+            ))
+            _script_body_cache.put(cache_key, body)
+        else:
+            logger.info(f"キャッシュ済みのRスクリプト本体を使用します (key: {cache_key[:12]})")
+
         logger.info(f"出力パス: {output_paths}")
         logger.info(f"スクリプト内CSVパス: {csv_file_path_in_script}")
+        return body.render({
+            f"{_JOB_PATH_PREFIX}{key}": value.replace('\\', '/') for key, value in job_paths.items()
+        })
+
+    def _generate_script_body(self,
+                              analysis_params: Dict[str, Any],
+                              data_summary: Dict[str, Any],
+                              output_paths: Dict[str, str],
+                              csv_file_path_in_script: str) -> str:
+        """パスにプレースホルダーを埋め込んだスクリプト本体を生成"""
+        logger.info(f"Rスクリプト生成開始。解析パラメータ: {analysis_params}")
+        logger.info(f"データサマリー (列名など): {data_summary.get('columns', 'N/A')}") # data_summary全体は大きい可能性があるので一部のみログ
 
         # 列名マッピングをanalysis_paramsに適用
         column_mapping = data_summary.get('column_mapping', {})
@@ -2122,91 +2092,68 @@ if (exists("res_by_subgroup_{safe_var_name}") && !is.null(res_by_subgroup_{safe_
             analysis_params = self._apply_column_mapping(analysis_params, column_mapping)
             logger.info(f"Column mapping applied. Updated analysis_params: {analysis_params}")
 
-        script_parts = [self.templates["library_load"]]
+        script_parts = [self.templates["library_load"], r_function_library_loader()]
         
         # データ読み込み (パスはバックスラッシュをスラッシュに置換)
         # na.stringsで"NA"文字列を欠損値として処理
         csv_path_cleaned = csv_file_path_in_script.replace('\\\\', '/')
-        script_parts.append(f"dat <- read.csv('{csv_path_cleaned}', na.strings = c('NA', 'na', 'N/A', 'n/a', ''), stringsAsFactors = FALSE)")
+        schema = data_summary.get("schema")
+        rds_path = data_summary.get("rds_path")
+        if rds_path:
+            # Pythonで書き出した型付きデータセットを1回の呼び出しで読み込む
+            script_parts.append(f"dat <- readRDS('{rds_path.replace(chr(92), '/')}')")
+        elif schema:
+            # 取り込み時に正規化・型推定済みのCSVは列の型を指定して読み込む（型の推測とカンマ処理は不要）
+            # 列名は read.csv 内で make.names されるため、列の順序で指定する
+            col_classes = ", ".join(
+                '"numeric"' if column["dtype"] in ("integer", "number") else '"character"'
+                for column in schema["columns"]
+            )
+            script_parts.append(f"dat <- read.csv('{csv_path_cleaned}', na.strings = c('NA', 'na', 'N/A', 'n/a', ''), stringsAsFactors = FALSE, colClasses = c({col_classes}))")
+        else:
+            script_parts.append(f"dat <- read.csv('{csv_path_cleaned}', na.strings = c('NA', 'na', 'N/A', 'n/a', ''), stringsAsFactors = FALSE)")
         
         # 列名のサニタイズ処理を追加
         script_parts.append("""
 # 列名のサニタイズ（特殊文字を含む列名への対応）
-original_colnames <- colnames(dat)
-sanitized_colnames <- make.names(original_colnames, unique = TRUE)
-if (!identical(original_colnames, sanitized_colnames)) {
-    cat("列名のサニタイズを実行\\n")
-    cat("変更前:", paste(original_colnames, collapse = ", "), "\\n")
-    cat("変更後:", paste(sanitized_colnames, collapse = ", "), "\\n")
-    
-    # 元の列名とサニタイズ後の列名のマッピングを作成
-    column_mapping <- setNames(original_colnames, sanitized_colnames)
-    colnames(dat) <- sanitized_colnames
-} else {
-    column_mapping <- setNames(original_colnames, original_colnames)
-}
+sanitized <- metabot_sanitize_column_names(dat)
+dat <- sanitized$dat
+column_mapping <- sanitized$column_mapping
 """)
         
-        # カンマ区切り数値の処理を追加
-        script_parts.append("""
+        # カンマ区切り数値の処理を追加（スキーマがある場合は取り込み時に正規化済み）
+        if not schema:
+            script_parts.append("""
 # カンマ区切り数値の処理（例: "14,210" → 14210）
-numeric_cols <- sapply(dat, function(x) {
-    # 文字列かつ数値っぽい列を検出（カンマ区切りを含む）
-    if (is.character(x)) {
-        # カンマを含み、カンマを除去すれば数値になる列
-        test_values <- gsub(",", "", x[!is.na(x)])
-        if (length(test_values) > 0) {
-            return(all(grepl("^[0-9]+\\\\.?[0-9]*$", test_values)))
-        }
-    }
-    return(FALSE)
-})
-
-if (any(numeric_cols)) {
-    cat("カンマ区切り数値列を検出しました:\\n")
-    for (col_name in names(numeric_cols)[numeric_cols]) {
-        cat("  ", col_name, "\\n")
-        dat[[col_name]] <- as.numeric(gsub(",", "", dat[[col_name]]))
-    }
-}
+dat <- metabot_convert_comma_numbers(dat)
 """)
         
         # データ品質チェック（NA値の確認）
         script_parts.append("""
 # データ品質チェック
-cat("データ読み込み完了\\n")
-cat("総行数:", nrow(dat), "\\n")
-if (any(is.na(dat))) {
-    na_summary <- sapply(dat, function(x) sum(is.na(x)))
-    na_cols <- na_summary[na_summary > 0]
-    if (length(na_cols) > 0) {
-        cat("欠損値を含む列:\\n")
-        for (col_name in names(na_cols)) {
-            cat("  ", col_name, ":", na_cols[col_name], "個\\n")
-        }
-    }
-} else {
-    cat("欠損値なし\\n")
-}
+metabot_report_data_quality(dat)
 
 # 解析に必要な数値列の数値変換とNA値処理
 numeric_cols_to_check <- c()
 """)
         
-        # 数値変換が必要な列をリストに追加
+        # 数値変換が必要な列をリストに追加（スキーマで数値型と判定済みの列は変換済み）
         data_cols = analysis_params.get("data_columns", {})
         numeric_conversion_code = []
+        typed_numeric_columns = {column["name"] for column in schema["columns"]
+                                 if column["dtype"] in ("integer", "number")} if schema else set()
         
         # 二値アウトカムの場合の数値列
         if analysis_params.get("measure") in ["OR", "RR", "RD", "PETO"]:
             for col_key in ["ai", "ci", "n1i", "n2i"]:
                 col_name = data_cols.get(col_key)
                 if col_name:
+                    needs_conversion = col_name not in typed_numeric_columns
+                    log_line = f'\n    cat("数値変換: {col_name}\\n")' if needs_conversion else ""
+                    conversion_line = f"\n    dat${col_name} <- as.numeric(as.character(dat${col_name}))" if needs_conversion else ""
                     numeric_conversion_code.append(f"""
-if ("{col_name}" %in% names(dat)) {{
-    cat("数値変換: {col_name}\\n")
-    original_values <- dat${col_name}
-    dat${col_name} <- as.numeric(as.character(dat${col_name}))
+if ("{col_name}" %in% names(dat)) {{{log_line}
+    original_values <- dat${col_name}{conversion_line}
     invalid_rows <- which(is.na(dat${col_name}))
     if (length(invalid_rows) > 0) {{
         cat("⚠️ データ品質警告: {col_name}列でNA値または非数値データが検出されました\\n")
@@ -2428,3 +2375,9 @@ if __name__ == '__main__':
     )
     # print(r_script_pre)
     print("\nNote: Full R scripts are long and not printed here. Check logic if needed.")
+
+
+# テンプレートはインポート時に一度だけ構築・コンパイルし、全インスタンスで共有する
+_SHARED_TEMPLATES: Mapping[str, str] = MappingProxyType(RTemplateGenerator._load_templates())
+for _template in _SHARED_TEMPLATES.values():
+    compile_template(_template)
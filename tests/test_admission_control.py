@@ -0,0 +1,71 @@
+"""
+ユーザー・チャンネル・ワークスペース単位の受付制御（トークンバケット）のテスト
+"""
+import pytest
+
+from core.admission_control import AdmissionController, TokenBucket
+
+QUOTAS = {
+    "user": {"rate_per_minute": 60, "burst": 2},
+    "channel": {"rate_per_minute": 60, "burst": 3},
+    "workspace": {"rate_per_minute": 60, "burst": 100},
+}
+
+
+class TestTokenBucket:
+    """トークンバケットのテストクラス"""
+
+    def test_burst_then_refill(self):
+        """バースト量まで消費でき、補充のペースに応じて再試行までの秒数を返すこと"""
+        bucket = TokenBucket(rate_per_minute=30, burst=2, now=0.0)
+        for _ in range(2):
+            assert bucket.available(1, now=0.0)
+            bucket.consume(1)
+        assert not bucket.available(1, now=0.0)
+        assert bucket.retry_after(1, now=0.0) == pytest.approx(2.0)
+        assert bucket.available(1, now=2.0)
+        assert bucket.retry_after(3, now=2.0) == float("inf")
+
+
+class TestAdmissionController:
+    """受付制御のテストクラス"""
+
+    def test_user_quota_does_not_affect_other_users(self):
+        """1人が上限に達しても他のユーザーは受け付けられること"""
+        controller = AdmissionController(default_quotas=QUOTAS, quota_overrides={})
+        assert controller.admit("csv", user_id="U1")["admitted"]
+        assert controller.admit("csv", user_id="U1")["admitted"]
+        rejected = controller.admit("csv", user_id="U1")
+        assert not rejected["admitted"]
+        assert rejected["scope"] == "user"
+        assert 0 < rejected["retry_after"] <= 1.0
+        assert controller.admit("csv", user_id="U2")["admitted"]
+
+    def test_channel_quota_is_shared_and_rejection_consumes_nothing(self):
+        """チャンネルの上限は複数のユーザーで共有し、拒否した場合はどのバケットも消費しないこと"""
+        controller = AdmissionController(default_quotas=QUOTAS, quota_overrides={})
+        for user_id in ("U1", "U2", "U3"):
+            assert controller.admit("analysis", user_id=user_id, channel_id="C1")["admitted"]
+        rejected = controller.admit("analysis", user_id="U4", channel_id="C1")
+        assert rejected["scope"] == "channel"
+        assert controller.buckets["user:U4"].tokens == pytest.approx(2, abs=0.1)
+        assert controller.admit("analysis", user_id="U4", channel_id="C2")["admitted"]
+
+    def test_quota_overrides_and_weight(self):
+        """ADMISSION_QUOTAS の個別設定で上限と重みを変えられること"""
+        controller = AdmissionController(default_quotas=QUOTAS,
+                                         quota_overrides={"user:VIP": {"burst": 5, "weight": 3}})
+        assert all(controller.admit("csv", user_id="VIP")["admitted"] for _ in range(5))
+        assert controller.weight_for("VIP") == 3
+        assert controller.weight_for("U1") == 1
+        assert controller.weight_for(None) == 1
+
+    def test_refund_and_metrics(self):
+        """実行されなかったジョブのトークンを戻し、受付数と拒否数を記録すること"""
+        controller = AdmissionController(default_quotas=QUOTAS, quota_overrides={})
+        first = controller.admit("csv", user_id="U1")
+        controller.admit("csv", user_id="U1")
+        assert not controller.admit("csv", user_id="U1")["admitted"]
+        controller.refund(first)
+        assert controller.admit("csv", user_id="U1")["admitted"]
+        assert controller.get_metrics() == {"csv": {"admitted": 3, "rejected_user": 1}}
@@ -0,0 +1,87 @@
+"""
+共有イベントループサービスのテスト
+"""
+import asyncio
+import threading
+import pytest
+
+from core.async_loop import AsyncLoopService
+
+
+@pytest.fixture
+def service():
+    svc = AsyncLoopService(max_jobs=2, thread_workers=4)
+    svc.start()
+    yield svc
+    svc.shutdown(timeout=5)
+
+
+class TestAsyncLoopService:
+    """共有イベントループサービスのテストクラス"""
+
+    def test_jobs_share_one_long_lived_loop(self, service):
+        """複数のジョブが同じループ・同じスレッドで実行されること"""
+        async def current_loop():
+            await asyncio.sleep(0)
+            return asyncio.get_running_loop(), threading.current_thread().name
+
+        first = service.submit(current_loop()).result(timeout=5)
+        second = service.run(current_loop(), timeout=5)
+        assert first == second
+        assert first[0] is service.loop
+        assert first[1] == "async-loop-service"
+
+    def test_exception_is_propagated_to_future(self, service):
+        """ジョブの例外がFutureに伝わり、ジョブ一覧から削除されること"""
+        async def failing():
+            raise ValueError("boom")
+
+        future = service.submit(failing(), job_id="failing_job")
+        with pytest.raises(ValueError, match="boom"):
+            future.result(timeout=5)
+        assert service.get_active_count() == 0
+
+    def test_concurrency_is_bounded_by_max_jobs(self, service):
+        """同時実行数が max_jobs を超えないこと"""
+        state = {"running": 0, "peak": 0}
+
+        async def job():
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(0.05)
+            state["running"] -= 1
+
+        futures = [service.submit(job()) for _ in range(6)]
+        for future in futures:
+            future.result(timeout=5)
+        assert state["peak"] == 2
+
+    def test_blocking_work_runs_off_the_loop(self, service):
+        """to_threadのブロッキング処理中も他のジョブが進むこと"""
+        release = threading.Event()
+
+        async def blocking():
+            await asyncio.to_thread(release.wait, 5)
+            return "blocking done"
+
+        async def quick():
+            return "quick done"
+
+        slow_future = service.submit(blocking())
+        assert service.run(quick(), timeout=2) == "quick done"
+        release.set()
+        assert slow_future.result(timeout=5) == "blocking done"
+
+    def test_run_from_loop_thread_is_rejected(self, service):
+        """ループスレッドからrun()を呼ぶとデッドロックせずにエラーになること"""
+        async def nested():
+            async def inner():
+                return 1
+            coro = inner()
+            try:
+                service.run(coro)
+            finally:
+                coro.close()
+
+        with pytest.raises(RuntimeError):
+            service.submit(nested()).result(timeout=5)
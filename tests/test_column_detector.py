@@ -0,0 +1,87 @@
+"""
+ルールベースの列役割検出のテスト
+"""
+import asyncio
+import logging
+import pandas as pd
+import pytest
+from pathlib import Path
+from unittest.mock import patch, AsyncMock
+
+from core.column_detector import detect_columns, LOCAL_COLUMN_DETECTOR_MIN_CONFIDENCE
+
+EXAMPLES_DIR = Path(__file__).parent.parent / "examples"
+
+
+class TestColumnDetector:
+    """ルールベース列検出のテストクラス"""
+
+    @pytest.mark.parametrize("csv_name,effect_type,columns", [
+        ("example_binary_meta_dataset.csv", "OR", {"binary_intervention_events": ["events_treatment"],
+                                                   "binary_control_total": ["total_control"]}),
+        ("example_binary_with_zero_cells.csv", "OR", {"binary_intervention_total": ["Intervention_Total"],
+                                                      "binary_control_events": ["Control_Events"]}),
+        ("example_continuous_meta_dataset.csv", "SMD", {"continuous_intervention_sd": ["sd_treatment"],
+                                                        "continuous_control_n": ["n_control"]}),
+        ("example_hazard_ratio_meta_dataset.csv", "HR", {"effect_size_candidates": ["log_hr"],
+                                                         "variance_candidates": ["se_log_hr"]}),
+        ("example_meta_data.csv", "PRE", {"effect_size_candidates": ["yi"], "variance_candidates": ["vi"]}),
+        ("example_or_ci_meta_dataset.csv", "OR", {"effect_size_candidates": ["OR"], "ci_lower_candidates": ["CI_Lower"]}),
+        ("example_rr_ci_meta_dataset.csv", "RR", {"ci_upper_candidates": ["Upper_CI"]}),
+        ("example_proportion_meta_dataset.csv", "PLO", {"proportion_events": ["events"], "proportion_total": ["total"]}),
+    ])
+    def test_example_layouts_are_detected_confidently(self, csv_name, effect_type, columns):
+        """examples/ の標準的なレイアウトを高い信頼度で検出すること"""
+        result = detect_columns((EXAMPLES_DIR / csv_name).read_text(encoding="utf-8"))
+        assert result["confidence"] >= LOCAL_COLUMN_DETECTOR_MIN_CONFIDENCE
+        assert result["is_suitable"] is True
+        assert result["suggested_analysis"]["effect_type_suggestion"] == effect_type
+        for key, expected in columns.items():
+            assert result["detected_columns"][key] == expected, key
+        assert result["detected_columns"]["study_id_candidates"]
+
+    def test_subgroups_and_moderators(self):
+        """文字列列をサブグループ候補、役割の無い数値列をモデレーター候補にすること"""
+        result = detect_columns((EXAMPLES_DIR / "example_binary_meta_dataset.csv").read_text(encoding="utf-8"))
+        detected = result["detected_columns"]
+        assert "region" in detected["subgroup_candidates"]
+        assert "publication_year" in detected["moderator_candidates"]
+        assert "events_treatment" not in detected["moderator_candidates"]
+        assert result["num_studies"] == len(pd.read_csv(EXAMPLES_DIR / "example_binary_meta_dataset.csv"))
+
+    def test_japanese_headers(self):
+        """日本語の列名でも二値データを検出すること"""
+        csv_content = "研究名,介入群イベント数,介入群総数,対照群イベント数,対照群総数\nA,3,50,5,50\nB,4,60,8,61\n"
+        result = detect_columns(csv_content)
+        assert result["confidence"] >= LOCAL_COLUMN_DETECTOR_MIN_CONFIDENCE
+        assert result["detected_columns"]["binary_control_total"] == ["対照群総数"]
+        assert result["detected_columns"]["study_id_candidates"] == ["研究名"]
+
+    @pytest.mark.parametrize("csv_content", [
+        # イベント数が総数を超える
+        "study,events_treatment,total_treatment,events_control,total_control\nA,60,50,5,50\nB,4,60,8,61\n",
+        # 信頼区間の順序が不正
+        "study,OR,CI_Lower,CI_Upper\nA,1.5,1.7,2.0\nB,1.2,1.0,1.4\n",
+        # 二値データと事前計算済み効果量の両方に該当
+        "study,yi,vi,events_treatment,total_treatment,events_control,total_control\nA,0.1,0.01,3,50,5,50\nB,0.2,0.02,4,60,8,61\n",
+        # 役割を判定できる列が無い
+        "name,foo,bar\nA,1,2\nB,3,4\n",
+    ])
+    def test_low_confidence_cases(self, csv_content):
+        """値の検査に失敗する・曖昧・不明な場合は信頼度が低いこと"""
+        assert detect_columns(csv_content)["confidence"] < LOCAL_COLUMN_DETECTOR_MIN_CONFIDENCE
+
+    def test_gemini_is_called_only_for_low_confidence(self):
+        """信頼度が高い場合はGeminiを呼ばず、低い場合のみGeminiを呼ぶこと"""
+        from handlers import csv_handler
+
+        gemini_result = {"is_suitable": True, "detected_columns": {}}
+        with patch.object(csv_handler, "GeminiClient") as mock_client_class:
+            mock_client_class.return_value.analyze_csv = AsyncMock(return_value=gemini_result)
+            local = asyncio.run(csv_handler.analyze_csv_content(
+                (EXAMPLES_DIR / "example_meta_data.csv").read_text(encoding="utf-8"), logging.getLogger(__name__)))
+            fallback = asyncio.run(csv_handler.analyze_csv_content("name,foo\nA,1\nB,2\n", logging.getLogger(__name__)))
+
+        assert local["detector"] == "rule_based"
+        assert fallback is gemini_result
+        assert mock_client_class.return_value.analyze_csv.await_count == 1
@@ -0,0 +1,103 @@
+"""
+コンパイル済みRテンプレート（1回の走査での置換・インスタンス間の共有）とスクリプト本体キャッシュのテスト
+"""
+from unittest.mock import patch
+
+import templates.r_templates as r_templates
+from templates.r_templates import RTemplateGenerator, ScriptBodyCache, compile_template, compute_script_cache_key
+
+
+def _legacy_safe_format(template, **kwargs):
+    """以前の _safe_format の実装（置換結果の比較用）"""
+    token_map = {}
+    for key in kwargs:
+        token = f"__PLACEHOLDER_{key.upper()}__"
+        token_map[token] = f"{{{key}}}"
+        template = template.replace(f"{{{key}}}", token)
+    template = template.replace('{', '{{').replace('}', '}}')
+    for token, marker in token_map.items():
+        template = template.replace(token, marker)
+    return template.format(**kwargs)
+
+
+class TestCompiledTemplates:
+    """コンパイル済みテンプレートのテストクラス"""
+
+    def test_render_matches_legacy_safe_format(self):
+        """Rの波括弧・未指定のプレースホルダー・二重括弧を以前と同じように扱うこと"""
+        template = 'if (x) {{\n  y <- "{col}"\n}}\nf <- function() { {other} }\nz <- {{col}} + {col}}\n'
+        values = {"col": "yi", "unused": 1.5}
+        assert compile_template(template).render(values) == _legacy_safe_format(template, **values)
+        assert RTemplateGenerator()._safe_format(template, col="yi") == _legacy_safe_format(template, col="yi")
+
+    def test_all_templates_render_like_legacy(self):
+        """全テンプレートで以前の実装と同じ結果になること"""
+        generator = RTemplateGenerator()
+        for name, template in generator.templates.items():
+            values = {placeholder: f"<{placeholder}>" for placeholder in compile_template(template).names}
+            assert generator._safe_format(template, **values) == _legacy_safe_format(template, **values), name
+
+    def test_templates_are_shared_and_compiled_once(self):
+        """テンプレートは全インスタンスで共有し、コンパイル結果を再利用すること"""
+        first, second = RTemplateGenerator(), RTemplateGenerator()
+        assert first.templates is second.templates
+        forest_plot = first.templates["forest_plot"]
+        assert compile_template(forest_plot) is compile_template(forest_plot)
+
+
+class TestScriptBodyCache:
+    """パスに依存しないスクリプト本体キャッシュのテストクラス"""
+
+    ANALYSIS_PARAMS = {"measure": "OR", "model": "REML",
+                       "data_columns": {"ai": "ai", "ci": "ci", "n1i": "n1i", "n2i": "n2i", "study_label": "study"},
+                       "subgroup_columns": ["region"]}
+    DATA_SUMMARY = {"columns": ["study", "ai", "ci", "n1i", "n2i", "region"]}
+
+    @staticmethod
+    def _output_paths(job_id):
+        return {"forest_plot_path": f"/tmp/{job_id}/forest.png", "funnel_plot_path": f"/tmp/{job_id}/funnel.png",
+                "rdata_path": f"/tmp/{job_id}/result.RData", "json_summary_path": f"/tmp/{job_id}/summary.json",
+                "forest_plot_subgroup_prefix": f"/tmp/{job_id}/forest_subgroup"}
+
+    def test_jobs_differing_only_by_paths_reuse_body(self, monkeypatch):
+        """ジョブIDだけが異なる解析では本体を再生成せず、パスだけを差し替えること"""
+        cache = ScriptBodyCache(8)
+        monkeypatch.setattr(r_templates, "_script_body_cache", cache)
+        generator = RTemplateGenerator()
+
+        first = generator.generate_full_r_script(self.ANALYSIS_PARAMS, self.DATA_SUMMARY,
+                                                 self._output_paths("job1"), "/tmp/job1/data.csv")
+        with patch.object(RTemplateGenerator, "_generate_script_body") as mock_body:
+            second = generator.generate_full_r_script(self.ANALYSIS_PARAMS, self.DATA_SUMMARY,
+                                                      self._output_paths("job2"), "/tmp/job2/data.csv")
+        mock_body.assert_not_called()
+
+        assert cache.get_stats()["hits"] == 1
+        assert second == first.replace("/tmp/job1/", "/tmp/job2/")
+        assert "/tmp/job2/forest_subgroup_region.png" in second
+        assert r_templates._JOB_PATH_PREFIX not in second
+
+    def test_cached_script_matches_uncached_generation(self, monkeypatch):
+        """キャッシュ経由のスクリプトがパスを直接埋め込んで生成したものと一致すること"""
+        monkeypatch.setattr(r_templates, "_script_body_cache", ScriptBodyCache(8))
+        generator = RTemplateGenerator()
+        output_paths = self._output_paths("job1")
+
+        cached = generator.generate_full_r_script(self.ANALYSIS_PARAMS, self.DATA_SUMMARY, output_paths,
+                                                  "C:\\jobs\\data.csv")
+        direct = generator._generate_script_body(self.ANALYSIS_PARAMS, self.DATA_SUMMARY, output_paths,
+                                                 "C:/jobs/data.csv")
+        assert cached == direct
+
+    def test_parameters_and_schema_change_the_key(self):
+        """パラメータ・列・スキーマの型・指定された出力の種類が異なれば別のキーになること"""
+        base = compute_script_cache_key(self.ANALYSIS_PARAMS, self.DATA_SUMMARY, ["csv_path", "rdata_path"])
+        reordered = compute_script_cache_key(dict(reversed(list(self.ANALYSIS_PARAMS.items()))), self.DATA_SUMMARY,
+                                             ["rdata_path", "csv_path"])
+        assert base == reordered
+        assert base != compute_script_cache_key({**self.ANALYSIS_PARAMS, "model": "DL"}, self.DATA_SUMMARY,
+                                                ["csv_path", "rdata_path"])
+        assert base != compute_script_cache_key(self.ANALYSIS_PARAMS, self.DATA_SUMMARY, ["csv_path"])
+        schema = {"columns": [{"name": "ai", "dtype": "integer"}]}
+        assert base != compute_script_cache_key(self.ANALYSIS_PARAMS, {**self.DATA_SUMMARY, "schema": schema},
+                                                ["csv_path", "rdata_path"])
@@ -0,0 +1,79 @@
+"""
+Gemini CSV分析結果キャッシュのテスト（Gemini APIには接続しない）
+"""
+import os
+import time
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import core.gemini_client as gemini_client
+import utils.csv_analysis_cache as csv_analysis_cache
+from utils.csv_analysis_cache import compute_csv_fingerprint, get_cached_csv_analysis, store_csv_analysis
+
+CSV_CONTENT = "study,yi,vi\nA,0.1,0.01\nB,0.2,0.02\n"
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path):
+    with patch.object(csv_analysis_cache, "CSV_ANALYSIS_CACHE_DIR", tmp_path / "csv_analysis"), \
+         patch.object(csv_analysis_cache, "CSV_ANALYSIS_CACHE_ENABLED", True), \
+         patch("utils.conversation_state.STORAGE_BACKEND", "memory"):
+        yield tmp_path / "csv_analysis"
+
+
+class TestCsvAnalysisCache:
+    """CSV分析結果キャッシュのテストクラス"""
+
+    def test_fingerprint_normalizes_whitespace(self):
+        """改行コードや空行の違いは同じフィンガープリントになり、内容・プロンプト版の違いは別になること"""
+        base = compute_csv_fingerprint(CSV_CONTENT, "1", "model")
+        assert compute_csv_fingerprint("study,yi,vi\r\n\r\nA,0.1,0.01\r\nB,0.2,0.02", "1", "model") == base
+        assert compute_csv_fingerprint(CSV_CONTENT + "C,0.3,0.03\n", "1", "model") != base
+        assert compute_csv_fingerprint(CSV_CONTENT, "2", "model") != base
+        assert compute_csv_fingerprint(CSV_CONTENT, "1", "other-model") != base
+        # 先頭のサンプルが同じでも、全行から判定した列の型が違えば別のキーになる
+        with_schema = compute_csv_fingerprint(CSV_CONTENT, "1", "model", "- yi: 数値")
+        assert with_schema != base
+        assert compute_csv_fingerprint(CSV_CONTENT, "1", "model", "- yi: 文字列") != with_schema
+
+    def test_store_and_expire(self, isolated_cache):
+        """保存した結果を取得でき、有効期限を過ぎると返さないこと"""
+        fingerprint = compute_csv_fingerprint(CSV_CONTENT, "1", "model")
+        store_csv_analysis(fingerprint, {"is_suitable": True, "detected_columns": {"effect_size_candidates": ["yi"]}})
+        assert get_cached_csv_analysis(fingerprint)["detected_columns"] == {"effect_size_candidates": ["yi"]}
+
+        expired = time.time() - (csv_analysis_cache.CSV_ANALYSIS_CACHE_TTL_HOURS * 3600 + 1)
+        os.utime(isolated_cache / f"{fingerprint}.json", (expired, expired))
+        assert get_cached_csv_analysis(fingerprint) is None
+
+    def test_oldest_entries_are_pruned(self, isolated_cache):
+        """最大エントリ数を超えると最終アクセスが古いものから削除されること"""
+        with patch.object(csv_analysis_cache, "CSV_ANALYSIS_CACHE_MAX_ENTRIES", 2):
+            store_csv_analysis("a", {"n": 1})
+            os.utime(isolated_cache / "a.json", (time.time() - 20, time.time() - 20))
+            store_csv_analysis("b", {"n": 2})
+            os.utime(isolated_cache / "b.json", (time.time() - 10, time.time() - 10))
+            store_csv_analysis("c", {"n": 3})
+        assert get_cached_csv_analysis("a") is None
+        assert get_cached_csv_analysis("b") == {"n": 2}
+        assert get_cached_csv_analysis("c") == {"n": 3}
+
+    def test_analyze_csv_calls_gemini_once_for_same_dataset(self, monkeypatch):
+        """同じデータセットの2回目の分析ではGeminiを呼ばないこと"""
+        monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+        response = SimpleNamespace(text='{"is_suitable": true, "detected_columns": {}, "suggested_analysis": {}}')
+
+        async def fake_generate(prompt, model_name, operation="generate"):
+            return response
+
+        with patch.object(gemini_client, "_gemini_registry", None), \
+             patch.object(gemini_client.genai, "configure"):
+            registry = gemini_client.get_gemini_registry()
+            with patch.object(registry, "generate_content_async", side_effect=fake_generate) as mock_generate:
+                first = asyncio.run(gemini_client.GeminiClient().analyze_csv(CSV_CONTENT))
+                second = asyncio.run(gemini_client.GeminiClient().analyze_csv(CSV_CONTENT.replace("\n", "\r\n")))
+
+        assert mock_generate.call_count == 1
+        assert first == second == {"is_suitable": True, "detected_columns": {}, "suggested_analysis": {}}
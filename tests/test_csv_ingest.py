@@ -0,0 +1,96 @@
+"""
+CSV取り込み（エンコーディング判定・型推定・スキーママニフェスト）のテスト
+"""
+import pytest
+from pathlib import Path
+from unittest.mock import patch
+
+import utils.dataset_store as dataset_store
+from utils.csv_ingest import ingest_csv, sniff_encoding, sniff_delimiter, describe_schema
+from utils.dataset_store import store_dataset, load_dataset
+from templates.r_templates import RTemplateGenerator
+
+EXAMPLES_DIR = Path(__file__).parent.parent / "examples"
+
+
+class TestCsvIngest:
+    """CSV取り込みのテストクラス"""
+
+    @pytest.mark.parametrize("raw,encoding,has_bom", [
+        ("研究,yi\nA,0.1\n".encode("utf-8"), "utf-8", False),
+        ("研究,yi\nA,0.1\n".encode("utf-8-sig"), "utf-8-sig", True),
+        ("研究,yi\nA,0.1\n".encode("cp932"), "cp932", False),
+        ("研究\tyi\nA\t0.1\n".encode("utf-16"), "utf-16", True),
+    ])
+    def test_encoding_is_sniffed(self, raw, encoding, has_bom):
+        """BOM付きUTF-8・UTF-16・Shift-JISを判定し、同じ内容に正規化すること"""
+        assert sniff_encoding(raw) == (encoding, has_bom)
+        result = ingest_csv(raw)
+        assert result["csv_bytes"].decode("utf-8") == "研究,yi\nA,0.1\n"
+        assert result["schema"]["encoding"] == encoding
+
+    def test_delimiter_is_sniffed(self):
+        """タブ・セミコロン区切りを判定し、カンマを含む文字列値では誤判定しないこと"""
+        assert sniff_delimiter("a\tb\tc\n1\t2\t3\n") == "\t"
+        assert sniff_delimiter("a;b\n1;2\n") == ";"
+        assert sniff_delimiter("a,b\n\"x;y\",2\n") == ","
+
+    def test_types_thousands_and_na_tokens(self):
+        """桁区切りカンマ・欠損値トークンを正規化し、列の型を推定すること"""
+        csv_text = 'Study Name,n,yi,note\nA,"14,210",0.12,ok\nB,350,NA,\nC,N/A,-0.3,n/a\n'
+        result = ingest_csv(csv_text.encode("utf-8"))
+
+        columns = {column["name"]: column for column in result["schema"]["columns"]}
+        assert columns["n"]["dtype"] == "integer" and columns["n"]["thousands_separator"]
+        assert columns["yi"]["dtype"] == "number" and columns["yi"]["na_count"] == 1
+        assert columns["note"]["dtype"] == "string" and columns["note"]["na_count"] == 2
+        assert columns["Study_Name"]["original_name"] == "Study Name"
+        assert result["column_mapping"] == {"Study Name": "Study_Name", "n": "n", "yi": "yi", "note": "note"}
+        assert result["csv_bytes"].decode("utf-8").splitlines() == [
+            "Study_Name,n,yi,note", "A,14210,0.12,ok", "B,350,,", "C,,-0.3,"
+        ]
+        assert result["dataframe"]["n"].tolist()[:2] == [14210, 350]
+        assert "yi: 数値（欠損 1件）" in describe_schema(result["schema"])
+
+    def test_trailing_empty_rows_and_columns_are_dropped(self):
+        """Excelから書き出した末尾の空行・空列を除去すること"""
+        result = ingest_csv(b"study,yi,\nA,0.1,\nB,0.2,\n,,\n")
+        assert result["schema"]["n_rows"] == 2
+        assert [column["name"] for column in result["schema"]["columns"]] == ["study", "yi"]
+
+    def test_example_datasets_are_typed(self):
+        """examples/ のデータセットの数値列を数値型と判定すること"""
+        result = ingest_csv((EXAMPLES_DIR / "example_binary_meta_dataset.csv").read_bytes())
+        dtypes = {column["name"]: column["dtype"] for column in result["schema"]["columns"]}
+        assert dtypes["events_treatment"] == "integer"
+        assert dtypes["region"] == "string"
+
+    def test_precleaned_dataset_is_stored_with_schema(self, tmp_path):
+        """取り込み済みのCSVは再パースせずにスキーマとともに保存すること"""
+        result = ingest_csv(b"Study Name,yi\nA,0.1\n")
+        with patch.object(dataset_store, "DATASET_STORE_DIR", tmp_path / "datasets"), \
+             patch("utils.conversation_state.STORAGE_BACKEND", "memory"), \
+             patch.object(dataset_store, "clean_csv_content") as mock_clean:
+            ref = store_dataset("F1", result["csv_bytes"], "data.csv", result["column_mapping"], result["schema"])
+            content, column_mapping = load_dataset("F1", ref["content_hash"])
+        mock_clean.assert_not_called()
+        assert content == result["csv_bytes"]
+        assert column_mapping == {"Study Name": "Study_Name", "yi": "yi"}
+
+    def test_r_script_reads_with_schema_types(self):
+        """スキーマがある場合はRで列の型を指定して読み込み、カンマ区切りの後処理を省くこと"""
+        result = ingest_csv(b'study,yi,vi\nA,0.1,0.01\nB,0.2,0.02\n')
+        generator = RTemplateGenerator()
+        analysis_params = {"measure": "PRE", "model": "REML",
+                           "data_columns": {"yi": "yi", "vi": "vi", "study_label": "study"}}
+        output_paths = {"forest_plot_path": "/tmp/f.png", "funnel_plot_path": "/tmp/u.png",
+                        "rdata_path": "/tmp/r.RData", "json_summary_path": "/tmp/s.json"}
+
+        with_schema = generator.generate_full_r_script(
+            analysis_params, {"columns": ["study", "yi", "vi"], "schema": result["schema"]}, output_paths, "/tmp/d.csv")
+        without_schema = generator.generate_full_r_script(
+            analysis_params, {"columns": ["study", "yi", "vi"]}, output_paths, "/tmp/d.csv")
+
+        assert 'colClasses = c("character", "numeric", "numeric")' in with_schema
+        assert "カンマ区切り数値の処理" not in with_schema
+        assert "カンマ区切り数値の処理" in without_schema
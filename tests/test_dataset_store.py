@@ -0,0 +1,79 @@
+"""
+アップロード済みデータセットストアのテスト
+"""
+import time
+import json
+import asyncio
+import pytest
+from unittest.mock import patch, MagicMock
+
+import utils.dataset_store as dataset_store
+from utils.dataset_store import store_dataset, load_dataset
+
+
+@pytest.fixture(autouse=True)
+def isolated_store(tmp_path):
+    with patch.object(dataset_store, "DATASET_STORE_DIR", tmp_path / "datasets"), \
+         patch("utils.conversation_state.STORAGE_BACKEND", "memory"):
+        yield tmp_path / "datasets"
+
+
+class TestDatasetStore:
+    """データセットストアのテストクラス"""
+
+    def test_store_cleans_columns_once_and_loads(self):
+        """保存時に列名をクリーンアップし、同じ内容とマッピングを取得できること"""
+        ref = store_dataset("F123", "研究 名,効果 量\nA,0.1\n".encode("utf-8"), "data.csv")
+        loaded = load_dataset("F123", ref["content_hash"])
+
+        assert loaded is not None
+        content, column_mapping = loaded
+        assert content.decode("utf-8").splitlines()[0] == "研究_名,効果_量"
+        assert column_mapping == {"研究 名": "研究_名", "効果 量": "効果_量"}
+        assert load_dataset("F123", "other_hash") is None
+        assert load_dataset("F999") is None
+
+    def test_expired_dataset_is_not_returned(self, isolated_store):
+        """有効期限を過ぎたデータセットは返さないこと"""
+        store_dataset("F1", b"yi,vi\n0.1,0.01\n")
+        meta_path = isolated_store / "F1.json"
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        meta["stored_at"] = time.time() - (dataset_store.STATE_EXPIRY_HOURS * 3600 + 1)
+        meta_path.write_text(json.dumps(meta), encoding="utf-8")
+
+        assert load_dataset("F1") is None
+        assert not meta_path.exists()
+
+    def test_failed_rewrite_keeps_previous_metadata(self, isolated_store):
+        """メタ情報の書き込みに失敗しても以前の内容が読め、一時ファイルが残らないこと"""
+        first = store_dataset("F1", b"yi,vi\n0.1,0.01\n")
+        with patch.object(dataset_store.os, "replace", side_effect=OSError("disk full")):
+            store_dataset("F1", b"yi,vi\n0.2,0.02\n")
+
+        assert load_dataset("F1", first["content_hash"])[0] == b"yi,vi\n0.1,0.01\n"
+        assert not list(isolated_store.glob("*.tmp"))
+
+    def test_run_analysis_uses_stored_dataset_without_download(self, tmp_path):
+        """保存済みデータセットがあればSlackから再ダウンロードしないこと"""
+        from handlers import analysis_handler
+
+        ref = store_dataset("F42", b"yi,vi\n0.1,0.01\n0.2,0.02\n", "data.csv")
+        payload = {"job_id": "job42", "file_id": "F42", "content_hash": ref["content_hash"], "csv_analysis": {}}
+        captured = {}
+
+        class StopAfterExecutor(Exception):
+            pass
+
+        def fake_executor(r_output_dir, csv_file_path, job_id):
+            captured["csv"] = csv_file_path.read_text(encoding="utf-8")
+            raise StopAfterExecutor()
+
+        with patch("utils.file_utils.download_slack_file_content_async") as mock_download, \
+             patch.object(analysis_handler, "RAnalysisExecutor", side_effect=fake_executor):
+            asyncio.run(analysis_handler.run_analysis_async(
+                payload, {}, "C1", "1.0", "U1", MagicMock(), MagicMock(),
+                tmp_path / "r_out", original_file_url="https://files.slack.com/x", original_file_name="data.csv"
+            ))
+
+        mock_download.assert_not_called()
+        assert captured["csv"].startswith("yi,vi")
@@ -0,0 +1,76 @@
+"""
+Slackイベントの重複排除（event_id / client_msg_id のTTL付き記録とRedisでの共有）のテスト
+"""
+import time
+import pytest
+
+from utils.event_dedup import EventDeduplicator, event_keys, is_duplicate_event
+import utils.event_dedup as event_dedup
+
+
+def _body(event_id, client_msg_id=None, event_type="app_mention"):
+    event = {"type": event_type, "text": "<@U0BOT> hello", "channel": "C1", "ts": "1.0"}
+    if client_msg_id:
+        event["client_msg_id"] = client_msg_id
+    return {"type": "event_callback", "event_id": event_id, "team_id": "T1", "event": event}
+
+
+class TestEventDeduplicator:
+    """重複排除のテストクラス"""
+
+    def test_event_keys(self):
+        """event_id と client_msg_id（イベントの種類ごと）をキーにし、イベント以外は対象外とすること"""
+        assert event_keys(_body("Ev1", "m1")) == ["event:Ev1", "message:app_mention:m1"]
+        assert event_keys(_body("Ev1")) == ["event:Ev1"]
+        assert event_keys({"type": "block_actions", "actions": []}) == []
+
+    def test_retry_is_dropped_and_counted(self):
+        """同じ event_id の再送と、別の event_id で届いた同じメッセージを捨てて件数を記録すること"""
+        dedup = EventDeduplicator(ttl=60, max_keys=100)
+        assert not dedup.is_duplicate(event_keys(_body("Ev1", "m1")))
+        assert dedup.is_duplicate(event_keys(_body("Ev1", "m1")), retry_num=1)
+        assert dedup.is_duplicate(event_keys(_body("Ev2", "m1")))
+        assert not dedup.is_duplicate(event_keys(_body("Ev3", "m1", event_type="message")))
+        assert dedup.get_metrics() == {"processed": 2, "duplicates": 2, "retries": 1, "redis_errors": 0}
+
+    def test_ttl_and_max_keys(self):
+        """記録は保持期間を過ぎるか件数の上限を超えると削除されること"""
+        dedup = EventDeduplicator(ttl=0.1, max_keys=2)
+        assert not dedup.is_duplicate(["event:Ev1"])
+        time.sleep(0.15)
+        assert not dedup.is_duplicate(["event:Ev1"])
+        dedup.ttl = 60
+        for key in ("event:Ev2", "event:Ev3", "event:Ev4"):
+            dedup.is_duplicate([key])
+        assert list(dedup.seen) == ["event:Ev3", "event:Ev4"]
+
+    def test_redis_is_shared_between_processes(self):
+        """Redisを使う場合は別のプロセス（dyno）に届いた再送も捨てること"""
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeRedis(decode_responses=True)
+        first_dyno = EventDeduplicator(ttl=60, redis_client=client)
+        second_dyno = EventDeduplicator(ttl=60, redis_client=client)
+        assert not first_dyno.is_duplicate(["event:Ev1"])
+        assert second_dyno.is_duplicate(["event:Ev1"], retry_num=1)
+        assert client.ttl("slack_event:event:Ev1") > 0
+
+    def test_redis_errors_fall_back_to_memory(self):
+        """Redisに接続できない場合もプロセス内の記録で判定を続けること"""
+        class BrokenRedis:
+            def set(self, *args, **kwargs):
+                raise ConnectionError("redis down")
+
+        dedup = EventDeduplicator(ttl=60, redis_client=BrokenRedis())
+        assert not dedup.is_duplicate(["event:Ev1"])
+        assert dedup.is_duplicate(["event:Ev1"])
+        assert dedup.get_metrics()["redis_errors"] == 1
+
+    def test_is_duplicate_event_reads_bolt_headers(self, monkeypatch):
+        """Boltのリクエストヘッダー（値がリスト）から再送の回数を読み取ること"""
+        dedup = EventDeduplicator(ttl=60)
+        monkeypatch.setattr(event_dedup, "get_event_deduplicator", lambda: dedup)
+        assert not is_duplicate_event(_body("Ev1"), {})
+        assert is_duplicate_event(_body("Ev1"), {"x-slack-retry-num": ["1"], "x-slack-retry-reason": ["http_timeout"]})
+        assert dedup.get_metrics()["retries"] == 1
+        monkeypatch.setattr(event_dedup, "EVENT_DEDUP_ENABLED", False)
+        assert not is_duplicate_event(_body("Ev1"), {})
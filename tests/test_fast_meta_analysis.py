@@ -0,0 +1,152 @@
+"""
+NumPy高速パスのテスト
+metaforの公表値（dat.bcg）と examples/ のデータセットで数値を検証する。
+Rscriptがある環境では metafor の結果と直接比較する。
+"""
+import json
+import shutil
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+
+from core.fast_meta_analysis import escalc, rma, run_fast_meta_analysis
+
+EXAMPLES_DIR = Path(__file__).parent.parent / "examples"
+
+# metafor::dat.bcg (tpos, tneg, cpos, cneg)
+BCG = np.array([
+    (4, 119, 11, 128), (6, 300, 29, 274), (3, 228, 11, 209), (62, 13536, 248, 12619),
+    (33, 5036, 47, 5761), (180, 1361, 372, 1079), (8, 2537, 10, 619), (505, 87886, 499, 87892),
+    (29, 7470, 45, 7232), (17, 1699, 65, 1600), (186, 50448, 141, 27197), (5, 2493, 3, 2338),
+    (27, 16886, 29, 17825),
+], dtype=float)
+
+BINARY_COLUMNS = {"ai": "events_treatment", "n1i": "total_treatment",
+                  "ci": "events_control", "n2i": "total_control"}
+CONTINUOUS_COLUMNS = {"m1i": "mean_treatment", "sd1i": "sd_treatment", "n1i": "n_treatment",
+                      "m2i": "mean_control", "sd2i": "sd_control", "n2i": "n_control"}
+
+# (CSV, measure, data_columns) — 二値データはゼロセルを含む研究を除いたもの（ゼロセルはRでMH法になるため）
+EXAMPLE_CASES = [
+    ("binary_no_zero", "OR", BINARY_COLUMNS),
+    ("binary_no_zero", "RR", BINARY_COLUMNS),
+    ("binary_no_zero", "RD", BINARY_COLUMNS),
+    ("example_continuous_meta_dataset.csv", "SMD", CONTINUOUS_COLUMNS),
+    ("example_continuous_meta_dataset.csv", "MD", CONTINUOUS_COLUMNS),
+    ("example_meta_data.csv", "PRE", {"yi": "yi", "vi": "vi"}),
+]
+
+
+@pytest.fixture
+def example_csv(tmp_path):
+    def _get(name):
+        if name != "binary_no_zero":
+            return EXAMPLES_DIR / name
+        dat = pd.read_csv(EXAMPLES_DIR / "example_binary_meta_dataset.csv")
+        dat = dat[(dat[list(BINARY_COLUMNS.values())] > 0).all(axis=1)]
+        path = tmp_path / "binary_no_zero.csv"
+        dat.to_csv(path, index=False)
+        return path
+    return _get
+
+
+class TestFastMetaAnalysis:
+    """NumPy高速パスのテストクラス"""
+
+    @pytest.mark.parametrize("method,expected", [
+        # metafor: rma(yi, vi, data=escalc("RR", ai=tpos, bi=tneg, ci=cpos, di=cneg, data=dat.bcg), method=...)
+        ("REML", {"estimate": -0.7145, "se": 0.1798, "ci_lb": -1.0669, "ci_ub": -0.3622, "tau2": 0.3132, "I2": 92.22, "H2": 12.86}),
+        ("DL", {"estimate": -0.7141, "se": 0.1787, "ci_lb": -1.0644, "ci_ub": -0.3638, "tau2": 0.3088, "I2": 92.12, "H2": 12.69}),
+        ("FE", {"estimate": -0.4303, "se": 0.0405, "ci_lb": -0.5097, "ci_ub": -0.3509, "tau2": 0.0, "I2": 92.12, "H2": 12.69}),
+        ("PM", {"tau2": 0.3181}),
+    ])
+    def test_bcg_matches_metafor(self, method, expected):
+        """metaforのdat.bcgの公表値と一致すること"""
+        yi, vi = escalc("RR", ai=BCG[:, 0], bi=BCG[:, 1], ci=BCG[:, 2], di=BCG[:, 3])
+        result = rma(yi, vi, method=method)
+        assert result["k"] == 13
+        assert result["QE"] == pytest.approx(152.2330, abs=1e-4)
+        for key, value in expected.items():
+            assert result[key] == pytest.approx(value, abs=0.006 if key in ("I2", "H2") else 1e-4), key
+
+    def test_escalc_smd_is_hedges_g(self):
+        """SMDがHedgesのg（小標本補正あり）とmetaforのLS分散になること"""
+        yi, vi = escalc("SMD", m1i=[10.0], sd1i=[2.0], n1i=[20], m2i=[9.0], sd2i=[2.0], n2i=[20])
+        d = 0.5
+        j = 1 - 3 / (4 * 38 - 1)
+        assert yi[0] == pytest.approx(d * j, rel=1e-4)
+        assert vi[0] == pytest.approx(1 / 20 + 1 / 20 + yi[0] ** 2 / 80, rel=1e-12)
+
+    @pytest.mark.parametrize("csv_name,measure,columns", EXAMPLE_CASES)
+    def test_examples_estimators_are_consistent(self, example_csv, csv_name, measure, columns):
+        """examples/ の各データで推定式（REMLスコア=0、PMのQ=k-1）と信頼区間が整合すること"""
+        params = {"measure": measure, "data_columns": columns}
+        for method in ("FE", "DL", "REML", "PM"):
+            result = run_fast_meta_analysis(example_csv(csv_name), {**params, "model": method})
+            overall = result["overall_analysis"]
+            assert overall["ci_lb"] < overall["estimate"] < overall["ci_ub"]
+            assert 0 <= overall["I2"] < 100 and overall["tau2"] >= 0
+            assert 0 <= overall["QEp"] <= 1
+
+        yi, vi = _yi_vi(example_csv(csv_name), measure, columns)
+        reml = rma(yi, vi, "REML")["tau2"]
+        if reml > 0:
+            w = 1 / (vi + reml)
+            p_resid = w * (yi - np.sum(w * yi) / np.sum(w))
+            score = np.sum(p_resid ** 2) - (np.sum(w) - np.sum(w ** 2) / np.sum(w))
+            assert score == pytest.approx(0, abs=1e-6)
+        pm = rma(yi, vi, "PM")["tau2"]
+        if pm > 0:
+            w = 1 / (vi + pm)
+            assert np.sum(w * (yi - np.sum(w * yi) / np.sum(w)) ** 2) == pytest.approx(len(yi) - 1, abs=1e-6)
+
+    def test_unsupported_analyses_fall_back_to_r(self):
+        """ゼロセル・モデレーター・未対応の推定法では None を返すこと"""
+        zero_cells = {"measure": "OR", "model": "REML", "data_columns": {
+            "ai": "Intervention_Events", "n1i": "Intervention_Total",
+            "ci": "Control_Events", "n2i": "Control_Total"}}
+        assert run_fast_meta_analysis(EXAMPLES_DIR / "example_binary_with_zero_cells.csv", zero_cells) is None
+
+        pre = {"measure": "PRE", "model": "REML", "data_columns": {"yi": "yi", "vi": "vi"}}
+        csv_path = EXAMPLES_DIR / "example_meta_regression_data.csv"
+        assert run_fast_meta_analysis(csv_path, pre) is not None
+        assert run_fast_meta_analysis(csv_path, {**pre, "moderator_columns": ["year"]}) is None
+        assert run_fast_meta_analysis(csv_path, {**pre, "model": "SJ"}) is None
+
+    @pytest.mark.skipif(shutil.which("Rscript") is None, reason="Rscript not available")
+    @pytest.mark.parametrize("csv_name,measure,columns", EXAMPLE_CASES)
+    def test_examples_match_metafor(self, example_csv, tmp_path, csv_name, measure, columns):
+        """Rscriptがある環境では metafor の rma() と一致すること"""
+        csv_path = example_csv(csv_name)
+        if measure == "PRE":
+            escalc_code = ""
+        elif measure in ("SMD", "MD"):
+            escalc_code = "dat <- escalc(measure='{0}', m1i={m1i}, sd1i={sd1i}, n1i={n1i}, m2i={m2i}, sd2i={sd2i}, n2i={n2i}, data=dat)".format(measure, **columns)
+        else:
+            escalc_code = "dat <- escalc(measure='{0}', ai={ai}, n1i={n1i}, ci={ci}, n2i={n2i}, data=dat)".format(measure, **columns)
+        for method in ("FE", "DL", "REML", "PM"):
+            script = tmp_path / "check.R"
+            script.write_text(
+                "suppressMessages(library(metafor)); library(jsonlite)\n"
+                f"dat <- read.csv('{csv_path.as_posix()}')\n{escalc_code}\n"
+                f"res <- rma(yi, vi, data=dat, method='{method}')\n"
+                "cat(toJSON(list(estimate=as.numeric(res$b), se=res$se, tau2=res$tau2, I2=res$I2, QE=res$QE), digits=NA, auto_unbox=TRUE))\n",
+                encoding="utf-8")
+            completed = subprocess.run(["Rscript", str(script)], capture_output=True, text=True, check=True)
+            expected = json.loads(completed.stdout)
+            overall = run_fast_meta_analysis(csv_path, {"measure": measure, "model": method, "data_columns": columns})["overall_analysis"]
+            for key, value in expected.items():
+                assert overall[key] == pytest.approx(value, rel=1e-4, abs=1e-6), (method, key)
+
+
+def _yi_vi(csv_path, measure, columns):
+    dat = pd.read_csv(csv_path)
+    if measure == "PRE":
+        return dat[columns["yi"]].to_numpy(float), dat[columns["vi"]].to_numpy(float)
+    if measure in ("SMD", "MD"):
+        return escalc(measure, **{key: dat[col].to_numpy(float) for key, col in columns.items()})
+    ai, ci = dat[columns["ai"]].to_numpy(float), dat[columns["ci"]].to_numpy(float)
+    return escalc(measure, ai=ai, bi=dat[columns["n1i"]].to_numpy(float) - ai,
+                  ci=ci, di=dat[columns["n2i"]].to_numpy(float) - ci)
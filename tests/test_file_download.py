@@ -0,0 +1,100 @@
+"""
+Slackファイルのストリーミングダウンロードのテスト（ローカルのaiohttpテストサーバーを使用）
+"""
+import asyncio
+import hashlib
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import utils.file_utils as file_utils
+from utils.file_utils import (
+    download_slack_file_to_path_async, download_slack_file_content_async, get_http_session, close_http_session,
+    FileTooLargeError
+)
+
+BODY = b"study,yi,vi\n" + b"A,0.1,0.01\n" * 20000
+
+
+async def _serve(handler, scenario):
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        return await scenario(str(server.make_url("/file")))
+    finally:
+        await close_http_session()
+        await server.close()
+
+
+async def _ok_handler(request):
+    assert request.headers["Authorization"] == "Bearer xoxb-test"
+    return web.Response(body=BODY)
+
+
+class TestFileDownload:
+    """ストリーミングダウンロードのテストクラス"""
+
+    def test_download_streams_to_disk_with_hash(self, tmp_path):
+        """ファイルに書き込みながらサイズとSHA-256を返すこと"""
+        async def scenario(url):
+            return await download_slack_file_to_path_async(url, "xoxb-test", tmp_path / "upload")
+
+        result = asyncio.run(_serve(_ok_handler, scenario))
+        assert result["size"] == len(BODY)
+        assert result["sha256"] == hashlib.sha256(BODY).hexdigest()
+        assert (tmp_path / "upload").read_bytes() == BODY
+
+    def test_oversized_file_is_rejected(self, tmp_path):
+        """上限サイズを超えたら中断し、書きかけのファイルを削除すること"""
+        async def chunked_handler(request):
+            # Content-Length を付けずに送り、受信中のサイズ検査を確認する
+            response = web.StreamResponse()
+            await response.prepare(request)
+            for _ in range(10):
+                await response.write(b"x" * 1024)
+            return response
+
+        async def scenario(url):
+            return await download_slack_file_to_path_async(url, "xoxb-test", tmp_path / "upload", max_bytes=4096)
+
+        with pytest.raises(FileTooLargeError):
+            asyncio.run(_serve(chunked_handler, scenario))
+        assert not (tmp_path / "upload").exists()
+
+    def test_interrupted_download_resumes_with_range(self, tmp_path, monkeypatch):
+        """接続が途中で切れた場合はRangeヘッダーで続きから取得すること"""
+        monkeypatch.setattr(file_utils, "SLACK_DOWNLOAD_CHUNK_SIZE", 1024)
+        range_headers = []
+
+        async def flaky_handler(request):
+            range_header = request.headers.get("Range")
+            range_headers.append(range_header)
+            if range_header is None:
+                # 本文の途中で接続を切る
+                response = web.StreamResponse(headers={"Content-Length": str(len(BODY))})
+                await response.prepare(request)
+                await response.write(BODY[:50000])
+                request.transport.close()
+                return response
+            start = int(range_header.split("=")[1].rstrip("-"))
+            return web.Response(status=206, body=BODY[start:])
+
+        async def scenario(url):
+            return await download_slack_file_to_path_async(url, "xoxb-test", tmp_path / "upload")
+
+        result = asyncio.run(_serve(flaky_handler, scenario))
+        assert result["sha256"] == hashlib.sha256(BODY).hexdigest()
+        assert range_headers[0] is None and range_headers[1].startswith("bytes=")
+
+    def test_session_is_shared_within_loop(self):
+        """同じイベントループ内では同じセッションを再利用し、バイト列版も同じ内容を返すこと"""
+        async def scenario(url):
+            first = get_http_session()
+            content = await download_slack_file_content_async(url, "xoxb-test")
+            return first is get_http_session(), content
+
+        shared, content = asyncio.run(_serve(_ok_handler, scenario))
+        assert shared
+        assert content == BODY
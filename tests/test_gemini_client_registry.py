@@ -0,0 +1,105 @@
+"""
+Geminiモデルレジストリのテスト（Gemini APIには接続しない）
+"""
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+import core.gemini_client as gemini_client
+from core.gemini_client import GeminiClient, get_gemini_registry
+
+
+class FakeModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._async_client = None
+        self.fail = False
+
+    async def generate_content_async(self, prompt):
+        if self.fail:
+            raise RuntimeError("api error")
+        return SimpleNamespace(text="ok", usage_metadata=SimpleNamespace(prompt_token_count=10, candidates_token_count=4))
+
+
+@pytest.fixture
+def fake_genai(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    with patch.object(gemini_client, "_gemini_registry", None), \
+         patch.object(gemini_client.genai, "configure") as mock_configure, \
+         patch.object(gemini_client.genai, "GenerativeModel", side_effect=FakeModel), \
+         patch.object(gemini_client.genai_client._client_manager, "make_client", side_effect=lambda name: MagicMock()):
+        yield mock_configure
+
+
+class TestGeminiModelRegistry:
+    """Geminiモデルレジストリのテストクラス"""
+
+    def test_configure_once_and_reuse_model(self, fake_genai):
+        """複数のGeminiClientを作成しても設定は一度だけで、同じループではモデルを再利用すること"""
+        async def get_models():
+            return GeminiClient().model, GeminiClient().model
+
+        first, second = asyncio.run(get_models())
+        assert first is second
+        assert fake_genai.call_count == 1
+
+    def test_models_are_per_event_loop(self, fake_genai):
+        """イベントループごとに別のモデルと非同期クライアントを持つこと"""
+        async def get_model():
+            return GeminiClient().model
+
+        model_a = asyncio.run(get_model())
+        model_b = asyncio.run(get_model())
+        sync_model = GeminiClient().model
+        assert model_a is not model_b
+        assert model_a._async_client is not model_b._async_client
+        assert sync_model is not model_a and sync_model._async_client is None
+        assert GeminiClient().model is sync_model
+
+    def test_unsupported_sdk_version_uses_public_api(self, fake_genai):
+        """動作を確認していないSDKのバージョンでは非公開APIを使わず、SDKの既定のクライアントに任せること"""
+        async def get_model():
+            return GeminiClient().model
+
+        with patch.object(gemini_client.genai, "__version__", "0.9.0"), \
+             patch.object(gemini_client.genai_client._client_manager, "make_client") as mock_make_client:
+            model_a = asyncio.run(get_model())
+            model_b = asyncio.run(get_model())
+        mock_make_client.assert_not_called()
+        assert model_a is not model_b
+        assert model_a._async_client is None and model_b._async_client is None
+
+    def test_private_client_failure_falls_back(self, fake_genai):
+        """非公開APIでのクライアント作成に失敗してもモデルは作成できること"""
+        async def get_model():
+            return GeminiClient().model
+
+        with patch.object(gemini_client.genai_client._client_manager, "make_client", side_effect=AttributeError("gone")):
+            model = asyncio.run(get_model())
+        assert model._async_client is None
+
+    def test_metrics_record_latency_and_tokens(self, fake_genai):
+        """操作別に呼び出し数・エラー数・トークン数が集計されること"""
+        registry = get_gemini_registry()
+
+        async def run_calls():
+            await registry.generate_content_async("p", model_name="m", operation="analyze_csv")
+            await registry.generate_content_async("p", model_name="m", operation="analyze_csv")
+            registry.get_model("m").fail = True
+            with pytest.raises(RuntimeError):
+                await registry.generate_content_async("p", model_name="m", operation="analyze_csv")
+
+        asyncio.run(run_calls())
+        stats = registry.get_metrics()["analyze_csv"]
+        assert stats["calls"] == 3
+        assert stats["errors"] == 1
+        assert stats["prompt_tokens"] == 20
+        assert stats["output_tokens"] == 8
+        assert stats["avg_latency"] >= 0
+
+    def test_missing_api_key_raises(self, fake_genai, monkeypatch):
+        """APIキーが無い場合は従来通りValueErrorになること"""
+        monkeypatch.delenv("GEMINI_API_KEY")
+        with pytest.raises(ValueError):
+            GeminiClient()
@@ -0,0 +1,218 @@
+"""
+永続ジョブキュー（SQLite / Redis Streams のリース・再実行・冪等な投入とディスパッチャー）のテスト
+"""
+import time
+import asyncio
+import threading
+import pytest
+
+from core.async_loop import AsyncLoopService
+from core.job_scheduler import JobScheduler
+from core.job_queue import SQLiteJobQueue, RedisStreamJobQueue, JobQueueDispatcher, register_job_kind
+import core.job_queue as job_queue
+
+
+def _job(job_id, lane="analysis", **params):
+    return {"job_id": job_id, "kind": "test_kind", "lane": lane, "params": params,
+            "channel_id": "C1", "thread_ts": "1.0", "user_id": "U1", "team_id": "T1", "enqueued_at": time.time()}
+
+
+@pytest.fixture
+def sqlite_queue(tmp_path):
+    return SQLiteJobQueue(tmp_path / "jobs.sqlite3", visibility_timeout=0.2, max_attempts=2, done_ttl=60)
+
+
+@pytest.fixture
+def redis_queue():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis(decode_responses=True)
+    return RedisStreamJobQueue(client, prefix="test_jobs", visibility_timeout=0.2, max_attempts=2, done_ttl=60)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def queue(request):
+    return request.getfixturevalue(f"{request.param}_queue")
+
+
+@pytest.fixture
+def service():
+    svc = AsyncLoopService(max_jobs=4, thread_workers=4)
+    svc.start()
+    yield svc
+    svc.shutdown(timeout=5)
+
+
+class TestDurableJobQueue:
+    """永続ジョブキューのテストクラス（SQLite と Redis Streams で同じ振る舞いを確認）"""
+
+    def test_enqueue_is_idempotent(self, queue):
+        """同じジョブIDの投入は実行待ち・実行中の間は1件にまとめ、完了後は再び実行すること"""
+        assert queue.enqueue(_job("job1"))
+        assert not queue.enqueue(_job("job1"))
+        jobs = queue.claim("analysis", "worker-a", 10)
+        assert [job["job_id"] for job in jobs] == ["job1"]
+        assert not queue.enqueue(_job("job1"))
+        queue.ack(jobs[0])
+        assert queue.get("job1")["status"] == "done"
+        assert queue.claim("analysis", "worker-a", 10) == []
+
+        assert queue.enqueue(_job("job1"))
+        assert queue.get("job1")["status"] == "queued"
+        assert [(job["job_id"], job["attempts"]) for job in queue.claim("analysis", "worker-a", 10)] == [("job1", 1)]
+
+    def test_expired_lease_is_redelivered(self, queue):
+        """リースの切れたジョブは別のコンシューマーに再び取り出され、延長中のジョブは取り出されないこと"""
+        queue.enqueue(_job("crashed"))
+        queue.enqueue(_job("alive"))
+        first = {job["job_id"]: job for job in queue.claim("analysis", "worker-a", 10)}
+        assert set(first) == {"crashed", "alive"}
+        assert queue.claim("analysis", "worker-b", 10) == []
+
+        time.sleep(0.12)
+        assert queue.extend(first["alive"], "worker-a")
+        time.sleep(0.12)
+        redelivered = queue.claim("analysis", "worker-b", 10)
+        assert [job["job_id"] for job in redelivered] == ["crashed"]
+        assert redelivered[0]["attempts"] == 2
+        assert not queue.extend(first["crashed"], "worker-a")
+
+    def test_max_attempts_marks_job_dead(self, queue):
+        """実行回数の上限に達したジョブは dead として記録し、取り出さないこと"""
+        queue.enqueue(_job("poison"))
+        for _ in range(2):
+            assert len(queue.claim("analysis", "worker-a", 10)) == 1
+            time.sleep(0.25)
+        assert queue.claim("analysis", "worker-a", 10) == []
+        assert queue.get("poison")["status"] == "dead"
+
+    def test_release_does_not_count_as_attempt(self, queue):
+        """リースを手放したジョブはすぐに取り出せ、実行回数に数えないこと"""
+        queue.enqueue(_job("released"))
+        job = queue.claim("analysis", "worker-a", 10)[0]
+        queue.release(job)
+        again = queue.claim("analysis", "worker-b", 10)
+        assert [(j["job_id"], j["attempts"]) for j in again] == [("released", 1)]
+        assert queue.count("analysis") == 1
+        assert queue.claim("csv", "worker-b", 10) == []
+
+
+    def test_redis_enqueue_is_atomic(self, redis_queue, monkeypatch):
+        """XADDに失敗した場合はジョブの記録も残さず、同じジョブIDで再投入できること"""
+        import redis
+
+        def broken_xadd(self, *args, **kwargs):
+            raise redis.exceptions.ConnectionError("connection lost")
+
+        with monkeypatch.context() as m:
+            m.setattr(redis.client.Pipeline, "xadd", broken_xadd)
+            with pytest.raises(redis.exceptions.ConnectionError):
+                redis_queue.enqueue(_job("lost"))
+        assert redis_queue.get("lost") is None
+        assert redis_queue.enqueue(_job("lost"))
+        assert [job["job_id"] for job in redis_queue.claim("analysis", "worker-a", 10)] == ["lost"]
+
+
+class TestJobQueueDispatcher:
+    """ディスパッチャーのテストクラス"""
+
+    def test_dispatches_resumed_jobs_into_scheduler_lanes(self, sqlite_queue, service):
+        """再起動前に残ったジョブをレーンの空きの分だけ実行し、完了したらackすること"""
+        ran = []
+        release = threading.Event()
+
+        async def run(params, job_logger):
+            await asyncio.to_thread(release.wait, 5)
+            ran.append(params["name"])
+
+        register_job_kind("test_kind", "analysis", lambda params, client, job_logger: run(params, job_logger))
+        for i in range(4):
+            sqlite_queue.enqueue(_job(f"job{i}", name=f"job{i}"))
+        scheduler = JobScheduler(lanes={"analysis": {"concurrency": 1, "queue_size": 1}}, loop_service=service)
+        dispatcher = JobQueueDispatcher(sqlite_queue, scheduler=scheduler, lanes=("analysis",), consumer_id="worker-a")
+
+        assert dispatcher.poll_once() == 2  # 実行枠1 + 待ち行列1
+        assert dispatcher.poll_once() == 0
+        release.set()
+        deadline = time.time() + 5
+        while sqlite_queue.count("analysis") and time.time() < deadline:
+            dispatcher.poll_once()
+            time.sleep(0.05)
+        assert sorted(ran) == ["job0", "job1", "job2", "job3"]
+        assert all(sqlite_queue.get(f"job{i}")["status"] == "done" for i in range(4))
+
+    def test_failed_job_is_acked_and_reported(self, sqlite_queue, service):
+        """処理自体のエラーは再実行せずにスレッドへ通知すること"""
+        async def broken(params):
+            raise ValueError("bad csv")
+
+        class FakeClient:
+            def __init__(self):
+                self.messages = []
+
+            def chat_postMessage(self, **kwargs):
+                self.messages.append(kwargs)
+
+        register_job_kind("test_kind", "analysis", lambda params, client, job_logger: broken(params))
+        sqlite_queue.enqueue(_job("broken"))
+        client = FakeClient()
+        scheduler = JobScheduler(lanes={"analysis": {"concurrency": 1, "queue_size": 1}}, loop_service=service)
+        dispatcher = JobQueueDispatcher(sqlite_queue, client=client, scheduler=scheduler, lanes=("analysis",))
+        dispatcher.poll_once()
+        deadline = time.time() + 5
+        while sqlite_queue.get("broken")["status"] != "done" and time.time() < deadline:
+            time.sleep(0.05)
+        assert sqlite_queue.get("broken")["status"] == "done"
+        assert client.messages[0]["thread_ts"] == "1.0" and "bad csv" in client.messages[0]["text"]
+
+    def test_enqueue_job_rejects_duplicates(self, sqlite_queue, monkeypatch):
+        """enqueue_job は同じジョブIDの再投入を duplicate として扱うこと"""
+        async def noop(params):
+            return None
+
+        register_job_kind("test_kind", "analysis", lambda params, client, job_logger: noop(params))
+        monkeypatch.setattr(job_queue, "get_job_queue", lambda: sqlite_queue)
+        monkeypatch.setattr(job_queue, "check_admission",
+                            lambda *args, **kwargs: {"admitted": True, "keys": [], "cost": 0})
+        first = job_queue.enqueue_job("test_kind", {}, "same", client=None, channel_id="C1", user_id="U1")
+        second = job_queue.enqueue_job("test_kind", {}, "same", client=None, channel_id="C1", user_id="U1")
+        assert first["status"] == "enqueued" and second["status"] == "duplicate"
+        assert sqlite_queue.count("analysis") == 1
+
+    def test_enqueue_analysis_reports_duplicate_and_allows_rerun(self, sqlite_queue, monkeypatch):
+        """実行待ちの解析と同じ依頼は利用者に知らせ、完了後の同じ条件での再実行は受け付けること"""
+        from handlers.analysis_handler import enqueue_analysis
+
+        class FakeClient:
+            def __init__(self):
+                self.messages = []
+
+            def chat_postMessage(self, **kwargs):
+                self.messages.append(kwargs)
+
+        monkeypatch.setattr(job_queue, "get_job_queue", lambda: sqlite_queue)
+        monkeypatch.setattr(job_queue, "check_admission",
+                            lambda *args, **kwargs: {"admitted": True, "keys": [], "cost": 0})
+        client = FakeClient()
+        args = dict(payload={"job_id": "csv1"}, user_parameters={"measure": "OR"}, channel_id="C1",
+                    thread_ts="1.0", user_id="U1", client=client, original_file_url=None,
+                    original_file_name="data.csv")
+        assert enqueue_analysis(**args)["status"] == "enqueued"
+        assert enqueue_analysis(**args)["status"] == "duplicate"
+        assert "実行中" in client.messages[-1]["text"] and client.messages[-1]["thread_ts"] == "1.0"
+
+        sqlite_queue.ack(sqlite_queue.claim("analysis", "worker-a", 10)[0])
+        assert enqueue_analysis(**args)["status"] == "enqueued"
+        assert len(client.messages) == 1
+
+    def test_web_process_does_not_consume_unless_forced(self, sqlite_queue, monkeypatch):
+        """JOB_QUEUE_CONSUMER_ENABLED=false のWebプロセスでは取り出さず、ワーカーは常に取り出すこと"""
+        monkeypatch.setattr(job_queue, "get_job_queue", lambda: sqlite_queue)
+        monkeypatch.setattr(job_queue, "JOB_QUEUE_CONSUMER_ENABLED", False)
+        monkeypatch.setattr(job_queue, "_dispatcher", None)
+        assert job_queue.start_job_queue_dispatcher(client=None) is None
+        dispatcher = job_queue.start_job_queue_dispatcher(client=None, force=True)
+        try:
+            assert dispatcher is not None and dispatcher.thread.is_alive()
+        finally:
+            job_queue.stop_job_queue_dispatcher()
+        assert not dispatcher.thread.is_alive()
@@ -0,0 +1,214 @@
+"""
+レーン別ジョブスケジューラー（同時実行数・待ち行列の上限・優先度のエージング・テナント間の公平性・完了記録の削除）のテスト
+"""
+import time
+import asyncio
+import threading
+import pytest
+
+from core.async_loop import AsyncLoopService
+from core.admission_control import AdmissionController
+from core.job_scheduler import JobScheduler, JobQueueFullError, submit_job
+import core.job_scheduler as job_scheduler
+
+LANES = {"dialogue": {"concurrency": 2, "queue_size": 5}, "analysis": {"concurrency": 1, "queue_size": 2}}
+
+
+@pytest.fixture
+def service():
+    svc = AsyncLoopService(max_jobs=1, thread_workers=4)
+    svc.start()
+    yield svc
+    svc.shutdown(timeout=5)
+
+
+def _blocking_job(release: threading.Event, result="done"):
+    async def job():
+        await asyncio.to_thread(release.wait, 5)
+        return result
+    return job()
+
+
+def _recording_job(order: list, name: str):
+    async def job():
+        order.append(name)
+        return name
+    return job()
+
+
+class TestJobScheduler:
+    """レーン別ジョブスケジューラーのテストクラス"""
+
+    def test_dialogue_is_not_blocked_by_analysis(self, service):
+        """解析レーンが埋まっていても（ループ全体の上限を超えても）対話レーンのジョブはすぐに実行されること"""
+        scheduler = JobScheduler(lanes=LANES, loop_service=service)
+        release = threading.Event()
+        analysis = scheduler.submit(_blocking_job(release), "analysis", job_id="r_run")
+
+        async def dialogue_turn():
+            return "reply"
+
+        ticket = scheduler.submit(dialogue_turn(), "dialogue", job_id="turn")
+        assert ticket["status"] == "running"
+        assert ticket["future"].result(timeout=2) == "reply"
+        assert not analysis["future"].done()
+        release.set()
+        assert analysis["future"].result(timeout=5) == "done"
+
+    def test_queue_position_and_backpressure(self, service):
+        """枠が埋まると待ち順を返し、待ち行列が上限に達したら投入を拒否すること"""
+        scheduler = JobScheduler(lanes=LANES, loop_service=service)
+        release = threading.Event()
+        first = scheduler.submit(_blocking_job(release, "first"), "analysis")
+        second = scheduler.submit(_blocking_job(release, "second"), "analysis")
+        third = scheduler.submit(_blocking_job(release, "third"), "analysis")
+        assert [first["status"], second["status"], third["status"]] == ["running", "queued", "queued"]
+        assert [second["position"], third["position"]] == [1, 2]
+        assert scheduler.get_job_status(third["job_id"])["position"] == 2
+
+        rejected = _blocking_job(release)
+        with pytest.raises(JobQueueFullError):
+            scheduler.submit(rejected, "analysis")
+        assert rejected.cr_frame is None  # 受け付けなかったコルーチンは閉じる
+
+        release.set()
+        assert [t["future"].result(timeout=5) for t in (first, second, third)] == ["first", "second", "third"]
+        assert scheduler.get_stats()["lanes"]["analysis"]["running"] == 0
+
+    def test_priority_and_aging(self, service):
+        """高優先度のジョブが先に実行され、長く待ったジョブはエージングで追い越されないこと"""
+        order = []
+        release = threading.Event()
+        scheduler = JobScheduler(lanes=LANES, aging_seconds=0.05, loop_service=service)
+        blocker = scheduler.submit(_blocking_job(release), "analysis")
+        old = scheduler.submit(_recording_job(order, "old_low"), "analysis", priority=0)
+        time.sleep(0.3)
+        new = scheduler.submit(_recording_job(order, "new_high"), "analysis", priority=2)
+        assert new["position"] == 2
+        release.set()
+        for ticket in (blocker, old, new):
+            ticket["future"].result(timeout=5)
+        assert order == ["old_low", "new_high"]
+
+        order.clear()
+        release.clear()
+        scheduler = JobScheduler(lanes=LANES, aging_seconds=0, loop_service=service)
+        blocker = scheduler.submit(_blocking_job(release), "analysis")
+        low = scheduler.submit(_recording_job(order, "low"), "analysis", priority=0)
+        high = scheduler.submit(_recording_job(order, "high"), "analysis", priority=2)
+        release.set()
+        for ticket in (blocker, low, high):
+            ticket["future"].result(timeout=5)
+        assert order == ["high", "low"]
+
+    def test_tenants_take_turns(self, service):
+        """大量に投入したユーザーがいても、後から来たユーザーのジョブが次の順番で実行されること"""
+        order = []
+        release = threading.Event()
+        scheduler = JobScheduler(lanes=LANES, tenant_queue_size=3, loop_service=service)
+        scheduler.lanes["analysis"] = {"concurrency": 1, "queue_size": 10}
+        blocker = scheduler.submit(_blocking_job(release), "analysis", tenant="user:heavy")
+        heavy = [scheduler.submit(_recording_job(order, f"heavy{i}"), "analysis", tenant="user:heavy")
+                 for i in range(3)]
+        light = scheduler.submit(_recording_job(order, "light"), "analysis", tenant="user:light")
+        assert [ticket["position"] for ticket in heavy] == [1, 2, 3]
+        assert light["position"] == 2
+        with pytest.raises(JobQueueFullError) as excinfo:
+            scheduler.submit(_recording_job(order, "heavy3"), "analysis", tenant="user:heavy")
+        assert excinfo.value.tenant == "user:heavy"
+
+        release.set()
+        for ticket in [blocker, light] + heavy:
+            ticket["future"].result(timeout=5)
+        assert order == ["heavy0", "light", "heavy1", "heavy2"]
+        metrics = scheduler.get_metrics()["analysis"]
+        assert metrics["queued"] == 4 and metrics["rejected_tenant_full"] == 1
+        assert metrics["dispatched_from_queue"] == 4 and metrics["max_queue_wait"] >= metrics["avg_queue_wait"] > 0
+
+    def test_weighted_round_robin(self, service):
+        """重みの大きいテナントは1回の順番で重みの件数だけ実行されること"""
+        order = []
+        release = threading.Event()
+        scheduler = JobScheduler(lanes=LANES, tenant_queue_size=0, loop_service=service)
+        scheduler.lanes["analysis"] = {"concurrency": 1, "queue_size": 10}
+        blocker = scheduler.submit(_blocking_job(release), "analysis")
+        tickets = [scheduler.submit(_recording_job(order, f"vip{i}"), "analysis", tenant="user:vip", weight=2)
+                   for i in range(3)]
+        tickets += [scheduler.submit(_recording_job(order, f"user{i}"), "analysis", tenant="user:u1")
+                    for i in range(2)]
+        release.set()
+        for ticket in [blocker] + tickets:
+            ticket["future"].result(timeout=5)
+        assert order == ["vip0", "vip1", "user0", "vip2", "user1"]
+
+    def test_finished_records_are_evicted(self, service):
+        """完了したジョブの記録が件数の上限と保持期間で削除されること"""
+        scheduler = JobScheduler(lanes=LANES, max_records=3, record_ttl=0.2, loop_service=service)
+        tickets = [scheduler.submit(_recording_job([], f"job{i}"), "dialogue", job_id=f"job{i}") for i in range(5)]
+        for ticket in tickets:
+            ticket["future"].result(timeout=5)
+        scheduler.submit(_recording_job([], "job5"), "dialogue", job_id="job5")["future"].result(timeout=5)
+        assert list(scheduler.records) == ["job3", "job4", "job5"]
+        assert scheduler.get_job_status("job0") is None
+        assert scheduler.get_job_status("job5")["status"] == "completed"
+
+        time.sleep(0.3)
+        scheduler.submit(_recording_job([], "job6"), "dialogue", job_id="job6")["future"].result(timeout=5)
+        assert list(scheduler.records) == ["job6"]
+
+    def test_cancel_queued_job(self, service):
+        """待機中のジョブを取り消すと実行されずに次のジョブへ進むこと"""
+        order = []
+        release = threading.Event()
+        scheduler = JobScheduler(lanes=LANES, loop_service=service)
+        blocker = scheduler.submit(_blocking_job(release), "analysis")
+        cancelled = scheduler.submit(_recording_job(order, "cancelled"), "analysis", job_id="to_cancel")
+        kept = scheduler.submit(_recording_job(order, "kept"), "analysis")
+        assert scheduler.cancel_job("to_cancel")
+        release.set()
+        blocker["future"].result(timeout=5)
+        kept["future"].result(timeout=5)
+        assert cancelled["future"].cancelled()
+        assert order == ["kept"]
+        assert scheduler.get_job_status("to_cancel")["status"] == "cancelled"
+
+    def test_submit_job_notifies_queue_status(self, service, monkeypatch):
+        """待ちが発生したら待ち順を、受け付けられなかったらその旨を通知すること"""
+        scheduler = JobScheduler(lanes={"analysis": {"concurrency": 1, "queue_size": 1}}, loop_service=service)
+        monkeypatch.setattr(job_scheduler, "_job_scheduler", scheduler)
+        monkeypatch.setattr(job_scheduler, "get_job_scheduler", lambda: scheduler)
+        messages = []
+        release = threading.Event()
+
+        running = submit_job(_blocking_job(release), "analysis", notify=messages.append)
+        queued = submit_job(_blocking_job(release), "analysis", notify=messages.append)
+        rejected = submit_job(_blocking_job(release), "analysis", notify=messages.append)
+        release.set()
+
+        assert running["status"] == "running" and queued["status"] == "queued" and rejected is None
+        assert len(messages) == 2
+        assert "1番目" in messages[0]
+        assert "受け付けできませんでした" in messages[1]
+        queued["future"].result(timeout=5)
+
+    def test_submit_job_applies_admission_control(self, service, monkeypatch):
+        """受付制御の上限を超えた投入は実行せずに再試行までの目安を通知すること"""
+        scheduler = JobScheduler(lanes=LANES, loop_service=service)
+        controller = AdmissionController(quota_overrides={}, default_quotas={
+            "user": {"rate_per_minute": 1, "burst": 1},
+            "channel": {"rate_per_minute": 60, "burst": 10},
+            "workspace": {"rate_per_minute": 60, "burst": 10},
+        })
+        monkeypatch.setattr(job_scheduler, "get_job_scheduler", lambda: scheduler)
+        monkeypatch.setattr(job_scheduler, "get_admission_controller", lambda: controller)
+        messages = []
+
+        first = submit_job(_recording_job([], "first"), "analysis", notify=messages.append, user_id="U1", channel_id="C1")
+        second = submit_job(_recording_job([], "second"), "analysis", notify=messages.append, user_id="U1",
+                            channel_id="C1")
+        assert first["future"].result(timeout=5) == "first"
+        assert scheduler.records[first["job_id"]]["tenant"] == "user:U1"
+        assert second is None
+        assert len(messages) == 1 and "ユーザーごとの上限" in messages[0] and "秒後" in messages[0]
+        # 対話レーンは受付制御の対象外
+        assert submit_job(_recording_job([], "turn"), "dialogue", user_id="U1")["future"].result(timeout=5) == "turn"
@@ -4,9 +4,9 @@ CLAUDE.md仕様: Gemini AIによる対話的パラメータ収集をテストす
 """
 import pytest
 from unittest.mock import Mock, AsyncMock, patch
-from utils.gemini_dialogue import process_user_input_with_gemini
+from utils.gemini_dialogue import process_user_input_with_gemini, format_conversation_history
 from utils.parameter_extraction import extract_parameters_from_text
-from utils.conversation_state import DialogState
+from utils.conversation_state import DialogState, ConversationState
 
 
 class TestNaturalLanguageParameterCollection:
@@ -42,6 +42,21 @@ class TestNaturalLanguageParameterCollection:
             assert "bot_message" in result
             assert "モデル" in result["bot_message"]
     
+    def test_compacted_history_summary_is_in_prompt(self):
+        """履歴を畳み込んだ後も、古い会話の要約がGeminiへの会話履歴に含まれること"""
+        state = ConversationState("T1", "C1")
+        state.conversation_history = [
+            {"role": "user", "content": "サブグループはRegionでお願いします"},
+            {"role": "assistant", "content": "承知しました"},
+            {"role": "user", "content": "ランダム効果で"},
+        ]
+        state.compact_history(keep_turns=1)
+
+        formatted = format_conversation_history(state.conversation_history, state.history_summary)
+        assert "サブグループはRegionでお願いします" in formatted
+        assert formatted.endswith("ユーザー: ランダム効果で")
+        assert format_conversation_history([]) == "（会話履歴なし）"
+
     @pytest.mark.asyncio
     async def test_context_aware_conversation(self):
         """会話文脈を理解して適切な質問を生成すること"""
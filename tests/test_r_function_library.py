@@ -0,0 +1,100 @@
+"""
+共通R関数ライブラリ（生成スクリプトからの呼び出し・常駐Rワーカーでの事前読み込み）のテスト
+"""
+import re
+import shutil
+import hashlib
+import subprocess
+import pytest
+
+import core.r_worker_pool as r_worker_pool
+import templates.r_templates as r_templates
+from templates.r_templates import (
+    RTemplateGenerator, R_FUNCTION_LIBRARY_PATH, R_FUNCTION_LIBRARY_VERSION, r_function_library_loader
+)
+
+OUTPUT_PATHS = {"forest_plot_path": "/tmp/f.png", "funnel_plot_path": "/tmp/u.png", "rdata_path": "/tmp/r.RData",
+                "json_summary_path": "/tmp/s.json", "forest_plot_subgroup_prefix": "/tmp/sg"}
+BINARY_SUBGROUP_PARAMS = {"measure": "OR", "model": "REML",
+                          "data_columns": {"ai": "ai", "bi": "bi", "ci": "ci", "di": "di", "study_label": "study"},
+                          "subgroup_columns": ["region"]}
+DATA_SUMMARY = {"columns": ["study", "ai", "bi", "ci", "di", "region"]}
+
+
+def _library_functions():
+    source = R_FUNCTION_LIBRARY_PATH.read_text(encoding="utf-8")
+    return set(re.findall(r"^(metabot_\w+) <- function", source, flags=re.MULTILINE))
+
+
+class TestRFunctionLibrary:
+    """共通R関数ライブラリのテストクラス"""
+
+    def test_version_is_content_hash(self):
+        """ライブラリのバージョンがファイル内容のハッシュで、読み込みコードに含まれること"""
+        assert R_FUNCTION_LIBRARY_VERSION == hashlib.sha256(R_FUNCTION_LIBRARY_PATH.read_bytes()).hexdigest()[:12]
+        loader = r_function_library_loader()
+        assert f'"{R_FUNCTION_LIBRARY_VERSION}"' in loader
+        assert R_FUNCTION_LIBRARY_PATH.as_posix() in loader
+
+    def test_script_calls_library_instead_of_inlining(self):
+        """生成スクリプトはライブラリを読み込んで関数を呼び出し、共通処理をインラインで含まないこと"""
+        script = RTemplateGenerator().generate_full_r_script(
+            BINARY_SUBGROUP_PARAMS, DATA_SUMMARY, OUTPUT_PATHS, "/tmp/d.csv")
+
+        assert script.index(r_function_library_loader()) < script.index("dat <- read.csv(")
+        assert 'zero_cells_summary <- metabot_zero_cell_summary(dat, "ai", "bi", "ci", "di")' in script
+        assert "metabot_subgroup_row_layout(dat_ordered_filtered" in script
+        assert "make.names(original_colnames" not in script
+        assert "studies_per_sg_filtered" not in script
+
+    def test_all_called_functions_are_defined(self):
+        """生成スクリプトから呼び出す metabot_ 関数がすべてライブラリに定義されていること"""
+        script = RTemplateGenerator().generate_full_r_script(
+            BINARY_SUBGROUP_PARAMS, DATA_SUMMARY, OUTPUT_PATHS, "/tmp/d.csv")
+        called = set(re.findall(r"\b(metabot_\w+)\(", script))
+        assert called
+        assert called <= _library_functions()
+
+    def test_worker_bootstrap_preloads_library(self, tmp_path, monkeypatch):
+        """常駐Rワーカーの起動スクリプトがジョブ環境のリセット基準より前にライブラリを読み込むこと"""
+        monkeypatch.setattr(r_worker_pool.tempfile, "gettempdir", lambda: str(tmp_path))
+        bootstrap = r_worker_pool._bootstrap_script_path().read_text(encoding="utf-8")
+        assert "__FUNCTION_LIBRARY__" not in bootstrap
+        assert bootstrap.index(r_function_library_loader()) < bootstrap.index(".worker_baseline <-")
+
+    def test_plots_are_independent_tasks(self, monkeypatch):
+        """各プロットをラベル付きの独立したタスクとして定義し、まとめて並列実行すること"""
+        monkeypatch.setattr(r_templates, "R_PLOT_WORKERS", 3)
+        analysis_params = {**BINARY_SUBGROUP_PARAMS, "moderator_columns": ["year"]}
+        output_paths = {**OUTPUT_PATHS, "bubble_plot_path_prefix": "/tmp/b"}
+        plot_code = RTemplateGenerator()._generate_plot_code(
+            analysis_params, output_paths, {"columns": DATA_SUMMARY["columns"] + ["year"]})
+
+        labels = re.findall(r'^plot_tasks\[\["(\w+)"\]\] <- function\(\) \{$', plot_code, flags=re.MULTILINE)
+        assert labels == ["forest_plot_overall", "forest_plot_subgroup_region", "funnel_plot", "bubble_plot_year"]
+        assert plot_code.rstrip().endswith("metabot_run_plot_tasks(plot_tasks, workers = 3)")
+
+    @pytest.mark.skipif(shutil.which("Rscript") is None, reason="Rscript is not installed")
+    def test_plot_tasks_run_in_parallel_in_r(self, tmp_path):
+        """並列実行でも各タスクの出力をタスクの順に表示し、失敗したタスクが他を止めないこと"""
+        script = tmp_path / "tasks.R"
+        script.write_text(
+            f"source('{R_FUNCTION_LIBRARY_PATH.as_posix()}', encoding = 'UTF-8')\n"
+            "plot_tasks <- list(a = function() cat('task a\\n'), b = function() stop('boom'),\n"
+            "                   c = function() cat('task c\\n'))\n"
+            "metabot_run_plot_tasks(plot_tasks, workers = 2)\n"
+            "cat('after tasks\\n')\n",
+            encoding="utf-8")
+        result = subprocess.run(["Rscript", str(script)], capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.index("task a") < result.stdout.index("task c") < result.stdout.index("after tasks")
+        assert "Error in plot task b: boom" in result.stderr
+
+    @pytest.mark.skipif(shutil.which("Rscript") is None, reason="Rscript is not installed")
+    def test_library_sources_in_r(self):
+        """Rでライブラリを読み込むと全関数がバイトコンパイルされた状態で定義されること"""
+        expr = (f"source('{R_FUNCTION_LIBRARY_PATH.as_posix()}', encoding = 'UTF-8'); "
+                "cat(sort(ls(pattern = '^metabot_')), sep = '\\n')")
+        result = subprocess.run(["Rscript", "-e", expr], capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        assert set(result.stdout.split()) == _library_functions()
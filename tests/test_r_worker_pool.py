@@ -0,0 +1,155 @@
+"""
+常駐Rワーカープールのテスト
+Rが無い環境でも動くよう、同じ行プロトコルを話すPythonスクリプトをRscriptの代わりに使う
+"""
+import sys
+import stat
+import subprocess
+import textwrap
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+from core.r_worker_pool import RWorkerPool, RWorkerUnavailableError
+
+
+FAKE_WORKER = textwrap.dedent(f"""\
+    #!{sys.executable}
+    import os, sys, time
+    print("__R_WORKER_READY__", flush=True)
+    for line in sys.stdin:
+        line = line.rstrip("\\n")
+        if line == "__QUIT__":
+            break
+        if line == "__PING__":
+            print("__PONG__", flush=True)
+            continue
+        _, script, out_path, err_path = line.split("\\t")
+        body = open(script, encoding="utf-8").read()
+        if "SLEEP" in body:
+            time.sleep(5)
+        if "NAP" in body:
+            time.sleep(1)
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(f"pid={{os.getpid()}}\\n")
+        with open(err_path, "w", encoding="utf-8") as f:
+            f.write("Error: failed\\n" if "FAIL" in body else "")
+        print("__R_WORKER_DONE__\\t" + ("1" if "FAIL" in body else "0"), flush=True)
+""")
+
+
+@pytest.fixture
+def fake_rscript(tmp_path):
+    path = tmp_path / "fake_rscript"
+    path.write_text(FAKE_WORKER, encoding="utf-8")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def _write_script(tmp_path, name, body="cat('ok')"):
+    script = tmp_path / name
+    script.write_text(body, encoding="utf-8")
+    return script
+
+
+class TestRWorkerPool:
+    """常駐Rワーカープールのテストクラス"""
+
+    def test_run_script_returns_completed_process(self, fake_rscript, tmp_path):
+        """ワーカーでスクリプトを実行し、stdout/stderr/returncodeが返ること"""
+        pool = RWorkerPool(size=1, r_executable=fake_rscript)
+        assert pool.start()
+        try:
+            result = pool.run_script(_write_script(tmp_path, "ok.R"), timeout=10)
+            assert result.returncode == 0
+            assert result.stdout.startswith("pid=")
+
+            failed = pool.run_script(_write_script(tmp_path, "fail.R", "FAIL"), timeout=10)
+            assert failed.returncode == 1
+            assert "Error" in failed.stderr
+        finally:
+            pool.shutdown()
+
+    def test_worker_reused_and_recycled_after_max_jobs(self, fake_rscript, tmp_path):
+        """同じワーカーが再利用され、最大ジョブ数到達で作り直されること"""
+        pool = RWorkerPool(size=1, r_executable=fake_rscript, max_jobs_per_worker=2)
+        assert pool.start()
+        try:
+            pids = [pool.run_script(_write_script(tmp_path, f"s{i}.R"), timeout=10).stdout for i in range(3)]
+            assert pids[0] == pids[1]
+            assert pids[2] != pids[1]
+        finally:
+            pool.shutdown()
+
+    def test_timeout_replaces_worker(self, fake_rscript, tmp_path):
+        """タイムアウト時にTimeoutExpiredが送出され、プールは利用可能なまま"""
+        pool = RWorkerPool(size=1, r_executable=fake_rscript)
+        assert pool.start()
+        try:
+            with pytest.raises(subprocess.TimeoutExpired):
+                pool.run_script(_write_script(tmp_path, "slow.R", "SLEEP"), timeout=0.5)
+            assert pool.available
+            assert pool.run_script(_write_script(tmp_path, "after.R"), timeout=10).returncode == 0
+        finally:
+            pool.shutdown()
+
+    def test_failed_restart_under_load_keeps_pool_available(self, fake_rscript, tmp_path):
+        """他のワーカーが実行中に1つの再起動が失敗しても、プールは使い続けられ、後で補充されること"""
+        pool = RWorkerPool(size=2, r_executable=fake_rscript)
+        assert pool.start()
+        try:
+            pool.r_executable = str(tmp_path / "no_such_rscript")
+            busy = threading.Thread(target=pool.run_script, args=(_write_script(tmp_path, "nap.R", "NAP"), 10))
+            busy.start()
+            time.sleep(0.2)
+            with pytest.raises(subprocess.TimeoutExpired):
+                pool.run_script(_write_script(tmp_path, "slow.R", "SLEEP"), timeout=0.3)
+            assert pool.available  # 実行中のワーカーが残っている
+            busy.join()
+            assert pool.run_script(_write_script(tmp_path, "after.R"), timeout=10).returncode == 0
+            assert pool._live == 1
+
+            pool.r_executable = fake_rscript
+            with patch("core.r_worker_pool.R_WORKER_RESPAWN_INTERVAL", 0):
+                pool.run_script(_write_script(tmp_path, "respawn.R"), timeout=10)
+            assert pool._live == 2 and pool._idle.qsize() == 2
+        finally:
+            pool.shutdown()
+
+    def test_missing_executable_makes_pool_unavailable(self, tmp_path):
+        """Rが起動できない場合はプールが利用不可となること"""
+        pool = RWorkerPool(size=1, r_executable=str(tmp_path / "no_such_rscript"))
+        assert pool.start() is False
+        with pytest.raises(RWorkerUnavailableError):
+            pool.run_script(_write_script(tmp_path, "x.R"))
+
+    def test_unavailable_pool_recovers_when_spawn_succeeds(self, fake_rscript, tmp_path, monkeypatch):
+        """起動に失敗して利用不可となったプールも、後で起動できるようになれば補充して再び使われること"""
+        import core.r_worker_pool as r_worker_pool
+
+        pool = RWorkerPool(size=1, r_executable=str(tmp_path / "no_such_rscript"))
+        monkeypatch.setattr(r_worker_pool, "R_WORKER_POOL_SIZE", 1)
+        monkeypatch.setattr(r_worker_pool, "_r_worker_pool", pool)
+        try:
+            assert pool.start() is False
+            assert r_worker_pool.get_r_worker_pool() is None  # 補充の間隔が過ぎるまでは試みない
+
+            pool.r_executable = fake_rscript
+            with patch("core.r_worker_pool.R_WORKER_RESPAWN_INTERVAL", 0):
+                assert r_worker_pool.get_r_worker_pool() is pool
+            assert pool.available and pool._live == 1
+            assert pool.run_script(_write_script(tmp_path, "recovered.R"), timeout=10).returncode == 0
+        finally:
+            pool.shutdown()
+
+    def test_executor_falls_back_to_rscript_without_pool(self, tmp_path):
+        """プールが無い場合、RAnalysisExecutorは単発のRscriptで実行すること"""
+        from core.r_executor import RAnalysisExecutor
+
+        executor = RAnalysisExecutor(r_output_dir=tmp_path, csv_file_path=tmp_path / "d.csv", job_id="job1")
+        completed = subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr="")
+        with patch("core.r_executor.get_r_worker_pool", return_value=None), \
+             patch("core.r_executor.subprocess.run", return_value=completed) as mock_run:
+            assert executor._run_r_script("Rscript") is completed
+            assert mock_run.call_args[0][0] == ["Rscript", str(executor.r_script_path)]
@@ -0,0 +1,56 @@
+"""
+RDS形式でのデータ受け渡し（PythonからRへの型付きデータセット）のテスト
+"""
+import struct
+import pytest
+import numpy as np
+import pandas as pd
+
+from utils.csv_ingest import ingest_csv
+from utils.rds_writer import serialize_data_frame, write_dataset_rds
+from templates.r_templates import RTemplateGenerator
+
+
+class TestRdsWriter:
+    """RDS書き出しのテストクラス"""
+
+    def test_header_and_na_encoding(self):
+        """XDRバージョン2のヘッダーで書き出し、欠損値をRのNAのビットパターンにすること"""
+        data = serialize_data_frame(pd.DataFrame({"yi": [0.1, np.nan], "study": ["A", None]}))
+        assert data.startswith(b"X\n" + struct.pack(">i", 2))
+        assert struct.pack(">II", 0x7FF00000, 1954) in data
+        # NA_character_ は長さ -1 の CHARSXP
+        assert struct.pack(">ii", 9, -1) in data
+
+    def test_round_trip_with_rdata_parser(self, tmp_path):
+        """正規化済みCSVから書き出したRDSが型付きのdata.frameとして読めること"""
+        rdata = pytest.importorskip("rdata")
+        result = ingest_csv('study,n,yi\nA,"1,200",0.1\n日本,350,NA\n'.encode("utf-8"))
+        csv_path = tmp_path / "data.csv"
+        csv_path.write_bytes(result["csv_bytes"])
+
+        rds_path = write_dataset_rds(csv_path, result["schema"])
+        dat = rdata.read_rds(rds_path)
+
+        assert list(dat.columns) == ["study", "n", "yi"]
+        assert dat["study"].tolist() == ["A", "日本"]
+        assert dat["n"].tolist() == [1200.0, 350.0]
+        assert dat["yi"].iloc[0] == 0.1 and np.isnan(dat["yi"].iloc[1])
+
+    def test_r_script_reads_rds_without_numeric_conversion(self):
+        """RDSがある場合は readRDS で読み込み、型付きの数値列の変換を省くこと"""
+        result = ingest_csv(b"study,ai,ci,n1i,n2i\nA,1,2,10,10\nB,3,4,20,20\n")
+        generator = RTemplateGenerator()
+        analysis_params = {"measure": "OR", "model": "REML",
+                           "data_columns": {"ai": "ai", "ci": "ci", "n1i": "n1i", "n2i": "n2i",
+                                            "study_label": "study"}}
+        output_paths = {"forest_plot_path": "/tmp/f.png", "funnel_plot_path": "/tmp/u.png",
+                        "rdata_path": "/tmp/r.RData", "json_summary_path": "/tmp/s.json"}
+        data_summary = {"columns": ["study", "ai", "ci", "n1i", "n2i"], "schema": result["schema"],
+                        "rds_path": "C:\\work\\data.rds"}
+
+        script = generator.generate_full_r_script(analysis_params, data_summary, output_paths, "/tmp/d.csv")
+
+        assert "dat <- readRDS('C:/work/data.rds')" in script
+        assert "read.csv" not in script
+        assert "dat$ai <- as.numeric(as.character(dat$ai))" not in script
@@ -0,0 +1,97 @@
+"""
+Redisバックエンドのパイプライン化した状態操作と楽観的ロックのテスト（fakeredisを使用）
+"""
+import threading
+import pytest
+from unittest.mock import patch
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import utils.conversation_state as conversation_state
+from utils.conversation_state import (
+    ConversationState, StateCache, save_state, get_state, get_states, update_state, delete_state,
+    cleanup_expired_states, REDIS_STATE_INDEX_KEY
+)
+
+
+@pytest.fixture
+def redis_client():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    with patch.object(conversation_state, "_storage_backend", client), \
+         patch.object(conversation_state, "_state_cache", StateCache(max_size=16)):
+        yield client
+
+
+class TestRedisStateOps:
+    """Redis状態操作のテストクラス"""
+
+    def test_save_writes_state_version_and_index_in_one_round_trip(self, redis_client):
+        """保存時に状態・バージョン・有効期限インデックスを1回のパイプラインで書き込むこと"""
+        state = ConversationState("T1", "C1")
+        state.csv_analysis = {"is_suitable": True}
+        with patch.object(redis_client, "pipeline", wraps=redis_client.pipeline) as mock_pipeline:
+            save_state(state)
+        assert mock_pipeline.call_count == 1
+        assert redis_client.ttl("conversation_state:C1:T1") > 0
+        assert redis_client.zscore(REDIS_STATE_INDEX_KEY, "C1:T1") is not None
+
+        delete_state("T1", "C1")
+        assert redis_client.zscore(REDIS_STATE_INDEX_KEY, "C1:T1") is None
+
+    def test_get_states_uses_batched_reads(self, redis_client):
+        """複数の状態を状態本体とCSV分析結果それぞれ1回のMGETで読み込むこと"""
+        for thread_ts in ("T1", "T2", "T3"):
+            state = ConversationState(thread_ts, "C1")
+            state.csv_analysis = {"is_suitable": True, "thread": thread_ts}
+            save_state(state)
+
+        with patch.object(conversation_state, "_state_cache", StateCache(max_size=0)), \
+             patch.object(redis_client, "mget", wraps=redis_client.mget) as mock_mget, \
+             patch.object(redis_client, "get", wraps=redis_client.get) as mock_get:
+            states = get_states([("T1", "C1"), ("T2", "C1"), ("T3", "C1"), ("missing", "C1")])
+
+        assert sorted(states) == ["C1:T1", "C1:T2", "C1:T3"]
+        assert states["C1:T2"].csv_analysis == {"is_suitable": True, "thread": "T2"}
+        assert mock_mget.call_count == 2
+        mock_get.assert_not_called()
+
+    def test_concurrent_updates_are_not_lost(self, redis_client):
+        """複数スレッドから同時にパラメータを更新しても互いの更新を上書きしないこと"""
+        save_state(ConversationState("T1", "C1"))
+
+        def worker(i):
+            update_state("T1", "C1", lambda state: state.update_params({f"param_{i}": i}), retries=50)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with patch.object(conversation_state, "_state_cache", StateCache(max_size=0)):
+            params = get_state("T1", "C1").collected_params
+        assert params == {f"param_{i}": i for i in range(8)}
+
+    def test_update_retries_after_conflicting_write(self, redis_client):
+        """WATCH中に他のワーカーが書き込んだ場合は最新の状態を読み直して再適用すること"""
+        save_state(ConversationState("T1", "C1"))
+        calls = []
+
+        def mutator(state):
+            calls.append(dict(state.collected_params))
+            if len(calls) == 1:
+                other = ConversationState("T1", "C1")
+                other.update_params({"effect_size": "OR"})
+                save_state(other)
+            state.update_params({"model_type": "random"})
+
+        updated = update_state("T1", "C1", mutator)
+        assert calls == [{}, {"effect_size": "OR"}]
+        assert updated.collected_params == {"effect_size": "OR", "model_type": "random"}
+
+    def test_cleanup_trims_expired_index_entries(self, redis_client):
+        """有効期限インデックスから期限切れのキーだけを取り除くこと"""
+        save_state(ConversationState("T1", "C1"))
+        redis_client.zadd(REDIS_STATE_INDEX_KEY, {"C1:old": 1})
+        assert cleanup_expired_states() == 1
+        assert redis_client.zrange(REDIS_STATE_INDEX_KEY, 0, -1) == ["C1:T1"]
@@ -0,0 +1,145 @@
+"""
+解析結果キャッシュのテスト
+"""
+import json
+import asyncio
+import subprocess
+import pytest
+from pathlib import Path
+from unittest.mock import patch
+
+import core.result_cache as result_cache_module
+from core.result_cache import ResultCache, compute_cache_key
+
+
+@pytest.fixture(autouse=True)
+def fixed_r_version():
+    with patch.object(result_cache_module, "_r_version_fingerprint", "R version 4.4.0|4.6-0"):
+        yield
+
+
+def _fake_r_outputs(out_dir: Path, job_id: str):
+    """Rスクリプトが出力するファイル一式を模擬的に作成"""
+    plot_path = out_dir / f"forest_plot_{job_id}.png"
+    plot_path.write_bytes(b"PNG")
+    rdata_path = out_dir / f"result_{job_id}.RData"
+    rdata_path.write_bytes(b"RDATA")
+    script_path = out_dir / f"run_meta_{job_id}.R"
+    script_path.write_text("library(metafor)", encoding="utf-8")
+    summary = {"overall_analysis": {"estimate": 0.5},
+               "generated_plots_paths": [{"label": "forest_plot_overall", "path": str(plot_path)}]}
+    summary_path = out_dir / f"summary_{job_id}.json"
+    summary_path.write_text(json.dumps(summary), encoding="utf-8")
+    return {
+        "success": True, "stdout": "ok", "stderr": "",
+        "r_script_path": str(script_path),
+        "generated_plots_paths": summary["generated_plots_paths"],
+        "structured_summary_json_path": str(summary_path),
+        "structured_summary_content": json.dumps(summary),
+        "rdata_path": str(rdata_path),
+    }
+
+
+class TestResultCache:
+    """解析結果キャッシュのテストクラス"""
+
+    def test_cache_key_is_normalized(self):
+        """パラメータの順序に依存せず、内容が変われば別キーになること"""
+        summary = {"columns": ["yi", "vi"]}
+        key1 = compute_cache_key(b"yi,vi\n1,2\n", {"measure": "OR", "model": "REML"}, summary)
+        key2 = compute_cache_key(b"yi,vi\n1,2\n", {"model": "REML", "measure": "OR"}, summary)
+        key3 = compute_cache_key(b"yi,vi\n1,2\n", {"measure": "RR", "model": "REML"}, summary)
+        key4 = compute_cache_key(b"yi,vi\n1,3\n", {"measure": "OR", "model": "REML"}, summary)
+        assert key1 == key2
+        assert len({key1, key3, key4}) == 3
+
+    def test_put_and_get_restores_artifacts_for_new_job(self, tmp_path):
+        """保存した成果物が新しいジョブIDのファイル名で復元されること"""
+        cache = ResultCache(cache_dir=str(tmp_path / "cache"))
+        first_dir = tmp_path / "job_a"
+        first_dir.mkdir()
+        cache.put("k1", _fake_r_outputs(first_dir, "job_a"), "job_a")
+
+        second_dir = tmp_path / "job_b"
+        second_dir.mkdir()
+        hit = cache.get("k1", second_dir, "job_b")
+
+        assert hit["cache_hit"] is True
+        assert hit["rdata_path"] == str(second_dir / "result_job_b.RData")
+        assert Path(hit["generated_plots_paths"][0]["path"]).read_bytes() == b"PNG"
+        summary = json.loads(hit["structured_summary_content"])
+        assert summary["generated_plots_paths"][0]["path"].startswith(str(second_dir))
+        assert cache.get("missing", second_dir, "job_b") is None
+        assert cache.get_stats()["hits"] == 1
+        assert cache.get_stats()["misses"] == 1
+
+    def test_lru_eviction_by_entry_count(self, tmp_path):
+        """件数上限を超えると最も古いエントリから削除されること"""
+        cache = ResultCache(cache_dir=str(tmp_path / "cache"), max_entries=2)
+        for i, key in enumerate(["old", "mid", "new"]):
+            job_dir = tmp_path / f"job{i}"
+            job_dir.mkdir()
+            cache.put(key, _fake_r_outputs(job_dir, f"job{i}"), f"job{i}")
+
+        assert not (tmp_path / "cache" / "old").exists()
+        assert (tmp_path / "cache" / "new").exists()
+        assert cache.get_stats()["evictions"] == 1
+
+    def test_get_copies_outside_lock_and_put_does_not_rescan(self, tmp_path):
+        """成果物のコピーはロック外で行い、保存のたびにキャッシュディレクトリを走査しないこと"""
+        cache = ResultCache(cache_dir=str(tmp_path / "cache"), max_entries=2)
+        scanned_at = []
+        for i in range(4):
+            job_dir = tmp_path / f"job{i}"
+            job_dir.mkdir()
+            cache.put(f"k{i}", _fake_r_outputs(job_dir, f"job{i}"), f"job{i}")
+            scanned_at.append(cache._scanned_at)
+        assert len(set(scanned_at)) == 1  # 最初の保存時に1回だけ走査する
+        assert list(cache._index) == ["k2", "k3"]
+        assert sorted(p.name for p in (tmp_path / "cache").iterdir()) == ["k2", "k3"]
+
+        locked_during_copy = []
+        real_copy2 = result_cache_module.shutil.copy2
+
+        def spy_copy2(src, dst):
+            locked_during_copy.append(cache.lock.locked())
+            return real_copy2(src, dst)
+
+        restore_dir = tmp_path / "restore"
+        restore_dir.mkdir()
+        with patch.object(result_cache_module.shutil, "copy2", side_effect=spy_copy2):
+            assert cache.get("k2", restore_dir, "job_r")["cache_hit"] is True
+        assert locked_during_copy and not any(locked_during_copy)
+        assert list(cache._index) == ["k3", "k2"]
+
+    def test_executor_returns_cached_result_without_running_r(self, tmp_path):
+        """キャッシュヒット時はRを実行せず、use_cache=Falseでバイパスできること"""
+        from core.r_executor import RAnalysisExecutor
+
+        csv_path = tmp_path / "data.csv"
+        csv_path.write_text("yi,vi\n0.1,0.01\n0.2,0.02\n", encoding="utf-8")
+        params = {"measure": "PRE", "model": "REML", "data_columns": {"yi": "yi", "vi": "vi"}}
+        data_summary = {"columns": ["yi", "vi"]}
+        cache = ResultCache(cache_dir=str(tmp_path / "cache"))
+
+        def fake_run(self, r_executable, timeout=300):
+            _fake_r_outputs(self.r_output_dir, self.job_id)
+            return subprocess.CompletedProcess(args=[], returncode=0, stdout="ok", stderr="")
+
+        with patch("core.r_executor.get_result_cache", return_value=cache), \
+             patch.object(RAnalysisExecutor, "_run_r_script", autospec=True, side_effect=fake_run) as mock_run:
+            for job_id in ["job1", "job2"]:
+                out_dir = tmp_path / job_id
+                out_dir.mkdir()
+                executor = RAnalysisExecutor(r_output_dir=out_dir, csv_file_path=csv_path, job_id=job_id)
+                result = asyncio.run(executor.execute_meta_analysis(params, data_summary))
+                assert result["success"]
+            assert mock_run.call_count == 1
+            assert result["cache_hit"] is True
+
+            out_dir = tmp_path / "job3"
+            out_dir.mkdir()
+            executor = RAnalysisExecutor(r_output_dir=out_dir, csv_file_path=csv_path, job_id="job3")
+            result = asyncio.run(executor.execute_meta_analysis(params, data_summary, use_cache=False))
+            assert mock_run.call_count == 2
+            assert "cache_hit" not in result
@@ -0,0 +1,182 @@
+"""
+Redis会話状態のプロセス内キャッシュと保存形式のテスト（Redisはインメモリの代替オブジェクトを使用）
+"""
+import json
+import pytest
+from unittest.mock import patch
+
+import utils.conversation_state as conversation_state
+from utils.conversation_state import (
+    ConversationState, StateCache, save_state, get_state, delete_state, encode_state_payload, decode_state_payload
+)
+
+
+class FakeRedis:
+    """テスト用の最小限のRedis互換オブジェクト"""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append(("get", key))
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        self.calls.append(("mget",) + keys)
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def setex(self, key, seconds, value):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def setex(self, key, seconds, value):
+        self.commands.append((key, value, False))
+
+    def set(self, key, value, ex=None, nx=False):
+        self.commands.append((key, value, nx))
+
+    def expire(self, key, seconds):
+        pass
+
+    def zadd(self, key, mapping):
+        pass
+
+    def zrem(self, key, *members):
+        pass
+
+    def delete(self, *keys):
+        self.commands.append((keys, None, False))
+
+    def execute(self):
+        for key, value, nx in self.commands:
+            if isinstance(key, tuple):
+                self.redis.delete(*key)
+            elif not (nx and key in self.redis.data):
+                self.redis.data[key] = value
+
+
+@pytest.fixture
+def redis_backend():
+    fake = FakeRedis()
+    with patch.object(conversation_state, "_storage_backend", fake), \
+         patch.object(conversation_state, "_state_cache", StateCache(max_size=2)):
+        yield fake
+
+
+class TestStateCache:
+    """Redis状態キャッシュのテストクラス"""
+
+    def test_hit_skips_state_get_and_parse(self, redis_backend):
+        """バージョンが一致すれば状態本体を読まずにキャッシュから返すこと"""
+        state = ConversationState("T1", "C1")
+        state.collected_params = {"effect_size": "OR"}
+        save_state(state)
+        redis_backend.calls.clear()
+
+        with patch.object(conversation_state, "decode_state_payload") as mock_decode:
+            cached = get_state("T1", "C1")
+        mock_decode.assert_not_called()
+        assert cached is not state and cached.to_dict() == state.to_dict()
+        assert redis_backend.calls == [("get", "conversation_state_version:C1:T1")]
+        assert conversation_state.get_state_cache_stats()["hits"] == 1
+
+    def test_cached_state_is_not_shared_between_callers(self, redis_backend):
+        """キャッシュから取得した状態を変更しても、保存するまで次の取得には見えないこと"""
+        state = ConversationState("T1", "C1")
+        state.collected_params = {"effect_size": "OR"}
+        save_state(state)
+        state.collected_params["model_type"] = "REML"  # 保存後の変更もキャッシュには漏れない
+
+        first = get_state("T1", "C1")
+        first.collected_params["effect_size"] = "RR"
+        first.conversation_history.append({"role": "user", "content": "unsaved"})
+        second = get_state("T1", "C1")
+        assert second.collected_params == {"effect_size": "OR"}
+        assert second.conversation_history == []
+        assert conversation_state.get_state_cache_stats()["hits"] == 2
+
+    def test_update_from_another_process_is_detected(self, redis_backend):
+        """他のプロセスが更新した場合はバージョン不一致で読み直すこと"""
+        save_state(ConversationState("T1", "C1"))
+        other = ConversationState("T1", "C1")
+        other.collected_params = {"effect_size": "OR"}
+        redis_backend.data["conversation_state:C1:T1"] = encode_state_payload(other.to_dict())
+        redis_backend.data["conversation_state_version:C1:T1"] = "other-version"
+
+        assert get_state("T1", "C1").collected_params == {"effect_size": "OR"}
+        stats = conversation_state.get_state_cache_stats()
+        assert stats["stale"] == 1
+        assert get_state("T1", "C1").collected_params == {"effect_size": "OR"}
+        assert conversation_state.get_state_cache_stats()["hits"] == 1
+
+    def test_lru_eviction_and_delete(self, redis_backend):
+        """上限を超えると古いものから追い出し、削除時は無効化すること"""
+        for thread_ts in ("T1", "T2", "T3"):
+            save_state(ConversationState(thread_ts, "C1"))
+        stats = conversation_state.get_state_cache_stats()
+        assert stats["size"] == 2 and stats["evictions"] == 1
+
+        # 追い出された状態はRedisから読み直してキャッシュに戻る
+        assert get_state("T1", "C1") is not None
+        assert ("mget", "conversation_state:C1:T1", "conversation_state_version:C1:T1") in redis_backend.calls
+
+        delete_state("T1", "C1")
+        assert get_state("T1", "C1") is None
+        assert "conversation_state_version:C1:T1" not in redis_backend.data
+
+
+class TestStateSerialization:
+    """会話状態の保存形式のテストクラス"""
+
+    def test_payload_round_trip_and_legacy_json(self):
+        """圧縮形式を復元でき、従来の非圧縮JSONも読み込めること"""
+        data = {"text": "メタ解析" * 100, "n": 1}
+        payload = encode_state_payload(data)
+        assert payload.startswith("z1:") and len(payload) < len(json.dumps(data, ensure_ascii=False))
+        assert decode_state_payload(payload) == data
+        assert decode_state_payload(json.dumps(data)) == data
+
+    def test_csv_analysis_is_written_once(self, redis_backend):
+        """csv_analysis は別キーに一度だけ保存され、読み込み時に復元されること"""
+        state = ConversationState("T1", "C1")
+        state.csv_analysis = {"is_suitable": True, "data_preview": [{"yi": 0.1}] * 50}
+        save_state(state)
+        save_state(state)
+
+        csv_keys = [key for key in redis_backend.data if key.startswith("conversation_state_csv:")]
+        assert len(csv_keys) == 1
+        assert "data_preview" not in decode_state_payload(redis_backend.data["conversation_state:C1:T1"])
+
+        with patch.object(conversation_state, "_state_cache", StateCache(max_size=0)):
+            assert get_state("T1", "C1").csv_analysis == state.csv_analysis
+
+    def test_old_history_is_compacted_into_summary(self, redis_backend):
+        """保存時に古い会話履歴が要約に畳み込まれること"""
+        state = ConversationState("T1", "C1")
+        for i in range(30):
+            state.conversation_history.append({"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"})
+
+        with patch.object(conversation_state, "STATE_HISTORY_KEEP_TURNS", 10):
+            save_state(state)
+
+        with patch.object(conversation_state, "_state_cache", StateCache(max_size=0)):
+            restored = get_state("T1", "C1")
+        assert [entry["content"] for entry in restored.conversation_history] == [f"message {i}" for i in range(20, 30)]
+        assert restored.history_summary.splitlines()[0] == "ユーザー: message 0"
+        assert restored.history_summary.splitlines()[-1] == "ボット: message 19"
@@ -0,0 +1,99 @@
+"""
+会話状態の有効期限インデックスとバックグラウンド掃除のテスト
+"""
+import os
+import glob
+import time
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import utils.conversation_state as conversation_state
+from utils.conversation_state import (
+    ConversationState, ExpiryIndex, save_state, get_state, get_or_create_state, cleanup_expired_states,
+    start_state_expiry_sweeper, stop_state_expiry_sweeper
+)
+
+
+def _make_state(thread_ts: str, hours_ago: float) -> ConversationState:
+    state = ConversationState(thread_ts, "C1")
+    state.created_at = state.updated_at = datetime.now() - timedelta(hours=hours_ago)
+    return state
+
+
+@pytest.fixture
+def backend(request, tmp_path):
+    """memory または file バックエンドを分離した状態で使う"""
+    backend_value = 'memory' if request.param == 'memory' else str(tmp_path / "states")
+    if request.param == 'file':
+        os.makedirs(backend_value)
+    with patch.object(conversation_state, "_storage_backend", backend_value), \
+         patch.object(conversation_state, "_memory_store", {}), \
+         patch.object(conversation_state, "_expiry_index", ExpiryIndex()), \
+         patch.object(conversation_state, "_indexed_state_dirs", set()):
+        yield backend_value
+
+
+class TestStateExpiry:
+    """有効期限インデックスのテストクラス"""
+
+    @pytest.mark.parametrize("backend", ["memory", "file"], indirect=True)
+    def test_cleanup_removes_only_expired(self, backend):
+        """インデックスから期限切れの状態だけを削除すること"""
+        save_state(_make_state("valid", 24))
+        save_state(_make_state("expired", 50))
+
+        assert cleanup_expired_states() == 1
+        assert get_state("valid", "C1") is not None
+        assert get_state("expired", "C1") is None
+        assert cleanup_expired_states() == 0
+
+    @pytest.mark.parametrize("backend", ["memory"], indirect=True)
+    def test_lookup_does_not_scan_all_states(self, backend):
+        """get_or_create_state が全状態の走査を行わないこと"""
+        for i in range(50):
+            save_state(_make_state(f"thread_{i}", 1))
+
+        with patch.object(conversation_state, "cleanup_expired_states") as mock_cleanup, \
+             patch.object(ConversationState, "from_dict", wraps=ConversationState.from_dict) as mock_from_dict:
+            get_or_create_state("thread_3", "C1")
+
+        mock_cleanup.assert_not_called()
+        assert mock_from_dict.call_count == 1
+
+    @pytest.mark.parametrize("backend", ["file"], indirect=True)
+    def test_file_index_is_rebuilt_from_mtime(self, backend):
+        """再起動後はJSONを読まずにファイルのmtimeから期限を判定すること"""
+        save_state(_make_state("valid", 1))
+        save_state(_make_state("expired", 49))
+
+        with patch.object(conversation_state, "_expiry_index", ExpiryIndex()), \
+             patch.object(conversation_state, "_indexed_state_dirs", set()), \
+             patch.object(conversation_state.json, "load", side_effect=AssertionError("JSON should not be parsed")):
+            assert cleanup_expired_states() == 1
+        assert sorted(os.path.basename(path) for path in glob.glob(os.path.join(backend, "*", "*.json"))) == ["C1:valid.json"]
+
+    @pytest.mark.parametrize("backend", ["file"], indirect=True)
+    def test_file_updated_elsewhere_is_kept(self, backend):
+        """インデックスの期限が古くても、ファイルが他で更新されていれば削除しないこと"""
+        save_state(_make_state("shared", 1))
+        # 他のプロセスによる更新前の期限がこのプロセスのインデックスに残っている状態
+        conversation_state._expiry_index.set("C1:shared", time.time() - 60)
+
+        assert cleanup_expired_states() == 0
+        assert get_state("shared", "C1") is not None
+
+    @pytest.mark.parametrize("backend", ["memory"], indirect=True)
+    def test_background_sweeper(self, backend):
+        """バックグラウンドスレッドが定期的に期限切れの状態を削除すること"""
+        save_state(_make_state("expired", 50))
+        stop_state_expiry_sweeper()
+        with patch.object(conversation_state, "STATE_CLEANUP_INTERVAL_SECONDS", 0.05):
+            start_state_expiry_sweeper()
+            try:
+                deadline = time.time() + 5
+                while conversation_state._memory_store and time.time() < deadline:
+                    time.sleep(0.02)
+            finally:
+                stop_state_expiry_sweeper()
+        assert conversation_state._memory_store == {}
@@ -0,0 +1,96 @@
+"""
+fileバックエンド（アトミック書き込み・シャード化・アドバイザリロック）のテスト
+"""
+import os
+import glob
+import time
+import threading
+import pytest
+from unittest.mock import patch
+
+import utils.conversation_state as conversation_state
+from utils.conversation_state import (
+    ConversationState, ExpiryIndex, save_state, get_state, update_state, delete_state, cleanup_expired_states
+)
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    state_dir = str(tmp_path / "states")
+    os.makedirs(state_dir)
+    with patch.object(conversation_state, "_storage_backend", state_dir), \
+         patch.object(conversation_state, "_expiry_index", ExpiryIndex()), \
+         patch.object(conversation_state, "_indexed_state_dirs", set()):
+        yield state_dir
+
+
+class TestStateFileBackend:
+    """fileバックエンドのテストクラス"""
+
+    def test_states_are_sharded_without_leftover_temp_files(self, state_dir):
+        """状態ファイルをハッシュで分けたサブディレクトリに書き込み、一時ファイルを残さないこと"""
+        for i in range(20):
+            save_state(ConversationState(f"T{i}", "C1"))
+
+        json_files = glob.glob(os.path.join(state_dir, "*", "*.json"))
+        assert len(json_files) == 20
+        assert len({os.path.dirname(path) for path in json_files}) > 1
+        assert not glob.glob(os.path.join(state_dir, "*", "*.tmp"))
+        assert get_state("T3", "C1") is not None
+
+        delete_state("T3", "C1")
+        assert get_state("T3", "C1") is None
+
+    def test_failed_write_keeps_previous_state(self, state_dir):
+        """書き込み途中で失敗しても以前の状態ファイルが壊れないこと"""
+        state = ConversationState("T1", "C1")
+        state.update_params({"effect_size": "OR"})
+        save_state(state)
+
+        with patch.object(conversation_state.json, "dump", side_effect=OSError("disk full")), \
+             patch.object(conversation_state, "_memory_store", {}):
+            state.update_params({"effect_size": "RR"})
+            save_state(state)
+
+        assert get_state("T1", "C1").collected_params == {"effect_size": "OR"}
+        assert not glob.glob(os.path.join(state_dir, "*", "*.tmp"))
+
+    def test_concurrent_updates_are_not_lost(self, state_dir):
+        """複数スレッドから同時に更新しても互いの更新を上書きしないこと"""
+        def worker(i):
+            update_state("T1", "C1", lambda state: state.update_params({f"param_{i}": i}))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert get_state("T1", "C1").collected_params == {f"param_{i}": i for i in range(8)}
+
+    def test_flat_files_are_migrated(self, state_dir):
+        """シャード化以前の直下の状態ファイルをサブディレクトリへ移動すること"""
+        save_state(ConversationState("T1", "C1"))
+        [path] = glob.glob(os.path.join(state_dir, "*", "*.json"))
+        os.replace(path, os.path.join(state_dir, "C1:T1.json"))
+        assert get_state("T1", "C1") is None
+
+        conversation_state._migrate_flat_state_files(state_dir)
+        assert get_state("T1", "C1") is not None
+        assert not glob.glob(os.path.join(state_dir, "*.json"))
+
+    def test_stale_temp_files_are_removed_on_index(self, state_dir):
+        """クラッシュで残った古い一時ファイルを索引作成時に削除すること"""
+        save_state(ConversationState("T1", "C1"))
+        shard_dir = os.path.dirname(glob.glob(os.path.join(state_dir, "*", "*.json"))[0])
+        stale = os.path.join(shard_dir, ".stale.tmp")
+        fresh = os.path.join(shard_dir, ".fresh.tmp")
+        for path in (stale, fresh):
+            open(path, "w").close()
+        old = time.time() - conversation_state.STATE_FILE_TMP_MAX_AGE_SECONDS - 10
+        os.utime(stale, (old, old))
+
+        with patch.object(conversation_state, "_indexed_state_dirs", set()):
+            cleanup_expired_states()
+        assert not os.path.exists(stale)
+        assert os.path.exists(fresh)
@@ -6,10 +6,26 @@
 import logging
 import os
 import json
-from typing import Dict, Any, Optional
+import time
+import zlib
+import base64
+import copy
+import hashlib
+import heapq
+import uuid
+import threading
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple, Callable
 from datetime import datetime, timedelta
 from enum import Enum
 
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間ロックを使わない
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
 # ストレージバックエンド設定
@@ -21,6 +37,44 @@ STATE_EXPIRY_HOURS = int(os.environ.get('CONTEXT_RETENTION_HOURS', '48'))
 # 会話履歴の最大保持件数
 MAX_HISTORY_LENGTH = int(os.environ.get('MAX_HISTORY_LENGTH', '20'))
 
+# 期限切れ状態をバックグラウンドで削除する間隔（秒）
+STATE_CLEANUP_INTERVAL_SECONDS = int(os.environ.get('STATE_CLEANUP_INTERVAL_SECONDS', '300'))
+
+# 保存時に全文で保持する会話履歴の件数（それより古い履歴は要約に畳み込む）
+STATE_HISTORY_KEEP_TURNS = int(os.environ.get('STATE_HISTORY_KEEP_TURNS', str(MAX_HISTORY_LENGTH)))
+
+# 古い会話履歴の要約の最大文字数（超えた分は古い方から切り捨て）
+HISTORY_SUMMARY_MAX_CHARS = 2000
+HISTORY_SUMMARY_LINE_CHARS = 80
+
+# Redisに保存する状態のエンコーディング（zlib圧縮したJSONをbase64化し、先頭にバージョンを付ける）
+STATE_ENCODING_PREFIX = "z1:"
+
+# Redisバックエンドで復元済みの状態を保持するプロセス内キャッシュの件数（0で無効）
+STATE_CACHE_SIZE = int(os.environ.get('STATE_CACHE_SIZE', '256'))
+
+# fileバックエンド: 書き込みごとにfsyncするか（電源断にも耐えるが遅くなる）
+STATE_FILE_FSYNC = os.environ.get('STATE_FILE_FSYNC', 'false').lower() == 'true'
+
+# fileバックエンド: キーのハッシュ先頭何文字でサブディレクトリに分割するか（2文字で256ディレクトリ）
+STATE_FILE_SHARD_CHARS = 2
+
+# fileバックエンド: クラッシュで残った一時ファイルを削除するまでの秒数
+STATE_FILE_TMP_MAX_AGE_SECONDS = 3600
+
+# Redisコネクションプールの設定
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', '20'))
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', '10'))  # 空き接続を待つ秒数
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', '5'))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get('REDIS_SOCKET_CONNECT_TIMEOUT', '5'))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', '30'))
+
+# update_state の楽観的ロック（WATCH/MULTI）の再試行回数
+STATE_UPDATE_MAX_RETRIES = int(os.environ.get('STATE_UPDATE_MAX_RETRIES', '5'))
+
+# Redisで有効な会話状態のキーを有効期限順に保持するソート済みセット
+REDIS_STATE_INDEX_KEY = "conversation_state_index"
+
 class DialogState(str, Enum):
     """CLAUDE.mdの要件に準拠した5つの状態"""
     WAITING_FOR_FILE = "waiting_for_file"
@@ -46,6 +100,7 @@ class ConversationState:
         self.csv_analysis = {}
         self.file_info = {}
         self.async_job_status = {}
+        self.history_summary = ""
         
     def update_params(self, params: Dict[str, Any]):
         """パラメータを更新"""
@@ -64,16 +119,31 @@ class ConversationState:
             "content": content,
             "timestamp": datetime.now().isoformat()
         })
-        # 最大件数を超えた場合は古い履歴を削除
-        if len(self.conversation_history) > MAX_HISTORY_LENGTH:
-            self.conversation_history = self.conversation_history[-MAX_HISTORY_LENGTH:]
+        # 最大件数を超えた場合は古い履歴を要約に畳み込む
+        self.compact_history(MAX_HISTORY_LENGTH)
         self.updated_at = datetime.now()
     
     def limit_history(self, max_messages: int):
         """会話履歴を指定件数に制限"""
-        if len(self.conversation_history) > max_messages:
-            self.conversation_history = self.conversation_history[-max_messages:]
+        self.compact_history(max_messages)
         self.updated_at = datetime.now()
+    
+    def compact_history(self, keep_turns: int = None):
+        """直近 keep_turns 件より古い会話履歴を1行ずつの短い要約に畳み込む"""
+        if keep_turns is None:
+            keep_turns = STATE_HISTORY_KEEP_TURNS
+        if len(self.conversation_history) <= keep_turns:
+            return
+        older = self.conversation_history[:len(self.conversation_history) - keep_turns]
+        self.conversation_history = self.conversation_history[len(older):]
+        lines = [self.history_summary] if self.history_summary else []
+        for entry in older:
+            role = "ユーザー" if entry.get("role") == "user" else "ボット"
+            content = " ".join(str(entry.get("content", "")).split())
+            if len(content) > HISTORY_SUMMARY_LINE_CHARS:
+                content = content[:HISTORY_SUMMARY_LINE_CHARS] + "…"
+            lines.append(f"{role}: {content}")
+        self.history_summary = "\n".join(lines)[-HISTORY_SUMMARY_MAX_CHARS:]
         
     def is_expired(self) -> bool:
         """状態が期限切れかチェック"""
@@ -104,7 +174,8 @@ class ConversationState:
             "conversation_history": self.conversation_history,
             "job_status": self.job_status,
             "analysis_params": self.analysis_params,
-            "async_job_status": self.async_job_status
+            "async_job_status": self.async_job_status,
+            "history_summary": self.history_summary
         }
         
     @classmethod
@@ -121,11 +192,253 @@ class ConversationState:
         state.job_status = data.get('job_status')
         state.analysis_params = data.get('analysis_params', {})
         state.async_job_status = data.get('async_job_status', {})
+        state.history_summary = data.get('history_summary', "")
         return state
 
+class ExpiryIndex:
+    """
+    memory/fileバックエンド用の有効期限インデックス（最小ヒープ）
+
+    保存のたびに (期限, キー) を追加し、古いエントリは取り出し時に読み捨てます。
+    期限切れのキーだけを取り出せるため、全状態を読み込まずに掃除できます。
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.expires_at: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def set(self, key: str, expires_at: float):
+        with self.lock:
+            self.expires_at[key] = expires_at
+            heapq.heappush(self.heap, (expires_at, key))
+            # 更新の多いスレッドで読み捨てるエントリが溜まりすぎたら作り直す
+            if len(self.heap) > 2 * len(self.expires_at) + 1000:
+                self.heap = [(expiry, k) for k, expiry in self.expires_at.items()]
+                heapq.heapify(self.heap)
+
+    def discard(self, key: str):
+        with self.lock:
+            self.expires_at.pop(key, None)
+
+    def pop_expired(self, now: float) -> List[str]:
+        """期限切れのキーをインデックスから取り出す"""
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                expires_at, key = heapq.heappop(self.heap)
+                if self.expires_at.get(key) == expires_at:
+                    del self.expires_at[key]
+                    expired.append(key)
+        return expired
+
+    def __len__(self):
+        return len(self.expires_at)
+
+
+def encode_state_payload(data: Any) -> str:
+    """Redis保存用にJSONをzlib圧縮してエンコード（バージョン付き）"""
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return STATE_ENCODING_PREFIX + base64.b64encode(zlib.compress(raw)).decode('ascii')
+
+
+def decode_state_payload(payload) -> Any:
+    """encode_state_payload の逆変換（従来の非圧縮JSONも読み込める）"""
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    if payload.startswith(STATE_ENCODING_PREFIX):
+        return json.loads(zlib.decompress(base64.b64decode(payload[len(STATE_ENCODING_PREFIX):])).decode('utf-8'))
+    return json.loads(payload)
+
+
+class StateCache:
+    """
+    Redisバックエンド用の復元済み ConversationState のLRUキャッシュ
+
+    保存のたびにRedisへ状態と一緒にバージョン（ランダムなetag）を書き込みます。
+    取得時は小さなバージョンキーだけを読み、キャッシュのバージョンと一致すれば
+    状態本体のGETとJSONパースを省略します（他のプロセスが更新した場合は不一致になり読み直す）。
+    memoryバックエンドと同様に取得のたびに新しいオブジェクトを返すため、呼び出し側の変更は save_state / update_state で
+    保存するまで他の呼び出し側には見えません（キャッシュには保存時点の内容の複製を保持する）。
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # {key: (version, state_data)}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def version_of(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[0] if entry else None
+
+    def get(self, key: str, current_version: Optional[str]) -> Optional[ConversationState]:
+        """現在のバージョンと一致するキャッシュ済みの状態を取得"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if current_version is None or entry[0] != current_version:
+                del self.entries[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            state_data = entry[1]
+        # 呼び出し側の変更がキャッシュや他の呼び出し側に漏れないよう、取得のたびに複製から復元する
+        return ConversationState.from_dict(copy.deepcopy(state_data))
+
+    def put(self, key: str, version: Optional[str], state: ConversationState):
+        if self.max_size <= 0 or not version:
+            return
+        state_data = copy.deepcopy(state.to_dict())
+        with self.lock:
+            self.entries[key] = (version, state_data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries), "max_size": self.max_size,
+                "hits": self.hits, "misses": self.misses, "stale": self.stale, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
 # ストレージバックエンドの初期化
 _storage_backend = None
 _memory_store = {}
+_expiry_index = ExpiryIndex()
+_indexed_state_dirs = set()
+_index_lock = threading.Lock()
+_sweeper_thread = None
+_sweeper_stop = threading.Event()
+_sweeper_lock = threading.Lock()
+_state_cache = StateCache(STATE_CACHE_SIZE)
+# memory バックエンドの update_state 用のプロセス内ロック（キーのハッシュで振り分ける）
+_update_locks = [threading.Lock() for _ in range(64)]
+
+
+def get_state_cache_stats() -> Dict[str, Any]:
+    """Redis状態キャッシュのヒット・ミス数などを取得"""
+    return _state_cache.stats()
+
+
+def _expires_at(state: ConversationState) -> float:
+    return state.updated_at.timestamp() + STATE_EXPIRY_HOURS * 3600
+
+
+def _index_state_dir(state_dir: str):
+    """fileバックエンドのディレクトリを一度だけ走査し、ファイルのmtime（=最終更新時刻）から期限を登録"""
+    with _index_lock:
+        if state_dir in _indexed_state_dirs:
+            return
+        stale_tmp_before = time.time() - STATE_FILE_TMP_MAX_AGE_SECONDS
+        for shard_dir in _list_shard_dirs(state_dir):
+            with os.scandir(shard_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json'):
+                        _expiry_index.set(entry.name[:-5], entry.stat().st_mtime + STATE_EXPIRY_HOURS * 3600)
+                    elif entry.name.endswith('.tmp') and entry.stat().st_mtime < stale_tmp_before:
+                        # 書き込み途中でクラッシュしたプロセスが残した一時ファイル
+                        _remove_quietly(entry.path)
+        _indexed_state_dirs.add(state_dir)
+
+def _list_shard_dirs(state_dir: str) -> List[str]:
+    if not os.path.isdir(state_dir):
+        return []
+    with os.scandir(state_dir) as entries:
+        return [entry.path for entry in entries if entry.is_dir() and len(entry.name) == STATE_FILE_SHARD_CHARS]
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _state_file_path(state_dir: str, key: str) -> str:
+    """キーのハッシュで振り分けたサブディレクトリ内の状態ファイルのパス"""
+    shard = hashlib.sha1(key.encode('utf-8')).hexdigest()[:STATE_FILE_SHARD_CHARS]
+    return os.path.join(state_dir, shard, f"{key}.json")
+
+@contextmanager
+def _state_file_lock(state_dir: str, key: str):
+    """キーが属するシャードのアドバイザリロック（flockのため同一プロセス内の別スレッドと他プロセスの両方を排他する）
+
+    キーごとのロックファイルは削除時の競合を避けられないため、シャードごとの固定のロックファイルを使う。
+    """
+    shard_dir = os.path.dirname(_state_file_path(state_dir, key))
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(os.path.join(shard_dir, '.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _read_state_file(state_dir: str, key: str) -> Optional[Dict[str, Any]]:
+    # 書き込みは os.replace で置き換えるため、読み込み側はロック無しでも書きかけの内容を読まない
+    try:
+        with open(_state_file_path(state_dir, key), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _write_state_file(state_dir: str, state: ConversationState, state_data: Dict[str, Any]):
+    """一時ファイルに書き込んでから os.replace で置き換える（呼び出し側で _state_file_lock を取得しておく）"""
+    file_path = _state_file_path(state_dir, state.key)
+    shard_dir = os.path.dirname(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=shard_dir, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state_data, f, ensure_ascii=False, separators=(',', ':'))
+            if STATE_FILE_FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    if STATE_FILE_FSYNC:
+        dir_fd = os.open(shard_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    # mtimeを最終更新時刻に合わせ、再起動後や他プロセスからも期限をJSONを読まずに判定できるようにする
+    updated_ts = state.updated_at.timestamp()
+    os.utime(file_path, (updated_ts, updated_ts))
+    _expiry_index.set(state.key, _expires_at(state))
+
+def _migrate_flat_state_files(state_dir: str):
+    """シャード化以前の直下に置かれた状態ファイルをサブディレクトリへ移動"""
+    with os.scandir(state_dir) as entries:
+        legacy_files = [entry.name for entry in entries if entry.is_file() and entry.name.endswith('.json')]
+    for name in legacy_files:
+        key = name[:-5]
+        with _state_file_lock(state_dir, key):
+            try:
+                os.replace(os.path.join(state_dir, name), _state_file_path(state_dir, key))
+            except FileNotFoundError:
+                pass
+    if legacy_files:
+        logger.info(f"Migrated {len(legacy_files)} state files into sharded directories")
 
 def get_storage_backend():
     """ストレージバックエンドを取得（テスト用に公開）"""
@@ -138,38 +451,37 @@ def _get_storage_backend():
         if STORAGE_BACKEND == 'redis':
             try:
                 import redis
-                import ssl
                 redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+                pool_kwargs = {
+                    "max_connections": REDIS_MAX_CONNECTIONS,
+                    "timeout": REDIS_POOL_TIMEOUT,
+                    "socket_timeout": REDIS_SOCKET_TIMEOUT,
+                    "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+                    "socket_keepalive": True,
+                    "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+                    "retry_on_timeout": True,
+                    "decode_responses": True,
+                }
                 
                 # Heroku Redis uses self-signed certificates, so we need to disable SSL verification
                 if redis_url.startswith('rediss://'):
                     logger.info("Detected Redis SSL connection, configuring SSL settings...")
-                    # Create SSL context that doesn't verify certificates
-                    ssl_context = ssl.create_default_context()
-                    ssl_context.check_hostname = False
-                    ssl_context.verify_mode = ssl.CERT_NONE
-                    
-                    _storage_backend = redis.from_url(
-                        redis_url, 
-                        decode_responses=True,
-                        ssl_cert_reqs=None,
-                        ssl_ca_certs=None,
-                        ssl_keyfile=None,
-                        ssl_certfile=None,
-                        ssl_check_hostname=False
-                    )
-                else:
-                    _storage_backend = redis.from_url(redis_url, decode_responses=True)
+                    pool_kwargs.update(ssl_cert_reqs=None, ssl_ca_certs=None, ssl_keyfile=None,
+                                       ssl_certfile=None, ssl_check_hostname=False)
+                
+                # 全スレッドで共有するコネクションプール（上限に達した場合は空きを待つ）
+                pool = redis.BlockingConnectionPool.from_url(redis_url, **pool_kwargs)
+                _storage_backend = redis.Redis(connection_pool=pool)
                 
                 _storage_backend.ping()  # 接続テスト
-                logger.info("Redis storage backend initialized")
+                logger.info(f"Redis storage backend initialized (pool size: {REDIS_MAX_CONNECTIONS})")
             except Exception as e:
                 logger.error(f"Failed to initialize Redis: {e}, falling back to memory")
                 _storage_backend = 'memory'
         elif STORAGE_BACKEND == 'file':
-            import tempfile
             file_dir = os.path.join(tempfile.gettempdir(), 'meta_analysis_states')
             os.makedirs(file_dir, exist_ok=True)
+            _migrate_flat_state_files(file_dir)
             _storage_backend = file_dir
             logger.info(f"File storage backend initialized: {file_dir}")
         elif STORAGE_BACKEND == 'dynamodb':
@@ -190,8 +502,8 @@ def get_or_create_state(thread_ts: str, channel_id: str) -> ConversationState:
     """会話状態を取得または作成"""
     key = f"{channel_id}:{thread_ts}"
     
-    # 期限切れの状態をクリーンアップ
-    cleanup_expired_states()
+    # 期限切れの状態はバックグラウンドで削除する（ここでは全件走査しない）
+    start_state_expiry_sweeper()
     
     # 既存の状態を取得
     state = get_state(thread_ts, channel_id)
@@ -202,24 +514,60 @@ def get_or_create_state(thread_ts: str, channel_id: str) -> ConversationState:
     
     return state
 
+def _queue_redis_save(pipe, state: ConversationState, state_data: Dict[str, Any]) -> str:
+    """状態の保存コマンド（本体・バージョン・CSV分析結果・有効期限インデックス）をパイプラインに積み、新しいバージョンを返す"""
+    expiry_seconds = STATE_EXPIRY_HOURS * 3600
+    version = uuid.uuid4().hex
+    redis_data = dict(state_data)
+    csv_analysis = redis_data.pop("csv_analysis", None)
+    if csv_analysis:
+        # 変更されない大きなCSV分析結果は内容ハッシュをキーに一度だけ書き込み、以降は有効期限だけ延長する
+        csv_json = json.dumps(csv_analysis, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        csv_ref = hashlib.sha256(csv_json.encode('utf-8')).hexdigest()[:32]
+        redis_data["csv_analysis_ref"] = csv_ref
+        pipe.set(f"conversation_state_csv:{csv_ref}", encode_state_payload(csv_analysis), ex=expiry_seconds, nx=True)
+        pipe.expire(f"conversation_state_csv:{csv_ref}", expiry_seconds)
+    pipe.setex(f"conversation_state:{state.key}", expiry_seconds, encode_state_payload(redis_data))
+    pipe.setex(f"conversation_state_version:{state.key}", expiry_seconds, version)
+    pipe.zadd(REDIS_STATE_INDEX_KEY, {state.key: _expires_at(state)})
+    return version
+
+def _decode_redis_state(backend, state_payload, csv_payloads: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Redisの状態ペイロードを復元し、別キーの csv_analysis を埋め戻す（csv_payloads に無ければGETする）"""
+    if not state_payload:
+        return None
+    state_data = decode_state_payload(state_payload)
+    # csv_analysis はデータセットごとに一度だけ書き込まれる別キーに保存されている
+    csv_ref = state_data.pop('csv_analysis_ref', None)
+    if csv_ref:
+        if csv_payloads is not None and csv_ref in csv_payloads:
+            csv_payload = csv_payloads[csv_ref]
+        else:
+            csv_payload = backend.get(f"conversation_state_csv:{csv_ref}")
+        state_data['csv_analysis'] = decode_state_payload(csv_payload) if csv_payload else {}
+    return state_data
+
 def get_state(thread_ts: str, channel_id: str) -> Optional[ConversationState]:
     """会話状態を取得"""
     key = f"{channel_id}:{thread_ts}"
     backend = _get_storage_backend()
+    redis_version = None
     
     try:
         if backend == 'memory':
             state_data = _memory_store.get(key)
         elif isinstance(backend, str) and backend.startswith('/'):  # file backend
-            file_path = os.path.join(backend, f"{key}.json")
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    state_data = json.load(f)
-            else:
-                state_data = None
+            state_data = _read_state_file(backend, key)
         elif hasattr(backend, 'get'):  # Redis
-            state_json = backend.get(f"conversation_state:{key}")
-            state_data = json.loads(state_json) if state_json else None
+            # キャッシュ済みならバージョンキーだけを確認し、一致すれば本体のGETとJSONパースを省略する
+            current_version = None
+            if _state_cache.version_of(key) is not None:
+                current_version = backend.get(f"conversation_state_version:{key}")
+            cached_state = _state_cache.get(key, current_version)
+            if cached_state is not None and not cached_state.is_expired():
+                return cached_state
+            state_payload, redis_version = backend.mget(f"conversation_state:{key}", f"conversation_state_version:{key}")
+            state_data = _decode_redis_state(backend, state_payload)
         elif hasattr(backend, 'Table'):  # DynamoDB
             table = backend.Table(os.environ.get('DYNAMODB_TABLE', 'meta_analysis_states'))
             response = table.get_item(Key={'state_key': key})
@@ -230,6 +578,7 @@ def get_state(thread_ts: str, channel_id: str) -> Optional[ConversationState]:
         if state_data:
             state = ConversationState.from_dict(state_data)
             if not state.is_expired():
+                _state_cache.put(key, redis_version, state)
                 return state
             else:
                 # 期限切れの場合は削除
@@ -243,18 +592,22 @@ def get_state(thread_ts: str, channel_id: str) -> Optional[ConversationState]:
 def save_state(state: ConversationState):
     """会話状態を保存"""
     backend = _get_storage_backend()
+    state.compact_history()
     state_data = state.to_dict()
     
     try:
         if backend == 'memory':
             _memory_store[state.key] = state_data
+            _expiry_index.set(state.key, _expires_at(state))
         elif isinstance(backend, str) and backend.startswith('/'):  # file backend
-            file_path = os.path.join(backend, f"{state.key}.json")
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(state_data, f, ensure_ascii=False, indent=2)
+            with _state_file_lock(backend, state.key):
+                _write_state_file(backend, state, state_data)
         elif hasattr(backend, 'set'):  # Redis
-            expiry_seconds = STATE_EXPIRY_HOURS * 3600
-            backend.setex(f"conversation_state:{state.key}", expiry_seconds, json.dumps(state_data, ensure_ascii=False))
+            # 保存に必要なコマンドを1往復にまとめる
+            pipe = backend.pipeline(transaction=False)
+            version = _queue_redis_save(pipe, state, state_data)
+            pipe.execute()
+            _state_cache.put(state.key, version, state)
         elif hasattr(backend, 'Table'):  # DynamoDB
             table = backend.Table(os.environ.get('DYNAMODB_TABLE', 'meta_analysis_states'))
             import time
@@ -270,7 +623,110 @@ def save_state(state: ConversationState):
     except Exception as e:
         logger.error(f"Error saving state {state.key}: {e}")
         # フォールバックとしてメモリに保存
+        _state_cache.invalidate(state.key)
         _memory_store[state.key] = state_data
+        _expiry_index.set(state.key, _expires_at(state))
+
+def get_states(threads: List[Tuple[str, str]]) -> Dict[str, ConversationState]:
+    """複数の会話状態をまとめて取得（(thread_ts, channel_id) のリストを受け取り、キーごとの状態を返す）
+
+    Redisバックエンドでは状態本体・バージョン・CSV分析結果をそれぞれ1回のMGETで読み込む。
+    """
+    backend = _get_storage_backend()
+    if not threads:
+        return {}
+    if not (hasattr(backend, 'mget') and hasattr(backend, 'pipeline')):
+        states = {}
+        for thread_ts, channel_id in threads:
+            state = get_state(thread_ts, channel_id)
+            if state is not None:
+                states[state.key] = state
+        return states
+
+    keys = list(dict.fromkeys(f"{channel_id}:{thread_ts}" for thread_ts, channel_id in threads))
+    states = {}
+    try:
+        values = backend.mget(*[k for key in keys for k in (f"conversation_state:{key}", f"conversation_state_version:{key}")])
+        payloads = {}
+        for i, key in enumerate(keys):
+            state_payload, version = values[2 * i], values[2 * i + 1]
+            cached_state = _state_cache.get(key, version) if _state_cache.version_of(key) is not None else None
+            if cached_state is not None and not cached_state.is_expired():
+                states[key] = cached_state
+            elif state_payload:
+                payloads[key] = (decode_state_payload(state_payload), version)
+
+        csv_refs = list({data['csv_analysis_ref'] for data, _ in payloads.values() if data.get('csv_analysis_ref')})
+        csv_payloads = dict(zip(csv_refs, backend.mget(*[f"conversation_state_csv:{ref}" for ref in csv_refs]))) if csv_refs else {}
+
+        for key, (state_data, version) in payloads.items():
+            csv_ref = state_data.pop('csv_analysis_ref', None)
+            if csv_ref:
+                csv_payload = csv_payloads.get(csv_ref)
+                state_data['csv_analysis'] = decode_state_payload(csv_payload) if csv_payload else {}
+            state = ConversationState.from_dict(state_data)
+            if not state.is_expired():
+                _state_cache.put(key, version, state)
+                states[key] = state
+    except Exception as e:
+        logger.error(f"Error getting states {keys}: {e}")
+
+    return states
+
+def update_state(thread_ts: str, channel_id: str, mutator: Callable[[ConversationState], None],
+                 retries: Optional[int] = None) -> ConversationState:
+    """最新の会話状態に mutator を適用して保存し、更新後の状態を返す（状態が無ければ新規作成）
+
+    Redisバックエンドでは WATCH/MULTI による楽観的ロックを使い、他のワーカーが同時に更新した場合は
+    最新の状態を読み直して mutator を再適用する。mutator は再実行されても安全な処理にすること。
+    fileバックエンドではシャードのアドバイザリロックを保持したまま読み込み・更新・書き込みを行う。
+    """
+    key = f"{channel_id}:{thread_ts}"
+    backend = _get_storage_backend()
+
+    if hasattr(backend, 'pipeline') and hasattr(backend, 'get'):  # Redis
+        import redis
+        retries = STATE_UPDATE_MAX_RETRIES if retries is None else retries
+        state_key, version_key = f"conversation_state:{key}", f"conversation_state_version:{key}"
+        for attempt in range(retries + 1):
+            try:
+                with backend.pipeline() as pipe:
+                    pipe.watch(state_key, version_key)
+                    # WATCH中は即時実行モードのため、キャッシュを経由せずRedisから最新の状態を読む
+                    state_data = _decode_redis_state(pipe, pipe.get(state_key))
+                    state = ConversationState.from_dict(state_data) if state_data else None
+                    if state is None or state.is_expired():
+                        state = ConversationState(thread_ts, channel_id)
+                    mutator(state)
+                    state.compact_history()
+                    pipe.multi()
+                    version = _queue_redis_save(pipe, state, state.to_dict())
+                    pipe.execute()
+                _state_cache.put(key, version, state)
+                logger.info(f"Updated conversation state for {key} (attempt {attempt + 1})")
+                return state
+            except redis.exceptions.WatchError:
+                logger.info(f"Concurrent update detected for {key}, retrying")
+        raise RuntimeError(f"Failed to update state {key} after {retries + 1} attempts due to concurrent updates")
+
+    if isinstance(backend, str) and backend.startswith('/'):  # file backend
+        # 読み込みから書き込みまでアドバイザリロックを保持し、他のプロセスの更新と直列化する
+        with _state_file_lock(backend, key):
+            state_data = _read_state_file(backend, key)
+            state = ConversationState.from_dict(state_data) if state_data else None
+            if state is None or state.is_expired():
+                state = ConversationState(thread_ts, channel_id)
+            mutator(state)
+            state.compact_history()
+            _write_state_file(backend, state, state.to_dict())
+        return state
+
+    # memory バックエンドは同一プロセス内の更新をロックで直列化する
+    with _update_locks[hash(key) % len(_update_locks)]:
+        state = get_state(thread_ts, channel_id) or ConversationState(thread_ts, channel_id)
+        mutator(state)
+        save_state(state)
+        return state
 
 def delete_state(thread_ts: str, channel_id: str):
     """会話状態を削除"""
@@ -280,12 +736,17 @@ def delete_state(thread_ts: str, channel_id: str):
     try:
         if backend == 'memory':
             _memory_store.pop(key, None)
+            _expiry_index.discard(key)
         elif isinstance(backend, str) and backend.startswith('/'):  # file backend
-            file_path = os.path.join(backend, f"{key}.json")
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            with _state_file_lock(backend, key):
+                _remove_quietly(_state_file_path(backend, key))
+            _expiry_index.discard(key)
         elif hasattr(backend, 'delete'):  # Redis
-            backend.delete(f"conversation_state:{key}")
+            _state_cache.invalidate(key)
+            pipe = backend.pipeline(transaction=False)
+            pipe.delete(f"conversation_state:{key}", f"conversation_state_version:{key}")
+            pipe.zrem(REDIS_STATE_INDEX_KEY, key)
+            pipe.execute()
         elif hasattr(backend, 'Table'):  # DynamoDB
             table = backend.Table(os.environ.get('DYNAMODB_TABLE', 'meta_analysis_states'))
             table.delete_item(Key={'state_key': key})
@@ -296,42 +757,38 @@ def delete_state(thread_ts: str, channel_id: str):
         logger.error(f"Error deleting state {key}: {e}")
 
 def cleanup_expired_states():
-    """期限切れの状態をクリーンアップ"""
+    """期限切れの状態をクリーンアップ（有効期限インデックスから期限切れのキーだけを削除）"""
     backend = _get_storage_backend()
     expired_count = 0
+    now = time.time()
     
     try:
         if backend == 'memory':
-            expired_keys = []
-            for key, state_data in list(_memory_store.items()):
-                try:
-                    state = ConversationState.from_dict(state_data)
-                    if state.is_expired():
-                        expired_keys.append(key)
-                except Exception:
-                    expired_keys.append(key)  # 破損したデータも削除
-            
-            for key in expired_keys:
-                _memory_store.pop(key, None)
-            expired_count = len(expired_keys)
+            for key in _expiry_index.pop_expired(now):
+                if _memory_store.pop(key, None) is not None:
+                    expired_count += 1
             
         elif isinstance(backend, str) and backend.startswith('/'):  # file backend
-            if os.path.exists(backend):
-                for filename in os.listdir(backend):
-                    if filename.endswith('.json'):
-                        file_path = os.path.join(backend, filename)
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                state_data = json.load(f)
-                            state = ConversationState.from_dict(state_data)
-                            if state.is_expired():
-                                os.remove(file_path)
-                                expired_count += 1
-                        except Exception:
-                            os.remove(file_path)  # 破損したファイルも削除
-                            expired_count += 1
+            _index_state_dir(backend)
+            for key in _expiry_index.pop_expired(now):
+                file_path = _state_file_path(backend, key)
+                with _state_file_lock(backend, key):
+                    try:
+                        expires_at = os.path.getmtime(file_path) + STATE_EXPIRY_HOURS * 3600
+                    except FileNotFoundError:
+                        continue
+                    if expires_at > now:
+                        # 他のプロセスが更新した場合は新しい期限で登録し直す
+                        _expiry_index.set(key, expires_at)
+                        continue
+                    os.remove(file_path)
+                expired_count += 1
                             
-        # Redis/DynamoDBは自動的にTTLで削除されるため、明示的なクリーンアップは不要
+        elif hasattr(backend, 'zremrangebyscore'):  # Redis
+            # 状態本体はTTLで自動的に削除されるため、有効期限インデックスから期限切れのキーだけを取り除く
+            expired_count = backend.zremrangebyscore(REDIS_STATE_INDEX_KEY, '-inf', now)
+        
+        # DynamoDBは自動的にTTLで削除されるため、明示的なクリーンアップは不要
         
         if expired_count > 0:
             logger.info(f"Cleaned up {expired_count} expired conversation states")
@@ -339,4 +796,34 @@ def cleanup_expired_states():
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
         
-    return expired_count
\ No newline at end of file
+    return expired_count
+
+
+def _sweep_expired_states(stop_event: threading.Event):
+    while not stop_event.wait(STATE_CLEANUP_INTERVAL_SECONDS):
+        cleanup_expired_states()
+
+
+def start_state_expiry_sweeper():
+    """期限切れ状態を定期的に削除するバックグラウンドスレッドを起動（起動済みなら何もしない）"""
+    global _sweeper_thread
+    with _sweeper_lock:
+        # fork後の子プロセスではスレッドが引き継がれないため is_alive() が False になり再起動される
+        if _sweeper_thread is not None and _sweeper_thread.is_alive():
+            return
+        _sweeper_stop.clear()
+        _sweeper_thread = threading.Thread(
+            target=_sweep_expired_states, args=(_sweeper_stop,), name="state-expiry-sweeper", daemon=True
+        )
+        _sweeper_thread.start()
+        logger.info(f"State expiry sweeper started (interval: {STATE_CLEANUP_INTERVAL_SECONDS}s)")
+
+
+def stop_state_expiry_sweeper():
+    """期限切れ状態の定期削除スレッドを停止"""
+    global _sweeper_thread
+    with _sweeper_lock:
+        if _sweeper_thread is not None:
+            _sweeper_stop.set()
+            _sweeper_thread.join(timeout=5)
+            _sweeper_thread = None
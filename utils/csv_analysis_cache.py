@@ -0,0 +1,132 @@
+"""
+Gemini CSV分析結果キャッシュ
+
+GeminiClient.analyze_csv がGeminiに送る内容（ヘッダーとサンプル行、研究数）から正規化した
+フィンガープリントを作り、構造化された分析結果（detected_columns, suggested_analysis など）を保存します。
+同じデータセットが別のスレッドやチャンネルで共有された場合は、Geminiを呼ばずに結果を返します。
+
+キャッシュキー = sha256(プロンプトのバージョン + モデル名 + 研究数 + 正規化したCSVサンプル)
+
+STORAGE_BACKEND=redis の場合はRedis（TTLで自動削除）、それ以外はローカルディスクに保存します。
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from utils import conversation_state
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの有効化（false で無効）
+CSV_ANALYSIS_CACHE_ENABLED = os.environ.get('CSV_ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+
+# キャッシュの有効期限（時間）
+CSV_ANALYSIS_CACHE_TTL_HOURS = int(os.environ.get('CSV_ANALYSIS_CACHE_TTL_HOURS', '168'))
+
+# ローカルディスクに保持する最大エントリ数（古い順に削除）
+CSV_ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('CSV_ANALYSIS_CACHE_MAX_ENTRIES', '1000'))
+
+# キャッシュディレクトリ
+CSV_ANALYSIS_CACHE_DIR = Path(os.environ.get(
+    'CSV_ANALYSIS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'meta_analysis_bot_csv_analysis_cache')
+))
+
+# Geminiに送るCSVサンプルの最大文字数（GeminiClient.analyze_csv のプロンプトと合わせる）
+CSV_SAMPLE_CHARS = 3000
+
+
+def compute_csv_fingerprint(csv_content: str, prompt_version: str, model_name: str,
+                            schema_description: str = "") -> str:
+    """
+    Geminiに送られる内容のフィンガープリントを計算します。
+    改行コード・行頭末尾の空白・空行の違いは同じデータとして扱います。
+
+    schema_description（csv_ingest.describe_schema の結果）はプロンプトに含まれるため、
+    先頭 CSV_SAMPLE_CHARS 文字より後ろの行で列の型が変わる場合も別のキーになります。
+    """
+    csv_lines = [line.strip() for line in csv_content.strip().split('\n') if line.strip()]
+    data_rows = len(csv_lines) - 1 if csv_lines else 0
+    sample = '\n'.join(csv_lines)[:CSV_SAMPLE_CHARS]
+    key_parts = [prompt_version, model_name, data_rows, sample]
+    if schema_description:
+        key_parts.append(schema_description)
+    key_source = json.dumps(key_parts, ensure_ascii=False)
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+
+def _get_redis_backend():
+    """Redisバックエンドを取得（Redis設定でない、または接続できない場合はNone）"""
+    if conversation_state.STORAGE_BACKEND != 'redis':
+        return None
+    backend = conversation_state.get_storage_backend()
+    return backend if hasattr(backend, 'setex') else None
+
+
+def get_cached_csv_analysis(fingerprint: str) -> Optional[Dict[str, Any]]:
+    """キャッシュ済みの分析結果を取得（無い・期限切れの場合は None）"""
+    if not CSV_ANALYSIS_CACHE_ENABLED:
+        return None
+    try:
+        redis_backend = _get_redis_backend()
+        if redis_backend is not None:
+            cached = redis_backend.get(f"csv_analysis:{fingerprint}")
+            return json.loads(cached) if cached else None
+
+        cache_path = CSV_ANALYSIS_CACHE_DIR / f"{fingerprint}.json"
+        if not cache_path.exists():
+            return None
+        if time.time() - cache_path.stat().st_mtime > CSV_ANALYSIS_CACHE_TTL_HOURS * 3600:
+            cache_path.unlink(missing_ok=True)
+            return None
+        result = json.loads(cache_path.read_text(encoding='utf-8'))
+        os.utime(cache_path)  # LRU用にアクセス時刻を更新
+        return result
+    except Exception as e:
+        logger.error(f"Error reading CSV analysis cache {fingerprint[:12]}: {e}")
+        return None
+
+
+def store_csv_analysis(fingerprint: str, result: Dict[str, Any]):
+    """分析結果をキャッシュに保存"""
+    if not CSV_ANALYSIS_CACHE_ENABLED:
+        return
+    try:
+        result_json = json.dumps(result, ensure_ascii=False)
+        redis_backend = _get_redis_backend()
+        if redis_backend is not None:
+            redis_backend.setex(f"csv_analysis:{fingerprint}", CSV_ANALYSIS_CACHE_TTL_HOURS * 3600, result_json)
+        else:
+            CSV_ANALYSIS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            cache_path = CSV_ANALYSIS_CACHE_DIR / f"{fingerprint}.json"
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(result_json, encoding='utf-8')
+            os.replace(tmp_path, cache_path)
+            _prune_cache()
+        logger.info(f"Stored CSV analysis in cache ({fingerprint[:12]})")
+    except Exception as e:
+        logger.error(f"Error storing CSV analysis cache {fingerprint[:12]}: {e}")
+
+
+def _prune_cache():
+    """期限切れと上限超過分（最終アクセスが古い順）のローカルキャッシュを削除"""
+    entries = []
+    cutoff = time.time() - CSV_ANALYSIS_CACHE_TTL_HOURS * 3600
+    for path in CSV_ANALYSIS_CACHE_DIR.glob("*.json"):
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            continue
+        if mtime < cutoff:
+            path.unlink(missing_ok=True)
+        else:
+            entries.append((mtime, path))
+    excess = len(entries) - CSV_ANALYSIS_CACHE_MAX_ENTRIES
+    if excess > 0:
+        for _, path in sorted(entries)[:excess]:
+            path.unlink(missing_ok=True)
+        logger.info(f"Pruned {excess} CSV analysis cache entries")
@@ -0,0 +1,174 @@
+"""
+CSV取り込みユーティリティ
+
+アップロードされたCSVのバイト列を一度だけデコード・パースし、以降の処理（列検出・Gemini・R）が
+共通して使う正規化済みCSVとスキーママニフェストを作成します。
+
+- エンコーディング（BOM付きUTF-8 / UTF-16 / UTF-8 / CP932）と区切り文字を判定
+- 列ごとの型（整数・数値・文字列）を推定し、桁区切りカンマ（例: "14,210"）と欠損値トークンを正規化
+- 列名は file_utils.clean_column_names と同じ規則でクリーンアップ
+
+正規化済みCSVは UTF-8・カンマ区切り・欠損値は空欄で、数値列にカンマは含まれません。
+"""
+import io
+import re
+import logging
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from utils.file_utils import clean_column_names
+
+logger = logging.getLogger(__name__)
+
+# スキーママニフェストの形式のバージョン
+CSV_SCHEMA_VERSION = 1
+
+# 欠損値として扱う文字列（Rの read.csv の na.strings と揃える）
+NA_TOKENS = ['NA', 'na', 'N/A', 'n/a', '']
+
+# 区切り文字の候補（先頭行で最も多く現れるものを使い、同数ならカンマ）
+DELIMITER_CANDIDATES = [',', '\t', ';']
+
+_PLAIN_NUMBER = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+_THOUSANDS_NUMBER = re.compile(r'^[+-]?\d{1,3}(,\d{3})+(\.\d+)?$')
+_AUTO_COLUMN_NAME = re.compile(r'^Unnamed: \d+$')
+
+
+def sniff_encoding(raw: bytes) -> Tuple[str, bool]:
+    """
+    バイト列のエンコーディングを判定
+
+    Returns:
+        (encoding, has_bom) — encoding は bytes.decode にそのまま渡せる名前
+
+    Raises:
+        UnicodeDecodeError: UTF-8 と CP932 のどちらでもデコードできない場合
+    """
+    if raw.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig', True
+    if raw.startswith(b'\xff\xfe') or raw.startswith(b'\xfe\xff'):
+        return 'utf-16', True
+    try:
+        raw.decode('utf-8')
+        return 'utf-8', False
+    except UnicodeDecodeError:
+        logger.warning("UTF-8 decoding failed, trying CP932 (Shift-JIS)")
+    # CP932 は Windows版Excelが出力するShift-JISの上位互換
+    raw.decode('cp932')
+    return 'cp932', False
+
+
+def sniff_delimiter(text: str) -> str:
+    """先頭の空でない行から区切り文字を判定"""
+    header = next((line for line in text.splitlines() if line.strip()), '')
+    counts = {delimiter: header.count(delimiter) for delimiter in DELIMITER_CANDIDATES}
+    best = max(DELIMITER_CANDIDATES, key=lambda delimiter: counts[delimiter])
+    return best if counts[best] > counts[','] else ','
+
+
+def _infer_column(series: pd.Series) -> Tuple[pd.Series, str, bool]:
+    """文字列の列から型を推定し、(変換後の列, dtype, 桁区切りカンマを含むか) を返す"""
+    values = series.dropna().str.strip()
+    if values.empty:
+        return series, "string", False
+    plain = values.str.match(_PLAIN_NUMBER)
+    thousands = ~plain & values.str.match(_THOUSANDS_NUMBER)
+    if not (plain | thousands).all():
+        return series, "string", False
+
+    numbers = pd.to_numeric(series.str.strip().str.replace(',', '', regex=False), errors='coerce')
+    is_integer = not values.str.contains(r'[.eE]', regex=True).any() and bool((numbers.dropna() == numbers.dropna().round()).all())
+    if is_integer:
+        return numbers.astype('Int64'), "integer", bool(thousands.any())
+    return numbers.astype(float), "number", bool(thousands.any())
+
+
+def ingest_csv(content: Union[bytes, str]) -> Dict[str, Any]:
+    """
+    CSVを一度だけデコード・パースし、正規化済みCSVとスキーママニフェストを作成
+
+    Args:
+        content: アップロードされたCSVのバイト列（または既にデコード済みの文字列）
+
+    Returns:
+        {
+            "text": デコード済みの元のCSVテキスト（BOMは除去）,
+            "dataframe": 型変換済みのDataFrame（列名は元のまま）,
+            "csv_bytes": 正規化済みCSV（UTF-8、列名はクリーンアップ済み）,
+            "column_mapping": {元の列名: クリーンアップ後の列名},
+            "schema": スキーママニフェスト
+        }
+
+    Raises:
+        UnicodeDecodeError: エンコーディングを判定できない場合
+        pandas.errors.ParserError / EmptyDataError: CSVとしてパースできない場合
+    """
+    if isinstance(content, str):
+        encoding, has_bom = 'utf-8', content.startswith('\ufeff')
+        text = content.lstrip('\ufeff')
+    else:
+        encoding, has_bom = sniff_encoding(content)
+        text = content.decode(encoding).lstrip('\ufeff')
+    delimiter = sniff_delimiter(text)
+
+    dat = pd.read_csv(
+        io.StringIO(text), sep=delimiter, dtype=str, keep_default_na=False, na_values=NA_TOKENS,
+        skipinitialspace=True
+    )
+    # Excel由来の末尾の空行・空列を除去
+    dat = dat.dropna(how='all')
+    empty_auto_columns = [col for col in dat.columns if _AUTO_COLUMN_NAME.match(str(col)) and dat[col].isna().all()]
+    dat = dat.drop(columns=empty_auto_columns).reset_index(drop=True)
+
+    column_schemas: List[Dict[str, Any]] = []
+    for col in dat.columns:
+        converted, dtype, has_thousands = _infer_column(dat[col])
+        dat[col] = converted
+        column_schemas.append({
+            "original_name": str(col),
+            "dtype": dtype,
+            "na_count": int(dat[col].isna().sum()),
+            "thousands_separator": has_thousands
+        })
+
+    normalized = dat.copy(deep=False)
+    normalized, column_mapping = clean_column_names(normalized)
+    for column_schema, cleaned_name in zip(column_schemas, normalized.columns):
+        column_schema["name"] = cleaned_name
+
+    csv_buffer = io.StringIO()
+    normalized.to_csv(csv_buffer, index=False, na_rep='')
+
+    schema = {
+        "version": CSV_SCHEMA_VERSION,
+        "encoding": encoding,
+        "bom": has_bom,
+        "delimiter": delimiter,
+        "n_rows": len(dat),
+        "na_tokens": NA_TOKENS,
+        "columns": column_schemas
+    }
+    logger.info(f"Ingested CSV: {len(dat)} rows, {len(column_schemas)} columns "
+                f"(encoding: {encoding}, delimiter: {delimiter!r})")
+    return {
+        "text": text,
+        "dataframe": dat,
+        "csv_bytes": csv_buffer.getvalue().encode('utf-8'),
+        "column_mapping": column_mapping,
+        "schema": schema
+    }
+
+
+def describe_schema(schema: Optional[Dict[str, Any]]) -> str:
+    """スキーママニフェストをプロンプト用の短いテキストに変換"""
+    if not schema:
+        return ""
+    dtype_labels = {"integer": "整数", "number": "数値", "string": "文字列"}
+    lines = []
+    for column in schema["columns"]:
+        line = f"- {column['original_name']}: {dtype_labels.get(column['dtype'], column['dtype'])}"
+        if column["na_count"]:
+            line += f"（欠損 {column['na_count']}件）"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,174 @@
+"""
+アップロード済みデータセットストア
+
+CSV受付時（csv_handler）にダウンロード・デコード・列名クリーンアップ済みのCSVと
+列名マッピングを保存し、解析段階（analysis_handler）でSlackから再ダウンロードせずに
+再利用できるようにします。
+
+キーはSlackのファイルIDで、内容はコンテンツハッシュで識別します。
+STORAGE_BACKEND=redis の場合はRedis（複数dyno間で共有）、それ以外はローカルディスクに保存します。
+有効期限は会話状態と同じ STATE_EXPIRY_HOURS です。
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+from utils import conversation_state
+from utils.conversation_state import STATE_EXPIRY_HOURS
+from utils.file_utils import clean_csv_content
+
+logger = logging.getLogger(__name__)
+
+DATASET_STORE_DIR = Path(tempfile.gettempdir()) / "meta_analysis_bot_datasets"
+
+
+def compute_content_hash(content: bytes) -> str:
+    """データセット内容のハッシュ"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def _get_redis_backend():
+    """Redisバックエンドを取得（Redis設定でない、または接続できない場合はNone）"""
+    if conversation_state.STORAGE_BACKEND != 'redis':
+        return None
+    backend = conversation_state.get_storage_backend()
+    return backend if hasattr(backend, 'setex') else None
+
+
+def store_dataset(file_id: str, csv_bytes: bytes, original_filename: str = "data.csv",
+                  precleaned_column_mapping: Optional[Dict[str, str]] = None,
+                  schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    CSVの列名を一度だけクリーンアップし、列名マッピングとともに保存します。
+
+    Args:
+        file_id: SlackのファイルID（テキスト貼り付けの場合は呼び出し側で生成したID）
+        csv_bytes: デコード可能なCSVバイト列（Excelの場合は変換後のCSV）
+        original_filename: 元のファイル名
+        precleaned_column_mapping: 指定された場合は csv_ingest で正規化済みとみなし、再パースしない
+        schema: csv_ingest のスキーママニフェスト（メタ情報に保存する）
+
+    Returns:
+        {"file_id": ..., "content_hash": ...} 会話状態のfile_infoに保存する参照情報
+    """
+    if precleaned_column_mapping is None:
+        cleaned_csv, column_mapping = clean_csv_content(csv_bytes)
+    else:
+        cleaned_csv, column_mapping = csv_bytes, precleaned_column_mapping
+    content_hash = compute_content_hash(cleaned_csv)
+    meta = {
+        "file_id": file_id,
+        "content_hash": content_hash,
+        "column_mapping": column_mapping,
+        "schema": schema,
+        "original_filename": original_filename,
+        "stored_at": time.time()
+    }
+    expiry_seconds = STATE_EXPIRY_HOURS * 3600
+
+    try:
+        redis_backend = _get_redis_backend()
+        if redis_backend is not None:
+            # 内容はハッシュ単位で1つだけ保持し、同じデータの再アップロードでは共有する
+            redis_backend.setex(f"dataset_content:{content_hash}", expiry_seconds, cleaned_csv.decode('utf-8'))
+            redis_backend.setex(f"dataset:{file_id}", expiry_seconds, json.dumps(meta, ensure_ascii=False))
+        else:
+            cleanup_expired_datasets()
+            DATASET_STORE_DIR.mkdir(parents=True, exist_ok=True)
+            content_path = DATASET_STORE_DIR / f"{content_hash}.csv"
+            if not content_path.exists():
+                _write_atomic(content_path, cleaned_csv)
+            else:
+                os.utime(content_path)
+            meta_path = DATASET_STORE_DIR / f"{_safe_file_id(file_id)}.json"
+            # 同じファイルの再保存中に load_dataset が書きかけのJSONを読まないよう、メタ情報も置き換えで書き込む
+            _write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        logger.info(f"Stored dataset {file_id} (hash: {content_hash[:12]}, {len(cleaned_csv)} bytes)")
+    except Exception as e:
+        logger.error(f"Error storing dataset {file_id}: {e}")
+
+    return {"file_id": file_id, "content_hash": content_hash}
+
+
+def load_dataset(file_id: str, content_hash: Optional[str] = None) -> Optional[Tuple[bytes, Optional[Dict[str, str]]]]:
+    """
+    保存済みのデータセットを取得します。
+
+    Args:
+        file_id: SlackのファイルID
+        content_hash: 指定された場合、保存内容のハッシュと一致するときのみ返す
+
+    Returns:
+        (cleaned_csv, column_mapping) または見つからない・期限切れの場合は None
+    """
+    try:
+        redis_backend = _get_redis_backend()
+        if redis_backend is not None:
+            meta_json = redis_backend.get(f"dataset:{file_id}")
+            if not meta_json:
+                return None
+            meta = json.loads(meta_json)
+            if content_hash and meta["content_hash"] != content_hash:
+                return None
+            content = redis_backend.get(f"dataset_content:{meta['content_hash']}")
+            if content is None:
+                return None
+            return content.encode('utf-8'), meta.get("column_mapping")
+
+        meta_path = DATASET_STORE_DIR / f"{_safe_file_id(file_id)}.json"
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        if content_hash and meta["content_hash"] != content_hash:
+            return None
+        content_path = DATASET_STORE_DIR / f"{meta['content_hash']}.csv"
+        if time.time() - meta["stored_at"] > STATE_EXPIRY_HOURS * 3600 or not content_path.exists():
+            meta_path.unlink(missing_ok=True)
+            return None
+        return content_path.read_bytes(), meta.get("column_mapping")
+
+    except Exception as e:
+        logger.error(f"Error loading dataset {file_id}: {e}")
+        return None
+
+
+def cleanup_expired_datasets() -> int:
+    """期限切れのローカルデータセットを削除（Redisは TTL で自動削除される）"""
+    if not DATASET_STORE_DIR.exists():
+        return 0
+    cutoff = time.time() - STATE_EXPIRY_HOURS * 3600
+    removed = 0
+    for path in DATASET_STORE_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Cleaned up {removed} expired dataset files")
+    return removed
+
+
+def _write_atomic(path: Path, data: bytes):
+    """同じディレクトリの一時ファイルに書き込んでから os.replace で置き換える"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _safe_file_id(file_id: str) -> str:
+    return "".join(c if c.isalnum() or c in ['-', '_'] else '_' for c in file_id)
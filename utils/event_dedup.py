@@ -0,0 +1,159 @@
+"""
+Slackイベントの重複排除
+
+Slackはackが遅れると同じイベントを再送します（X-Slack-Retry-Num ヘッダー）。再送されたイベントで
+handle_app_mention / handle_direct_message が二度目のCSV分析や対話のターンを始めないよう、
+event_id（とメッセージの client_msg_id）を一定時間記録し、記録済みのイベントはハンドラーに渡す前に捨てます。
+
+記録はプロセス内のTTL付きの集合で行い、STORAGE_BACKEND=redis の場合は SET NX EX で複数のdynoと共有します。
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from utils import conversation_state
+
+logger = logging.getLogger(__name__)
+
+EVENT_DEDUP_ENABLED = os.environ.get('EVENT_DEDUP_ENABLED', 'true').lower() == 'true'
+
+# イベントを記録しておく秒数（Slackの再送は最大3回、約5分後まで）
+EVENT_DEDUP_TTL_SECONDS = int(os.environ.get('EVENT_DEDUP_TTL_SECONDS', '600'))
+
+# プロセス内で記録するイベント数の上限（超えた分は古いものから削除）
+EVENT_DEDUP_MAX_KEYS = int(os.environ.get('EVENT_DEDUP_MAX_KEYS', '10000'))
+
+REDIS_EVENT_DEDUP_PREFIX = "slack_event"
+
+
+def event_keys(body: Dict[str, Any]) -> List[str]:
+    """
+    重複の判定に使うキー
+
+    event_id は再送でも変わらず、client_msg_id は同じメッセージが別の event_id で届いた場合にも一致します
+    （イベントの種類ごとに分けるため、同じメッセージの app_mention と message は別々に処理されます）。
+    """
+    if body.get("type") != "event_callback":
+        return []
+    keys = []
+    if body.get("event_id"):
+        keys.append(f"event:{body['event_id']}")
+    event = body.get("event") or {}
+    if event.get("client_msg_id"):
+        keys.append(f"message:{event.get('type')}:{event['client_msg_id']}")
+    return keys
+
+
+class EventDeduplicator:
+    """TTL付きの集合（任意でRedis SET NX）による処理済みイベントの記録"""
+
+    def __init__(self, ttl: int = EVENT_DEDUP_TTL_SECONDS, max_keys: int = EVENT_DEDUP_MAX_KEYS,
+                 redis_client=None):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.redis_client = redis_client
+        self.seen: "OrderedDict[str, float]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.metrics = {"processed": 0, "duplicates": 0, "retries": 0, "redis_errors": 0}
+
+    def _claim_local(self, key: str, now: float) -> bool:
+        expires = self.seen.get(key)
+        if expires is not None and expires > now:
+            return False
+        self.seen[key] = now + self.ttl
+        self.seen.move_to_end(key)
+        while self.seen and (len(self.seen) > self.max_keys or next(iter(self.seen.values())) <= now):
+            self.seen.popitem(last=False)
+        return True
+
+    def _claim_redis(self, key: str) -> bool:
+        if self.redis_client is None:
+            return True
+        try:
+            return bool(self.redis_client.set(f"{REDIS_EVENT_DEDUP_PREFIX}:{key}", "1", nx=True, ex=self.ttl))
+        except Exception as e:
+            # Redisに接続できない場合はプロセス内の記録だけで判定する
+            with self.lock:
+                self.metrics["redis_errors"] += 1
+            logger.warning(f"Event dedup via Redis failed (using in-memory only): {e}")
+            return True
+
+    def is_duplicate(self, keys: List[str], retry_num: Optional[int] = None) -> bool:
+        """
+        いずれかのキーが記録済みなら重複と判定し、そうでなければすべてのキーを記録します。
+
+        Args:
+            keys: event_keys の結果
+            retry_num: X-Slack-Retry-Num ヘッダーの値（再送の件数を記録するため）
+        """
+        if not keys:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            if retry_num:
+                self.metrics["retries"] += 1
+            fresh = [self._claim_local(key, now) for key in keys]
+        # プロセス内で初めてのキーだけRedisに問い合わせる（同じプロセスへの再送はRedisに行かずに捨てる）
+        duplicate = not all(fresh) or not all([self._claim_redis(key) for key in keys])
+        with self.lock:
+            self.metrics["duplicates" if duplicate else "processed"] += 1
+        return duplicate
+
+    def get_metrics(self) -> Dict[str, int]:
+        """処理したイベント数・捨てた重複の数・再送を受けた数"""
+        with self.lock:
+            return dict(self.metrics)
+
+
+# グローバルインスタンス
+_event_deduplicator = None
+_event_deduplicator_lock = threading.Lock()
+
+
+def _get_redis_backend():
+    """Redisバックエンドを取得（Redis設定でない、または接続できない場合はNone）"""
+    if conversation_state.STORAGE_BACKEND != 'redis':
+        return None
+    backend = conversation_state.get_storage_backend()
+    return backend if hasattr(backend, 'setex') else None
+
+
+def get_event_deduplicator() -> EventDeduplicator:
+    """重複排除のシングルトンを取得"""
+    global _event_deduplicator
+    with _event_deduplicator_lock:
+        if _event_deduplicator is None:
+            _event_deduplicator = EventDeduplicator(redis_client=_get_redis_backend())
+        return _event_deduplicator
+
+
+def _header(headers: Optional[Dict[str, Any]], name: str) -> Optional[str]:
+    value = (headers or {}).get(name)
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    return str(value) if value is not None else None
+
+
+def is_duplicate_event(body: Dict[str, Any], headers: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    処理済みのイベント（Slackの再送を含む）ならTrue
+
+    Args:
+        body: Slackのリクエストボディ
+        headers: リクエストヘッダー（Boltのように値がリストでもよい）
+    """
+    if not EVENT_DEDUP_ENABLED:
+        return False
+    keys = event_keys(body)
+    if not keys:
+        return False
+    raw = _header(headers, "x-slack-retry-num")
+    retry_num = int(raw) if raw and raw.isdigit() else None
+    duplicate = get_event_deduplicator().is_duplicate(keys, retry_num=retry_num)
+    if duplicate:
+        reason = _header(headers, "x-slack-retry-reason")
+        logger.info(f"Dropped duplicate Slack event {body.get('event_id')} (retry: {retry_num}, reason: {reason})")
+    return duplicate
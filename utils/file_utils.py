@@ -1,16 +1,43 @@
 import asyncio
 import os
 import aiohttp
+import hashlib
 import logging
 import tempfile
-import pandas as pd
-import io
+import weakref
 import re
 from pathlib import Path
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, Any
 
 logger = logging.getLogger(__name__)
 
+# Slackからダウンロードするファイルの最大サイズ（バイト）
+SLACK_DOWNLOAD_MAX_BYTES = int(os.environ.get('SLACK_DOWNLOAD_MAX_MB', '50')) * 1024 * 1024
+
+# ダウンロード時にディスクへ書き込むチャンクサイズ（バイト）
+SLACK_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# 接続断などで中断したダウンロードを続きから再開する回数
+SLACK_DOWNLOAD_MAX_RETRIES = int(os.environ.get('SLACK_DOWNLOAD_MAX_RETRIES', '3'))
+
+# ダウンロード全体のタイムアウト（秒）
+SLACK_DOWNLOAD_TIMEOUT = float(os.environ.get('SLACK_DOWNLOAD_TIMEOUT', '120'))
+
+# 共有HTTPセッションの同時接続数の上限（全体 / 接続先ホストごと）
+HTTP_CONNECTION_LIMIT = int(os.environ.get('HTTP_CONNECTION_LIMIT', '20'))
+HTTP_CONNECTION_LIMIT_PER_HOST = int(os.environ.get('HTTP_CONNECTION_LIMIT_PER_HOST', '10'))
+
+# イベントループごとの共有aiohttpセッション（セッションは作成したループでしか使えない）
+_http_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+
+class FileTooLargeError(ValueError):
+    """ダウンロードするファイルが上限サイズを超えた"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"ファイルサイズが上限（{max_bytes // (1024 * 1024)}MB）を超えています")
+        self.max_bytes = max_bytes
+
 def make_gemini_safe_name(column_name: str) -> str:
     """
     GeminiのJSON出力で問題が起きにくい列名に変換
@@ -109,28 +136,127 @@ def clean_column_names(df):
     
     return df, column_mapping
 
-async def download_slack_file_content_async(file_url: str, bot_token: str) -> bytes:
+def get_http_session() -> aiohttp.ClientSession:
+    """実行中のイベントループで共有するaiohttpセッションを取得（接続数を制限し、コネクションを再利用する）"""
+    loop = asyncio.get_running_loop()
+    session = _http_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_CONNECTION_LIMIT, limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST)
+        session = aiohttp.ClientSession(connector=connector)
+        _http_sessions[loop] = session
+    return session
+
+async def close_http_session():
+    """実行中のイベントループの共有aiohttpセッションを閉じる（ループ停止前に呼ぶ）"""
+    session = _http_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+async def download_slack_file_to_path_async(file_url: str, bot_token: str, dest_path: Path,
+                                            max_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    SlackのプライベートURLからファイルをチャンク単位でディスクに書き込みながらダウンロードする。
+    
+    メモリ使用量はチャンクサイズ程度に抑えられ、書き込みと同時にSHA-256を計算する。
+    接続断などで中断した場合は Range ヘッダーで続きから再開する。
+    
+    Returns:
+        dict: {"path": 保存先, "size": バイト数, "sha256": 内容のハッシュ}
+    
+    Raises:
+        FileTooLargeError: ファイルサイズが max_bytes を超えた場合（保存先ファイルは削除される）
+    """
+    max_bytes = SLACK_DOWNLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    session = get_http_session()
+    timeout = aiohttp.ClientTimeout(total=SLACK_DOWNLOAD_TIMEOUT)
+    hasher = hashlib.sha256()
+    received = 0
+    attempt = 0
+    
+    try:
+        with open(dest_path, 'wb') as f:
+            while True:
+                headers = {"Authorization": f"Bearer {bot_token}"}
+                if received:
+                    headers["Range"] = f"bytes={received}-"
+                try:
+                    async with session.get(file_url, headers=headers, timeout=timeout) as response:
+                        response.raise_for_status()  # エラーがあれば例外を発生させる
+                        if received and response.status != 206:
+                            # サーバーがRangeに対応していない場合は最初からやり直す
+                            logger.warning(f"Server ignored range request for {file_url}, restarting download")
+                            f.seek(0)
+                            f.truncate()
+                            hasher = hashlib.sha256()
+                            received = 0
+                        if response.content_length is not None and received + response.content_length > max_bytes:
+                            raise FileTooLargeError(max_bytes)
+                        async for chunk in response.content.iter_chunked(SLACK_DOWNLOAD_CHUNK_SIZE):
+                            received += len(chunk)
+                            if received > max_bytes:
+                                raise FileTooLargeError(max_bytes)
+                            f.write(chunk)
+                            hasher.update(chunk)
+                    break
+                except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    attempt += 1
+                    if attempt > SLACK_DOWNLOAD_MAX_RETRIES:
+                        raise
+                    logger.warning(f"Download of {file_url} interrupted at {received} bytes ({e}), "
+                                   f"retrying ({attempt}/{SLACK_DOWNLOAD_MAX_RETRIES})")
+                    await asyncio.sleep(min(0.5 * 2 ** attempt, 5))
+    except BaseException:
+        Path(dest_path).unlink(missing_ok=True)
+        raise
+    
+    logger.info(f"Successfully downloaded {received} bytes from {file_url} to {dest_path}")
+    return {"path": Path(dest_path), "size": received, "sha256": hasher.hexdigest()}
+
+async def download_slack_file_content_async(file_url: str, bot_token: str, max_bytes: Optional[int] = None) -> bytes:
     """
     SlackのプライベートURLからファイルの内容を非同期でダウンロードする。
+    
+    一時ファイルにストリーミングで保存してから読み込むため、受信中のバッファは溜まらず、
+    返り値の大きさも max_bytes で制限される。
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix="slack_download_")
+    os.close(fd)
+    try:
+        await download_slack_file_to_path_async(file_url, bot_token, Path(tmp_path), max_bytes=max_bytes)
+        return await asyncio.to_thread(Path(tmp_path).read_bytes)
+    finally:
+        Path(tmp_path).unlink(missing_ok=True)
+
+def clean_csv_content(content: bytes) -> Tuple[bytes, Optional[Dict[str, str]]]:
+    """
+    CSVのバイト列をデコードし、列名をクリーンアップしたUTF-8のCSVバイト列を返す。
+    
+    Returns:
+        tuple: (cleaned_content, column_mapping)
+               処理に失敗した場合は元のコンテンツと None を返す
     """
-    headers = {"Authorization": f"Bearer {bot_token}"}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(file_url, headers=headers) as response:
-            response.raise_for_status()  # エラーがあれば例外を発生させる
-            logger.info(f"Successfully initiated download from {file_url}")
-            content = await response.read()
-            logger.info(f"Successfully read {len(content)} bytes from {file_url}")
-            return content
+    from utils.csv_ingest import ingest_csv
+    try:
+        # エンコーディング判定・パース・型の正規化は csv_ingest で一度だけ行う
+        ingested = ingest_csv(content)
+        return ingested["csv_bytes"], ingested["column_mapping"]
+        
+    except Exception as e:
+        logger.error(f"Error cleaning CSV column names: {e}")
+        # エラーが発生した場合は元のコンテンツをそのまま使用
+        return content, None
 
 async def save_content_to_temp_file(
     content: bytes, 
     job_id: str, 
-    original_filename: str = "uploaded_file.csv"
+    original_filename: str = "uploaded_file.csv",
+    precleaned_column_mapping: Optional[Dict[str, str]] = None
 ) -> Tuple[str, Path, Optional[Dict[str, str]]]:
     """
     バイトコンテンツを一時ファイルに保存し、そのパスとPathオブジェクトを返す。
     ファイル名は job_id と元のファイル名から生成する。
     CSVファイルの場合は列名をクリーンアップする。
+    precleaned_column_mapping が指定された場合はクリーンアップ済みとみなし、そのマッピングを返す。
     
     Returns:
         tuple: (file_path_str, file_path_obj, column_mapping)
@@ -150,40 +276,10 @@ async def save_content_to_temp_file(
     temp_file_name = f"{safe_original_filename_base}_{job_id}{ext}"
     temp_file_path = temp_dir_job / temp_file_name
     
-    # 列名マッピングの初期化
-    column_mapping = None
-    
     # CSVファイルの場合は列名をクリーンアップ
-    if ext.lower() == ".csv":
-        try:
-            # バイトデータをデコード（UTF-8を試し、失敗したらShift-JIS）
-            try:
-                csv_str = content.decode('utf-8')
-            except UnicodeDecodeError:
-                logger.warning("UTF-8 decoding failed, trying Shift-JIS")
-                csv_str = content.decode('shift_jis')
-            
-            # pandasでCSVを読み込み
-            df = pd.read_csv(io.StringIO(csv_str))
-            logger.info(f"Original column names: {list(df.columns)}")
-            
-            # 列名をクリーンアップ
-            df, column_mapping = clean_column_names(df)
-            logger.info(f"Cleaned column names: {list(df.columns)}")
-            logger.info(f"Column mapping: {column_mapping}")
-            
-            # クリーンアップしたCSVを文字列に変換
-            csv_buffer = io.StringIO()
-            df.to_csv(csv_buffer, index=False)
-            clean_csv_str = csv_buffer.getvalue()
-            
-            # UTF-8でバイトに変換
-            content = clean_csv_str.encode('utf-8')
-            
-        except Exception as e:
-            logger.error(f"Error cleaning CSV column names: {e}")
-            # エラーが発生した場合は元のコンテンツをそのまま使用
-            column_mapping = None
+    column_mapping = precleaned_column_mapping
+    if ext.lower() == ".csv" and precleaned_column_mapping is None:
+        content, column_mapping = clean_csv_content(content)
     
     with open(temp_file_path, 'wb') as f:
         f.write(content)
@@ -16,11 +16,15 @@ async def process_user_input_with_gemini(
     csv_columns: List[str],
     current_params: Dict[str, Any],
     conversation_history: List[Dict[str, str]],
-    csv_analysis: Dict[str, Any]
+    csv_analysis: Dict[str, Any],
+    history_summary: str = ""
 ) -> Dict[str, Any]:
     """
     Geminiを使用してユーザー入力を処理し、パラメータ抽出と応答生成を行う
     
+    Args:
+        history_summary: 会話状態に畳み込まれた古い会話履歴の要約（ConversationState.history_summary）
+    
     Returns:
         {
             "extracted_params": {...},  # 抽出されたパラメータ
@@ -47,7 +51,7 @@ async def process_user_input_with_gemini(
 {', '.join(csv_columns)}
 
 ## 会話履歴
-{format_conversation_history(conversation_history)}
+{format_conversation_history(conversation_history, history_summary)}
 
 ## 現在収集済みのパラメータ
 {json.dumps(current_params, ensure_ascii=False, indent=2)}
@@ -136,9 +140,11 @@ async def process_user_input_with_gemini(
         logger.error(f"Error in process_user_input_with_gemini: {e}", exc_info=True)
         return None
 
-def format_conversation_history(history: List[Dict[str, str]]) -> str:
-    """会話履歴を読みやすい形式にフォーマット"""
+def format_conversation_history(history: List[Dict[str, str]], history_summary: str = "") -> str:
+    """会話履歴を読みやすい形式にフォーマット（古い履歴の要約があれば先頭に付ける）"""
     formatted = []
+    if history_summary:
+        formatted.append(f"（これまでの会話の要約）\n{history_summary}\n（直近の会話）")
     for entry in history[-10:]:  # 最新10件のみ表示
         role = "ユーザー" if entry.get("role") == "user" else "ボット"
         content = entry.get("content", "")
@@ -0,0 +1,116 @@
+"""
+RのRDS形式（XDRシリアライズ バージョン2）でデータフレームを書き出すユーティリティ
+
+csv_ingest で型推定・正規化済みのデータセットを、Rが readRDS() の1回の呼び出しで
+型付きの data.frame として読み込めるように書き出します。RにもPythonにも追加パッケージは不要です。
+
+対応する列の型は数値（double）と文字列（UTF-8）のみで、欠損値は NA_real_ / NA_character_ になります。
+"""
+import os
+import struct
+import logging
+from pathlib import Path
+from typing import Dict, Any, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Rへのデータ受け渡し形式（csv: read.csv で読み込む、rds: Pythonで書き出したRDSを readRDS で読み込む）
+R_DATA_HANDOFF_FORMAT = os.environ.get('R_DATA_HANDOFF_FORMAT', 'csv').lower()
+
+# SEXPTYPE とフラグ（R の serialize.c と同じ値）
+_NILVALUE_SXP = 254
+_SYMSXP = 1
+_LISTSXP = 2
+_CHARSXP = 9
+_INTSXP = 13
+_REALSXP = 14
+_STRSXP = 16
+_VECSXP = 19
+_IS_OBJECT = 1 << 8
+_HAS_ATTR = 1 << 9
+_HAS_TAG = 1 << 10
+_UTF8_LEVELS = (1 << 3) << 12
+_ASCII_LEVELS = (1 << 6) << 12
+
+_NA_INTEGER = -2147483648
+# R の NA_real_ は下位ワードが 1954 の NaN
+_NA_REAL_BYTES = struct.pack('>II', 0x7FF00000, 1954)
+
+_R_VERSION = (4 << 16) | (0 << 8) | 0
+_MIN_READER_VERSION = (2 << 16) | (3 << 8) | 0
+
+
+def _int(value: int) -> bytes:
+    return struct.pack('>i', value)
+
+
+def _charsxp(value) -> bytes:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return _int(_CHARSXP) + _int(-1)
+    encoded = str(value).encode('utf-8')
+    levels = _ASCII_LEVELS if encoded.isascii() else _UTF8_LEVELS
+    return _int(_CHARSXP | levels) + _int(len(encoded)) + encoded
+
+
+def _strsxp(values) -> bytes:
+    return b''.join([_int(_STRSXP), _int(len(values))] + [_charsxp(value) for value in values])
+
+
+def _realsxp(values: np.ndarray) -> bytes:
+    values = np.asarray(values, dtype='>f8')
+    data = bytearray(values.tobytes())
+    for i in np.flatnonzero(np.isnan(values)):
+        data[i * 8:(i + 1) * 8] = _NA_REAL_BYTES
+    return _int(_REALSXP) + _int(len(values)) + bytes(data)
+
+
+def _attribute(name: str, value: bytes) -> bytes:
+    return _int(_LISTSXP | _HAS_TAG) + _int(_SYMSXP) + _charsxp(name) + value
+
+
+def serialize_data_frame(dat: pd.DataFrame) -> bytes:
+    """DataFrameをRDS形式（非圧縮）のバイト列に変換（数値型の列はdouble、それ以外は文字列）"""
+    columns = []
+    for name in dat.columns:
+        series = dat[name]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            columns.append(_realsxp(series.astype('float64').to_numpy(na_value=np.nan)))
+        else:
+            columns.append(_strsxp([None if pd.isna(value) else value for value in series.tolist()]))
+
+    attributes = b''.join([
+        _attribute('names', _strsxp([str(name) for name in dat.columns])),
+        _attribute('class', _strsxp(['data.frame'])),
+        # 行名は R と同じ省略形 c(NA_integer_, -nrow)
+        _attribute('row.names', _int(_INTSXP) + _int(2) + _int(_NA_INTEGER) + _int(-len(dat))),
+        _int(_NILVALUE_SXP),
+    ])
+    header = b'X\n' + _int(2) + _int(_R_VERSION) + _int(_MIN_READER_VERSION)
+    body = _int(_VECSXP | _IS_OBJECT | _HAS_ATTR) + _int(len(columns)) + b''.join(columns)
+    return header + body + attributes
+
+
+def write_dataset_rds(csv_path: Union[str, Path], schema: Dict[str, Any]) -> Path:
+    """
+    正規化済みCSVをスキーママニフェストの型で読み込み、同じ場所にRDSとして書き出す
+
+    Args:
+        csv_path: csv_ingest で正規化済みのCSV（UTF-8、欠損値は空欄、数値列にカンマなし）
+        schema: csv_ingest のスキーママニフェスト
+
+    Returns:
+        書き出したRDSファイルのパス
+    """
+    csv_path = Path(csv_path)
+    dtypes = {column["name"]: ('float64' if column["dtype"] in ("integer", "number") else 'object')
+              for column in schema["columns"]}
+    dat = pd.read_csv(csv_path, dtype=dtypes, keep_default_na=False, na_values=[''])
+    rds_path = csv_path.with_suffix('.rds')
+    tmp_path = rds_path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_path.write_bytes(serialize_data_frame(dat))
+    os.replace(tmp_path, rds_path)
+    logger.info(f"Wrote typed dataset for R: {rds_path} ({len(dat)} rows, {len(dat.columns)} columns)")
+    return rds_path
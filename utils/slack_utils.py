@@ -2,6 +2,7 @@ import asyncio # upload_files_to_slack のために追加
 import os # upload_files_to_slack のために追加
 import requests # upload_files_to_slack のために追加
 import logging # upload_files_to_slack のために追加
+import math
 from typing import Dict, Any, List, Optional
 
 logger = logging.getLogger(__name__) # upload_files_to_slack のために追加
@@ -305,6 +306,25 @@ def create_analysis_result_message(analysis_result_from_r: Dict[str, Any]) -> st
     
     return message
 
+def create_fast_result_message(fast_result: Dict[str, Any]) -> str:
+    """Rの解析完了前に投稿する速報値メッセージを作成"""
+    overall = fast_result.get("overall_analysis", {})
+    measure = fast_result.get("measure", "")
+    
+    effect_text = f"{overall['estimate']:.3f} [{overall['ci_lb']:.3f}, {overall['ci_ub']:.3f}]"
+    # OR/RRは対数スケールで計算されるため、元のスケールも併記
+    if measure in ["OR", "RR"]:
+        effect_text += (f"（{measure}: {math.exp(overall['estimate']):.3f} "
+                        f"[{math.exp(overall['ci_lb']):.3f}, {math.exp(overall['ci_ub']):.3f}]）")
+    
+    return f"""⚡ **速報値**（{measure}, {overall.get('method', 'N/A')}）
+• 統合効果量 [95%信頼区間]: {effect_text}
+• p値: {overall['pval']:.4f}
+• 異質性: I²={overall['I2']:.1f}%, τ²={overall['tau2']:.3f}
+• 研究数: {overall['k']}件
+
+フォレストプロット等の詳細な結果はRでの解析完了後に投稿します..."""
+
 def create_report_message(interpretation: Dict[str, Any]) -> str:
     """解釈レポートを自然言語メッセージとして作成（統計解析とGRADE準拠結果のみ）"""
     methods_text = interpretation.get('methods_section', 'N/A')
@@ -0,0 +1,102 @@
+"""
+ジョブワーカー
+
+Webプロセス（Gunicorn）から切り離して、永続ジョブキューのCSV取り込み・R解析・レポート生成のジョブを実行する
+プロセスです。WebプロセスはSlackのイベントをackしてキューに投入するだけになるため、重いR解析が続いても
+3秒以内のackに影響せず、WebとワーカーのdynoをそれぞれHeroku上で独立にスケールできます。
+
+    python -m worker
+
+複数のプロセスで同じキューを共有するには STORAGE_BACKEND=redis（Redis Streams）を使用し、
+Webプロセスでは JOB_QUEUE_CONSUMER_ENABLED=false を設定します。同時に実行するR解析の数は
+JOB_LANE_ANALYSIS_CONCURRENCY と R_WORKER_POOL_SIZE で指定します。
+"""
+import os
+import sys
+import signal
+import logging
+import threading
+
+from slack_sdk import WebClient
+
+# Configure logging
+log_level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(
+    level=getattr(logging, log_level, logging.INFO),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    force=True  # Force reconfiguration of the root logger
+)
+
+# ジョブの種類は各ハンドラーのモジュールで登録される
+import handlers.csv_handler  # noqa: F401
+import handlers.analysis_handler  # noqa: F401
+import handlers.report_handler  # noqa: F401
+from core.async_loop import get_loop_service, shutdown_loop_service
+from core.job_queue import (
+    JobQueueDispatcher, get_job_queue, release_inflight_jobs, start_job_queue_dispatcher
+)
+from core.job_scheduler import get_job_scheduler, shutdown_job_scheduler
+from core.r_worker_pool import get_r_worker_pool, shutdown_r_worker_pool
+
+logger = logging.getLogger(__name__)
+
+# ジョブの状況をログに出力する間隔（秒、0で無効）
+WORKER_STATS_INTERVAL = float(os.environ.get('WORKER_STATS_INTERVAL', '60'))
+
+_stop_event = threading.Event()
+
+
+def _signal_handler(sig, frame):
+    """シグナルハンドラー"""
+    logger.info(f"Received signal {sig}. Stopping worker...")
+    _stop_event.set()
+
+
+def start_worker(client: WebClient) -> JobQueueDispatcher:
+    """共有イベントループとRワーカーを起動し、永続ジョブキューの取り出しを開始"""
+    if get_job_queue() is None:
+        raise RuntimeError("JOB_QUEUE_BACKEND=memory ではワーカーを起動できません")
+    get_loop_service()
+    # 最初の解析を待たせないよう常駐Rワーカーを先に起動しておく
+    get_r_worker_pool()
+    # JOB_QUEUE_CONSUMER_ENABLED はWebプロセス向けの設定のため、ワーカーでは常に取り出す
+    dispatcher = start_job_queue_dispatcher(client, force=True)
+    logger.info(f"Worker started (consumer: {dispatcher.consumer_id}, lanes: {', '.join(dispatcher.lanes)})")
+    return dispatcher
+
+
+def stop_worker(dispatcher: JobQueueDispatcher):
+    """取り出しを止め、実行中のジョブの完了を待ってから、終わらなかったジョブのリースを手放す"""
+    dispatcher.stop()
+    for name, shutdown in (("job scheduler", shutdown_job_scheduler),
+                           ("async loop service", shutdown_loop_service),
+                           ("durable job release", release_inflight_jobs),
+                           ("R worker pool", shutdown_r_worker_pool)):
+        try:
+            shutdown()
+        except Exception as e:
+            logger.error(f"Error during {name} shutdown: {e}")
+    logger.info("Worker shutdown complete")
+
+
+def main():
+    client = WebClient(token=os.environ.get("SLACK_BOT_TOKEN"))
+    signal.signal(signal.SIGTERM, _signal_handler)
+    signal.signal(signal.SIGINT, _signal_handler)
+    try:
+        dispatcher = start_worker(client)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    while not _stop_event.wait(WORKER_STATS_INTERVAL or None):
+        lanes = get_job_scheduler().get_stats()["lanes"]
+        logger.info("Worker lanes: " + ", ".join(
+            f"{lane} {stats['running']} running / {stats['queued']} queued" for lane, stats in lanes.items()
+            if lane in dispatcher.lanes
+        ))
+    stop_worker(dispatcher)
+
+
+if __name__ == "__main__":
+    main()